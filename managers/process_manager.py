@@ -562,6 +562,17 @@ class ProcessManager:
 
         return alive_processes
 
+    def print_conn_flows_cache_stats(self):
+        # the stats of this process weren't added to the db yet
+        self.main.db.update_conn_flows_cache_stats()
+        stats: Dict[str, float] = self.main.db.get_conn_flows_cache_stats()
+        self.get_print_function()(
+            f"Conn flows cache: {stats['hits']} hits, "
+            f"{stats['misses']} misses "
+            f"({stats['hit_rate']:.2%} hit rate)",
+            log_to_logfiles_only=True,
+        )
+
     def get_analysis_time(self) -> Tuple[str, str]:
         """
         Returns how long slips took to analyze the given file
@@ -799,6 +810,7 @@ class ProcessManager:
                     graceful_shutdown = False
 
                 self.kill_all_children()
+                self.print_conn_flows_cache_stats()
 
             if self.main.args.save:
                 self.main.save_the_db()
@@ -838,6 +850,8 @@ class ProcessManager:
                     f"shutdown gracefully - {reason}\n",
                     log_to_logfiles_only=True,
                 )
+            # write the lines buffered by the output to the logfiles
+            self.main.logger.flush()
 
         except KeyboardInterrupt:
             return False
@@ -0,0 +1,316 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import ipaddress
+import json
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import numpy as np
+
+from slips_files.common.abstracts.iflowalerts_analyzer import (
+    IFlowalertsAnalyzer,
+)
+from slips_files.common.flow_classifier import FlowClassifier
+from slips_files.common.slips_utils import utils
+
+# (daddr, dport, proto)
+TupleKey = Tuple[str, str, str]
+# periodic by design, these would be detected all the time
+IGNORED_PORTS = {("53", "UDP"), ("123", "UDP")}
+# the number of periods of flows used by each fit of estimate_period().
+# the number of fits is bounded so the cost of scoring is predictable
+PERIODS_TO_FIT = [2**exponent for exponent in range(2, 16)] + [np.inf]
+
+
+@dataclass
+class TupleIntervals:
+    """The inter-arrival times of the flows of a tuple of a profile"""
+
+    # ring buffer with the last max_intervals inter-arrival times
+    intervals: np.ndarray
+    # number of intervals added so far, the next one goes to
+    # count % len(intervals)
+    count: int = 0
+    last_ts: Optional[float] = None
+    # used for the evidence, the flows of old tws aren't in the db
+    last_flow: Any = None
+    # the number of the last tw this tuple had flows in
+    last_tw: int = 0
+    reported: bool = False
+
+    def add(self, ts: float, flow, tw_number: int):
+        if self.last_ts is not None:
+            if ts <= self.last_ts:
+                # conn.log is sorted by the end of the conns, an older
+                # flow is ignored and its interval merges with the next
+                # one, like a missed beacon
+                return
+            self.intervals[self.count % len(self.intervals)] = (
+                ts - self.last_ts
+            )
+            self.count += 1
+        self.last_ts = ts
+        self.last_flow = flow
+        self.last_tw = tw_number
+
+    def get_intervals(self) -> np.ndarray:
+        """returns the intervals in the buffer from the oldest to the
+        newest one"""
+        size = len(self.intervals)
+        if self.count <= size:
+            return self.intervals[: self.count]
+        return np.roll(self.intervals, -(self.count % size))
+
+
+@dataclass
+class PeriodicityScores:
+    """the periodicity scores of many tuples, one item per tuple"""
+
+    # coefficient of variation of the intervals, std / mean
+    cv: np.ndarray
+    # the period of the dominant frequency of the flows, in seconds
+    period: np.ndarray
+    # how much of the flows are in phase with that period, from 0 to 1
+    coherence: np.ndarray
+
+
+def estimate_period(
+    intervals: np.ndarray, ts: np.ndarray, valid: np.ndarray
+) -> np.ndarray:
+    """
+    returns the period of the flows of each tuple.
+    the first estimate is the 25th percentile of the intervals, which is
+    still one period when up to half of the beacons are missed, unlike
+    the median. it's refined by least squares fits of the ts of the
+    flows to the number of periods since the first flow, using the
+    flows of the first 4, 8, 16... periods, so the error of the previous
+    estimate never makes us count the periods wrong
+    :param ts: the ts of the flows since the first one
+    """
+    period = np.nanpercentile(intervals, 25, axis=1)
+    # tuples whose last fit used all their flows
+    done = np.zeros(len(period), dtype=bool)
+    for horizon in PERIODS_TO_FIT:
+        periods_since_first = np.where(valid, np.rint(ts / period[:, None]), 0)
+        used_all_flows = periods_since_first.max(axis=1) <= horizon
+        periods_since_first[periods_since_first > horizon] = 0
+        squares = (periods_since_first**2).sum(axis=1)
+        fitted = (periods_since_first * ts).sum(axis=1) / np.maximum(
+            squares, 1
+        )
+        # tuples without flows in the first periods keep their estimate
+        period = np.where((squares > 0) & ~done, fitted, period)
+        done |= used_all_flows
+        if done.all():
+            break
+    return period
+
+
+def get_periodicity_scores(intervals: np.ndarray) -> PeriodicityScores:
+    """
+    scores the periodicity of many tuples at once
+    :param intervals: a (tuples, max_intervals) matrix with the
+    inter-arrival times of the flows of each tuple from the oldest to
+    the newest one, padded with NaN at the end
+
+    Two scores are computed for each tuple:
+    - the coefficient of variation of the intervals. beacons that sleep
+    for a fixed time between connections have a low one even if the
+    sleep is jittered
+    - the coherence of the flows with the dominant period, the
+    normalized power of the flows at that frequency,
+    |mean(exp(2*pi*i*t/period))|. it's close to 1 for beacons that are
+    scheduled every period even when some of them are missed, which
+    gives them a high cv, and around 1/sqrt(flows) for random flows.
+    the period is estimated by estimate_period()
+
+    The cost is O(tuples * max_intervals * len(PERIODS_TO_FIT)) at most
+    """
+    valid = ~np.isnan(intervals)
+    flows = valid.sum(axis=1) + 1
+    mean = np.nanmean(intervals, axis=1)
+    cv = np.nanstd(intervals, axis=1) / mean
+
+    # ts of the flows since the first one of each tuple, the first flow
+    # is at 0 and isn't stored
+    ts = np.cumsum(np.where(valid, intervals, 0), axis=1)
+    period = estimate_period(intervals, ts, valid)
+
+    phases = np.exp(2j * np.pi * ts / period[:, None])
+    # + 1 for the first flow, its phase is 0
+    coherence = np.abs(np.where(valid, phases, 0).sum(axis=1) + 1) / flows
+    return PeriodicityScores(cv=cv, period=period, coherence=coherence)
+
+
+class Beaconing(IFlowalertsAnalyzer):
+    """
+    Detects C&C beaconing, a profile connecting to the same daddr, dport
+    and proto periodically.
+
+    The inter-arrival times of the flows of every tuple of a profile are
+    kept in a ring buffer of the last max_intervals ones, so the memory
+    per tuple is bounded, and old timewindows are never read from the db.
+
+    Nothing is computed per flow. When a tw is closed, the tuples that
+    had flows in it are scored all at once by get_periodicity_scores(),
+    so the cost of a tw is predictable,
+    O(tuples of the tw * max_intervals).
+    """
+
+    def init(self):
+        self.classifier = FlowClassifier()
+        self.max_intervals = 64
+        # fewer flows than this can look periodic by chance
+        self.min_intervals = 12
+        # beacons that sleep between conns
+        self.max_cv = 0.15
+        # beacons scheduled every period
+        self.min_coherence = 0.85
+        # in seconds, faster flows are usually bursts of retries
+        self.min_period = 1
+        # tuples without flows in this many tws are forgotten
+        self.idle_tws = 3
+        # {profileid: {tuple: TupleIntervals}}
+        self.tuples: Dict[str, Dict[TupleKey, TupleIntervals]] = {}
+        # the tuples that had flows in each tw, scored when it's closed
+        # {profileid: {twid: {tuple, ...}}}
+        self.tuples_in_tw: Dict[str, Dict[str, Set[TupleKey]]] = {}
+
+    def name(self) -> str:
+        return "beaconing_analyzer"
+
+    @staticmethod
+    def get_tw_number(twid: str) -> int:
+        return int(twid.replace("timewindow", ""))
+
+    @staticmethod
+    def get_ts(starttime) -> float:
+        try:
+            return float(starttime)
+        except ValueError:
+            return float(utils.convert_ts_format(starttime, "unixtimestamp"))
+
+    @staticmethod
+    def is_ignored_dstip(daddr: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(daddr)
+        except ValueError:
+            return True
+        return ip.is_multicast or daddr == "255.255.255.255"
+
+    def add_flow(self, profileid: str, twid: str, flow):
+        """adds the inter-arrival time of the given flow to the ring
+        buffer of its tuple"""
+        protocol = flow.proto.upper()
+        if protocol not in ("TCP", "UDP"):
+            return
+
+        # we only care about the flows where the profile is the client
+        if flow.saddr != profileid.split("_")[-1]:
+            return
+
+        dport = str(flow.dport)
+        if (dport, protocol) in IGNORED_PORTS or self.is_ignored_dstip(
+            flow.daddr
+        ):
+            return
+
+        key: TupleKey = (flow.daddr, dport, protocol)
+        tuples = self.tuples.setdefault(profileid, {})
+        if key not in tuples:
+            tuples[key] = TupleIntervals(
+                intervals=np.zeros(self.max_intervals)
+            )
+        tuples[key].add(
+            self.get_ts(flow.starttime), flow, self.get_tw_number(twid)
+        )
+        tws = self.tuples_in_tw.setdefault(profileid, {})
+        tws.setdefault(twid, set()).add(key)
+
+    def get_tuples_to_score(
+        self, profileid: str, twid: str
+    ) -> List[Tuple[TupleKey, TupleIntervals]]:
+        tuples = self.tuples.get(profileid, {})
+        to_score = []
+        tws = self.tuples_in_tw.get(profileid, {})
+        for key in tws.pop(twid, ()):
+            tuple_intervals = tuples.get(key)
+            if (
+                tuple_intervals
+                and not tuple_intervals.reported
+                and tuple_intervals.count >= self.min_intervals
+            ):
+                to_score.append((key, tuple_intervals))
+        return to_score
+
+    def is_beaconing(self, scores: PeriodicityScores) -> np.ndarray:
+        """returns a mask of the scored tuples that are beaconing"""
+        return (scores.period >= self.min_period) & (
+            (scores.cv <= self.max_cv)
+            | (scores.coherence >= self.min_coherence)
+        )
+
+    def check_beaconing(self, profileid: str, twid: str):
+        """
+        scores the tuples that had flows in the given tw of the given
+        profile and sets an evidence for the beaconing ones.
+        called when the tw is closed
+        """
+        to_score = self.get_tuples_to_score(profileid, twid)
+        if to_score:
+            intervals = np.full((len(to_score), self.max_intervals), np.nan)
+            for row, (_, tuple_intervals) in enumerate(to_score):
+                buffered = tuple_intervals.get_intervals()
+                intervals[row, : len(buffered)] = buffered
+
+            scores = get_periodicity_scores(intervals)
+            flows = (~np.isnan(intervals)).sum(axis=1) + 1
+            for row in np.flatnonzero(self.is_beaconing(scores)):
+                _, tuple_intervals = to_score[row]
+                tuple_intervals.reported = True
+                self.set_evidence.beaconing(
+                    twid,
+                    tuple_intervals.last_flow,
+                    period=float(scores.period[row]),
+                    cv=float(scores.cv[row]),
+                    coherence=float(scores.coherence[row]),
+                    flows=int(flows[row]),
+                )
+
+        self.forget_idle_tuples(profileid, self.get_tw_number(twid))
+
+    def forget_idle_tuples(self, profileid: str, tw_number: int):
+        oldest_tw = tw_number - self.idle_tws
+        tuples = self.tuples.get(profileid, {})
+        for key, tuple_intervals in list(tuples.items()):
+            if tuple_intervals.last_tw <= oldest_tw:
+                del tuples[key]
+        if not tuples:
+            self.tuples.pop(profileid, None)
+
+        # flows that arrived after their tw was closed
+        tws = self.tuples_in_tw.get(profileid, {})
+        for twid in list(tws):
+            if self.get_tw_number(twid) <= oldest_tw:
+                del tws[twid]
+        if not tws:
+            self.tuples_in_tw.pop(profileid, None)
+
+    def analyze(self, msg):
+        if utils.is_msg_intended_for(msg, "new_flow"):
+            msg = json.loads(msg["data"])
+            flow = self.classifier.convert_to_flow_obj(msg["flow"])
+            self.add_flow(msg["profileid"], msg["twid"], flow)
+
+        elif utils.is_msg_intended_for(msg, "tw_closed"):
+            profileid_tw = msg["data"].split("_")
+            profileid = f"{profileid_tw[0]}_{profileid_tw[1]}"
+            twid = profileid_tw[-1]
+            self.check_beaconing(profileid, twid)
@@ -1,11 +1,12 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
-import asyncio
 import contextlib
 import ipaddress
 import json
+import time
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Tuple, List, Dict
+from typing import List, Dict, Optional
 import validators
 
 from modules.flowalerts.dns import DNS
@@ -22,6 +23,22 @@ ESTAB = "Established"
 SPECIAL_IPV6 = ("0.0.0.0", "255.255.255.255")
 
 
+@dataclass
+class IPConns:
+    """what a profile did with one ip in one timewindow"""
+
+    bytes_sent: int = 0
+    # uids of the flows that sent bytes to this ip
+    upload_uids: List[str] = field(default_factory=list)
+    # ts of the last flow that sent bytes to this ip
+    last_upload_ts: str = ""
+    # ports of the established tcp conns with this ip, the dict is used as
+    # an ordered set
+    estab_tcp_ports: Dict[str, None] = field(default_factory=dict)
+    # uids of the established tcp conns with this ip
+    estab_tcp_uids: List[str] = field(default_factory=list)
+
+
 class Conn(IFlowalertsAnalyzer):
     def init(self):
         # get the default gateway
@@ -43,6 +60,15 @@ class Conn(IFlowalertsAnalyzer):
         self.our_ips: List[str] = utils.get_own_ips(ret="List")
         self.input_type: str = self.db.get_input_type()
         self.multiple_reconnection_attempts_threshold = 5
+        # counters of the conns of each profile with each ip, per open
+        # timewindow. {profileid: {twid: {ip: IPConns}}}
+        self.tw_conns: Dict[str, Dict[str, Dict[str, IPConns]]] = {}
+        # how long to wait in real time for the dns resolution of a conn
+        # before reporting it as a connection without dns. In seconds
+        self.conn_without_dns_wait_time = 15
+        self.flowalerts.delayed_checks.register(
+            "conn_without_dns", self.check_pending_conn_without_dns
+        )
         # we use this to try to detect if there's dns server that has a
         # private ip outside of localnet
 
@@ -305,61 +331,88 @@ class Conn(IFlowalertsAnalyzer):
 
         return False
 
-    def get_sent_bytes(
-        self, all_flows: Dict[str, dict]
-    ) -> Dict[str, Tuple[int, List[str], str]]:
+    def get_ip_conns(self, profileid, twid, ip) -> IPConns:
+        tws = self.tw_conns.setdefault(profileid, {})
+        ips = tws.setdefault(twid, {})
+        try:
+            return ips[ip]
+        except KeyError:
+            ips[ip] = IPConns()
+            return ips[ip]
+
+    def update_tw_conns(self, profileid, twid, flow):
         """
-        Returns a dict of sent bytes to all ips in the all_flows dict
-         {
-            contacted_ip: (
-                sum_of_mbs_sent,
-                [uids],
-                last_ts_of_flow_containging_this_contacted_ip
-            )
-        }
+        updates the counters of the conns of the given profile in the
+        given tw with the given flow. they're used by the data upload
+        and the multiple ports detections instead of reading the whole
+        tw from the db
         """
-        bytes_sent = {}
-        for uid, flow in all_flows.items():
-            daddr = flow["daddr"]
-            sbytes: int = int(flow.get("sbytes", 0))
-            ts: str = flow.get("starttime", "")
+        profile_ip = profileid.split("_")[-1]
+        sbytes = int(flow.sbytes or 0)
+        if (
+            sbytes
+            and flow.daddr
+            and flow.saddr == profile_ip
+            and not self.is_ignored_ip_data_upload(flow.daddr)
+        ):
+            ip_conns = self.get_ip_conns(profileid, twid, flow.daddr)
+            ip_conns.bytes_sent += sbytes
+            ip_conns.upload_uids.append(flow.uid)
+            ip_conns.last_upload_ts = flow.starttime
 
-            if self.is_ignored_ip_data_upload(daddr) or not sbytes:
-                continue
+        if flow.proto != "tcp" or flow.interpreted_state != ESTAB:
+            return
 
-            if daddr in bytes_sent:
-                mbs_sent, uids, _ = bytes_sent[daddr]
-                mbs_sent += int(sbytes)
-                uids.append(uid)
-                bytes_sent[daddr] = (mbs_sent, uids, ts)
-            else:
-                bytes_sent[daddr] = (sbytes, [uid], ts)
+        if flow.saddr == profile_ip:
+            ip = flow.daddr
+        elif flow.daddr == profile_ip:
+            ip = flow.saddr
+        else:
+            return
+        ip_conns = self.get_ip_conns(profileid, twid, ip)
+        ip_conns.estab_tcp_ports[flow.dport] = None
+        ip_conns.estab_tcp_uids.append(flow.uid)
+
+    def evict_tw_conns(self, profileid, twid) -> Dict[str, IPConns]:
+        """
+        removes the counters of the given closed tw, and of the older tws
+        of the same profile, in case flows of them arrived after they were
+        closed.
+        returns the counters of the given tw
+        """
+        tws = self.tw_conns.get(profileid)
+        if not tws:
+            return {}
 
-        return bytes_sent
+        closed_tw_number = int(twid.replace("timewindow", ""))
+        for tw in list(tws):
+            if int(tw.replace("timewindow", "")) < closed_tw_number:
+                del tws[tw]
+
+        ips = tws.pop(twid, {})
+        if not tws:
+            del self.tw_conns[profileid]
+        return ips
 
     def detect_data_upload_in_twid(self, profileid, twid):
         """
         For each contacted ip in this twid,
         check if the total bytes sent to this ip is >= data_exfiltration_threshold
         """
-        all_flows: Dict[str, dict] = self.db.get_all_flows_in_profileid(
-            profileid
-        )
-        if not all_flows:
-            return
-
-        bytes_sent: Dict[str, Tuple[int, List[str], str]]
-        bytes_sent = self.get_sent_bytes(all_flows)
-
-        for ip, ip_info in bytes_sent.items():
-            ip_info: Tuple[int, List[str], str]
-            bytes_uploaded, uids, ts = ip_info
-            mbs_uploaded = utils.convert_to_mb(bytes_uploaded)
+        for ip, ip_conns in self.evict_tw_conns(profileid, twid).items():
+            if not ip_conns.bytes_sent:
+                continue
+            mbs_uploaded = utils.convert_to_mb(ip_conns.bytes_sent)
             if mbs_uploaded < self.data_exfiltration_threshold:
                 continue
 
             self.set_evidence.data_exfiltration(
-                ip, mbs_uploaded, profileid, twid, uids, ts
+                ip,
+                mbs_uploaded,
+                profileid,
+                twid,
+                ip_conns.upload_uids,
+                ip_conns.last_upload_ts,
             )
 
     @staticmethod
@@ -510,7 +563,7 @@ class Conn(IFlowalertsAnalyzer):
         # 30 minutes have passed?
         return diff >= self.conn_without_dns_interface_wait_time
 
-    async def check_connection_without_dns_resolution(
+    def check_connection_without_dns_resolution(
         self, profileid, twid, flow
     ) -> bool:
         """
@@ -524,7 +577,7 @@ class Conn(IFlowalertsAnalyzer):
             return False
 
         # search 24hs back for a dns resolution
-        if self.db.is_ip_resolved(flow.daddr, 24):
+        if self.db.is_ip_resolved(flow.daddr, 24, flow.starttime):
             return False
 
         # There is no DNS resolution, but it can be that Slips is
@@ -532,8 +585,21 @@ class Conn(IFlowalertsAnalyzer):
         # To give time to Slips to read all the files and get all the flows
         # don't alert a Connection Without DNS until 15 seconds has passed
         # in real time from the time of this checking.
-        await asyncio.sleep(15)
-        if self.db.is_ip_resolved(flow.daddr, 24):
+        self.flowalerts.delayed_checks.schedule(
+            "conn_without_dns",
+            time.time() + self.conn_without_dns_wait_time,
+            profileid,
+            twid,
+            flow,
+        )
+        return False
+
+    def check_pending_conn_without_dns(self, profileid, twid, flow) -> bool:
+        """
+        runs 15 seconds after check_connection_without_dns_resolution()
+        didn't find a dns resolution for the given flow
+        """
+        if self.db.is_ip_resolved(flow.daddr, 24, flow.starttime):
             return False
 
         # Reaching here means we already waited 15 seconds for the dns
@@ -590,80 +656,35 @@ class Conn(IFlowalertsAnalyzer):
             return
 
         # Connection to multiple ports to the destination IP
-        if profileid.split("_")[1] == flow.saddr:
-            direction = "Dst"
-            state = ESTAB
-            protocol = "TCP"
-            role = "Client"
-            type_data = "IPs"
-
-            # get all the dst ips with established tcp connections
-            daddrs = self.db.get_data_from_profile_tw(
-                profileid,
-                twid,
-                direction,
-                state,
-                protocol,
-                role,
-                type_data,
-            )
-
-            # make sure we find established connections to this daddr
-            if flow.daddr not in daddrs:
-                return
-
-            dstports = list(daddrs[flow.daddr]["dstports"])
-            if len(dstports) <= 1:
-                return
-
+        profile_ip = profileid.split("_")[-1]
+        if profile_ip == flow.saddr:
             victim: str = flow.daddr
-            attacker: str = profileid.split("_")[-1]
-            self.set_evidence.connection_to_multiple_ports(
-                profileid,
-                twid,
-                flow,
-                victim,
-                attacker,
-                dstports,
-                daddrs[flow.daddr]["uid"],
-            )
-
+            attacker: str = profile_ip
+            ip = flow.daddr
         # Connection to multiple port to the Source IP.
         # Happens in the mode 'all'
-        elif profileid.split("_")[-1] == flow.daddr:
-            direction = "Src"
-            state = ESTAB
-            protocol = "TCP"
-            role = "Server"
-            type_data = "IPs"
-
-            # get all the src ips with established tcp connections
-            saddrs = self.db.get_data_from_profile_tw(
-                profileid,
-                twid,
-                direction,
-                state,
-                protocol,
-                role,
-                type_data,
-            )
-            dstports = list(saddrs[flow.saddr]["dstports"])
-            if len(dstports) <= 1:
-                return
-
-            uids = saddrs[flow.saddr]["uid"]
+        elif profile_ip == flow.daddr:
             attacker: str = flow.daddr
-            victim: str = profileid.split("_")[-1]
+            victim: str = profile_ip
+            ip = flow.saddr
+        else:
+            return
 
-            self.set_evidence.connection_to_multiple_ports(
-                profileid,
-                twid,
-                flow,
-                victim,
-                attacker,
-                dstports,
-                uids,
-            )
+        ip_conns: Optional[IPConns] = (
+            self.tw_conns.get(profileid, {}).get(twid, {}).get(ip)
+        )
+        if not ip_conns or len(ip_conns.estab_tcp_ports) <= 1:
+            return
+
+        self.set_evidence.connection_to_multiple_ports(
+            profileid,
+            twid,
+            flow,
+            victim,
+            attacker,
+            list(ip_conns.estab_tcp_ports),
+            ip_conns.estab_tcp_uids,
+        )
 
     def is_well_known_org(self, ip):
         """get the SNI, ASN, and  rDNS of the IP to check if it belongs
@@ -811,6 +832,7 @@ class Conn(IFlowalertsAnalyzer):
             flow.interpreted_state = self.db.get_final_state_from_flags(
                 flow.state, flow.pkts
             )
+            self.update_tw_conns(profileid, twid, flow)
             self.check_long_connection(twid, flow)
             self.check_unknown_port(profileid, twid, flow)
             self.check_multiple_reconnection_attempts(profileid, twid, flow)
@@ -824,12 +846,7 @@ class Conn(IFlowalertsAnalyzer):
             self.check_different_localnet_usage(
                 twid, flow, what_to_check="srcip"
             )
-            self.flowalerts.create_task(
-                self.check_connection_without_dns_resolution,
-                profileid,
-                twid,
-                flow,
-            )
+            self.check_connection_without_dns_resolution(profileid, twid, flow)
             self.detect_connection_to_multiple_ports(profileid, twid, flow)
             self.check_data_upload(profileid, twid, flow)
 
@@ -4,21 +4,16 @@ import collections
 import ipaddress
 import json
 import math
-import queue
-import time
 from datetime import datetime
 from typing import (
     List,
-    Tuple,
-    Any,
 )
 import validators
-from multiprocessing import Queue
-from threading import Thread, Event
 
 from slips_files.common.abstracts.iflowalerts_analyzer import (
     IFlowalertsAnalyzer,
 )
+from slips_files.common.data_structures.timer_wheel import TimerWheel
 from slips_files.common.flow_classifier import FlowClassifier
 from slips_files.common.parsers.config_parser import ConfigParser
 from slips_files.common.slips_utils import utils
@@ -43,23 +38,21 @@ class DNS(IFlowalertsAnalyzer):
         self.our_ips: List[str] = utils.get_own_ips(ret="List")
         # In mins
         self.dns_without_conn_interface_wait_time = 30
-        # to store dns queries that we should check later. the purpose of
-        # this is to give the connection some time to arrive
-        self.pending_dns_without_conn = Queue()
-        self.dns_without_connection_timeout_checker_thread = Thread(
-            target=self.check_dns_without_connection_timeout,
-            daemon=True,
-            name="dns_without_connection_timeout_checker_thread",
+        # how long to wait in zeek time for the connection of a dns flow
+        # to arrive, and how often to check for it while waiting. In mins
+        self.dns_without_conn_wait_time = 30
+        self.dns_without_conn_check_interval = 10
+        # dns flows that we should check later. the purpose of
+        # this is to give the connection some time to arrive.
+        # the clock of this wheel is the zeek time of the dns flows we
+        # receive
+        self.pending_dns_without_conn = TimerWheel()
+        self.pending_dns_without_conn.register(
+            "dns_without_conn", self.check_pending_dns_without_conn
         )
-        self.stop_event = Event()
-        # used to pass the msgs this analyzer reciecved, to the
-        # dns_without_connection_timeout_checker_thread.
-        # the reason why we can just use .get_msg() there is because once
-        # the msg is handled here, it wont be passed to other analyzers the
-        # should analyze it anymore.
-        # meaning, only flowalerts.py is allowed to do a get_msg because it
-        # manages all the analyzers the msg should be passed to
-        self.dns_msgs = Queue()
+        # False once slips is stopping, the pending dns flows are checked
+        # without waiting for their conns anymore
+        self.waiting_for_conns = True
         self.priv_ips_doing_dns_outside_of_localnet = {}
         self.is_dns_detected = False
         self.detected_dns_ip = "-"
@@ -266,131 +259,54 @@ class DNS(IFlowalertsAnalyzer):
 
     def check_dns_without_connection_of_all_pending_flows(self):
         """should be called before shutting down, to check all the pending
-        flows in the pending_dns_without_conn queue before stopping slips,
+        flows in the pending_dns_without_conn wheel before stopping slips,
         doesnt matter if the 30 mins passed or not"""
-        while self.pending_dns_without_conn.qsize() > 0:
-            try:
-                # flowalerts is closing here. there's no chance that
-                profileid, twid, pending_flow = (
-                    self.pending_dns_without_conn.get(timeout=5)
-                )
-            except queue.Empty:
-                return
+        # no more conns are coming
+        self.waiting_for_conns = False
+        self.pending_dns_without_conn.run_all()
 
-            self.check_dns_without_connection(
-                profileid, twid, pending_flow, waited_for_the_conn=True
-            )
+    @staticmethod
+    def get_zeek_time(flow) -> float:
+        return float(utils.convert_ts_format(flow.starttime, "unixtimestamp"))
 
-    def get_dns_flow_from_queue(self):
+    def check_pending_dns_without_conn(
+        self, profileid, twid, flow, mins_waited: int
+    ):
         """
-        Fetch and parse the DNS message from the dns_msgs queue.
-        Returns None if the queue is empty.
+        runs every 10 mins zeek time after the dns flow, until 30 mins
+        pass, to check if the connection of it arrived.
+        - To avoid having thousands of flows in memory for 30 mins, if the
+        connection is found we stop checking.
         """
-        try:
-            msg: str = self.dns_msgs.get(timeout=4)
-        except queue.Empty:
-            return None
-
-        msg: dict = json.loads(msg["data"])
-        flow = self.classifier.convert_to_flow_obj(msg["flow"])
-        return flow
-
-    def check_pending_flows_timeout(
-        self, reference_flow: Any
-    ) -> List[Tuple[str, str, Any]]:
-        """
-        Process all pending DNS flows without connections.
-
-        Calls check_dns_without_connection when 10, 20 and 30 mins (zeek
-        time) pass since the first encounter of the dns flow.
-        :param reference_flow: the current DNS flow slips is nalayzing.
-        only used to get the timestamp of the zeek now. just to know if 30
-        mins passed in zeek time or not.
-        Returns a list of flows that need to be put back into the queue
-         and checked later.
-        """
-        back_to_queue: List[Tuple[str, str, Any]] = []
-
-        while self.pending_dns_without_conn.qsize() > 0:
-            try:
-                profileid, twid, pending_flow = (
-                    self.pending_dns_without_conn.get(timeout=5)
-                )
-            except queue.Empty:
-                return back_to_queue
-
-            diff_in_mins = utils.get_time_diff(
-                pending_flow.starttime, reference_flow.starttime, "minutes"
+        if (
+            mins_waited >= self.dns_without_conn_wait_time
+            or not self.waiting_for_conns
+        ):
+            self.check_dns_without_connection(
+                profileid, twid, flow, waited_for_the_conn=True
             )
+            return
 
-            if diff_in_mins >= 30:
-                self.check_dns_without_connection(
-                    profileid, twid, pending_flow, waited_for_the_conn=True
-                )
-            elif 9.5 < diff_in_mins <= 10 or 19.5 < diff_in_mins <= 20:
-                self.check_dns_without_connection(
-                    profileid, twid, pending_flow, waited_for_the_conn=False
-                )
-            else:
-                back_to_queue.append((profileid, twid, pending_flow))
-
-        return back_to_queue
+        if self.is_any_flow_answer_contacted(profileid, twid, flow):
+            return
+        self.wait_for_the_conn(profileid, twid, flow, mins_waited)
 
-    def check_dns_without_connection_timeout(self):
+    def wait_for_the_conn(self, profileid, twid, flow, mins_waited=0):
         """
-        Waits 30 mins in zeek time for the connection of a dns to arrive
-        Does so by receiving every dns msg this analyzer receives. then we
-        compare the ts of it to the ts of the flow we're waiting the 30
-        mins for.
-        once we know that >=30 mins passed between them we check for the
-        dns without connection evidence.
-        The whole point is to give the connection 30 mins in zeek time to
-        arrive before setting "dns wihtout conn" evidence.
-
-        - To avoid having thousands of flows in memory for 30 mins. we check
-        every 10 mins for the connections, if not found we put it back to
-        queue, if found we remove that flow from the pending flows
-
-        This function runs in its own thread
+        schedules a check for the connection of the given dns flow
+        10 mins zeek time from now
         """
-        try:
-            while (
-                not self.flowalerts.should_stop()
-                and not self.stop_event.is_set()
-            ):
-                # if self.pending_dns_without_conn.empty():
-                #     time.sleep(1)
-                #     continue
-
-                # we just use it to know the zeek current ts to check if 30
-                # mins zeek time passed or not. we are not going to
-                # analyze it.
-                reference_flow = self.get_dns_flow_from_queue()
-                if not reference_flow:
-                    # ok wait for more dns flows to be read by slips
-                    time.sleep(1)
-                    continue
-
-                # back_to_queue will be used to store the flows we're
-                # waiting for the conn of temporarily if 30 mins didnt pass
-                # since we saw them.
-                # the goal of this is to not change the queue size in the
-                # below loop
-                back_to_queue = self.check_pending_flows_timeout(
-                    reference_flow
-                )
-                # put them back to the queue so we can check them later
-                for flow in back_to_queue:
-                    flow: Tuple[str, str, Any]
-                    self.pending_dns_without_conn.put(flow)
-
-        except KeyboardInterrupt:
-            # the rest will be handled in shutdown_gracefully
-            return
-        except Exception:
-            self.print_traceback()
+        mins_waited += self.dns_without_conn_check_interval
+        self.pending_dns_without_conn.schedule(
+            "dns_without_conn",
+            self.get_zeek_time(flow) + mins_waited * 60,
+            profileid,
+            twid,
+            flow,
+            mins_waited,
+        )
 
-    async def check_dns_without_connection(
+    def check_dns_without_connection(
         self, profileid, twid, flow, waited_for_the_conn=False
     ) -> bool:
         """
@@ -410,7 +326,7 @@ class DNS(IFlowalertsAnalyzer):
 
         if not waited_for_the_conn:
             # wait 30 mins zeek time for the conn of this dns to arrive
-            self.pending_dns_without_conn.put((profileid, twid, flow))
+            self.wait_for_the_conn(profileid, twid, flow)
             return False
 
         # Reaching here means we already waited for the connection
@@ -694,35 +610,6 @@ class DNS(IFlowalertsAnalyzer):
 
     def shutdown_gracefully(self):
         self.check_dns_without_connection_of_all_pending_flows()
-        self.stop_event.set()
-        self.dns_without_connection_timeout_checker_thread.join(30)
-        if self.dns_without_connection_timeout_checker_thread.is_alive():
-            self.flowalerts.print(
-                f"Problem shutting down "
-                f"dns_without_connection_timeout_checker_thread."
-                f"Flowalerts should_stop(): "
-                f"{self.flowalerts.should_stop()}"
-            )
-
-        # close the queue
-        # without this, queues are left in memory and flowalerts keeps
-        # waiting for them forever
-        # to exit the process quickly without blocking on the queue's cleanup
-        self.dns_msgs.cancel_join_thread()
-        self.dns_msgs.close()
-
-        self.pending_dns_without_conn.cancel_join_thread()
-
-        self.pending_dns_without_conn.close()
-
-    def pre_analyze(self):
-        """Code that shouldnt be run in a loop. runs only once in
-        flowalerts' pre_main"""
-        # we didnt put this in __init__ because it uses self.flowalerts
-        # attributes that are not initialized yet in __init__
-        utils.start_thread(
-            self.dns_without_connection_timeout_checker_thread, self.db
-        )
 
     async def analyze(self, msg):
         """
@@ -732,15 +619,15 @@ class DNS(IFlowalertsAnalyzer):
         if not utils.is_msg_intended_for(msg, "new_dns"):
             return False
 
-        self.dns_msgs.put(msg)
         msg = json.loads(msg["data"])
         profileid = msg["profileid"]
         twid = msg["twid"]
         flow = self.classifier.convert_to_flow_obj(msg["flow"])
 
-        self.flowalerts.create_task(
-            self.check_dns_without_connection, profileid, twid, flow
-        )
+        # dns flows are the clock of the pending dns flows, check the ones
+        # that waited long enough for their connection
+        self.pending_dns_without_conn.run_due(self.get_zeek_time(flow))
+        self.check_dns_without_connection(profileid, twid, flow)
 
         self.check_high_entropy_dns_answers(twid, flow)
         self.check_invalid_dns_answers(twid, flow)
@@ -2,11 +2,19 @@
 # SPDX-License-Identifier: GPL-2.0-only
 import asyncio
 import inspect
+import json
+import time
 from asyncio import Task
-from typing import List
+from dataclasses import dataclass
+from typing import (
+    Dict,
+    List,
+)
 
 from slips_files.common.slips_utils import utils
 from slips_files.common.abstracts.iasync_module import AsyncModule
+from slips_files.common.data_structures.timer_wheel import TimerWheel
+from .beaconing import Beaconing
 from .conn import Conn
 from .dns import DNS
 from .downloaded_file import DownloadedFile
@@ -19,6 +27,21 @@ from .tunnel import Tunnel
 from slips_files.core.helpers.whitelist.whitelist import Whitelist
 
 
+@dataclass
+class ChannelStats:
+    # msgs read from the channel
+    received: int = 0
+    # number of times we read msgs from the channel
+    batches: int = 0
+    # estimated number of msgs published in the channel that we didn't
+    # read yet
+    backlog: int = 0
+    # max number of msgs to read from the channel per iteration
+    quota: int = 1
+    # msgs published in the channel before we subscribed to it
+    published_before_start: int = 0
+
+
 class FlowAlerts(AsyncModule):
     name = "Flow Alerts"
     description = (
@@ -26,10 +49,21 @@ class FlowAlerts(AsyncModule):
         "password guessing, self-signed certificate, data exfiltration, etc."
     )
     authors = ["Kamila Babayeva", "Sebastian Garcia", "Alya Gomaa"]
+    # max number of msgs read from all channels per iteration of main().
+    # it's divided between the channels depending on their backlog
+    msgs_per_iteration = 1000
+    # every channel gets at least this many msgs per iteration, so quiet
+    # channels are never starved by busy ones
+    min_msgs_per_channel = 10
+    # how often to update the backlog of the channels. in seconds
+    quota_update_interval = 1
 
     def init(self):
         self.subscribe_to_channels()
         self.whitelist = Whitelist(self.logger, self.db)
+        # checks that the analyzers want to run some seconds (real time)
+        # after seeing a flow
+        self.delayed_checks = TimerWheel()
         self.dns = DNS(self.db, flowalerts=self)
         self.software = Software(self.db, flowalerts=self)
         self.notice = Notice(self.db, flowalerts=self)
@@ -39,8 +73,12 @@ class FlowAlerts(AsyncModule):
         self.downloaded_file = DownloadedFile(self.db, flowalerts=self)
         self.tunnel = Tunnel(self.db, flowalerts=self)
         self.conn = Conn(self.db, flowalerts=self)
+        self.beaconing = Beaconing(self.db, flowalerts=self)
         # list of async functions to await before flowalerts shuts down
         self.tasks: List[Task] = []
+        self.channel_stats: Dict[str, ChannelStats] = {}
+        self.ts_of_last_quota_update = 0.0
+        self.start_time = time.time()
 
     def subscribe_to_channels(self):
         channels = (
@@ -60,11 +98,104 @@ class FlowAlerts(AsyncModule):
             self.channels.update({channel: channel_obj})
 
     async def shutdown_gracefully(self):
+        self.print_delayed_checks_stats()
+        self.print_channel_stats()
+        # slips is done reading flows, no need to wait for them anymore
+        self.delayed_checks.run_all()
         self.dns.shutdown_gracefully()
 
+    def print_delayed_checks_stats(self):
+        stats = self.delayed_checks.get_stats()
+        stats.update(self.dns.pending_dns_without_conn.get_stats())
+        for check, check_stats in stats.items():
+            self.print(
+                f"Delayed check {check}: pending: {check_stats['pending']} "
+                f"ran: {check_stats['ran']} "
+                f"dropped: {check_stats['dropped']}",
+                2,
+                0,
+            )
+
+    def print_channel_stats(self):
+        elapsed = max(time.time() - self.start_time, 1)
+        for channel, stats in self.channel_stats.items():
+            self.print(
+                f"Channel {channel}: received: {stats.received} msgs "
+                f"({stats.received / elapsed:.0f} msgs/s) in "
+                f"{stats.batches} batches. backlog: {stats.backlog}",
+                2,
+                0,
+            )
+
+    def get_msgs_published_in_channel(self, channel: str) -> int:
+        return int(self.db.get_msgs_published_in_channel(channel) or 0)
+
+    def init_channel_stats(self):
+        for channel in self.analyzers_map:
+            self.channel_stats[channel] = ChannelStats(
+                quota=self.min_msgs_per_channel,
+                published_before_start=(
+                    self.get_msgs_published_in_channel(channel)
+                ),
+            )
+
+    def update_channel_quotas(self):
+        """
+        estimates the backlog of every channel and divides
+        msgs_per_iteration between the channels depending on it, so
+        channels with bursts, e.g. new_flow, are drained faster than
+        quiet ones
+        """
+        now = time.time()
+        if now - self.ts_of_last_quota_update < self.quota_update_interval:
+            return
+        self.ts_of_last_quota_update = now
+
+        for channel, stats in self.channel_stats.items():
+            published = (
+                self.get_msgs_published_in_channel(channel)
+                - stats.published_before_start
+            )
+            stats.backlog = max(0, published - stats.received)
+
+        total_backlog = sum(
+            stats.backlog for stats in self.channel_stats.values()
+        )
+        for stats in self.channel_stats.values():
+            share = 0
+            if total_backlog:
+                share = (
+                    self.msgs_per_iteration * stats.backlog // total_backlog
+                )
+            stats.quota = max(self.min_msgs_per_channel, share)
+
+    def get_msgs(self, channel: str) -> List[dict]:
+        """reads the msgs available in the given channel, up to the
+        quota of it"""
+        stats = self.channel_stats[channel]
+        msgs = []
+        while len(msgs) < stats.quota:
+            msg = self.get_msg(channel)
+            if not msg:
+                break
+            msgs.append(msg)
+
+        if msgs:
+            stats.received += len(msgs)
+            stats.batches += 1
+        return msgs
+
+    def cache_conn_flows(self, msgs: List[dict]):
+        """
+        keeps the given new_flow msgs in the conn flows cache of this
+        process, the ssl and ssh analyzers look them up by uid
+        """
+        for msg in msgs:
+            msg = json.loads(msg["data"])
+            self.db.cache_conn_flow(msg["flow"], msg["twid"])
+
     def pre_main(self):
         utils.drop_root_privs()
-        self.dns.pre_analyze()
         self.analyzers_map = {
             "new_downloaded_file": [self.downloaded_file],
             "new_notice": [self.notice],
@@ -72,35 +203,39 @@ class FlowAlerts(AsyncModule):
             "new_flow": [
                 self.conn,
                 self.ssl,
+                self.beaconing,
             ],
             "new_dns": [self.dns],
-            "tw_closed": [self.conn],
+            "tw_closed": [self.conn, self.beaconing],
             "new_ssh": [self.ssh],
             "new_software": [self.software],
             "new_tunnel": [self.tunnel],
             "new_ssl": [self.ssl],
         }
+        self.init_channel_stats()
 
     async def main(self):
         """runs in a loop, waiting for messages in subscribed channels"""
+        self.delayed_checks.run_due(time.time())
+        self.update_channel_quotas()
         for channel, analyzers in self.analyzers_map.items():
-            msg: dict = self.get_msg(channel)
-            if not msg:
+            msgs: List[dict] = self.get_msgs(channel)
+            if not msgs:
                 continue
 
+            if channel == "new_flow":
+                self.cache_conn_flows(msgs)
+
             for analyzer in analyzers:
                 # some analyzers are async functions
                 if inspect.iscoroutinefunction(analyzer.analyze):
                     # analyzer will run normally, until it finishes.
                     # tasks inside this analyzer will run asynchrously,
                     # and finish whenever they finish, we'll not wait for them
-                    loop = asyncio.get_event_loop()
-                    task = loop.create_task(analyzer.analyze(msg))
-                    # because Async Tasks swallow exceptions.
-                    task.add_done_callback(self.handle_exception)
-                    # to wait for these functions before flowalerts shuts down
-                    self.tasks.append(task)
-                    # Allow the event loop to run the scheduled task
+                    for msg in msgs:
+                        self.create_task(analyzer.analyze, msg)
+                    # Allow the event loop to run the scheduled tasks
                     await asyncio.sleep(0)
                 else:
-                    analyzer.analyze(msg)
+                    for msg in msgs:
+                        analyzer.analyze(msg)
@@ -1480,3 +1480,46 @@ class SetEvidenceHelper:
         )
 
         self.db.set_evidence(evidence)
+
+    def beaconing(
+        self,
+        twid: str,
+        flow,
+        period: float,
+        cv: float,
+        coherence: float,
+        flows: int,
+    ) -> None:
+        """
+        :param flow: the last flow of the beaconing tuple
+        :param flows: the number of flows the periodicity was computed from
+        """
+        confidence: float = round(min(1.0, max(coherence, 1 - cv)), 2)
+        description: str = (
+            f"Possible C&C beaconing from {flow.saddr} to {flow.daddr} "
+            f"port {flow.dport}/{flow.proto} every {period:.1f} seconds. "
+            f"{flows} connections with a coefficient of variation of "
+            f"{cv:.2f} and a periodicity of {coherence:.2f}"
+        )
+        evidence: Evidence = Evidence(
+            evidence_type=EvidenceType.BEACONING,
+            attacker=Attacker(
+                direction=Direction.SRC,
+                ioc_type=IoCType.IP,
+                value=flow.saddr,
+            ),
+            victim=Victim(
+                direction=Direction.DST,
+                ioc_type=IoCType.IP,
+                value=flow.daddr,
+            ),
+            threat_level=ThreatLevel.LOW,
+            confidence=confidence,
+            description=description,
+            profile=ProfileID(ip=flow.saddr),
+            timewindow=TimeWindow(number=int(twid.replace("timewindow", ""))),
+            uid=[flow.uid],
+            timestamp=flow.starttime,
+            dst_port=flow.dport,
+        )
+        self.db.set_evidence(evidence)
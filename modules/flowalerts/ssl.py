@@ -83,13 +83,14 @@ class SSL(IFlowalertsAnalyzer):
             # we don't have info about this flow's ja3 or ja3s fingerprint
             return
 
-        # get the dict of malicious ja3 stored in our db
-        malicious_ja3_dict = self.db.get_all_blacklisted_ja3()
-        if flow.ja3 in malicious_ja3_dict:
-            self.set_evidence.malicious_ja3(twid, flow, malicious_ja3_dict)
+        # lookup only the ja3 and ja3s of this flow in our db
+        if flow.ja3 and (ja3_info := self.db.is_blacklisted_ja3(flow.ja3)):
+            self.set_evidence.malicious_ja3(twid, flow, {flow.ja3: ja3_info})
 
-        if flow.ja3s in malicious_ja3_dict:
-            self.set_evidence.malicious_ja3s(twid, flow, malicious_ja3_dict)
+        if flow.ja3s and (ja3s_info := self.db.is_blacklisted_ja3(flow.ja3s)):
+            self.set_evidence.malicious_ja3s(
+                twid, flow, {flow.ja3s: ja3s_info}
+            )
 
     def detect_incompatible_cn(self, twid, flow):
         """
@@ -1,13 +1,19 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
-from typing import Optional
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
 # SPDX-License-Identifier: GPL-2.0-only
 import numpy
 from sklearn.linear_model import SGDClassifier
 from sklearn.preprocessing import StandardScaler
 import pickle
-import pandas as pd
 import json
+import time
 import traceback
 import warnings
 
@@ -38,6 +44,76 @@ def warn(*args, **kwargs):
 
 warnings.warn = warn
 
+# the features the model is trained and tested with, in the order of
+# the columns of the flows they were trained with. used when the scaler
+# doesn't know the names of its features
+FEATURES = (
+    "dur",
+    "proto",
+    "sport",
+    "dport",
+    "spkts",
+    "sbytes",
+    "state",
+    "allbytes",
+    "pkts",
+)
+# flows with these protos don't have ports, they're not detected
+PROTOS_TO_DISCARD = ("arp", "ARP", "icmp", "igmp", "ipv6-icmp", "")
+# the values given to each proto and state, a value gets the code of
+# the first of these substrings it contains
+PROTO_CODES = (("tcp", 0), ("udp", 1), ("icmp", 2), ("arp", 4))
+STATE_CODES = (("NotEstablished", 0), ("Established", 1))
+
+
+def to_float_column(values: Sequence) -> numpy.ndarray:
+    """
+    converts the given numbers or numeric strs to floats. the values that
+    can't be converted are nan
+    """
+    try:
+        return numpy.asarray(values, dtype=numpy.float64)
+    except (TypeError, ValueError):
+        column = numpy.full(len(values), numpy.nan)
+        for i, value in enumerate(values):
+            try:
+                column[i] = float(value)
+            except (TypeError, ValueError):
+                pass
+        return column
+
+
+def to_codes_column(
+    values: Sequence[str], codes: Tuple[Tuple[str, int], ...]
+) -> numpy.ndarray:
+    """
+    gives every value the code of the first substring it contains.
+    values without any of them keep their numeric value, or nan
+    """
+    strs = numpy.asarray(values, dtype=str)
+    column = numpy.full(len(strs), numpy.nan)
+    for substring, code in codes:
+        found = numpy.char.find(strs, substring) >= 0
+        column[found & numpy.isnan(column)] = code
+    not_found = numpy.isnan(column)
+    if not_found.any():
+        column[not_found] = to_float_column(strs[not_found])
+    return column
+
+
+def get_training_class(label: str) -> Optional[str]:
+    """
+    returns the class the model is trained with for the given label,
+    Normal or Malware, or None if the label is neither of them
+    """
+    if not label:
+        return None
+    if "ormal" in label:
+        return "Normal"
+    if "alware" in label or "alicious" in label:
+        return "Malware"
+    return None
+
 
 class FlowMLDetection(IModule):
     # Name: short name of the module. Do not use spaces
@@ -63,46 +139,48 @@ class FlowMLDetection(IModule):
         self.scaler = StandardScaler()
         self.model_path = "./modules/flowmldetection/model.bin"
         self.scaler_path = "./modules/flowmldetection/scaler.bin"
+        # in test mode, flows are detected in batches of this size, or
+        # once the oldest of them waited max_batch_delay seconds
+        self.batch_size = 256
+        self.max_batch_delay = 1
+        # (flow, twid) of the flows waiting to be detected
+        self.pending_flows: List[Tuple[Dict, str]] = []
+        self.oldest_pending_flow_time: Optional[float] = None
+        # in train mode, the rowid of the last flow in the db the model
+        # was trained with, and the max amount of flows read from the db
+        # at once
+        self.last_trained_rowid = 0
+        self.training_batch_size = 10000
 
     def read_configuration(self):
         conf = ConfigParser()
         self.mode = conf.get_ml_mode()
 
-    def train(self):
+    def train(self, x_flows: numpy.ndarray, y_flows: numpy.ndarray):
         """
-        Train a model based on the flows we receive and the labels
+        Train the model with the given flows and labels, on top of what
+        it learnt from the previous ones
+        :param x_flows: the features of the flows, as returned by
+            get_features()
+        :param y_flows: the class of each flow, Normal or Malware
         """
         try:
-            # Process the labels to have only Normal and Malware
-            self.flows.label = self.flows.label.str.replace(
-                r"(^.*ormal.*$)", "Normal", regex=True
-            )
-            self.flows.label = self.flows.label.str.replace(
-                r"(^.*alware.*$)", "Malware", regex=True
-            )
-            self.flows.label = self.flows.label.str.replace(
-                r"(^.*alicious.*$)", "Malware", regex=True
-            )
-
-            # Separate
-            y_flow = self.flows["label"]
-            X_flow = self.flows.drop("label", axis=1)
-            X_flow = X_flow.drop("module_labels", axis=1)
-
-            # Normalize this batch of data so far. This can get progressivle slow
-            X_flow = self.scaler.fit_transform(X_flow)
+            # Update the normalization with this batch of data only,
+            # instead of fitting it again with all the flows so far
+            self.scaler.partial_fit(x_flows)
+            x_flows = self.scaler.transform(x_flows)
 
             # Train
             try:
                 self.clf.partial_fit(
-                    X_flow, y_flow, classes=["Malware", "Normal"]
+                    x_flows, y_flows, classes=["Malware", "Normal"]
                 )
             except Exception:
                 self.print("Error while calling clf.train()")
                 self.print(traceback.format_exc(), 0, 1)
 
             # See score so far in training
-            score = self.clf.score(X_flow, y_flow)
+            score = self.clf.score(x_flows, y_flows)
 
             # To debug the training score
             # self.scores.append(score)
@@ -114,226 +192,199 @@ class FlowMLDetection(IModule):
             # plt.plot(self.scores)
             # plt.savefig('train-scores.png')
 
-            # Store the models on disk
-            self.store_model()
-
         except Exception:
             self.print("Error in train()", 0, 1)
             self.print(traceback.format_exc(), 0, 1)
 
-    def process_features(self, dataset):
-        """
-        Discards some features of the dataset and can create new.
-        Clean the dataset
-        """
-        try:
-            # Discard some type of flows that dont have ports
-            to_discard = ["arp", "ARP", "icmp", "igmp", "ipv6-icmp", ""]
-            for proto in to_discard:
-                dataset = dataset[dataset.proto != proto]
-
-            # For now, discard the ports
-            to_drop = [
-                "appproto",
-                "daddr",
-                "saddr",
-                "starttime",
-                "type_",
-                "smac",
-                "dmac",
-                "history",
-                "uid",
-                "dir_",
-                "dbytes",
-                "endtime",
-                "bytes",
-                "flow_source",
-            ]
-            for field in to_drop:
-                try:
-                    dataset = dataset.drop(field, axis=1)
-                except (ValueError, KeyError):
-                    pass
-
-            # Convert state to categorical
-            dataset.state = dataset.state.str.replace(
-                r"(^.*NotEstablished.*$)", "0", regex=True
-            )
-            dataset.state = dataset.state.str.replace(
-                r"(^.*Established.*$)", "1", regex=True
-            )
-            # Convert proto to categorical. For now we only have few states,
-            # so we can hardcode...
-            # We dont use the data to create categories because in testing mode
-            # we dont see all the protocols
-            # Also we dont store the Categorizer because the user can retrain
-            # with its own data.
-            dataset.proto = dataset.proto.str.lower()
-            dataset.proto = dataset.proto.str.replace(
-                r"(^.*tcp.*$)", "0", regex=True
-            )
-            dataset.proto = dataset.proto.str.replace(
-                r"(^.*udp.*$)", "1", regex=True
-            )
-            dataset.proto = dataset.proto.str.replace(
-                r"(^.*icmp.*$)", "2", regex=True
-            )
-            dataset.proto = dataset.proto.str.replace(
-                r"(^.*icmp-ipv6.*$)", "3", regex=True
-            )
-            dataset.proto = dataset.proto.str.replace(
-                r"(^.*arp.*$)", "4", regex=True
-            )
-            fields_to_convert_to_flow = [
-                dataset.proto,
-                dataset.dport,
-                dataset.sport,
-                dataset.dur,
-                dataset.pkts,
-                dataset.spkts,
-                dataset.allbytes,
-                dataset.sbytes,
-                dataset.state,
-            ]
-            for field in fields_to_convert_to_flow:
-                try:
-                    field = field.astype("float64")
-                except ValueError:
-                    pass
-
-            return dataset
-        except Exception:
-            # Stop the timer
-            self.print("Error in process_features()")
-            self.print(traceback.format_exc(), 0, 1)
-
-    def process_flows(self):
+    def get_training_flows(
+        self, rows: List[Tuple[int, Dict, str]]
+    ) -> Tuple[List[Dict], List[str]]:
         """
-        Process all the flwos in the DB
-        Store the pandas df in self.flows
+        Converts the given (rowid, flow, label) rows of the flows table to
+        flows with the fields get_features() needs, and returns them with
+        their classes.
+        Flows that aren't labeled as normal or malware are skipped
         """
-        try:
-            # We get all the flows so far
-            # because this retraining happens in batches
-            flows = self.db.get_all_flows()
-            # Check how many different labels are in the DB
-            # We need both normal and malware
-            labels = self.db.get_labels()
-            if len(labels) == 1:
-                # Only 1 label has flows
-                # There are not enough different labels, so insert two flows
-                # that are fake but representative of a normal and malware flow
-                # they are only for the training process
-                # At least 1 flow of each label is required
-                # self.print(f'Amount of labeled flows: {labels}', 0, 1)
-                flows.append(
-                    {
-                        "ts": 1594417039.029793,
-                        "dur": "1.9424750804901123",
-                        "saddr": "10.7.10.101",
-                        "sport": "49733",
-                        "daddr": "40.70.224.145",
-                        "dport": "443",
-                        "proto": "tcp",
-                        "state": "Established",
-                        "allbytes": 42764,
-                        "spkts": 37,
-                        "sbytes": 25517,
-                        "appproto": "ssl",
-                        "label": "Malware",
-                        "module_labels": {
-                            "flowalerts-long-connection": "Malware"
-                        },
-                    }
-                )
-                flows.append(
+        flows = []
+        classes = []
+        for _, flow, label in rows:
+            class_ = get_training_class(label)
+            if not class_:
+                continue
+            try:
+                pkts = flow["spkts"] + flow["dpkts"]
+                flow.update(
                     {
-                        "ts": 1382355032.706468,
-                        "dur": "10.896695",
-                        "saddr": "147.32.83.52",
-                        "sport": "47956",
-                        "daddr": "80.242.138.72",
-                        "dport": "80",
-                        "proto": "tcp",
-                        "state": "Established",
-                        "allbytes": 67696,
-                        "spkts": 1,
-                        "sbytes": 100,
-                        "appproto": "http",
-                        "label": "Normal",
-                        "module_labels": {
-                            "flowalerts-long-connection": "Normal"
-                        },
+                        "allbytes": flow["sbytes"] + flow["dbytes"],
+                        "pkts": pkts,
+                        # the stored state is the origstate, we need the
+                        # interpreted one, like in testing
+                        "state": self.db.get_final_state_from_flags(
+                            flow["state"], pkts
+                        ),
                     }
                 )
-                # If there are enough flows, we dont insert them anymore
-
-            # Convert to pandas df
-            df_flows = pd.DataFrame(flows)
-
-            # Process features
-            df_flows = self.process_features(df_flows)
+            except (KeyError, TypeError):
+                # not a conn flow
+                continue
+            flows.append(flow)
+            classes.append(class_)
+        return flows, classes
+
+    def train_with_new_flows(self):
+        """
+        Trains the model with the flows stored in the db since the last
+        training.
+        The flows are read by rowid in batches of training_batch_size, so
+        each flow is read and converted to features only once, and the
+        memory used doesn't grow with the amount of flows in the db
+        """
+        trained = False
+        while rows := self.db.get_flows_after(
+            self.last_trained_rowid, self.training_batch_size
+        ):
+            self.last_trained_rowid = rows[-1][0]
+            flows, classes = self.get_training_flows(rows)
+            x_flows, indices = self.get_features(flows)
+            if len(indices):
+                y_flows = numpy.asarray(classes)[indices]
+                self.train(x_flows, y_flows)
+                trained = True
+
+            if len(rows) < self.training_batch_size:
+                # no more flows so far
+                break
+
+        if trained:
+            # Store the models on disk
+            self.store_model()
 
-            # Update the flow to the processed version
-            self.flows = df_flows
-        except Exception:
-            # Stop the timer
-            self.print("Error in process_flows()")
-            self.print(traceback.format_exc(), 0, 1)
+    def get_feature_names(self) -> Sequence[str]:
+        """the features the scaler was trained with, in its order"""
+        return getattr(self.scaler, "feature_names_in_", FEATURES)
 
-    def process_flow(self, flow_to_process: dict):
+    def get_features(
+        self, flows: List[Dict]
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
         """
-        Process one flow. Only used during detection in testing
-        returns the pandas df with the processed flow
+        Converts the given flows to the features of the model, column by
+        column instead of flow by flow.
+        returns the matrix of the features of the flows that can be
+        detected, and the indices of these flows in the given list.
+        flows without ports or with values that aren't numeric are
+        skipped
         """
-        try:
-            # Convert the flow to a pandas dataframe
-            raw_flow = pd.DataFrame(flow_to_process, index=[0])
-            dflow = self.process_features(raw_flow)
-            # Update the flow to the processed version
-            return dflow
-        except Exception:
-            # Stop the timer
-            self.print("Error in process_flow()")
-            self.print(traceback.format_exc(), 0, 1)
-
-    def detect(self, x_flow) -> Optional[numpy.ndarray]:
+        indices = numpy.array(
+            [
+                i
+                for i, flow in enumerate(flows)
+                if flow["proto"] not in PROTOS_TO_DISCARD
+            ],
+            dtype=numpy.int64,
+        )
+        flows = [flows[i] for i in indices]
+        columns = {}
+        for feature in self.get_feature_names():
+            values = [flow.get(feature) for flow in flows]
+            if feature == "proto":
+                values = numpy.char.lower(numpy.asarray(values, dtype=str))
+                columns[feature] = to_codes_column(values, PROTO_CODES)
+            elif feature == "state":
+                columns[feature] = to_codes_column(values, STATE_CODES)
+            else:
+                columns[feature] = to_float_column(values)
+
+        if not flows:
+            return numpy.empty((0, len(columns))), indices
+
+        x_flows = numpy.column_stack(list(columns.values()))
+        valid = ~numpy.isnan(x_flows).any(axis=1)
+        return x_flows[valid], indices[valid]
+
+    def detect(self, x_flows: numpy.ndarray) -> Optional[numpy.ndarray]:
         """
-        Detects the given flow with the current model stored
+        Detects the given flows with the current model stored
         and returns the predection array
+        :param x_flows: the features of the flows, as returned by
+            get_features()
         """
         try:
-            given_x_flow = x_flow
-            # clean the flow
-            fields_to_drop = [
-                "label",
-                "module_labels",
-                "uid",
-                "history",
-                "dir_",
-                "dbytes",
-                "dpkts",
-                "endtime",
-                "bytes",
-                "flow_source",
-                "ground_truth_label",  # todo now we can use them
-                "detailed_ground_truth_label",
-            ]
-            for field in fields_to_drop:
-                try:
-                    x_flow = x_flow.drop(field, axis=1)
-                except (KeyError, ValueError):
-                    pass
-            # Scale the flow
-            x_flow: numpy.ndarray = self.scaler.transform(x_flow)
-            pred: numpy.ndarray = self.clf.predict(x_flow)
+            # Scale the flows
+            x_flows: numpy.ndarray = self.scaler.transform(x_flows)
+            pred: numpy.ndarray = self.clf.predict(x_flows)
             return pred
         except Exception as e:
             self.print(
-                f"Error in detect() while processing " f"\n{given_x_flow}\n{e}"
+                f"Error in detect() while processing "
+                f"{len(x_flows)} flows\n{e}"
             )
             self.print(traceback.format_exc(), 0, 1)
 
+    def add_pending_flow(self, flow: dict, twid: str):
+        if not self.pending_flows:
+            self.oldest_pending_flow_time = time.monotonic()
+        self.pending_flows.append((flow, twid))
+
+    def should_detect_pending_flows(self) -> bool:
+        if not self.pending_flows:
+            return False
+        if len(self.pending_flows) >= self.batch_size:
+            return True
+        waited = time.monotonic() - self.oldest_pending_flow_time
+        return waited >= self.max_batch_delay
+
+    def detect_pending_flows(self):
+        """
+        Detects all the flows waiting in self.pending_flows at once and
+        sets an evidence for each malicious one
+        """
+        pending_flows, self.pending_flows = self.pending_flows, []
+        flows = [flow for flow, _ in pending_flows]
+        x_flows, indices = self.get_features(flows)
+        # After processing the flows, it may happen that we
+        # delete icmp/arp/etc so there may be nothing to detect
+        if not len(indices):
+            return
+
+        pred: numpy.ndarray = self.detect(x_flows)
+        if pred is None:
+            # an error occurred
+            return
+
+        for i, prediction in zip(indices, pred):
+            flow, twid = pending_flows[i]
+            self.handle_prediction(flow, twid, prediction)
+
+    def handle_prediction(self, flow: dict, twid: str, prediction: str):
+        label = flow["label"]
+        if label and label != "unknown" and label != prediction:
+            # If the user specified a label in test mode,
+            # and the label is diff from the prediction,
+            # print in debug mode
+            self.print(
+                f"Report Prediction {prediction} for label"
+                f' {label} flow {flow["saddr"]}:'
+                f'{flow["sport"]} ->'
+                f' {flow["daddr"]}:'
+                f'{flow["dport"]}/'
+                f'{flow["proto"]}',
+                0,
+                3,
+            )
+        if prediction == "Malware":
+            # Generate an alert
+            self.set_evidence_malicious_flow(flow, twid)
+            self.print(
+                f"Prediction {prediction} for label {label}"
+                f' flow {flow["saddr"]}:'
+                f'{flow["sport"]} -> '
+                f'{flow["daddr"]}:'
+                f'{flow["dport"]}/'
+                f'{flow["proto"]}',
+                0,
+                2,
+            )
+
     def store_model(self):
         """
         Store the trained model on disk
@@ -414,6 +465,8 @@ class FlowMLDetection(IModule):
         # Confirm that the module is done processing
         if self.mode == "train":
             self.store_model()
+        elif self.mode == "test" and self.pending_flows:
+            self.detect_pending_flows()
 
     def pre_main(self):
         utils.drop_root_privs()
@@ -458,49 +511,11 @@ class FlowMLDetection(IModule):
                         f"Training the model with the last group of "
                         f"flows and labels. Total flows: {sum_labeled_flows}."
                     )
-                    # Process all flows in the DB and make them ready
-                    # for pandas
-                    self.process_flows()
-                    # Train an algorithm
-                    self.train()
+                    # Train with the flows added since the last training
+                    self.train_with_new_flows()
             elif self.mode == "test":
                 # We are testing, which means using the model to detect
-                processed_flow = self.process_flow(self.flow)
-
-                # After processing the flow, it may happen that we
-                # delete icmp/arp/etc so the dataframe can be empty
-                if processed_flow is not None and not processed_flow.empty:
-                    # Predict
-                    pred: numpy.ndarray = self.detect(processed_flow)
-                    if not pred:
-                        # an error occurred
-                        return
-
-                    label = self.flow["label"]
-                    if label and label != "unknown" and label != pred[0]:
-                        # If the user specified a label in test mode,
-                        # and the label is diff from the prediction,
-                        # print in debug mode
-                        self.print(
-                            f"Report Prediction {pred[0]} for label"
-                            f' {label} flow {self.flow["saddr"]}:'
-                            f'{self.flow["sport"]} ->'
-                            f' {self.flow["daddr"]}:'
-                            f'{self.flow["dport"]}/'
-                            f'{self.flow["proto"]}',
-                            0,
-                            3,
-                        )
-                    if pred[0] == "Malware":
-                        # Generate an alert
-                        self.set_evidence_malicious_flow(self.flow, twid)
-                        self.print(
-                            f"Prediction {pred[0]} for label {label}"
-                            f' flow {self.flow["saddr"]}:'
-                            f'{self.flow["sport"]} -> '
-                            f'{self.flow["daddr"]}:'
-                            f'{self.flow["dport"]}/'
-                            f'{self.flow["proto"]}',
-                            0,
-                            2,
-                        )
+                self.add_pending_flow(self.flow, twid)
+
+        if self.mode == "test" and self.should_detect_pending_flows():
+            self.detect_pending_flows()
@@ -14,6 +14,7 @@ from slips_files.common.flow_classifier import FlowClassifier
 from slips_files.common.parsers.config_parser import ConfigParser
 from slips_files.common.slips_utils import utils
 from slips_files.common.abstracts.iasync_module import AsyncModule
+from slips_files.common.data_structures.timer_wheel import TimerWheel
 
 
 ESTAB = "Established"
@@ -66,6 +67,13 @@ class HTTPAnalyzer(AsyncModule):
         self.ts_of_last_cleanup_of_http_recognized_flows = time.time()
         self.http_recognized_flows_lock = Lock()
         self.condition = asyncio.Condition()
+        # non http flows on port 80 waiting for a matching http flow
+        self.delayed_checks = TimerWheel()
+        self.delayed_checks.register(
+            "non_http_port_80_conn", self.check_pending_non_http_port_80_conn
+        )
+        # the last time we asked the db if the profiler is done
+        self.ts_of_last_incoming_flows_check = 0.0
 
     def read_configuration(self):
         conf = ConfigParser()
@@ -474,9 +482,7 @@ class HTTPAnalyzer(AsyncModule):
 
         return sorted_timestamps_of_past_http_flows[left_idx:right_idx]
 
-    async def check_non_http_port_80_conns(
-        self, twid, flow, timeout_reached=False
-    ):
+    def check_non_http_port_80_conns(self, twid, flow, timeout_reached=False):
         """
         alerts on established connections on port 80 that are not http
         This is how we do the detection.
@@ -536,43 +542,33 @@ class HTTPAnalyzer(AsyncModule):
         # wait 5 mins real-time (to give slips time to
         # read more flows) maybe the recognized http arrives
         # within that time?
-        await self.wait_for_new_flows_or_timeout(five_mins)
-        # we can safely await here without blocking the main thread because
-        # once we run this func with timeout_reached=True, this function will
-        # never sleep again, it'll either set the evidence or discard it
-        await self.check_non_http_port_80_conns(
-            twid, flow, timeout_reached=True
+        # once the check runs with timeout_reached=True, it'll either set
+        # the evidence or discard it
+        self.delayed_checks.schedule(
+            "non_http_port_80_conn", time.time() + five_mins, twid, flow
         )
         return False
 
-    async def wait_for_new_flows_or_timeout(self, timeout: float):
-        """
-        waits for new incoming flows, but interrupts the wait if profiler
-        stop sending new flows within the timeout period.
-        because that means no more flows are coming during the wait period,
-        no need to wait.
+    def check_pending_non_http_port_80_conn(self, twid, flow):
+        self.check_non_http_port_80_conns(twid, flow, timeout_reached=True)
 
-        :param timeout: the maximum time to wait before resuming execution.
+    def run_delayed_checks(self):
         """
+        runs the checks that waited long enough for their http flows.
+        if the profiler stopped sending new flows, no more flows are coming
+        during the wait period, so all of them run without waiting
+        """
+        now = time.time()
+        self.delayed_checks.run_due(now)
+        if not len(self.delayed_checks):
+            return
 
-        # repeatedly check if slips is no longer receiving new flows
-        async def will_slips_have_new_incoming_flows():
-            """if slips will have no incoming flows, aka profiler stopped.
-            this function will return False immediately"""
-            while self.db.will_slips_have_new_incoming_flows():
-                await asyncio.sleep(1)  # sleep to avoid busy looping
-            return False
-
-        try:
-            # wait until either:
-            # - will_slips_have_new_incoming_flows() returns False (no new flows)
-            # - timeout is reached (5 minutes)
-            await asyncio.wait_for(
-                will_slips_have_new_incoming_flows(), timeout
-            )
-
-        except asyncio.TimeoutError:
-            pass  # timeout reached
+        # avoid asking the db in every iteration
+        if now - self.ts_of_last_incoming_flows_check < 1:
+            return
+        self.ts_of_last_incoming_flows_check = now
+        if not self.db.will_slips_have_new_incoming_flows():
+            self.delayed_checks.run_all()
 
     async def update_flows_status(self):
         """
@@ -625,6 +621,7 @@ class HTTPAnalyzer(AsyncModule):
 
     async def shutdown_gracefully(self):
         """wait for all the tasks created by self.create_task()"""
+        self.delayed_checks.run_all()
         await asyncio.gather(*self.tasks, return_exceptions=True)
 
     def pre_main(self):
@@ -670,7 +667,9 @@ class HTTPAnalyzer(AsyncModule):
         if msg := self.get_msg("new_flow"):
             msg = json.loads(msg["data"])
             twid = msg["twid"]
+            self.db.cache_conn_flow(msg["flow"], twid)
             flow = self.classifier.convert_to_flow_obj(msg["flow"])
-            self.create_task(self.check_non_http_port_80_conns, twid, flow)
+            self.check_non_http_port_80_conns(twid, flow)
 
+        self.run_delayed_checks()
         self.remove_old_entries_from_http_recognized_flows()
@@ -1,10 +1,17 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
 import ipaddress
-from typing import List
+from typing import (
+    Dict,
+    List,
+    Tuple,
+)
 
 import validators
 
+from slips_files.common.data_structures.distinct_counter import (
+    DistinctCounter,
+)
 from slips_files.common.slips_utils import utils
 from slips_files.core.structures.evidence import (
     Evidence,
@@ -25,6 +32,12 @@ class HorizontalPortscan:
     """
     Horizontal scanning sends requests to the same port
     on different hosts.
+
+    The distinct dst IPs of the not established flows of each profile
+    are counted per tw, protocol and dport as the flows arrive, so
+    checking the threshold doesn't need to read all the ports of the tw
+    from the db. The db is only read to get the details of the evidence
+    once the threshold is reached.
     """
 
     def __init__(self, db):
@@ -34,6 +47,11 @@ class HorizontalPortscan:
         # The minimum amount of scanned dstips to trigger an evidence
         # is increased exponentially every evidence, and is reset each timewindow
         self.minimum_dstips_to_set_evidence = 5
+        # distinct dstips per dport in the format
+        # {profileid: {twid: {(protocol, dport): DistinctCounter}}}
+        self.dstips_per_dport: Dict[
+            str, Dict[str, Dict[Tuple[str, str], DistinctCounter]]
+        ] = {}
 
     def get_not_estab_dst_ports(
         self, protocol: str, state: str, profileid: str, twid: str
@@ -210,48 +228,134 @@ class HorizontalPortscan:
     def is_valid_twid(twid: str) -> bool:
         return not (twid in ("", None) or "timewindow" not in twid)
 
-    def check(self, profileid: str, twid: str):
-        if not self.is_valid_saddr(profileid) or not self.is_valid_twid(twid):
+    @staticmethod
+    def is_flipped(flow) -> bool:
+        """
+        flows with ^ in their history were flipped by zeek, they're
+        usually not established conns being redone by a benign host that
+        changed wifi, so they're not stored in the db for this detection
+        """
+        state_hist = flow.state_hist if hasattr(flow, "state_hist") else ""
+        return "^" in state_hist
+
+    def is_ignored_dstip(self, protocol: str, daddr: str) -> bool:
+        """
+        the db doesn't store the resolved, multicast and broadcast dst
+        IPs of the not established TCP flows, so they're not counted
+        either
+        """
+        if protocol != "TCP":
             return False
+        try:
+            if (
+                daddr == BROADCAST_ADDR
+                or ipaddress.ip_address(daddr).is_multicast
+            ):
+                return True
+        except ValueError:
+            return True
+        return bool(self.db.get_dns_resolution(daddr))
+
+    def get_dstips_counter(
+        self, profileid: str, twid: str, protocol: str, dport: str
+    ) -> DistinctCounter:
+        tws = self.dstips_per_dport.setdefault(profileid, {})
+        dports = tws.setdefault(twid, {})
+        key = (protocol, dport)
+        if key not in dports:
+            dports[key] = DistinctCounter()
+        return dports[key]
+
+    def evict(self, profileid: str, twid: str):
+        """
+        removes the counters of the given closed tw, and of the older tws
+        of the same profile, in case flows of them arrived after they were
+        closed
+        """
+        tws = self.dstips_per_dport.get(profileid)
+        if not tws:
+            return
+
+        closed_tw_number = int(twid.replace("timewindow", ""))
+        for tw in list(tws):
+            if int(tw.replace("timewindow", "")) <= closed_tw_number:
+                del tws[tw]
+
+        if not tws:
+            del self.dstips_per_dport[profileid]
 
+    def check(self, profileid: str, twid: str, flow, state: str):
+        """
+        counts the daddr of the given flow in the dstips of its dport,
+        and sets an evidence if they're enough
+        :param flow: a conn flow of the given profile and tw
+        :param state: the interpreted state of the flow
+        """
         # if you're portscaning a port that is open it's gonna be established
         # the amount of open ports we find is gonna be so small
         # theoretically this is incorrect bc we'll be ignoring
         # established evidence,
         # but usually open ports are very few compared to the whole range
         # so, practically this is correct to avoid FP
-        state = "Not Established"
-        for protocol in ("TCP", "UDP"):
-            dports: dict = self.get_not_estab_dst_ports(
-                protocol, state, profileid, twid
-            )
-
-            # For each port, see if the amount is over the threshold
-            for dport in dports.keys():
-                # PortScan Type 2. Direction OUT
-                dstips: dict = dports[dport]["dstips"]
-
-                twid_identifier: str = self.get_twid_identifier(
-                    profileid, twid, dport
-                )
-                if not twid_identifier:
-                    continue
-
-                amount_of_dips = len(dstips)
-
-                if self.check_if_enough_dstips_to_trigger_an_evidence(
-                    twid_identifier, amount_of_dips
-                ):
-                    evidence = {
-                        "protocol": protocol,
-                        "profileid": profileid,
-                        "twid": twid,
-                        "uids": self.get_uids(dstips),
-                        "dport": dport,
-                        "pkts_sent": self.get_packets_sent(dstips),
-                        "timestamp": next(iter(dstips.values()))["stime"],
-                        "state": state,
-                        "amount_of_dips": amount_of_dips,
-                    }
-
-                    self.set_evidence_horizontal_portscan(evidence)
+        if state != "Not Established":
+            return False
+
+        protocol = flow.proto.upper()
+        if protocol not in ("TCP", "UDP"):
+            return False
+
+        # we only care about the flows where the profile is the client
+        if flow.saddr != profileid.split("_")[-1]:
+            return False
+
+        twid_identifier: str = self.get_twid_identifier(
+            profileid, twid, flow.dport
+        )
+        if not twid_identifier:
+            return False
+
+        if self.is_flipped(flow) or self.is_ignored_dstip(
+            protocol, flow.daddr
+        ):
+            return False
+
+        # PortScan Type 2. Direction OUT
+        dport = str(flow.dport)
+        dstips: DistinctCounter = self.get_dstips_counter(
+            profileid, twid, protocol, dport
+        )
+        if not dstips.add(flow.daddr):
+            # nothing changed since the last check
+            return False
+
+        amount_of_dips = len(dstips)
+        if not self.check_if_enough_dstips_to_trigger_an_evidence(
+            twid_identifier, amount_of_dips
+        ):
+            return False
+
+        if not self.is_valid_saddr(profileid) or not self.is_valid_twid(twid):
+            return False
+
+        # get the details of the scanned dstips
+        dports: dict = self.get_not_estab_dst_ports(
+            protocol, state, profileid, twid
+        )
+        try:
+            dstips: dict = dports[dport]["dstips"]
+        except KeyError:
+            return False
+
+        evidence = {
+            "protocol": protocol,
+            "profileid": profileid,
+            "twid": twid,
+            "uids": self.get_uids(dstips),
+            "dport": dport,
+            "pkts_sent": self.get_packets_sent(dstips),
+            "timestamp": next(iter(dstips.values()))["stime"],
+            "state": state,
+            "amount_of_dips": amount_of_dips,
+        }
+        self.set_evidence_horizontal_portscan(evidence)
+        return True
@@ -7,6 +7,7 @@ from slips_files.common.flow_classifier import FlowClassifier
 from slips_files.common.slips_utils import utils
 from slips_files.common.abstracts.imodule import IModule
 from modules.network_discovery.horizontal_portscan import HorizontalPortscan
+from modules.network_discovery.slow_portscan import SlowPortscan
 from modules.network_discovery.vertical_portscan import VerticalPortscan
 from slips_files.core.structures.evidence import (
     Evidence,
@@ -35,13 +36,18 @@ class NetworkDiscovery(IModule):
     def init(self):
         self.horizontal_ps = HorizontalPortscan(self.db)
         self.vertical_ps = VerticalPortscan(self.db)
+        self.slow_ps = SlowPortscan(self.db)
         self.c1 = self.db.subscribe("tw_modified")
         self.c2 = self.db.subscribe("new_notice")
         self.c3 = self.db.subscribe("new_dhcp")
+        self.c4 = self.db.subscribe("new_flow")
+        self.c5 = self.db.subscribe("tw_closed")
         self.channels = {
             "tw_modified": self.c1,
             "new_notice": self.c2,
             "new_dhcp": self.c3,
+            "new_flow": self.c4,
+            "tw_closed": self.c5,
         }
         # We need to know that after a detection, if we receive another flow
         # that does not modify the count for the detection, we are not
@@ -375,18 +381,12 @@ class NetworkDiscovery(IModule):
         utils.drop_root_privs()
 
     def main(self):
-        if msg := self.get_msg("tw_modified"):
-            # Get the profileid and twid
-            profileid = msg["data"].split(":")[0]
-            twid = msg["data"].split(":")[1]
-            # Start of the port scan detection
-            self.print(
-                f"Running the detection of portscans in profile "
-                f"{profileid} TW {twid}",
-                3,
-                0,
-            )
-
+        if msg := self.get_msg("new_flow"):
+            msg = json.loads(msg["data"])
+            profileid = msg["profileid"]
+            twid = msg["twid"]
+            flow = self.classifier.convert_to_flow_obj(msg["flow"])
+            state = msg["interpreted_state"]
             # For port scan detection, we will measure different things:
 
             # 1. Vertical port scan:
@@ -401,15 +401,36 @@ class NetworkDiscovery(IModule):
             # - 1 srcip sends not established flows to the same dst ports,
             # > 3 pkts, to the same dst ip
             # 4. Slow port scan. Same as the others but distributed in
-            # multiple time windows
+            # multiple time windows, checked when a tw is closed
 
             # Remember that in slips all these port scans can happen
             # for traffic going IN to an IP or going OUT from the IP.
 
-            self.horizontal_ps.check(profileid, twid)
-            self.vertical_ps.check(profileid, twid)
+            # 1, 2 and 4 are counted as the flows arrive
+            self.horizontal_ps.check(profileid, twid, flow, state)
+            self.vertical_ps.check(profileid, twid, flow, state)
+            self.slow_ps.add_flow(profileid, twid, flow, state)
+
+        if msg := self.get_msg("tw_modified"):
+            # Get the profileid and twid
+            profileid = msg["data"].split(":")[0]
+            twid = msg["data"].split(":")[1]
+            self.print(
+                f"Running the detection of ICMP scans in profile "
+                f"{profileid} TW {twid}",
+                3,
+                0,
+            )
             self.check_icmp_scan(profileid, twid)
 
+        if msg := self.get_msg("tw_closed"):
+            profileid_tw = msg["data"].split("_")
+            profileid = f"{profileid_tw[0]}_{profileid_tw[1]}"
+            twid = profileid_tw[-1]
+            self.horizontal_ps.evict(profileid, twid)
+            self.vertical_ps.evict(profileid, twid)
+            self.slow_ps.check(profileid, twid)
+
         if msg := self.get_msg("new_notice"):
             data = json.loads(msg["data"])
             twid = data["twid"]
@@ -0,0 +1,219 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import ipaddress
+from typing import Dict
+
+from modules.network_discovery.horizontal_portscan import (
+    BROADCAST_ADDR,
+    HorizontalPortscan,
+)
+from slips_files.common.data_structures.distinct_counter import (
+    SlidingDistinctCounter,
+)
+from slips_files.core.structures.evidence import (
+    Evidence,
+    ProfileID,
+    TimeWindow,
+    Attacker,
+    ThreatLevel,
+    EvidenceType,
+    IoCType,
+    Direction,
+)
+
+
+class SlowPortscan:
+    """
+    Detects scans that are spread over many timewindows, slow enough to
+    never reach the thresholds of the vertical and horizontal portscans
+    in a single one.
+
+    For each profile, the distinct dst ports and the distinct dst IPs of
+    its not established TCP and UDP flows are counted in a
+    SlidingDistinctCounter of the last `windows` timewindows, as the
+    flows arrive. Old timewindows are never read again, from the db or
+    from memory.
+
+    When a timewindow of a profile is closed, slips sets an evidence if
+    the profile contacted minimum_* or more distinct dst ports or dst IPs
+    in the last timewindows, and none of the timewindows had more than
+    half of them, so the scan was actually spread and isn't a normal
+    portscan that was already detected in one timewindow.
+
+    Memory per profile is bounded to
+    2 counters * windows * max(64 items, 2**10 bytes), about 48KB with
+    the default 24 timewindows once a profile contacts more than 64
+    distinct ports or IPs per timewindow. Most profiles stay in the
+    exact sets, which are much smaller.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        # how many timewindows to look back, 1 day with the default 1h
+        # timewindows
+        self.windows = 24
+        self.minimum_dports_to_set_evidence = 50
+        self.minimum_dstips_to_set_evidence = 50
+        # {profileid: {"dports": SlidingDistinctCounter,
+        #              "dstips": SlidingDistinctCounter}}
+        self.counters: Dict[str, Dict[str, SlidingDistinctCounter]] = {}
+        # the amount of dports and dstips reported in the last evidence
+        # of each profile, in the format {profileid: {"dports": int,
+        # "dstips": int}}
+        self.reported: Dict[str, Dict[str, int]] = {}
+        # ts of the last flow counted for each profile
+        self.last_flow_ts: Dict[str, str] = {}
+
+    def is_ignored_dstip(self, daddr: str) -> bool:
+        """
+        resolved IPs are ignored for both TCP and UDP, over a whole day
+        benign hosts contact many of them without establishing a conn
+        """
+        try:
+            if (
+                daddr == BROADCAST_ADDR
+                or ipaddress.ip_address(daddr).is_multicast
+            ):
+                return True
+        except ValueError:
+            return True
+        return bool(self.db.get_dns_resolution(daddr))
+
+    @staticmethod
+    def get_tw_number(twid: str) -> int:
+        return int(twid.replace("timewindow", ""))
+
+    def get_counters(
+        self, profileid: str
+    ) -> Dict[str, SlidingDistinctCounter]:
+        if profileid not in self.counters:
+            self.counters[profileid] = {
+                "dports": SlidingDistinctCounter(self.windows),
+                "dstips": SlidingDistinctCounter(self.windows),
+            }
+        return self.counters[profileid]
+
+    def add_flow(self, profileid: str, twid: str, flow, state: str):
+        """
+        counts the dport and daddr of the given flow
+        :param flow: a conn flow of the given profile and tw
+        :param state: the interpreted state of the flow
+        """
+        if state != "Not Established":
+            return
+
+        protocol = flow.proto.upper()
+        if protocol not in ("TCP", "UDP"):
+            return
+
+        # we only care about the flows where the profile is the client
+        if flow.saddr != profileid.split("_")[-1]:
+            return
+
+        if HorizontalPortscan.is_flipped(flow):
+            return
+
+        tw_number = self.get_tw_number(twid)
+        counters = self.get_counters(profileid)
+        counters["dports"].add(tw_number, f"{flow.dport}/{protocol}")
+        if not self.is_ignored_dstip(flow.daddr):
+            counters["dstips"].add(tw_number, flow.daddr)
+        self.last_flow_ts[profileid] = flow.starttime
+
+    def should_set_evidence(
+        self, profileid: str, scanned: str, minimum: int
+    ) -> int:
+        """
+        returns the amount of dports or dstips to report if a slow scan
+        should be reported, 0 otherwise
+        :param scanned: "dports" or "dstips"
+        """
+        counter: SlidingDistinctCounter = self.counters[profileid][scanned]
+        amount = len(counter)
+        reported = self.reported.setdefault(profileid, {})
+        if amount < minimum:
+            # the last scan slid out of the timewindows we keep
+            reported.pop(scanned, None)
+            return 0
+
+        # like the other portscans, report again only if the scan grew
+        # enough since the last evidence
+        if amount < reported.get(scanned, 0) + minimum:
+            return 0
+
+        # a scan in a single timewindow is a normal portscan
+        if max(counter.get_window_counts()) * 2 > amount:
+            return 0
+
+        reported[scanned] = amount
+        return amount
+
+    def set_evidence_slow_portscan(
+        self, profileid: str, twid: str, scanned: str, amount: int
+    ):
+        srcip = profileid.split("_")[-1]
+        minimum = (
+            self.minimum_dports_to_set_evidence
+            if scanned == "dports"
+            else self.minimum_dstips_to_set_evidence
+        )
+        confidence = min(1.0, amount / (2 * minimum))
+        what = (
+            "destination ports" if scanned == "dports" else "destination IPs"
+        )
+        description = (
+            f"Slow port scan from {srcip} to {amount} different {what} "
+            f"with not established connections in the last "
+            f"{self.windows} timewindows. "
+            f"Confidence: {confidence}. by Slips"
+        )
+
+        evidence = Evidence(
+            evidence_type=EvidenceType.SLOW_PORT_SCAN,
+            attacker=Attacker(
+                direction=Direction.SRC, ioc_type=IoCType.IP, value=srcip
+            ),
+            threat_level=ThreatLevel.MEDIUM,
+            confidence=confidence,
+            description=description,
+            profile=ProfileID(ip=srcip),
+            timewindow=TimeWindow(number=self.get_tw_number(twid)),
+            # the flows of old timewindows aren't kept
+            uid=[],
+            timestamp=self.last_flow_ts[profileid],
+        )
+        self.db.set_evidence(evidence)
+
+    def check(self, profileid: str, twid: str):
+        """
+        checks for slow scans in the last timewindows of the given profile.
+        called when the given tw of the given profile is closed
+        """
+        counters = self.counters.get(profileid)
+        if not counters:
+            return
+
+        # flows of newer tws may have arrived before this tw was closed
+        newest_windows = [
+            counter.newest_window
+            for counter in counters.values()
+            if counter.newest_window is not None
+        ]
+        newest_window = max([self.get_tw_number(twid), *newest_windows])
+        for counter in counters.values():
+            counter.slide(newest_window)
+        if not any(counter.counters for counter in counters.values()):
+            # nothing in the timewindows we keep
+            del self.counters[profileid]
+            self.reported.pop(profileid, None)
+            self.last_flow_ts.pop(profileid, None)
+            return
+
+        for scanned, minimum in (
+            ("dports", self.minimum_dports_to_set_evidence),
+            ("dstips", self.minimum_dstips_to_set_evidence),
+        ):
+            if amount := self.should_set_evidence(profileid, scanned, minimum):
+                self.set_evidence_slow_portscan(
+                    profileid, twid, scanned, amount
+                )
@@ -1,5 +1,13 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
+from typing import (
+    Dict,
+    Tuple,
+)
+
+from slips_files.common.data_structures.distinct_counter import (
+    DistinctCounter,
+)
 from slips_files.common.slips_utils import utils
 from slips_files.core.structures.evidence import (
     Evidence,
@@ -18,10 +26,11 @@ from slips_files.core.structures.evidence import (
 class VerticalPortscan:
     """
     Here's how the detection of vertical portscans is done
-    1. Slips retrieves all destination IPs of the not
-    established flows on TCP and UDP protocols
-    2. For each dst IP, slips checks the amount of
-    destination ports we connected to
+    1. For each new not established flow on TCP and UDP protocols,
+    Slips adds its dst port to the distinct dst ports of its
+    dst IP in the current timewindow
+    2. Slips checks the amount of destination ports we connected to
+    on this dst IP, without reading the db
     3. The first evidence will be triggered if the amount of
     destination ports for 1 IP is 5+
     4. then we set evidence on 20+,35+. etc
@@ -42,6 +51,8 @@ class VerticalPortscan:
 
     5. Once the timewindow ends, Slips resets
      all counters, we go back to step 1
+
+    The db is only read to get the details of the evidence.
     """
 
     def __init__(self, db):
@@ -51,6 +62,11 @@ class VerticalPortscan:
         # The minimum amount of scanned ports to trigger an evidence
         # is increased exponentially every evidence, and is reset each timewindow
         self.minimum_dports_to_set_evidence = 5
+        # distinct dports per dstip in the format
+        # {profileid: {twid: {(protocol, dstip): DistinctCounter}}}
+        self.dports_per_dstip: Dict[
+            str, Dict[str, Dict[Tuple[str, str], DistinctCounter]]
+        ] = {}
 
     def set_evidence_vertical_portscan(self, evidence: dict):
         """Sets the vertical portscan evidence in the db"""
@@ -195,9 +211,40 @@ class VerticalPortscan:
         """
         return f"{profileid}:{twid}:dstip:{dstip}"
 
-    def check(self, profileid, twid):
+    def get_dports_counter(
+        self, profileid: str, twid: str, protocol: str, dstip: str
+    ) -> DistinctCounter:
+        tws = self.dports_per_dstip.setdefault(profileid, {})
+        dstips = tws.setdefault(twid, {})
+        key = (protocol, dstip)
+        if key not in dstips:
+            dstips[key] = DistinctCounter()
+        return dstips[key]
+
+    def evict(self, profileid: str, twid: str):
+        """
+        removes the counters of the given closed tw, and of the older tws
+        of the same profile, in case flows of them arrived after they were
+        closed
+        """
+        tws = self.dports_per_dstip.get(profileid)
+        if not tws:
+            return
+
+        closed_tw_number = int(twid.replace("timewindow", ""))
+        for tw in list(tws):
+            if int(tw.replace("timewindow", "")) <= closed_tw_number:
+                del tws[tw]
+
+        if not tws:
+            del self.dports_per_dstip[profileid]
+
+    def check(self, profileid: str, twid: str, flow, state: str):
         """
-        sets an evidence if a vertical portscan is detected
+        counts the dport of the given flow in the dports of its daddr,
+        and sets an evidence if a vertical portscan is detected
+        :param flow: a conn flow of the given profile and tw
+        :param state: the interpreted state of the flow
         """
         # if you're portscaning a port that is open it's gonna be established
         # the amount of open ports we find is gonna be so small
@@ -205,38 +252,54 @@ class VerticalPortscan:
         # established connections, but usually open ports are very few
         # compared to the whole range. so, practically this is correct to
         # avoid FP
-        state = "Not Established"
-
-        for protocol in ("TCP", "UDP"):
-            dstips: dict = self.get_not_established_dst_ips(
-                protocol, state, profileid, twid
-            )
-
-            # For each dstip, see if the amount of ports
-            # connections is over the threshold
-            for dstip in dstips.keys():
-                dst_ports: dict = dstips[dstip]["dstports"]
-                # Get the total amount of pkts sent to all
-                # ports on the same host
-                pkts_sent = sum(dst_ports[dport] for dport in dst_ports)
-                amount_of_dports = len(dst_ports)
-
-                twid_identifier: str = self.get_twid_identifier(
-                    profileid, twid, dstip
-                )
-                if self.check_if_enough_dports_to_trigger_an_evidence(
-                    twid_identifier, amount_of_dports
-                ):
-                    evidence_details = {
-                        "timestamp": dstips[dstip]["stime"],
-                        "pkts_sent": pkts_sent,
-                        "protocol": protocol,
-                        "profileid": profileid,
-                        "twid": twid,
-                        "uid": dstips[dstip]["uid"],
-                        "amount_of_dports": amount_of_dports,
-                        "dstip": dstip,
-                        "state": state,
-                    }
-
-                    self.set_evidence_vertical_portscan(evidence_details)
+        if state != "Not Established":
+            return False
+
+        protocol = flow.proto.upper()
+        if protocol not in ("TCP", "UDP"):
+            return False
+
+        # we only care about the flows where the profile is the client
+        if flow.saddr != profileid.split("_")[-1]:
+            return False
+
+        dstip = flow.daddr
+        dports: DistinctCounter = self.get_dports_counter(
+            profileid, twid, protocol, dstip
+        )
+        if not dports.add(str(flow.dport)):
+            # nothing changed since the last check
+            return False
+
+        amount_of_dports = len(dports)
+        twid_identifier: str = self.get_twid_identifier(profileid, twid, dstip)
+        if not self.check_if_enough_dports_to_trigger_an_evidence(
+            twid_identifier, amount_of_dports
+        ):
+            return False
+
+        # get the details of the scanned dports
+        dstips: dict = self.get_not_established_dst_ips(
+            protocol, state, profileid, twid
+        )
+        try:
+            dstip_info: dict = dstips[dstip]
+        except KeyError:
+            return False
+
+        # Get the total amount of pkts sent to all
+        # ports on the same host
+        dst_ports: dict = dstip_info["dstports"]
+        evidence_details = {
+            "timestamp": dstip_info["stime"],
+            "pkts_sent": sum(dst_ports.values()),
+            "protocol": protocol,
+            "profileid": profileid,
+            "twid": twid,
+            "uid": dstip_info["uid"],
+            "amount_of_dports": amount_of_dports,
+            "dstip": dstip,
+            "state": state,
+        }
+        self.set_evidence_vertical_portscan(evidence_details)
+        return True
@@ -0,0 +1,321 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import json
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+import h5py
+import numpy as np
+
+
+def sigmoid(x: np.ndarray) -> np.ndarray:
+    # avoids the overflow warnings of np.exp(-x) for very negative x
+    return np.exp(-np.logaddexp(0, -x)).astype(x.dtype)
+
+
+def hard_sigmoid(x: np.ndarray) -> np.ndarray:
+    return np.clip(x / 6 + 0.5, 0, 1)
+
+
+ACTIVATIONS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "sigmoid": sigmoid,
+    "hard_sigmoid": hard_sigmoid,
+    "tanh": np.tanh,
+}
+
+
+class Layer:
+    """
+    A keras layer that only knows how to run its forward pass.
+    Every layer receives the output of the previous one and its mask,
+    and returns its own output and mask, like keras propagates the
+    masks of an Embedding with mask_zero=True
+    """
+
+    def __init__(self, config: Dict, weights: Dict[str, np.ndarray]):
+        self.config = config
+        self.weights = weights
+
+    def __call__(
+        self, x: np.ndarray, mask: Optional[np.ndarray]
+    ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        raise NotImplementedError
+
+
+class Embedding(Layer):
+    def __call__(self, x, mask):
+        indices = x.astype(np.int64)
+        output = self.weights["embeddings"][indices]
+        if self.config.get("mask_zero"):
+            mask = indices != 0
+        return output, mask
+
+
+class Reshape(Layer):
+    def __call__(self, x, mask):
+        target_shape = tuple(self.config["target_shape"])
+        # the mask of the embedding can't follow the reshape, keras
+        # drops it too
+        return x.reshape((x.shape[0],) + target_shape), None
+
+
+class Dropout(Layer):
+    def __call__(self, x, mask):
+        # only used in training
+        return x, mask
+
+
+class Dense(Layer):
+    def __call__(self, x, mask):
+        activation = ACTIVATIONS[self.config["activation"]]
+        output = x @ self.weights["kernel"]
+        if "bias" in self.weights:
+            output += self.weights["bias"]
+        return activation(output), mask
+
+
+class Recurrent(Layer):
+    """
+    The loop over the timesteps shared by GRUs and LSTMs.
+    The input projections of all the timesteps are done in one matmul,
+    only the recurrent part is done step by step
+    """
+
+    def get_states(self, batch_size: int) -> List[np.ndarray]:
+        units = self.config["units"]
+        return [np.zeros((batch_size, units), dtype=np.float32)]
+
+    def step(
+        self, projected_x: np.ndarray, states: List[np.ndarray]
+    ) -> List[np.ndarray]:
+        """returns the states after the given timestep, the first one is
+        the output"""
+        raise NotImplementedError
+
+    def project_input(self, x: np.ndarray) -> np.ndarray:
+        projected_x = x @ self.weights["kernel"]
+        bias = self.weights.get("bias")
+        if bias is not None:
+            # GRUs with reset_after have a bias for the input and another
+            # one for the recurrent part
+            projected_x += bias[0] if bias.ndim == 2 else bias
+        return projected_x
+
+    def __call__(self, x, mask):
+        steps_mask = mask
+        if self.config.get("go_backwards"):
+            x = x[:, ::-1]
+            if mask is not None:
+                steps_mask = mask[:, ::-1]
+
+        projected_x = self.project_input(x.astype(np.float32))
+        states = self.get_states(x.shape[0])
+        outputs = []
+        for t in range(x.shape[1]):
+            new_states = self.step(projected_x[:, t], states)
+            if steps_mask is not None:
+                # masked timesteps keep the previous states
+                keep = steps_mask[:, t, None]
+                new_states = [
+                    np.where(keep, new_state, state)
+                    for new_state, state in zip(new_states, states)
+                ]
+            states = new_states
+            outputs.append(states[0])
+
+        if self.config.get("return_sequences"):
+            # the outputs of go_backwards layers stay reversed, but
+            # keras keeps the mask of the input
+            return np.stack(outputs, axis=1), mask
+        return states[0], None
+
+
+class GRU(Recurrent):
+    def step(self, projected_x, states):
+        (h,) = states
+        units = self.config["units"]
+        activation = ACTIVATIONS[self.config["activation"]]
+        recurrent_activation = ACTIVATIONS[self.config["recurrent_activation"]]
+        recurrent_kernel = self.weights["recurrent_kernel"]
+        x_z = projected_x[:, :units]
+        x_r = projected_x[:, units : 2 * units]
+        x_h = projected_x[:, 2 * units :]
+
+        if self.config.get("reset_after", True):
+            recurrent = h @ recurrent_kernel
+            bias = self.weights.get("bias")
+            if bias is not None and bias.ndim == 2:
+                recurrent += bias[1]
+            z = recurrent_activation(x_z + recurrent[:, :units])
+            r = recurrent_activation(x_r + recurrent[:, units : 2 * units])
+            hh = activation(x_h + r * recurrent[:, 2 * units :])
+        else:
+            recurrent = h @ recurrent_kernel[:, : 2 * units]
+            z = recurrent_activation(x_z + recurrent[:, :units])
+            r = recurrent_activation(x_r + recurrent[:, units:])
+            hh = activation(x_h + (r * h) @ recurrent_kernel[:, 2 * units :])
+        return [z * h + (1 - z) * hh]
+
+
+class LSTM(Recurrent):
+    def get_states(self, batch_size):
+        # the output and the carry
+        return super().get_states(batch_size) * 2
+
+    def step(self, projected_x, states):
+        h, c = states
+        units = self.config["units"]
+        activation = ACTIVATIONS[self.config["activation"]]
+        recurrent_activation = ACTIVATIONS[self.config["recurrent_activation"]]
+        z = projected_x + h @ self.weights["recurrent_kernel"]
+        i = recurrent_activation(z[:, :units])
+        f = recurrent_activation(z[:, units : 2 * units])
+        c = f * c + i * activation(z[:, 2 * units : 3 * units])
+        o = recurrent_activation(z[:, 3 * units :])
+        return [o * activation(c), c]
+
+
+RECURRENT_LAYERS = {"GRU": GRU, "LSTM": LSTM}
+
+
+class Bidirectional(Layer):
+    def __init__(self, config, weights):
+        super().__init__(config, weights)
+        layer = config["layer"]
+        backward_layer = config.get("backward_layer") or {
+            "class_name": layer["class_name"],
+            "config": {**layer["config"], "go_backwards": True},
+        }
+        forward_weights, backward_weights = weights
+        self.forward = RECURRENT_LAYERS[layer["class_name"]](
+            layer["config"], forward_weights
+        )
+        self.backward = RECURRENT_LAYERS[backward_layer["class_name"]](
+            backward_layer["config"], backward_weights
+        )
+
+    def __call__(self, x, mask):
+        forward, output_mask = self.forward(x, mask)
+        backward, _ = self.backward(x, mask)
+        if self.backward.config.get("return_sequences"):
+            # back to the order of the input
+            backward = backward[:, ::-1]
+
+        merge_mode = self.config.get("merge_mode", "concat")
+        if merge_mode == "concat":
+            output = np.concatenate([forward, backward], axis=-1)
+        elif merge_mode == "sum":
+            output = forward + backward
+        elif merge_mode == "ave":
+            output = (forward + backward) / 2
+        elif merge_mode == "mul":
+            output = forward * backward
+        else:
+            raise ValueError(f"Unsupported merge mode {merge_mode}")
+        return output, output_mask
+
+
+LAYERS = {
+    "Embedding": Embedding,
+    "Reshape": Reshape,
+    "Dropout": Dropout,
+    "Dense": Dense,
+    "Bidirectional": Bidirectional,
+    **RECURRENT_LAYERS,
+}
+
+
+class NumpyModel:
+    """
+    A keras Sequential model that runs with numpy only, so predicting
+    doesn't need tensorflow.
+    Only the layers used by the RNN C&C models are supported
+    """
+
+    def __init__(self, layers: List[Layer]):
+        self.layers = layers
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        """
+        returns the output of the model for the given batch of inputs,
+        the same keras' model.predict() returns
+        """
+        x = np.asarray(x, dtype=np.float32)
+        mask = None
+        for layer in self.layers:
+            x, mask = layer(x, mask)
+        return x
+
+
+def get_weights_name(weight_path: str) -> str:
+    """
+    returns the name of the given weight without the path of the layer,
+    e.g. kernel for bidirectional/forward_gru/gru_cell/kernel:0
+    """
+    return weight_path.split("/")[-1].split(":")[0]
+
+
+def read_layer_weights(
+    layer_group: h5py.Group,
+) -> List[Tuple[str, np.ndarray]]:
+    """returns (name, weights) of the weights of a layer, in the order
+    keras stored them"""
+    weights = []
+    for weight_path in layer_group.attrs["weight_names"]:
+        if isinstance(weight_path, bytes):
+            weight_path = weight_path.decode()
+        weights.append(
+            (get_weights_name(weight_path), layer_group[weight_path][()])
+        )
+    return weights
+
+
+def load_model(path: str) -> NumpyModel:
+    """
+    Reads the architecture and the weights of the keras Sequential model
+    stored in the given h5 file
+    """
+    with h5py.File(path, "r") as h5_file:
+        model_config = h5_file.attrs["model_config"]
+        if isinstance(model_config, bytes):
+            model_config = model_config.decode()
+        model_config = json.loads(model_config)
+        if model_config["class_name"] != "Sequential":
+            raise ValueError(
+                f"Unsupported model {model_config['class_name']}, only "
+                f"Sequential models can be loaded"
+            )
+        model_weights = h5_file["model_weights"]
+
+        layers = []
+        for layer in model_config["config"]["layers"]:
+            class_name = layer["class_name"]
+            if class_name == "InputLayer":
+                continue
+            if class_name not in LAYERS:
+                raise ValueError(f"Unsupported layer {class_name}")
+
+            config = layer["config"]
+            weights = []
+            if config["name"] in model_weights:
+                weights = read_layer_weights(model_weights[config["name"]])
+
+            if class_name == "Bidirectional":
+                # the weights of the forward layer are stored first
+                half = len(weights) // 2
+                weights = (
+                    dict(weights[:half]),
+                    dict(weights[half:]),
+                )
+            else:
+                weights = dict(weights)
+            layers.append(LAYERS[class_name](config, weights))
+
+    return NumpyModel(layers)
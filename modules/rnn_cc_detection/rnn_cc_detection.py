@@ -1,13 +1,19 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
+import time
 import warnings
 import json
-from typing import Dict
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
 from uuid import uuid4
 
 import numpy as np
-from tensorflow.keras.models import load_model
 
+from slips_files.common.parsers.config_parser import ConfigParser
 from slips_files.common.slips_utils import utils
 from slips_files.common.abstracts.imodule import IModule
 from slips_files.core.structures.evidence import (
@@ -26,10 +32,24 @@ from slips_files.core.structures.evidence import (
 from modules.rnn_cc_detection.strato_letters_exporter import (
     StratoLettersExporter,
 )
+from modules.rnn_cc_detection.numpy_model import load_model
 
 warnings.filterwarnings("ignore", category=FutureWarning)
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
+# Length of behavioral model with which we trained our module
+MAX_LETTERS = 500
+# Each of the stratosphere letters is converted to an integer. There are 50
+VOCABULARY = "abcdefghiABCDEFGHIrstuvwxyzRSTUVWXYZ1234567890,.+*"
+PADDING = "0"
+# the integer of each letter, indexed by the ascii code of the letter.
+# This is a simple encoding that is not one-hot. chars that aren't
+# letters are treated as padding
+LETTER_TO_INT = np.full(256, VOCABULARY.index(PADDING), dtype=np.float32)
+LETTER_TO_INT[np.frombuffer(VOCABULARY.encode(), dtype=np.uint8)] = np.arange(
+    len(VOCABULARY)
+)
+
 
 class CCDetection(IModule):
     # Name: short name of the module. Do not use spaces
@@ -40,6 +60,29 @@ class CCDetection(IModule):
     def init(self):
         self.subscribe_to_channels()
         self.exporter = StratoLettersExporter(self.db)
+        self.read_configuration()
+        # the newest msg of each tuple waiting to be scored, the older
+        # letters of the same tuple don't need to be scored anymore.
+        # {(profileid, twid, tupleid): msg}
+        self.pending_tuples: Dict[Tuple[str, str, str], Dict] = {}
+        self.oldest_pending_tuple_time: Optional[float] = None
+        # the pending tuples are scored in one batch once there are this
+        # many of them, or once the oldest one waited max_batch_delay
+        # seconds
+        self.batch_size = 64
+        self.max_batch_delay = 1
+        # the amount of letters each tuple had the last time it was
+        # scored, {(profileid, twid): {tupleid: letters}}
+        self.scored_letters: Dict[Tuple[str, str], Dict[str, int]] = {}
+        # the newest msg of each tuple with letters that weren't scored
+        # because not enough of them were added since the last score.
+        # they're scored when the tw is closed, if no more letters come
+        # {(profileid, twid): {tupleid: msg}}
+        self.unscored_tuples: Dict[Tuple[str, str], Dict[str, Dict]] = {}
+
+    def read_configuration(self):
+        conf = ConfigParser()
+        self.rescore_after_letters: int = conf.rnn_rescore_after_letters()
 
     def subscribe_to_channels(self):
         self.c1 = self.db.subscribe("new_letters")
@@ -128,49 +171,28 @@ class CCDetection(IModule):
 
         self.db.set_evidence(evidence)
 
-    def convert_input_for_module(self, pre_behavioral_model):
+    def convert_inputs_for_module(self, sequences: List[str]) -> np.ndarray:
+        """
+        Takes the letters of many tuples and converts them to the batch
+        of shape (len(sequences), MAX_LETTERS, 1) the model expects
+        """
+        letters = np.full(
+            (len(sequences), MAX_LETTERS), ord(PADDING), dtype=np.uint8
+        )
+        for i, sequence in enumerate(sequences):
+            # Be sure only max_length chars come. Not sure why we receive
+            # more
+            encoded = sequence[:MAX_LETTERS].encode("ascii", errors="replace")
+            letters[i, : len(encoded)] = np.frombuffer(encoded, dtype=np.uint8)
+        return LETTER_TO_INT[letters][:, :, np.newaxis]
+
+    def convert_input_for_module(self, pre_behavioral_model: str):
         """
         Takes the input from the letters and converts them
         to whatever is needed by the model
         The pre_behavioral_model is a 1D array of letters in an array
         """
-        # TODO: set the max_length in the function call
-
-        # Length of behavioral model with which we trained our module
-        max_length = 500
-
-        # Convert each of the stratosphere letters to an integer. There are 50
-        vocabulary = list("abcdefghiABCDEFGHIrstuvwxyzRSTUVWXYZ1234567890,.+*")
-        int_of_letters = {}
-
-        # This is a simple encoding that is not one-hot.
-        for i, letter in enumerate(vocabulary):
-            int_of_letters[letter] = float(i)
-
-        # String to test
-        # pre_behavioral_model = "88*y*y*h*h*h*h*h*h*h*y*y*h*h*h*y*y*"
-
-        # Be sure only max_length chars come. Not sure why we receive more
-        pre_behavioral_model = pre_behavioral_model[:max_length]
-
-        # Add padding to the letters passed
-        # self.print(f'Seq sent: {pre_behavioral_model}')
-        pre_behavioral_model += "0" * (max_length - len(pre_behavioral_model))
-        # self.print(f'Padded Seq sent: {pre_behavioral_model}')
-
-        # Convert to ndarray
-        pre_behavioral_model = np.array(
-            [[int_of_letters[i]] for i in pre_behavioral_model]
-        )
-        # self.print(f'The sequence has shape {pre_behavioral_model.shape}')
-
-        # Reshape into (1, 500, 1) We need the first 1, because this is one sample only, but keras expects a 3d vector
-        pre_behavioral_model = np.reshape(
-            pre_behavioral_model, (1, max_length, 1)
-        )
-
-        # self.print(f'Post Padded Seq sent: {pre_behavioral_model}. Shape: {pre_behavioral_model.shape}')
-        return pre_behavioral_model
+        return self.convert_inputs_for_module([pre_behavioral_model])
 
     def get_confidence(self, pre_behavioral_model):
         threshold_confidence = 100
@@ -179,8 +201,39 @@ class CCDetection(IModule):
 
         return len(pre_behavioral_model) / threshold_confidence
 
+    def should_score(
+        self, profileid: str, twid: str, tupleid: str, letters: str
+    ) -> bool:
+        """
+        The letters of a tuple are scored again only once
+        rescore_after_letters letters were added to them since the last
+        time they were scored. The model only sees the first MAX_LETTERS
+        letters, so they aren't scored again after that
+        """
+        scored = self.scored_letters.get((profileid, twid), {}).get(tupleid)
+        if scored is None:
+            return True
+        if scored >= MAX_LETTERS:
+            return False
+        return len(letters) >= min(
+            scored + self.rescore_after_letters, MAX_LETTERS
+        )
+
+    def has_unscored_letters(
+        self, profileid: str, twid: str, tupleid: str, letters: str
+    ) -> bool:
+        """returns True if the model would see letters of the given tuple
+        that weren't scored yet"""
+        scored = self.scored_letters.get((profileid, twid), {}).get(tupleid)
+        return scored is None or min(len(letters), MAX_LETTERS) > scored
+
+    def add_pending_tuple(self, profileid: str, twid: str, msg: Dict):
+        if not self.pending_tuples:
+            self.oldest_pending_tuple_time = time.monotonic()
+        self.pending_tuples[(profileid, twid, msg["tupleid"])] = msg
+
     def handle_new_letters(self, msg: Dict):
-        """handles msgs from the tw_closed channel"""
+        """handles msgs from the new_letters channel"""
 
         msg = msg["data"]
         msg = json.loads(msg)
@@ -198,65 +251,129 @@ class CCDetection(IModule):
         if "established" not in state.lower():
             return
 
+        if self.should_score(profileid, twid, tupleid, pre_behavioral_model):
+            self.unscored_tuples.get((profileid, twid), {}).pop(tupleid, None)
+            self.add_pending_tuple(profileid, twid, msg)
+        elif self.has_unscored_letters(
+            profileid, twid, tupleid, pre_behavioral_model
+        ):
+            self.unscored_tuples.setdefault((profileid, twid), {})[
+                tupleid
+            ] = msg
+
+    def add_unscored_tuples(self, profileid: str, twid: str):
+        """
+        adds the tuples of the given tw with letters that weren't scored
+        to the pending tuples. the ones pending already have newer letters
+        """
+        unscored_tuples = self.unscored_tuples.pop((profileid, twid), {})
+        for msg in unscored_tuples.values():
+            if (profileid, twid, msg["tupleid"]) not in self.pending_tuples:
+                self.add_pending_tuple(profileid, twid, msg)
+
+    def should_score_pending_tuples(self) -> bool:
+        if not self.pending_tuples:
+            return False
+        if len(self.pending_tuples) >= self.batch_size:
+            return True
+        waited = time.monotonic() - self.oldest_pending_tuple_time
+        return waited >= self.max_batch_delay
+
+    def score_pending_tuples(self):
+        """
+        Scores the letters of all the tuples waiting in
+        self.pending_tuples at once, and sets an evidence for each
+        C&C channel
+        """
+        pending_tuples, self.pending_tuples = self.pending_tuples, {}
+        msgs = list(pending_tuples.values())
+        sequences = [msg["new_symbol"] for msg in msgs]
+        behavioral_models = self.convert_inputs_for_module(sequences)
+        # predict the score of each behavioral model being c&c channel
+        scores = self.tcpmodel.predict(behavioral_models)
+
+        for (profileid, twid, tupleid), msg, score in zip(
+            pending_tuples, msgs, scores
+        ):
+            pre_behavioral_model = msg["new_symbol"]
+            self.scored_letters.setdefault((profileid, twid), {})[tupleid] = (
+                len(pre_behavioral_model)
+            )
+            # get a float instead of numpy array
+            score = score[0]
+            self.print(
+                f" >> sequence: {pre_behavioral_model}. "
+                f"final prediction score: {score:.20f}",
+                3,
+                0,
+            )
+            self.handle_score(msg, score)
+
+    def handle_score(self, msg: Dict, score: float):
+        """sets an evidence if the given score of the letters in the given
+        new_letters msg is high enough"""
         # to reduce false positives
         threshold = 0.99
-        # function to convert each letter of behavioral model to ascii
-        behavioral_model = self.convert_input_for_module(pre_behavioral_model)
-        # predict the score of behavioral model being c&c channel
-        self.print(
-            f"predicting the sequence: {pre_behavioral_model}",
-            3,
-            0,
-        )
-        score = self.tcpmodel.predict(behavioral_model, verbose=0)
-        self.print(
-            f" >> sequence: {pre_behavioral_model}. "
-            f"final prediction score: {score[0][0]:.20f}",
-            3,
-            0,
+        if score <= threshold:
+            return
+
+        pre_behavioral_model = msg["new_symbol"]
+        profileid = msg["profileid"]
+        twid = msg["twid"]
+        tupleid = msg["tupleid"]
+        flow = msg["flow"]
+        confidence = self.get_confidence(pre_behavioral_model)
+        uid = msg["uid"]
+        stime = flow["starttime"]
+        self.set_evidence_cc_channel(
+            score,
+            confidence,
+            uid,
+            stime,
+            tupleid,
+            profileid,
+            twid,
         )
-        # get a float instead of numpy array
-        score = score[0][0]
-        if score > threshold:
-            threshold_confidence = 100
-            if len(pre_behavioral_model) >= threshold_confidence:
-                confidence = 1
-            else:
-                confidence = len(pre_behavioral_model) / threshold_confidence
-            uid = msg["uid"]
-            stime = flow["starttime"]
-            self.set_evidence_cc_channel(
-                score,
-                confidence,
-                uid,
-                stime,
-                tupleid,
-                profileid,
-                twid,
-            )
-            to_send = {
-                "attacker_type": utils.detect_ioc_type(flow["daddr"]),
-                "profileid": profileid,
-                "twid": twid,
-                "flow": flow,
-            }
-            # we only check malicious jarm hashes when there's a CC
-            # detection
-            self.db.publish("check_jarm_hash", json.dumps(to_send))
+        to_send = {
+            "attacker_type": utils.detect_ioc_type(flow["daddr"]),
+            "profileid": profileid,
+            "twid": twid,
+            "flow": flow,
+        }
+        # we only check malicious jarm hashes when there's a CC
+        # detection
+        self.db.publish("check_jarm_hash", json.dumps(to_send))
 
     def handle_tw_closed(self, msg: Dict):
         """handles msgs from the tw_closed channel"""
         profileid_tw = msg["data"].split("_")
         profileid = f"{profileid_tw[0]}_{profileid_tw[1]}"
         twid = profileid_tw[-1]
-        self.exporter.export(profileid, twid)
+        # no more letters will be added to the tuples of this tw, score
+        # the ones that weren't scored because they didn't have enough
+        # new letters
+        self.add_unscored_tuples(profileid, twid)
+        # the letters of this tw may still be waiting to be scored
+        if self.pending_tuples:
+            self.score_pending_tuples()
+        # no more letters will be added to the tuples of this tw
+        self.scored_letters.pop((profileid, twid), None)
+
+        # the letters of the tw are final now
+        self.exporter.export_outtuples(profileid, twid)
+
+    def shutdown_gracefully(self):
+        for profileid, twid in list(self.unscored_tuples):
+            self.add_unscored_tuples(profileid, twid)
+        if self.pending_tuples:
+            self.score_pending_tuples()
 
     def pre_main(self):
         utils.drop_root_privs()
         # TODO: set the decision threshold in the function call
         try:
             self.tcpmodel = load_model("modules/rnn_cc_detection/rnn_model.h5")
-        except AttributeError as e:
+        except (OSError, KeyError, ValueError) as e:
             self.print("Error loading the model.")
             self.print(e)
             return 1
@@ -267,5 +384,8 @@ class CCDetection(IModule):
         if msg := self.get_msg("new_letters"):
             self.handle_new_letters(msg)
 
+        if self.should_score_pending_tuples():
+            self.score_pending_tuples()
+
         if msg := self.get_msg("tw_closed"):
             self.handle_tw_closed(msg)
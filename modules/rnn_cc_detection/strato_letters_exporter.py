@@ -1,9 +1,9 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
-import json
-from typing import Dict, List
 import csv
+import json
 import os
+from typing import Dict
 
 from slips_files.common.parsers.config_parser import ConfigParser
 
@@ -32,29 +32,34 @@ class StratoLettersExporter:
             writer = csv.writer(f, delimiter="\t")
             writer.writerow(["Outtuple", "Letters"])
 
-    def export(self, profileid: str, twid: str):
+    def export_outtuples(self, profileid: str, twid: str):
         """
-        exports starto letters to the file specified in
-        self.starto_letters_file
+        exports starto letters of the outtuples of a closed tw to the file
+        specified in self.starto_letters_file
         """
         if not self.should_export:
             return
 
-        saddr = profileid.split("_")[-1]
-        out_tuples: str = self.db.get_outtuples_from_profile_tw(
-            profileid, twid
-        )
-
-        if out_tuples is None:
+        out_tuples = self.db.get_outtuples_from_profile_tw(profileid, twid)
+        if not out_tuples:
             return
+        # {tupleid: [letters, timestamps]}
+        letters = {
+            outtuple: info[0]
+            for outtuple, info in json.loads(out_tuples).items()
+            if info[0]
+        }
+        self.export_letters(profileid, twid, letters)
 
-        out_tuples: Dict[str, List[str, List[float]]] = json.loads(out_tuples)
+    def export_letters(
+        self, profileid: str, twid: str, letters: Dict[str, str]
+    ):
+        """:param letters: {outtuple: letters}"""
+        if not self.should_export:
+            return
 
+        saddr = profileid.split("_")[-1]
         with open(self.starto_letters_file, "a") as f:
             writer = csv.writer(f, delimiter="\t")
-
-            for outtuple, info in out_tuples.items():
-                outtuple: str
-                info: List[str, List[float]]
-                letters = info[0]
-                writer.writerow([f"{saddr}-{outtuple}-{twid}", letters])
+            for outtuple, letters_ in letters.items():
+                writer.writerow([f"{saddr}-{outtuple}-{twid}", letters_])
@@ -1,19 +1,26 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
+import asyncio
 import json
-from multiprocessing.queues import Queue
+from typing import Optional
+
 import requests
 
+from modules.threat_intelligence.online_lookups import OnlineLookupError
+
 
 class Circllu:
     name = "Circl.lu"
     description = "Circl.lu lookups of IPs"
     authors = ["Alya Gomaa"]
+    base_url = "https://hashlookup.circl.lu/lookup"
+    # limits used by the online lookups worker
+    max_concurrent_queries = 4
+    queries_per_second = 5
 
-    def __init__(self, db, pending_queries: Queue):
+    def __init__(self, db):
         self.db = db
         self.create_session()
-        self.pending_queries = pending_queries
 
     @staticmethod
     def calculate_threat_level(circl_trust: str) -> float:
@@ -70,7 +77,7 @@ class Circllu:
             confidence = 1
         return confidence
 
-    def lookup(self, flow_info: dict):
+    def lookup(self, md5: str) -> Optional[dict]:
         """Queries the Circl.lu API to determine if an MD5 hash of a
         file is known to be malicious based on the file's hash.Utilizes
         internal helper functions to calculate a threat level and
@@ -78,32 +85,25 @@ class Circllu:
         response.
 
         Parameters:
-            - flow_info (dict): Information about the network flow including
-             the MD5 hash of the file to be checked.
+            - md5 (str): the MD5 hash of the file to be checked.
 
         Returns:
             - A dictionary containing the 'confidence' score, 'threat_level',
             and a list of 'blacklist' sources that flagged the file as
-            malicious. If the API call fails, or the file is not known
-             to be malicious,
+            malicious. If the file is not known to be malicious,
             None is returned.
 
-        Side Effects:
-            - May enqueue the flow information into `circllu_queue`
-            for later processing if the API call encounters an exception.
-            - Makes a network request to the Circl.lu API.
+        Raises:
+            - OnlineLookupError if circl.lu couldn't be reached, the
+            online lookups worker retries the lookup later.
         """
-        md5 = flow_info["flow"]["md5"]
-        circl_base_url = "https://hashlookup.circl.lu/lookup/"
         try:
             circl_api_response = self.circl_session.get(
-                f"{circl_base_url}/md5/{md5}",
+                f"{self.base_url}/md5/{md5}",
                 headers=self.circl_session.headers,
             )
-        except Exception:
-            # add the hash to the cirllu queue and ask for it later
-            self.pending_queries.put(flow_info)
-            return
+        except requests.exceptions.RequestException as e:
+            raise OnlineLookupError(str(e))
 
         if circl_api_response.status_code != 200:
             return
@@ -123,3 +123,8 @@ class Circllu:
             "blacklist": f'{response["KnownMalicious"]}, circl.lu',
         }
         return file_info
+
+    async def async_lookup(self, md5: str) -> Optional[dict]:
+        # requests is blocking, run it in a thread to not block the
+        # event loop of the online lookups
+        return await asyncio.to_thread(self.lookup, md5)
@@ -0,0 +1,198 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import (
+    Awaitable,
+    Callable,
+    Coroutine,
+    Dict,
+    Optional,
+    Tuple,
+)
+
+
+class OnlineLookupError(Exception):
+    """
+    raised by the online TI sources when they couldn't be reached.
+    lookups that fail with it are retried later and never cached
+    """
+
+
+class RateLimiter:
+    """
+    allows at most `rate` calls per second, spread evenly over the second.
+    meant to be used from a single event loop
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_slot = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+@dataclass
+class Source:
+    name: str
+    # takes the query and returns the TI found about it, or None
+    lookup: Callable[..., Awaitable[Optional[dict]]]
+    rate_limiter: RateLimiter
+    concurrency: asyncio.Semaphore
+    stats: Dict[str, int] = field(
+        default_factory=lambda: {
+            "lookups": 0,
+            "cache_hits": 0,
+            "errors": 0,
+        }
+    )
+
+
+class OnlineLookups:
+    """
+    Runs the lookups of the online TI sources (spamhaus, circl.lu,
+    urlhaus) in an asyncio event loop in its own thread, so the main loop
+    of the TI module never waits for the network.
+    The number of lookups is limited globally, and per source using the
+    max_concurrent_queries and queries_per_second of each source.
+    Results, including negative ones, are cached in the cache db for
+    cache_ttl seconds so they survive restarts of slips.
+    """
+
+    name = "OnlineLookups"
+
+    def __init__(
+        self,
+        db,
+        max_concurrent_lookups: int = 16,
+        max_pending_lookups: int = 10000,
+        cache_ttl: int = 86400,
+        retries: int = 2,
+        retry_delay: float = 120,
+    ):
+        self.db = db
+        self.max_pending_lookups = max_pending_lookups
+        self.cache_ttl = cache_ttl
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.loop = asyncio.new_event_loop()
+        self.global_concurrency = asyncio.Semaphore(
+            max(1, max_concurrent_lookups)
+        )
+        self.sources: Dict[str, Source] = {}
+        # {(source, *query): task}. concurrent lookups of the same ioc
+        # share the same request
+        self.in_flight: Dict[Tuple[str, ...], asyncio.Task] = {}
+        self.pending = 0
+        self.dropped = 0
+        self.pending_lock = threading.Lock()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever,
+            daemon=True,
+            name="ti_online_lookups",
+        )
+
+    def register(self, source) -> None:
+        """
+        :param source: an obj with a name, an async async_lookup() method,
+        and the max_concurrent_queries and queries_per_second attributes
+        """
+        self.sources[source.name] = Source(
+            name=source.name,
+            lookup=source.async_lookup,
+            rate_limiter=RateLimiter(source.queries_per_second),
+            concurrency=asyncio.Semaphore(source.max_concurrent_queries),
+        )
+
+    def stop(self):
+        if not self.thread.is_alive():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        stats = {name: dict(src.stats) for name, src in self.sources.items()}
+        stats["total"] = {"pending": self.pending, "dropped": self.dropped}
+        return stats
+
+    def submit(
+        self,
+        coroutine: Coroutine,
+        callback: Optional[Callable[[dict], None]] = None,
+    ) -> Optional[Future]:
+        """
+        schedules the given coroutine in the lookups thread without
+        waiting for it. can be called from any thread.
+        callback is called, in the lookups thread, with the result of the
+        coroutine if it found anything.
+        returns None and drops the lookup if there are too many pending
+        ones, so memory stays bounded when the sources are slow.
+        """
+        with self.pending_lock:
+            if self.pending >= self.max_pending_lookups:
+                self.dropped += 1
+                coroutine.close()
+                return None
+            self.pending += 1
+
+        async def run():
+            try:
+                result = await coroutine
+                if result and callback:
+                    callback(result)
+                return result
+            finally:
+                with self.pending_lock:
+                    self.pending -= 1
+
+        return asyncio.run_coroutine_threadsafe(run(), self.loop)
+
+    async def lookup(self, source: str, *query: str) -> Optional[dict]:
+        """
+        looks up the given query in the given source, or in the cache
+        of it. must be awaited in the lookups thread.
+        """
+        key = (source, *query)
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._lookup(source, *query))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        return await task
+
+    async def _lookup(self, source_name: str, *query: str) -> Optional[dict]:
+        source: Source = self.sources[source_name]
+        cache_key = ":".join(query)
+        if cached := self.db.get_cached_online_ti_result(
+            source_name, cache_key
+        ):
+            source.stats["cache_hits"] += 1
+            return json.loads(cached)
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                # the source is unreachable, give it some time
+                await asyncio.sleep(self.retry_delay)
+            async with source.concurrency, self.global_concurrency:
+                await source.rate_limiter.wait()
+                source.stats["lookups"] += 1
+                try:
+                    result = await source.lookup(*query)
+                except OnlineLookupError:
+                    source.stats["errors"] += 1
+                    continue
+
+            self.db.cache_online_ti_result(
+                source_name, cache_key, json.dumps(result), self.cache_ttl
+            )
+            return result
+        return None
@@ -6,25 +6,34 @@ from typing import (
     Union,
 )
 
+import dns.asyncresolver
 from dns.exception import DNSException
 import dns.resolver
-from dns.resolver import NXDOMAIN
+from dns.resolver import (
+    NXDOMAIN,
+    NoAnswer,
+)
+
+from modules.threat_intelligence.online_lookups import OnlineLookupError
 
 
 class Spamhaus:
     name = "Spamhaus"
     description = "Spamhaus lookups of IPs"
     authors = ["Alya Gomaa"]
+    # limits used by the online lookups worker
+    max_concurrent_queries = 10
+    queries_per_second = 20
 
     def __init__(self, db):
         self.db = db
         self._resolver = self._setup_resolver()
 
     @staticmethod
-    def _setup_resolver() -> dns.resolver.Resolver | None:
+    def _setup_resolver() -> dns.asyncresolver.Resolver | None:
         """Initialize and configure the DNS resolver."""
         try:
-            resolver = dns.resolver.Resolver()
+            resolver = dns.asyncresolver.Resolver()
             resolver.timeout = 2.0
             resolver.lifetime = 2.0
             resolver.cache = dns.resolver.LRUCache()
@@ -33,10 +42,10 @@ class Spamhaus:
             # slips started with no internet connection
             return
 
-    def query(self, ip) -> Union[bool, Dict[str, str]]:
+    async def async_lookup(self, ip) -> Union[bool, Dict[str, str]]:
         """Queries the Spamhaus DNSBL to check if the IP is listed."""
         spamhaus_dns_hostname: str = self._get_dns_hostname(ip)
-        spamhaus_result = self._perform_dns_query(spamhaus_dns_hostname)
+        spamhaus_result = await self._perform_dns_query(spamhaus_dns_hostname)
 
         if not spamhaus_result:
             return False
@@ -48,12 +57,21 @@ class Spamhaus:
         """Formats the IP address for the Spamhaus DNS query."""
         return ".".join(ip.split(".")[::-1]) + ".zen.spamhaus.org"
 
-    def _perform_dns_query(self, hostname):
-        """Performs the DNS query to the Spamhaus service."""
+    async def _perform_dns_query(self, hostname):
+        """
+        Performs the DNS query to the Spamhaus service.
+        returns None if the ip isn't listed and raises OnlineLookupError
+        if spamhaus couldn't be reached
+        """
+        if not self._resolver:
+            raise OnlineLookupError("No DNS resolver available")
         try:
-            return self._resolver.resolve(hostname, "A")
-        except (DNSException, NXDOMAIN):
+            return await self._resolver.resolve(hostname, "A")
+        except (NXDOMAIN, NoAnswer):
             return None
+        except DNSException as e:
+            # timeouts, no nameservers, etc.
+            raise OnlineLookupError(str(e))
 
     def _parse_result(self, spamhaus_result):
         """Parses the DNS query result and maps it to the dataset info."""
@@ -1,14 +1,12 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
 import ipaddress
-import multiprocessing
 import os
 import json
-import threading
-import time
 from uuid import uuid4
 import validators
 from typing import (
+    Callable,
     Dict,
     List,
     Union,
@@ -18,6 +16,7 @@ from typing import (
 from ipaddress import IPv4Network, IPv6Network, IPv4Address, IPv6Address
 
 from modules.threat_intelligence.circl_lu import Circllu
+from modules.threat_intelligence.online_lookups import OnlineLookups
 from modules.threat_intelligence.spamhaus import Spamhaus
 from slips_files.common.parsers.config_parser import ConfigParser
 from slips_files.common.slips_utils import utils
@@ -48,8 +47,8 @@ class ThreatIntel(IModule, URLhaus, Spamhaus):
         """Initializes the ThreatIntel module. This includes setting up database
         subscriptions for threat intelligence and new downloaded file notifications,
         reading configuration settings, caching malicious IP ranges, creating a session
-        for Circl.lu API queries, initializing the URLhaus module, and starting a
-        background thread for handling pending Circl.lu queries.
+        for Circl.lu API queries, initializing the URLhaus module, and
+        setting up the worker that does the lookups of the online sources.
 
         Attributes:
             separator (str): A field separator value retrieved from the
@@ -70,13 +69,16 @@ class ThreatIntel(IModule, URLhaus, Spamhaus):
         self.get_all_blacklisted_ip_ranges()
         self.urlhaus = URLhaus(self.db)
         self.spamhaus = Spamhaus(self.db)
-        self.pending_queries = multiprocessing.Queue()
-        self.pending_circllu_calls_thread = threading.Thread(
-            target=self.handle_pending_queries,
-            daemon=True,
-            name="ti_pending_circllu_calls_thread",
+        self.circllu = Circllu(self.db)
+        # online sources are looked up in the background, their results
+        # are handled by the callbacks given to online_lookups.submit()
+        self.online_lookups = OnlineLookups(
+            self.db,
+            max_concurrent_lookups=self.max_concurrent_online_lookups,
+            cache_ttl=self.online_lookups_cache_ttl,
         )
-        self.circllu = Circllu(self.db, self.pending_queries)
+        for source in (self.urlhaus, self.spamhaus, self.circllu):
+            self.online_lookups.register(source)
 
     def get_all_blacklisted_ip_ranges(self):
         """Retrieves and caches the malicious IP ranges from the database,
@@ -88,11 +90,14 @@ class ThreatIntel(IModule, URLhaus, Spamhaus):
             - Populates `cached_ipv4_ranges` and `cached_ipv6_ranges`
             dictionaries with malicious IP ranges categorized by their
             first octet or hextet.
+            - Stores the generation of the ranges the cache was built
+            from in `ip_ranges_generation`
         """
+        self.ip_ranges_generation = self.db.get_ioc_generation("ip_ranges")
         ip_ranges = self.db.get_all_blacklisted_ip_ranges()
         self.cached_ipv6_ranges = {}
         self.cached_ipv4_ranges = {}
-        for range in ip_ranges.keys():
+        for range in ip_ranges:
             if "." in range:
                 first_octet = range.split(".")[0]
                 try:
@@ -129,6 +134,10 @@ class ThreatIntel(IModule, URLhaus, Spamhaus):
             Union[IPv4Network, IPv6Network, IPv4Address, IPv6Address]
         ]
         self.client_ips = conf.client_ips()
+        self.max_concurrent_online_lookups = (
+            conf.max_concurrent_online_lookups()
+        )
+        self.online_lookups_cache_ttl = conf.online_lookups_cache_ttl()
 
     def set_evidence_malicious_asn(
         self,
@@ -1142,11 +1151,12 @@ class ThreatIntel(IModule, URLhaus, Spamhaus):
 
         self.db.set_evidence(evidence)
 
-    def search_online_for_hash(self, flow_info: dict):
+    async def search_online_for_hash(self, flow_info: dict):
         """
         Attempts to find information about a file hash by
         querying online sources.
         Currently, it queries the Circl.lu and URLhaus.
+        runs in the online lookups thread.
 
         Parameters:
             - flow_info (dict): Contains information about the flow,
@@ -1159,11 +1169,14 @@ class ThreatIntel(IModule, URLhaus, Spamhaus):
             - None: If no information is found about the hash in
             the queried sources.
         """
-        if circllu_info := self.circllu.lookup(flow_info):
+        md5 = flow_info["flow"]["md5"]
+        if circllu_info := await self.online_lookups.lookup(
+            self.circllu.name, md5
+        ):
             return circllu_info
 
-        if urlhaus_info := self.urlhaus.lookup(
-            flow_info["flow"]["md5"], "md5_hash"
+        if urlhaus_info := await self.online_lookups.lookup(
+            self.urlhaus.name, md5, "md5_hash"
         ):
             return urlhaus_info
 
@@ -1205,12 +1218,20 @@ class ThreatIntel(IModule, URLhaus, Spamhaus):
             and not utils.is_ip_in_client_ips(ip, self.client_ips)
         )
 
-    def search_online_for_ip(self, ip: str, ip_state: str):
-        if self.is_inbound_traffic(ip, ip_state):
+    def search_online_for_ip(
+        self, ip: str, ip_state: str, callback: Callable[[dict], None]
+    ) -> bool:
+        """
+        looks up the given ip in spamhaus in the background.
+        the given callback is called with the ip info if it's listed.
+        returns True if a lookup was submitted
+        """
+        if not self.is_inbound_traffic(ip, ip_state):
             # we're excluding outbound traffic from spamhaus queries
             # to reduce FPs
-            if spamhaus_res := self.spamhaus.query(ip):
-                return spamhaus_res
+            return False
+        lookup = self.online_lookups.lookup(self.spamhaus.name, ip)
+        return bool(self.online_lookups.submit(lookup, callback=callback))
 
     def ip_has_blacklisted_asn(
         self,
@@ -1298,6 +1319,14 @@ class ThreatIntel(IModule, URLhaus, Spamhaus):
             the IP is found within a blacklisted range.
         """
 
+        # the ranges changed since we cached them, e.g. the update manager
+        # promoted updated feeds
+        if (
+            self.db.get_ioc_generation("ip_ranges")
+            != self.ip_ranges_generation
+        ):
+            self.get_all_blacklisted_ip_ranges()
+
         ip_obj = ipaddress.ip_address(ip)
         # Malicious IP ranges are stored in slips sorted by the first octet
         # so get the ranges that match the fist octet of the given IP
@@ -1317,7 +1346,10 @@ class ThreatIntel(IModule, URLhaus, Spamhaus):
         for range in ranges_starting_with_octet:
             if ip_obj in ipaddress.ip_network(range):
                 # ip was found in one of the blacklisted ranges
-                ip_info = self.db.get_all_blacklisted_ip_ranges()[range]
+                ip_info = self.db.get_blacklisted_ip_range_info(range)
+                if not ip_info:
+                    # the range was removed from the db after we cached it
+                    continue
                 ip_info = json.loads(ip_info)
                 self.set_evidence_malicious_ip(
                     ip,
@@ -1361,8 +1393,8 @@ class ThreatIntel(IModule, URLhaus, Spamhaus):
             return domain_info, is_subdomain
         return None, False
 
-    def search_online_for_url(self, url):
-        return self.urlhaus.lookup(url, "url")
+    async def search_online_for_url(self, url):
+        return await self.online_lookups.lookup(self.urlhaus.name, url, "url")
 
     def is_malicious_ip(
         self,
@@ -1398,44 +1430,51 @@ class ThreatIntel(IModule, URLhaus, Spamhaus):
             is_dns_response is True
 
         Returns:
-            - bool: True if the IP address is found to be malicious,
-             False otherwise.
+            - bool: True if the IP address is found to be malicious in
+            the offline TI, False otherwise.
 
         Side Effects:
             - If the IP is found to be malicious, evidence is recorded
             using either `set_evidence_malicious_ip_in_dns_response`
             or `set_evidence_malicious_ip` methods depending on the context.
+            - If the IP isn't in the offline TI, it's looked up online in
+            the background, and the evidence is recorded when (and if)
+            it's found.
         """
-        ip_info = self.search_offline_for_ip(ip)
-        if not ip_info:
-            ip_info = self.search_online_for_ip(ip, ip_state)
-            if not ip_info:
-                # not malicious
-                return False
 
-        self.db.add_ips_to_ioc({ip: json.dumps(ip_info)})
-        if is_dns_response:
-            self.set_evidence_malicious_ip_in_dns_response(
-                ip,
-                uid,
-                timestamp,
-                ip_info,
-                dns_query,
-                profileid,
-                twid,
-            )
-        else:
-            self.set_evidence_malicious_ip(
-                ip,
-                uid,
-                daddr,
-                timestamp,
-                ip_info,
-                profileid,
-                twid,
-                ip_state,
-            )
-        return True
+        def set_evidence(ip_info: dict):
+            if is_dns_response:
+                self.set_evidence_malicious_ip_in_dns_response(
+                    ip,
+                    uid,
+                    timestamp,
+                    ip_info,
+                    dns_query,
+                    profileid,
+                    twid,
+                )
+            else:
+                self.set_evidence_malicious_ip(
+                    ip,
+                    uid,
+                    daddr,
+                    timestamp,
+                    ip_info,
+                    profileid,
+                    twid,
+                    ip_state,
+                )
+
+        def found_online(ip_info: dict):
+            self.db.add_ips_to_ioc({ip: json.dumps(ip_info)})
+            set_evidence(ip_info)
+
+        if ip_info := self.search_offline_for_ip(ip):
+            set_evidence(ip_info)
+            return True
+
+        self.search_online_for_ip(ip, ip_state, callback=found_online)
+        return False
 
     def is_malicious_hash(self, flow_info: dict):
         """Checks if a file hash is considered malicious based on online threat
@@ -1450,8 +1489,9 @@ class ThreatIntel(IModule, URLhaus, Spamhaus):
             evidence creation if the hash is found to be malicious.
 
         Side Effects:
-            - If the hash is found to be malicious based on online sources,
-            evidence is recorded using `set_evidence_malicious_hash`.
+            - The hash is looked up in the background. If it's found to
+            be malicious based on online sources, evidence is recorded
+            using `set_evidence_malicious_hash`.
         """
         if not flow_info["flow"]["md5"]:
             # some lines in the zeek files.log doesn't have a hash for example
@@ -1468,7 +1508,7 @@ class ThreatIntel(IModule, URLhaus, Spamhaus):
             # its benign so dont look it up
             return
 
-        if blacklist_details := self.search_online_for_hash(flow_info):
+        def found_online(blacklist_details: dict):
             # the md5 appeared in a blacklist
             # update the blacklist_details dict with uid,
             # twid, ts etc. of the detected file/flow
@@ -1479,6 +1519,10 @@ class ThreatIntel(IModule, URLhaus, Spamhaus):
             else:
                 self.set_evidence_malicious_hash(blacklist_details)
 
+        self.online_lookups.submit(
+            self.search_online_for_hash(flow_info), callback=found_online
+        )
+
     def is_malicious_url(self, url, uid, timestamp, daddr, profileid, twid):
         """Determines if a URL is considered malicious by querying online threat
         intelligence sources.
@@ -1488,17 +1532,18 @@ class ThreatIntel(IModule, URLhaus, Spamhaus):
             evidence creation if the URL is found to be malicious.
 
         Side Effects:
-            - If the URL is found to be malicious, evidence is recorded
-            using the `set_evidence_malicious_url` method.
+            - The URL is looked up in the background. If it's found to be
+            malicious, evidence is recorded using the
+            `set_evidence_malicious_url` method.
         """
-        url_info = self.search_online_for_url(url)
 
-        if not url_info:
-            # not malicious
-            return False
+        def found_online(url_info: dict):
+            self.urlhaus.set_evidence_malicious_url(
+                daddr, url_info, uid, timestamp, profileid, twid
+            )
 
-        self.urlhaus.set_evidence_malicious_url(
-            daddr, url_info, uid, timestamp, profileid, twid
+        self.online_lookups.submit(
+            self.search_online_for_url(url), callback=found_online
         )
 
     def set_evidence_malicious_cname_in_dns_response(
@@ -1758,37 +1803,6 @@ class ThreatIntel(IModule, URLhaus, Spamhaus):
             self.db.set_ti_feed_info(filename, malicious_file_info)
             return True
 
-    def handle_pending_queries(self):
-        """Processes the pending Circl.lu queries stored in the queue.
-        This method runs as a daemon thread, executing a batch of up to 10
-        queries every 2 minutes. After processing a batch, it waits for
-        another 2 minutes before attempting the next batch of queries.
-        This method continuously checks the queue for new items and
-        processes them accordingly.
-
-        Side Effects:
-            - Calls `is_malicious_hash` for each flow information
-            item retrieved from the queue.
-            - Modifies the state of the `circllu_queue` by
-            removing processed items.
-        """
-        max_queries = 10
-        while not self.should_stop():
-            time.sleep(120)
-            try:
-                flow_info = self.pending_queries.get(timeout=0.5)
-            except Exception:
-                # queue is empty wait extra 2 mins
-                continue
-
-            queries_done = 0
-            while (
-                not self.pending_queries.empty()
-                and queries_done <= max_queries
-            ):
-                self.is_malicious_hash(flow_info)
-                queries_done += 1
-
     def should_lookup(self, ip: str, protocol: str, ip_state: str) -> bool:
         """Return whether slips should lookup the given ip or not."""
         if utils.is_ignored_ip(ip):
@@ -1810,8 +1824,16 @@ class ThreatIntel(IModule, URLhaus, Spamhaus):
         )
         for local_file in local_files:
             self.update_local_file(local_file)
+        # share the loaded iocs with the rest of the processes
+        self.db.publish_ti_snapshot()
+
+        utils.start_thread(self.online_lookups.thread, self.db)
 
-        utils.start_thread(self.pending_circllu_calls_thread, self.db)
+    def shutdown_gracefully(self):
+        self.online_lookups.stop()
+        self.print(
+            f"Online lookups stats: {self.online_lookups.get_stats()}", 2, 0
+        )
 
     def main(self):
         # The channel can receive an IP address or a domain name
@@ -1,11 +1,13 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+import asyncio
 import json
 from uuid import uuid4
 
 import requests
 
+from modules.threat_intelligence.online_lookups import OnlineLookupError
 from slips_files.common.slips_utils import utils
 from slips_files.core.structures.evidence import (
     Evidence,
@@ -23,6 +25,9 @@ class URLhaus:
     name = "URLhaus"
     description = "URLhaus lookups of URLs and hashes"
     authors = ["Alya Gomaa"]
+    # limits used by the online lookups worker
+    max_concurrent_queries = 4
+    queries_per_second = 5
 
     def __init__(self, db):
         self.db = db
@@ -37,6 +42,7 @@ class URLhaus:
         """
         :param to_lookup: dict with {ioc_type: ioc}
         supported ioc types are md5_hash and url
+        raises OnlineLookupError if urlhaus couldn't be reached
         """
         ioc_type = next(iter(to_lookup))
         uri = "url" if ioc_type == "url" else "payload"
@@ -46,8 +52,9 @@ class URLhaus:
                 to_lookup,
                 headers=self.urlhaus_session.headers,
             )
-        except requests.exceptions.ConnectionError:
+        except requests.exceptions.RequestException as e:
             self.create_urlhaus_session()
+            raise OnlineLookupError(str(e))
 
     def parse_urlhaus_url_response(self, response, url):
         threat = response["threat"]
@@ -150,6 +157,11 @@ class URLhaus:
         elif type_of_ioc == "url":
             return self.parse_urlhaus_url_response(response, ioc)
 
+    async def async_lookup(self, ioc, type_of_ioc: str) -> Optional[dict]:
+        # requests is blocking, run it in a thread to not block the
+        # event loop of the online lookups
+        return await asyncio.to_thread(self.lookup, ioc, type_of_ioc)
+
     def set_evidence_malicious_hash(self, file_info: Dict[str, Any]) -> None:
         flow: Dict[str, Any] = file_info["flow"]
 
@@ -4,9 +4,12 @@ import traceback
 import sys
 import time
 import json
+from dataclasses import dataclass
 from typing import (
     Any,
+    Dict,
     List,
+    Tuple,
 )
 
 from slips_files.common.flow_classifier import FlowClassifier
@@ -15,6 +18,18 @@ from slips_files.common.slips_utils import utils
 from slips_files.common.abstracts.imodule import IModule
 
 
+@dataclass
+class PendingFlow:
+    """a conn flow waiting for its altflow to arrive"""
+
+    profileid: str
+    twid: str
+    flow: Any
+    activity: dict
+    # time.time() after which we stop waiting for the altflow
+    deadline: float
+
+
 class Timeline(IModule):
     # Name: short name of the module. Do not use spaces
     name = "Timeline"
@@ -23,15 +38,43 @@ class Timeline(IModule):
         " network based on flows and available data"
     )
     authors = ["Sebastian Garcia", "Alya Gomaa"]
+    # seconds to wait for the altflow of a conn flow before giving up
+    altflow_wait_time = 1
+    # max number of conn flows waiting for their altflows. when exceeded,
+    # the oldest ones are written without waiting
+    max_pending_flows = 10000
+    # max number of altflows waiting for their conn flows
+    max_buffered_altflows = 10000
+    # timeline lines are written to the db in batches of this size, or
+    # every flush_interval seconds, whichever comes first
+    max_batch_size = 500
+    flush_interval = 1
 
     def init(self):
         self.read_configuration()
         self.c1 = self.db.subscribe("new_flow")
+        self.c2 = self.db.subscribe("new_dns")
+        self.c3 = self.db.subscribe("new_http")
+        self.c4 = self.db.subscribe("new_ssl")
+        self.c5 = self.db.subscribe("new_ssh")
         self.channels = {
             "new_flow": self.c1,
+            "new_dns": self.c2,
+            "new_http": self.c3,
+            "new_ssl": self.c4,
+            "new_ssh": self.c5,
         }
         self.classifier = FlowClassifier()
         self.host_ip: str = self.db.get_host_ip()
+        # conn flows waiting for their altflows. {uid: PendingFlow}
+        # ordered by deadline since they all wait the same time
+        self.pending_flows: Dict[str, PendingFlow] = {}
+        # altflows that arrived before their conn flows. {uid: altflow}
+        self.altflows: Dict[str, dict] = {}
+        # (profileid, twid, activity, timestamp) of the lines waiting to
+        # be written to the db
+        self.timeline_lines: List[Tuple[str, str, dict, Any]] = []
+        self.last_flush_time = time.time()
 
     def read_configuration(self):
         conf = ConfigParser()
@@ -138,6 +181,9 @@ class Timeline(IModule):
         alt_flow: dict = self.db.get_altflow_from_uid(
             profileid, twid, flow.uid
         )
+        return self.get_altflow_activity(alt_flow)
+
+    def get_altflow_activity(self, alt_flow: dict) -> dict:
         altflow_info = {"info": ""}
 
         if not alt_flow:
@@ -306,23 +352,24 @@ class Timeline(IModule):
                 "IPV4-ICMP": self.process_icmp_flow,
                 "IGMP": self.process_igmp_flow,
             }
-            if flow.proto.upper() in proto_handlers:
-                activity = proto_handlers[flow.proto.upper()](flow)
+            proto = flow.proto.upper()
+            if proto in proto_handlers:
+                activity = proto_handlers[proto](flow)
             else:
                 activity = {}
             #################################
             # Now process the alternative flows
-            # Sometimes we need to wait a little to give time to Zeek to find
-            # the related flow since they are read very fast together.
-            # This should be improved algorithmically probably
-            time.sleep(0.05)
-            alt_activity = self.process_altflow(profileid, twid, flow)
-            # Combine the activity of normal flows and activity of alternative
-            # flows and store in the DB for this profileid and twid
-            activity.update(alt_activity)
-            self.db.add_timeline_line(
-                profileid, twid, activity, flow.starttime
-            )
+            # the altflow (dns, http, ssl, ssh) of this flow may arrive
+            # before or after it, so if we don't have it yet, this flow
+            # waits for it for a while without blocking the other flows
+            if alt_flow := self.altflows.pop(flow.uid, None):
+                activity.update(self.get_altflow_activity(alt_flow))
+            elif flow.uid and proto in ("TCP", "UDP"):
+                self.wait_for_altflow(profileid, twid, flow, activity)
+                return
+            else:
+                activity.update(self.process_altflow(profileid, twid, flow))
+            self.add_timeline_line(profileid, twid, activity, flow.starttime)
 
         except Exception:
             exception_line = sys.exc_info()[2].tb_lineno
@@ -332,6 +379,81 @@ class Timeline(IModule):
             self.print(traceback.format_exc(), 0, 1)
             return True
 
+    def wait_for_altflow(self, profileid, twid, flow, activity: dict):
+        if len(self.pending_flows) >= self.max_pending_flows:
+            self.write_pending_flow(next(iter(self.pending_flows)))
+
+        self.pending_flows[flow.uid] = PendingFlow(
+            profileid,
+            twid,
+            flow,
+            activity,
+            time.time() + self.altflow_wait_time,
+        )
+
+    def write_pending_flow(self, uid: str, alt_flow: dict = None):
+        """
+        writes the timeline line of the pending flow with the given uid
+        using the given altflow, or the one in the db if none is given.
+        """
+        pending: PendingFlow = self.pending_flows.pop(uid)
+        if alt_flow:
+            alt_activity = self.get_altflow_activity(alt_flow)
+        else:
+            # maybe the altflow arrived long before this flow, and was
+            # removed from self.altflows
+            alt_activity = self.process_altflow(
+                pending.profileid, pending.twid, pending.flow
+            )
+        pending.activity.update(alt_activity)
+        self.add_timeline_line(
+            pending.profileid,
+            pending.twid,
+            pending.activity,
+            pending.flow.starttime,
+        )
+
+    def write_expired_pending_flows(self, now: float):
+        while self.pending_flows:
+            uid = next(iter(self.pending_flows))
+            if self.pending_flows[uid].deadline > now:
+                break
+            self.write_pending_flow(uid)
+
+    def process_altflow_msg(self, msg: dict):
+        """
+        joins the altflow in the given msg with its conn flow if it's
+        waiting for it. otherwise keeps it until the conn flow arrives
+        """
+        alt_flow: dict = json.loads(msg["data"])["flow"]
+        uid = alt_flow.get("uid")
+        if not uid:
+            return
+
+        if uid in self.pending_flows:
+            self.write_pending_flow(uid, alt_flow)
+            return
+
+        if len(self.altflows) >= self.max_buffered_altflows:
+            self.altflows.pop(next(iter(self.altflows)))
+        self.altflows[uid] = alt_flow
+
+    def add_timeline_line(self, profileid, twid, activity: dict, timestamp):
+        self.timeline_lines.append((profileid, twid, activity, timestamp))
+        if len(self.timeline_lines) >= self.max_batch_size:
+            self.flush_timeline_lines()
+
+    def flush_timeline_lines(self):
+        if self.timeline_lines:
+            self.db.add_timeline_lines(self.timeline_lines)
+            self.timeline_lines = []
+        self.last_flush_time = time.time()
+
+    def shutdown_gracefully(self):
+        for uid in list(self.pending_flows):
+            self.write_pending_flow(uid)
+        self.flush_timeline_lines()
+
     def pre_main(self):
         utils.drop_root_privs()
 
@@ -343,3 +465,12 @@ class Timeline(IModule):
             twid = msg["twid"]
             flow = self.classifier.convert_to_flow_obj(msg["flow"])
             self.process_flow(profileid, twid, flow)
+
+        for channel in ("new_dns", "new_http", "new_ssl", "new_ssh"):
+            if msg := self.get_msg(channel):
+                self.process_altflow_msg(msg)
+
+        now = time.time()
+        self.write_expired_pending_flows(now)
+        if now - self.last_flush_time >= self.flush_interval:
+            self.flush_timeline_lines()
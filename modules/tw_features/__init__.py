@@ -0,0 +1,4 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+# This file is part of Viper - https://github.com/botherder/viper
+# See the file 'LICENSE' for copying permission.
@@ -0,0 +1,71 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import json
+from typing import Dict
+
+from slips_files.common.abstracts.imodule import IModule
+from slips_files.common.slips_utils import utils
+from slips_files.core.structures.tw_features import (
+    TWFeatures,
+    compute_tw_features,
+)
+
+
+class TimewindowFeatures(IModule):
+    """
+    Computes the features of every tw and of each of its outtuples once
+    the tw is closed, in one pass over the flows of the tw, and stores
+    them in the sqlite db as columns of numpy arrays.
+    Then publishes the profileid_twid in the tw_features channel, so
+    modules can read them with db.get_tw_features() instead of reading
+    the flows and the letters of the tw again.
+    Nothing is computed while no module is subscribed to tw_features.
+    """
+
+    name = "Timewindow Features"
+    description = "Computes the features of each closed timewindow"
+    authors = ["Sebastian Garcia", "Alya Gomaa"]
+
+    def init(self):
+        self.c1 = self.db.subscribe("tw_closed")
+        self.channels = {
+            "tw_closed": self.c1,
+        }
+
+    def pre_main(self):
+        utils.drop_root_privs()
+
+    def get_letters(self, profileid: str, twid: str) -> Dict[str, str]:
+        """returns {tupleid: letters} of the outtuples of the given tw"""
+        out_tuples = self.db.get_outtuples_from_profile_tw(profileid, twid)
+        if not out_tuples:
+            return {}
+        # {tupleid: [letters, timestamps]}
+        return {
+            tupleid: info[0]
+            for tupleid, info in json.loads(out_tuples).items()
+        }
+
+    def materialize(self, profileid: str, twid: str) -> TWFeatures:
+        flows = self.db.get_all_flows_in_profileid_twid(profileid, twid)
+        features: TWFeatures = compute_tw_features(
+            profileid,
+            twid,
+            (flows or {}).values(),
+            self.get_letters(profileid, twid),
+            self.db.get_final_state_from_flags,
+        )
+        self.db.set_tw_features(features)
+        self.db.publish("tw_features", f"{profileid}_{twid}")
+        return features
+
+    def main(self):
+        if msg := self.get_msg("tw_closed"):
+            # don't read all the flows of the tw if no one will use its
+            # features
+            if not self.db.has_subscribers("tw_features"):
+                return
+            profileid_tw = msg["data"].split("_")
+            profileid = f"{profileid_tw[0]}_{profileid_tw[1]}"
+            twid = profileid_tw[-1]
+            self.materialize(profileid, twid)
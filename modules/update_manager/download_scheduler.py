@@ -0,0 +1,195 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import asyncio
+import os
+from dataclasses import dataclass
+from enum import Enum
+from typing import (
+    Dict,
+    List,
+    Optional,
+)
+from urllib.parse import urlparse
+
+import requests
+
+# the status codes of errors that may go away if we try again
+RETRY_STATUS_CODES = {429}
+
+
+class DownloadStatus(Enum):
+    # the server sent us a new version of the file
+    UPDATED = "updated"
+    # the server told us our cached version is still valid (304)
+    NOT_MODIFIED = "not_modified"
+    FAILED = "failed"
+
+
+@dataclass
+class Download:
+    url: str
+    # where to write the downloaded file
+    path: str
+    # the validators of the version we have cached, sent to the server
+    # so it only sends the file if it changed
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+@dataclass
+class DownloadResult:
+    url: str
+    path: str
+    status: DownloadStatus
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    error: str = ""
+
+
+class DownloadScheduler:
+    """
+    Downloads files concurrently using conditional GET requests.
+    The number of concurrent downloads is limited globally and per host,
+    and the files are streamed to disk instead of being kept in memory.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_downloads: int = 8,
+        max_downloads_per_host: int = 2,
+        timeout: float = 5,
+        retries: int = 3,
+        chunk_size: int = 64 * 1024,
+    ):
+        self.max_concurrent_downloads = max(1, max_concurrent_downloads)
+        self.max_downloads_per_host = max(1, max_downloads_per_host)
+        self.timeout = timeout
+        self.retries = max(1, retries)
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def get_host(url: str) -> str:
+        return urlparse(url).netloc
+
+    @staticmethod
+    def get_conditional_headers(download: Download) -> Dict[str, str]:
+        headers = {}
+        if download.etag:
+            headers["If-None-Match"] = download.etag
+        if download.last_modified:
+            headers["If-Modified-Since"] = download.last_modified
+        return headers
+
+    @staticmethod
+    def should_retry(status_code: int) -> bool:
+        """
+        server errors and rate limiting are retried, other errors like
+        404 or 403 will be the same no matter how many times we ask
+        """
+        return status_code >= 500 or status_code in RETRY_STATUS_CODES
+
+    def _stream_to_disk(self, response, path: str):
+        """
+        writes the response to path chunk by chunk. the file is written to
+        a temp file first so a failed download never leaves a partial file
+        """
+        tmp_path = f"{path}.part"
+        with open(tmp_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                f.write(chunk)
+        os.replace(tmp_path, path)
+
+    def _download(self, download: Download) -> DownloadResult:
+        """
+        does the actual blocking request. runs in a thread to not block
+        the event loop
+        """
+        headers = self.get_conditional_headers(download)
+        error = ""
+        for _ in range(self.retries):
+            try:
+                with requests.get(
+                    download.url,
+                    headers=headers,
+                    timeout=self.timeout,
+                    stream=True,
+                ) as response:
+                    etag = response.headers.get("ETag")
+                    last_modified = response.headers.get("Last-Modified")
+                    if response.status_code == 304:
+                        return DownloadResult(
+                            download.url,
+                            download.path,
+                            DownloadStatus.NOT_MODIFIED,
+                            etag=etag or download.etag,
+                            last_modified=(
+                                last_modified or download.last_modified
+                            ),
+                        )
+
+                    if response.status_code != 200:
+                        error = (
+                            f"An error occurred while downloading the file "
+                            f"{download.url}. status code: "
+                            f"{response.status_code}. Aborting"
+                        )
+                        if self.should_retry(response.status_code):
+                            continue
+                        break
+
+                    self._stream_to_disk(response, download.path)
+                    return DownloadResult(
+                        download.url,
+                        download.path,
+                        DownloadStatus.UPDATED,
+                        etag=etag,
+                        last_modified=last_modified,
+                    )
+
+            except requests.exceptions.Timeout:
+                error = (
+                    f"Timeout reached while downloading the file "
+                    f"{download.url}. Aborting."
+                )
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+            ):
+                error = (
+                    f"Connection error while downloading the file "
+                    f"{download.url}. Aborting."
+                )
+            except OSError as e:
+                error = f"Error writing {download.url} to disk: {e}"
+                break
+
+        return DownloadResult(
+            download.url, download.path, DownloadStatus.FAILED, error=error
+        )
+
+    async def download_all(
+        self, downloads: List[Download]
+    ) -> List[DownloadResult]:
+        """
+        downloads all the given files concurrently while respecting the
+        global and the per host limits.
+        returns the results in the same order as the given downloads
+        """
+        global_limit = asyncio.Semaphore(self.max_concurrent_downloads)
+        host_limits: Dict[str, asyncio.Semaphore] = {}
+
+        async def download(download_: Download) -> DownloadResult:
+            host = self.get_host(download_.url)
+            if host not in host_limits:
+                host_limits[host] = asyncio.Semaphore(
+                    self.max_downloads_per_host
+                )
+            # take the host slot first so downloads from a busy host don't
+            # hold global slots that other hosts could use
+            async with host_limits[host]:
+                async with global_limit:
+                    return await asyncio.to_thread(self._download, download_)
+
+        return await asyncio.gather(
+            *(download(download_) for download_ in downloads)
+        )
@@ -5,6 +5,7 @@ import datetime
 import json
 import os
 import sys
+import threading
 import time
 import traceback
 from asyncio import Task
@@ -22,6 +23,12 @@ from exclusiveprocess import (
     CannotAcquireLock,
 )
 
+from modules.update_manager.download_scheduler import (
+    Download,
+    DownloadResult,
+    DownloadScheduler,
+    DownloadStatus,
+)
 from modules.update_manager.timer_manager import InfiniteTimer
 from slips_files.common.parsers.config_parser import ConfigParser
 from slips_files.common.abstracts.imodule import IModule
@@ -41,6 +48,11 @@ class UpdateManager(IModule):
         self.timer_manager = InfiniteTimer(
             self.update_period, self.update_ti_files
         )
+        # the timers below call update_ti_files() too, from their own
+        # threads, each with its own event loop. only one of them should
+        # be updating the feeds at a time, the others skip their update
+        # instead of blocking their loop waiting for it. see update()
+        self.update_lock = threading.Lock()
         # Timer to update the MAC db
         # when update_ti_files is called, it decides what exactly to
         # update, the mac db, online whitelist Or online ti files.
@@ -84,6 +96,10 @@ class UpdateManager(IModule):
         # store the responses of the files that should be updated when their
         # update period passed
         self.responses = {}
+        self.download_scheduler = DownloadScheduler(
+            max_concurrent_downloads=self.max_concurrent_downloads,
+            max_downloads_per_host=self.max_downloads_per_host,
+        )
 
     def read_configuration(self):
         def read_riskiq_creds(risk_iq_credentials_path):
@@ -106,6 +122,8 @@ class UpdateManager(IModule):
         conf = ConfigParser()
 
         self.update_period = conf.update_period()
+        self.max_concurrent_downloads = conf.max_concurrent_feed_downloads()
+        self.max_downloads_per_host = conf.max_feed_downloads_per_host()
 
         self.path_to_remote_ti_files = conf.remote_ti_data_path()
         if not os.path.exists(self.path_to_remote_ti_files):
@@ -403,80 +421,77 @@ class UpdateManager(IModule):
 
         self.loaded_ti_files += 1
 
-    def should_update(self, file_to_download: str, update_period) -> bool:
+    def should_update(self, feed: str, update_period) -> bool:
         """
-        Decides whether to update or not based on the update period and e-tag.
-        Used for remote files that are updated periodically
-        the response will be stored in self.responses if the file is old
-        and needs to be updated
-        :param file_to_download: url that contains the file to download
+        Decides whether to update or not based on the update period.
+        Used for remote files that are updated periodically.
+        whether the file actually changed on the server is decided later
+        by is_feed_modified() using the response of a conditional request.
+        :param feed: url that contains the file to download
         :param update_period: after how many seconds do we need to update
         this file?
         """
-        if not self.did_update_period_pass(update_period, file_to_download):
+        if not self.did_update_period_pass(update_period, feed):
             # Update period hasn't passed yet, but the file is in our db
             self.loaded_ti_files += 1
             return False
+        return True
 
-        # update period passed
-        if "risk" in file_to_download:
-            # updating riskiq TI data does not depend on an e-tag
-            return True
+    def get_download(self, feed: str) -> Download:
+        """
+        returns the download of the given feed with the e-tag and
+        last-modified of our cached version, so the server only sends
+        the file if it changed
+        """
+        ti_file_info: dict = self.db.get_ti_feed_info(feed)
+        return Download(
+            url=feed,
+            path=os.path.join(
+                self.path_to_remote_ti_files, feed.split("/")[-1]
+            ),
+            etag=ti_file_info.get("e-tag") or None,
+            last_modified=ti_file_info.get("Last-Modified") or None,
+        )
 
-        # Update only if the e-tag is different
-        try:
-            # response will be used to get e-tag, and if the file was updated
-            # the same response will be used to update the content in our db
-            response = self.download_file(file_to_download)
-            if not response:
-                return False
+    def is_feed_modified(self, result: DownloadResult) -> bool:
+        """
+        Decides whether the downloaded feed should be parsed or not based
+        on the response status, e-tag and last-modified.
+        some servers ignore conditional requests and send the whole file
+        anyway, so the e-tag and last-modified are compared here too.
+        """
+        feed = result.url
+        if result.status == DownloadStatus.FAILED:
+            self.print(result.error, 0, 1)
+            return False
 
-            # Get the E-TAG of this file to compare with current files
-            ti_file_info: dict = self.db.get_ti_feed_info(file_to_download)
-            old_e_tag = ti_file_info.get("e-tag", "")
-            # Check now if E-TAG of file in github is same as downloaded
-            # file here.
-            new_e_tag = self.get_e_tag(response)
-            if not new_e_tag:
-                # use last modified instead
-                cached_last_modified = ti_file_info.get("Last-Modified", "")
-                new_last_modified = self.get_last_modified(response)
-
-                if not new_last_modified:
-                    self.log(
-                        f"Error updating {file_to_download}."
-                        f" Doesn't have an e-tag or Last-Modified field."
-                    )
-                    return False
+        if result.status == DownloadStatus.NOT_MODIFIED:
+            # update period passed but the file hasnt changed on the
+            # server, no need to update
+            # Store the update time like we downloaded it anyway
+            self.mark_feed_as_updated(feed)
+            return False
 
-                # use last modified date instead of e-tag
-                if new_last_modified != cached_last_modified:
-                    self.responses[file_to_download] = response
-                    return True
-                else:
-                    self.mark_feed_as_updated(file_to_download)
-                    return False
+        ti_file_info: dict = self.db.get_ti_feed_info(feed)
+        if not result.etag:
+            if not result.last_modified:
+                self.log(
+                    f"Error updating {feed}."
+                    f" Doesn't have an e-tag or Last-Modified field."
+                )
+                return False
 
-            if old_e_tag != new_e_tag:
-                # Our TI file is old. Download the new one.
-                # we'll be storing this e-tag in our database
-                self.responses[file_to_download] = response
+            # use last modified date instead of e-tag
+            if result.last_modified != ti_file_info.get("Last-Modified", ""):
                 return True
+            self.mark_feed_as_updated(feed)
+            return False
 
-            else:
-                # old_e_tag == new_e_tag
-                # update period passed but the file hasnt changed on the
-                # server, no need to update
-                # Store the update time like we downloaded it anyway
-                self.mark_feed_as_updated(file_to_download)
-                return False
+        if result.etag != ti_file_info.get("e-tag", ""):
+            # Our TI file is old. parse the new one.
+            return True
 
-        except Exception:
-            exception_line = sys.exc_info()[2].tb_lineno
-            self.print(
-                f"Problem on should_update() line {exception_line}", 0, 1
-            )
-            self.print(traceback.format_exc(), 0, 1)
+        self.mark_feed_as_updated(feed)
         return False
 
     def get_e_tag(self, response):
@@ -485,10 +500,6 @@ class UpdateManager(IModule):
         """
         return response.headers.get("ETag", False)
 
-    def write_file_to_disk(self, response, full_path):
-        with open(full_path, "w") as f:
-            f.write(response.text)
-
     def parse_ssl_feed(self, url, full_path):
         """
         Read all ssl fingerprints in full_path and store the info in our db
@@ -616,21 +627,15 @@ class UpdateManager(IModule):
         self.db.add_ssl_sha1_to_ioc(malicious_ssl_certs)
         return True
 
-    async def update_ti_file(self, link_to_download: str) -> bool:
+    async def update_ti_file(self, result: DownloadResult) -> bool:
         """
-        Update remote TI files, JA3 feeds and SSL feeds by writing them to
-        disk and parsing them
+        Update remote TI files, JA3 feeds and SSL feeds by parsing the
+        file the download scheduler wrote to disk
         """
+        link_to_download = result.url
+        full_path = result.path
         try:
             self.log(f"Updating the remote file {link_to_download}")
-            response = self.responses[link_to_download]
-            file_name_to_download = link_to_download.split("/")[-1]
-
-            # first download the file and save it locally
-            full_path = os.path.join(
-                self.path_to_remote_ti_files, file_name_to_download
-            )
-            self.write_file_to_disk(response, full_path)
 
             # File is updated in the server and was in our database.
             # Delete previous iocs of this file.
@@ -674,9 +679,9 @@ class UpdateManager(IModule):
 
             # Store the new etag and time of file in the database
             file_info = {
-                "e-tag": self.get_e_tag(response),
+                "e-tag": result.etag or False,
                 "time": time.time(),
-                "Last-Modified": self.get_last_modified(response),
+                "Last-Modified": result.last_modified or False,
             }
             self.mark_feed_as_updated(link_to_download, extra_info=file_info)
             self.log(
@@ -684,13 +689,7 @@ class UpdateManager(IModule):
             )
 
             # done parsing the file, delete it from disk
-            try:
-                os.remove(full_path)
-            except FileNotFoundError:
-                # this happens in integration tests, when another test deletes
-                # the file while this one is updating it, ignore it
-                pass
-
+            self.delete_downloaded_feed(full_path)
             return True
 
         except Exception:
@@ -701,6 +700,14 @@ class UpdateManager(IModule):
             self.print(traceback.format_exc(), 0, 1)
             return False
 
+    def delete_downloaded_feed(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # this happens in integration tests, when another test deletes
+            # the file while this one is updating it, ignore it
+            pass
+
     def update_riskiq_feed(self):
         """Get and parse RiskIQ feed"""
         if not (self.riskiq_email and self.riskiq_key):
@@ -1681,6 +1688,17 @@ class UpdateManager(IModule):
             )
             return False
 
+        if not self.update_lock.acquire(blocking=False):
+            self.print(
+                "Another update of the TI files is running. Skipping.", 0, 2
+            )
+            return False
+        try:
+            return await self._update()
+        finally:
+            self.update_lock.release()
+
+    async def _update(self) -> bool:
         try:
             self.log("Checking if we need to download TI files.")
 
@@ -1703,44 +1721,62 @@ class UpdateManager(IModule):
             # this run (self.url_feeds, self.ja3_feeds, self.ssl_feeds)
             self.delete_unused_cached_remote_feeds()
 
-            for file_to_download in files_to_download:
-                if self.should_update(file_to_download, self.update_period):
-                    # failed to get the response, either a server problem
-                    # or the file is up to date so the response isn't needed
-                    # either way __check_if_update handles the error printing
-
-                    # this run wasn't started with existing ti files in the db
-                    self.first_time_reading_files = True
-
-                    # every function call to update_TI_file is now running
-                    # concurrently instead of serially
-                    # so when a server's taking a while to give us the TI
-                    # feed, we proceed to download the next file instead of
-                    # being idle
-                    task = asyncio.create_task(
-                        self.update_ti_file(file_to_download)
-                    )
-                    task.add_done_callback(self.handle_exception)
-            #######################################################
-            # in case of riskiq files, we don't have a link for them in ti_files, We update these files using their API
-            # check if we have a username and api key and a week has passed since we last updated
-            if self.should_update("riskiq_domains", self.riskiq_update_period):
-                self.update_riskiq_feed()
-
-            # wait for all TI files to update
+            # the updated feeds and their e-tags are loaded into staging
+            # keys and promoted all at once when we're done, so lookups
+            # never see a feed half deleted or half loaded
+            self.db.start_staging_iocs()
             try:
-                await task
-            except (UnboundLocalError, asyncio.exceptions.CancelledError):
-                # in case all our files are updated, we don't
-                # have task defined, skip
-                pass
+                await self.update_remote_feeds(files_to_download)
+            except BaseException:
+                # the staged iocs are dropped along with the e-tags of
+                # their feeds, so they're downloaded again next time
+                self.db.discard_staged_iocs()
+                raise
+            self.db.promote_staged_iocs()
 
             self.db.set_loaded_ti_files(self.loaded_ti_files)
+            # compile the loaded iocs into the snapshot shared by all
+            # processes that do TI lookups
+            self.db.publish_ti_snapshot()
             self.print_duplicate_ip_summary()
             self.loaded_ti_files = 0
         except KeyboardInterrupt:
             return False
 
+    async def update_remote_feeds(self, files_to_download: Dict[str, dict]):
+        """
+        Downloads and loads the given feeds if they need an update, then
+        updates riskiq. called while staging iocs
+        """
+        downloads: List[Download] = [
+            self.get_download(feed)
+            for feed in files_to_download
+            if self.should_update(feed, self.update_period)
+        ]
+        # all feeds are downloaded concurrently, with conditional
+        # requests, so servers only send the feeds that changed
+        results: List[DownloadResult] = (
+            await self.download_scheduler.download_all(downloads)
+        )
+        for result in results:
+            if not self.is_feed_modified(result):
+                # either a server problem or the file is up to date
+                # is_feed_modified() handles the error printing
+                if result.status == DownloadStatus.UPDATED:
+                    # the server ignored our conditional request and
+                    # sent the same version we have
+                    self.delete_downloaded_feed(result.path)
+                continue
+
+            # this run wasn't started with existing ti files in the db
+            self.first_time_reading_files = True
+            await self.update_ti_file(result)
+        #######################################################
+        # in case of riskiq files, we don't have a link for them in ti_files, We update these files using their API
+        # check if we have a username and api key and a week has passed since we last updated
+        if self.should_update("riskiq_domains", self.riskiq_update_period):
+            self.update_riskiq_feed()
+
     async def update_ti_files(self):
         """
         Update TI files and store them in database before slips starts
@@ -77,7 +77,7 @@ class AsyncModule(IModule):
         loop.set_exception_handler(self.handle_exception)
         return loop.run_until_complete(func())
 
-    def run(self):
+    def run_until_stopped(self):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
 
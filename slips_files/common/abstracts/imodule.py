@@ -66,6 +66,9 @@ class IModule(ABC, Process):
     def print(self, *args, **kwargs):
         return self.printer.print(*args, **kwargs)
 
+    def lazy_print(self, *args, **kwargs):
+        return self.printer.lazy_print(*args, **kwargs)
+
     def init_channel_tracker(self) -> Dict[str, Dict[str, bool]]:
         """
         tracks if in the last loop, a msg was received in any of the
@@ -159,6 +162,17 @@ class IModule(ABC, Process):
         self.print(traceback.format_exc(), 0, 1)
 
     def run(self):
+        """
+        must be called run because this is what multiprocessing runs
+        """
+        try:
+            self.run_until_stopped()
+        finally:
+            # the hits and misses of the conn flows cache of this process
+            # are logged by the main process when slips stops
+            self.db.update_conn_flows_cache_stats()
+
+    def run_until_stopped(self):
         """
         some modules use async functions like flowalerts,
         the goals of this function is to make sure that async and normal
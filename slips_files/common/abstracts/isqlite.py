@@ -150,7 +150,14 @@ class ISQLite(ABC):
             res = cursor.fetchone()
         return res
 
-    def execute(self, query: str, params=None) -> None:
+    def executemany(self, query: str, params) -> None:
+        """
+        executes the given query once per item in params, in one
+        transaction
+        """
+        return self.execute(query, params, many=True)
+
+    def execute(self, query: str, params=None, many=False) -> None:
         """
         wrapper for sqlite execute() To avoid
          'Recursive use of cursors not allowed' error
@@ -186,6 +193,8 @@ class ISQLite(ABC):
                     self._acquire_flock()
                     if params is None:
                         cursor.execute(query)
+                    elif many:
+                        cursor.executemany(query, params)
                     else:
                         cursor.execute(query, params)
                     self._release_flock()
@@ -202,6 +211,8 @@ class ISQLite(ABC):
                 # sqlite automatically rolls back the tx if an error occurs
                 trial += 1
                 if trial >= max_trials:
+                    if many:
+                        params = f"{len(params)} rows"
                     self.print(
                         f"Error executing query: "
                         f"'{query}'. Params: {params}. Error: {err}. "
@@ -0,0 +1,77 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import time
+from collections import OrderedDict
+from typing import (
+    Optional,
+    Tuple,
+)
+
+
+class ConnFlowsCache:
+    """
+    Keeps the most recent conn flows of a process in memory, by uid, so
+    the modules that need the conn flow of an ssl, http, ssh, etc. flow
+    don't have to read it from the sqlite db.
+
+    The cache is filled by the process that does the lookups, from the
+    new_flow msgs it receives, so both adding and looking up a flow are
+    dict operations, with no round trips to redis.
+
+    At most size flows are kept, the least recently added ones are dropped
+    first, and every flow is dropped ttl seconds after it was added.
+    Hits and misses are counted until they're read using pop_stats().
+    """
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        # {uid: (time it expires, twid, serialized flow)}
+        self.flows: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.flows)
+
+    def add(self, uid: str, twid: str, flow: str):
+        """
+        :param flow: the serialized flow, the same one stored in sqlite
+        """
+        if not uid:
+            return
+        self.flows.pop(uid, None)
+        self.flows[uid] = (time.monotonic() + self.ttl, twid, flow)
+        while len(self.flows) > self.size:
+            self.flows.popitem(last=False)
+
+    def get(self, uid: str, twid=False) -> Optional[str]:
+        """
+        returns the serialized conn flow with the given uid if it's in the
+        cache, None otherwise
+        :param twid: if given, the flow is only returned if it's in this tw
+        """
+        flow = None
+        if cached := self.flows.get(uid):
+            expires_at, cached_twid, cached_flow = cached
+            if expires_at <= time.monotonic():
+                del self.flows[uid]
+            elif not twid or twid == cached_twid:
+                flow = cached_flow
+
+        if flow:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return flow
+
+    @property
+    def lookups(self) -> int:
+        return self.hits + self.misses
+
+    def pop_stats(self) -> Tuple[int, int]:
+        """returns the hits and misses counted so far and resets them"""
+        stats = (self.hits, self.misses)
+        self.hits = 0
+        self.misses = 0
+        return stats
@@ -0,0 +1,220 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import math
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+MASK_64 = (1 << 64) - 1
+
+
+class DistinctCounter:
+    """
+    Counts the distinct items added to it, e.g. the distinct dst IPs a
+    profile contacted on a port in a timewindow.
+
+    The items are kept in a set until there are more than exact_limit of
+    them, then the set is replaced by a HyperLogLog sketch of
+    2**precision one byte registers, so the memory used by a counter
+    stays bounded no matter how many items are added to it. The count is
+    exact up to exact_limit, and has a standard error of about
+    1.04 / sqrt(2**precision) after it, 1.6% with the default precision.
+
+    Adding an item and getting the count are O(1), the estimate of the
+    sketch is updated as the registers change instead of being
+    recomputed from all of them.
+
+    Items are hashed with hash(), so counters can't be compared across
+    processes.
+    """
+
+    def __init__(self, exact_limit: int = 256, precision: int = 12):
+        self.exact_limit = exact_limit
+        self.precision = precision
+        self.items: Optional[Set[str]] = set()
+        self.registers: Optional[bytearray] = None
+        # sum(2 ** -register) and the number of registers that are 0,
+        # both are needed by the estimate
+        self.inverse_sum = 0.0
+        self.zeros = 0
+
+    @property
+    def is_exact(self) -> bool:
+        return self.registers is None
+
+    def add(self, item: str) -> bool:
+        """
+        returns True if the item changed the count, False if it was
+        already counted. once the counter isn't exact, an item that
+        wasn't seen before may return False too
+        """
+        if self.registers is not None:
+            return self._add_to_sketch(item)
+
+        if item in self.items:
+            return False
+        self.items.add(item)
+        if len(self.items) > self.exact_limit:
+            self._switch_to_sketch()
+        return True
+
+    def _switch_to_sketch(self):
+        registers_count = 1 << self.precision
+        self.registers = bytearray(registers_count)
+        self.inverse_sum = float(registers_count)
+        self.zeros = registers_count
+        items, self.items = self.items, None
+        for item in items:
+            self._add_to_sketch(item)
+
+    def get_register(self, item: str) -> Tuple[int, int]:
+        """returns the index of the register of the given item and its
+        rank"""
+        hashed = hash(item) & MASK_64
+        # the first bits of the hash choose the register, the rest are
+        # used to get the rank
+        index = hashed >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        rest = hashed & ((1 << remaining_bits) - 1)
+        # position of the leftmost 1 in the rest of the hash
+        rank = remaining_bits - rest.bit_length() + 1
+        return index, rank
+
+    def _add_to_sketch(self, item: str) -> bool:
+        index, rank = self.get_register(item)
+        old_rank = self.registers[index]
+        if rank <= old_rank:
+            return False
+
+        self.registers[index] = rank
+        self.inverse_sum += 2.0**-rank - 2.0**-old_rank
+        if old_rank == 0:
+            self.zeros -= 1
+        return True
+
+    def __len__(self) -> int:
+        if self.registers is None:
+            return len(self.items)
+        return self._estimate()
+
+    def _estimate(self) -> int:
+        estimate = estimate_cardinality(
+            len(self.registers), self.inverse_sum, self.zeros
+        )
+        # never report less than what we counted exactly before switching
+        return max(estimate, self.exact_limit + 1)
+
+
+def estimate_cardinality(
+    registers_count: int, inverse_sum: float, zeros: int
+) -> int:
+    """
+    the HyperLogLog estimate of a sketch with the given registers
+    :param inverse_sum: sum(2 ** -register)
+    :param zeros: number of registers that are 0
+    """
+    alpha = 0.7213 / (1 + 1.079 / registers_count)
+    estimate = alpha * registers_count**2 / inverse_sum
+    if estimate <= 2.5 * registers_count and zeros:
+        # small range correction, linear counting is more accurate
+        # when many registers are still empty
+        estimate = registers_count * math.log(registers_count / zeros)
+    return int(round(estimate))
+
+
+def count_union(counters: Iterable[DistinctCounter]) -> int:
+    """
+    returns the number of distinct items added to any of the given
+    counters. all of them must have the same precision.
+    it's O(number of counters * 2**precision) once any of them isn't
+    exact, so it's meant to be called once in a while, not per item
+    """
+    counters = list(counters)
+    sketches = [counter for counter in counters if not counter.is_exact]
+    if not sketches:
+        return len(set().union(*(counter.items for counter in counters)))
+
+    precision = sketches[0].precision
+    registers = bytearray(1 << precision)
+    for sketch in sketches:
+        if sketch.precision != precision:
+            raise ValueError(
+                "can't count the union of counters with different precisions"
+            )
+        registers = bytearray(map(max, registers, sketch.registers))
+
+    for counter in counters:
+        if not counter.is_exact:
+            continue
+        for item in counter.items:
+            index, rank = sketches[0].get_register(item)
+            if rank > registers[index]:
+                registers[index] = rank
+
+    inverse_sum = sum(2.0**-register for register in registers)
+    estimate = estimate_cardinality(
+        len(registers), inverse_sum, registers.count(0)
+    )
+    # the union can't be smaller than any of the counters
+    return max(estimate, *(len(counter) for counter in sketches))
+
+
+class SlidingDistinctCounter:
+    """
+    Counts the distinct items added in the last given number of windows,
+    e.g. the distinct dst ports a profile contacted in the last 24
+    timewindows.
+
+    Every window has its own DistinctCounter, and the windows that are
+    older than the newest one - windows + 1 are dropped as new ones are
+    added, so the memory used is at most windows * the memory of a
+    DistinctCounter, windows * max(exact_limit items,
+    2**precision bytes).
+    """
+
+    def __init__(
+        self, windows: int, exact_limit: int = 64, precision: int = 10
+    ):
+        self.windows = windows
+        self.exact_limit = exact_limit
+        self.precision = precision
+        # {window number: DistinctCounter}
+        self.counters: Dict[int, DistinctCounter] = {}
+        self.newest_window: Optional[int] = None
+
+    def add(self, window: int, item: str) -> bool:
+        """
+        adds the item to the given window. items of windows older than the
+        ones kept are ignored
+        """
+        if self.newest_window is None or window > self.newest_window:
+            self.slide(window)
+        elif window <= self.newest_window - self.windows:
+            return False
+
+        if window not in self.counters:
+            self.counters[window] = DistinctCounter(
+                exact_limit=self.exact_limit, precision=self.precision
+            )
+        return self.counters[window].add(item)
+
+    def slide(self, newest_window: int):
+        """drops the windows that are too old to be kept once the given
+        window is the newest one"""
+        self.newest_window = newest_window
+        oldest_window = newest_window - self.windows + 1
+        for window in list(self.counters):
+            if window < oldest_window:
+                del self.counters[window]
+
+    def get_window_counts(self) -> List[int]:
+        """returns the number of distinct items of each window kept"""
+        return [len(counter) for counter in self.counters.values()]
+
+    def __len__(self) -> int:
+        return count_union(self.counters.values())
@@ -0,0 +1,308 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import mmap
+import os
+import struct
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+# layout of the snapshot file
+# [header][section table][per section index][keys and values]
+# keys of each section are sorted, so lookups are binary searches
+# directly on the mapped bytes, nothing is parsed when mapping the file.
+MAGIC = b"SLIPSTI1"
+# magic, number of sections
+HEADER = struct.Struct("<8sI")
+# section name, generation, number of entries, offset of the index
+SECTION = struct.Struct("<16sQIQ")
+# key offset, key length, value offset, value length
+ENTRY = struct.Struct("<QIQI")
+# value of the iocs deleted from the cache db after the snapshot was
+# published, in the overlay of their section. see TISnapshotOverlay
+DELETED = ""
+
+
+class TISnapshotWriter:
+    """
+    Compiles the IoCs loaded in the cache db into one read-only file that
+    all slips processes can mmap and share.
+    """
+
+    @staticmethod
+    def _encode_section(entries: Dict[str, str]) -> List[Tuple[bytes, bytes]]:
+        """
+        returns the sorted (key, value) pairs of the given section as bytes
+        """
+        return sorted(
+            (str(key).encode(), str(value).encode())
+            for key, value in entries.items()
+        )
+
+    def write(
+        self,
+        path: str,
+        sections: Dict[str, Dict[str, str]],
+        generations: Dict[str, int],
+    ):
+        """
+        writes the given sections to path.
+        the file is written to a temp file first then renamed, so readers
+        either see the old snapshot or the new one, never a partial one.
+        :param sections: {section_name: {ioc: json description}}
+        :param generations: {section_name: generation of the section
+        in the cache db when it was read}
+        """
+        encoded_sections = {
+            name: self._encode_section(entries)
+            for name, entries in sections.items()
+        }
+
+        offset = HEADER.size + SECTION.size * len(encoded_sections)
+        section_table = bytearray()
+        indices = bytearray()
+        # the data region starts after all indices
+        data_offset = offset + sum(
+            ENTRY.size * len(entries) for entries in encoded_sections.values()
+        )
+        data = bytearray()
+        for name, entries in encoded_sections.items():
+            section_table += SECTION.pack(
+                name.encode(),
+                int(generations.get(name, 0)),
+                len(entries),
+                offset + len(indices),
+            )
+            for key, value in entries:
+                key_offset = data_offset + len(data)
+                data += key
+                value_offset = data_offset + len(data)
+                data += value
+                indices += ENTRY.pack(
+                    key_offset, len(key), value_offset, len(value)
+                )
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as snapshot:
+            snapshot.write(HEADER.pack(MAGIC, len(encoded_sections)))
+            snapshot.write(section_table)
+            snapshot.write(indices)
+            snapshot.write(data)
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(tmp_path, path)
+
+
+class TISnapshot:
+    """
+    Read-only view of the snapshot written by TISnapshotWriter.
+    The file is mmapped, so all processes reading it share the same
+    physical pages. Call reload_if_changed() to switch to a newer
+    published snapshot without restarting.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mapped = None
+        # (inode, mtime) of the currently mapped file
+        self.file_id = None
+        # {section_name: (generation, number of entries, index offset)}
+        self.sections = {}
+
+    def is_loaded(self) -> bool:
+        return self.mapped is not None
+
+    def _get_file_id(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def reload_if_changed(self) -> bool:
+        """
+        maps the published snapshot if it's newer than the one we have.
+        returns True if a new snapshot was mapped
+        """
+        file_id = self._get_file_id()
+        if file_id is None or file_id == self.file_id:
+            return False
+
+        try:
+            with open(self.path, "rb") as snapshot:
+                mapped = mmap.mmap(
+                    snapshot.fileno(), 0, access=mmap.ACCESS_READ
+                )
+        except (FileNotFoundError, ValueError):
+            # deleted between stat and open, or an empty file
+            return False
+
+        try:
+            sections = self._read_sections(mapped)
+        except (struct.error, UnicodeDecodeError):
+            # truncated or half-written snapshot, keep the one we have
+            sections = None
+        if sections is None:
+            mapped.close()
+            return False
+
+        self.close()
+        self.mapped = mapped
+        self.sections = sections
+        self.file_id = file_id
+        return True
+
+    @staticmethod
+    def _read_sections(mapped) -> Optional[Dict[str, Tuple[int, int, int]]]:
+        """
+        returns the section table of the given mapped snapshot, or None
+        if it's not a snapshot.
+        raises struct.error if the file is truncated
+        """
+        magic, sections_number = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC:
+            return None
+
+        sections = {}
+        for i in range(sections_number):
+            name, generation, count, index_offset = SECTION.unpack_from(
+                mapped, HEADER.size + i * SECTION.size
+            )
+            if index_offset + count * ENTRY.size > len(mapped):
+                raise struct.error(f"the index of {name} is truncated")
+            name = name.rstrip(b"\x00").decode()
+            sections[name] = (generation, count, index_offset)
+        return sections
+
+    def close(self):
+        if self.mapped is not None:
+            self.mapped.close()
+        self.mapped = None
+        self.file_id = None
+        self.sections = {}
+
+    def get_generation(self, section: str) -> Optional[int]:
+        """returns the generation of the given section or None if the
+        snapshot doesn't have it"""
+        if section not in self.sections:
+            return None
+        return self.sections[section][0]
+
+    def _get_entry(self, index_offset: int, i: int) -> Tuple[int, ...]:
+        return ENTRY.unpack_from(self.mapped, index_offset + i * ENTRY.size)
+
+    def get(self, section: str, key: str) -> Optional[str]:
+        """
+        returns the description of the given key in the given section,
+        or None if not found
+        """
+        if self.mapped is None or section not in self.sections:
+            return None
+
+        _, count, index_offset = self.sections[section]
+        key = key.encode()
+        low, high = 0, count
+        while low < high:
+            mid = (low + high) // 2
+            key_offset, key_len, value_offset, value_len = self._get_entry(
+                index_offset, mid
+            )
+            current = self.mapped[key_offset : key_offset + key_len]
+            if current == key:
+                return self.mapped[
+                    value_offset : value_offset + value_len
+                ].decode()
+            if current < key:
+                low = mid + 1
+            else:
+                high = mid
+        return None
+
+    def match_domain(self, domain: str) -> Optional[str]:
+        """
+        returns the description of the given domain or of the shortest
+        blacklisted domain it's a subdomain of.
+        matches the same entries Trie.search() does.
+        """
+        parts = domain.split(".")
+        # start from the tld, same as the trie
+        for i in range(len(parts) - 1, -1, -1):
+            if info := self.get("domains", ".".join(parts[i:])):
+                return info
+        return None
+
+    def keys(self, section: str) -> Iterator[str]:
+        """yields all the keys of the given section without their
+        descriptions"""
+        if self.mapped is None or section not in self.sections:
+            return
+
+        _, count, index_offset = self.sections[section]
+        for i in range(count):
+            key_offset, key_len, _, _ = self._get_entry(index_offset, i)
+            yield self.mapped[key_offset : key_offset + key_len].decode()
+
+    def items(self, section: str) -> Iterator[Tuple[str, str]]:
+        """yields all (key, description) pairs of the given section"""
+        if self.mapped is None or section not in self.sections:
+            return
+
+        _, count, index_offset = self.sections[section]
+        for i in range(count):
+            key_offset, key_len, value_offset, value_len = self._get_entry(
+                index_offset, i
+            )
+            yield (
+                self.mapped[key_offset : key_offset + key_len].decode(),
+                self.mapped[value_offset : value_offset + value_len].decode(),
+            )
+
+
+class TISnapshotOverlay:
+    """
+    A section of a TISnapshot with the changes made to it in the cache
+    db after it was published on top.
+    Has the same lookup methods as TISnapshot, so lookups keep using the
+    snapshot after a few iocs are added or deleted, until a new snapshot
+    is published.
+    """
+
+    def __init__(
+        self, snapshot: TISnapshot, section: str, changes: Dict[str, str]
+    ):
+        """
+        :param changes: {ioc: its new description, or DELETED}
+        """
+        self.snapshot = snapshot
+        self.section = section
+        self.changes = changes
+
+    def get(self, section: str, key: str) -> Optional[str]:
+        if section == self.section and key in self.changes:
+            return self.changes[key] or None
+        return self.snapshot.get(section, key)
+
+    def match_domain(self, domain: str) -> Optional[str]:
+        """same as TISnapshot.match_domain() with the changes on top"""
+        parts = domain.split(".")
+        for i in range(len(parts) - 1, -1, -1):
+            if info := self.get("domains", ".".join(parts[i:])):
+                return info
+        return None
+
+    def keys(self, section: str) -> Iterator[str]:
+        for key in self.snapshot.keys(section):
+            if section != self.section or key not in self.changes:
+                yield key
+        if section == self.section:
+            for key, description in self.changes.items():
+                if description != DELETED:
+                    yield key
+
+    def items(self, section: str) -> Iterator[Tuple[str, str]]:
+        for key in self.keys(section):
+            yield key, self.get(section, key)
@@ -0,0 +1,228 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+from collections import Counter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+# (tick it's due at, name of the check, args of the check)
+Record = Tuple[int, str, tuple]
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel for checks that have to run some time after
+    a flow is seen, e.g. to give the dns resolution of a conn time to
+    arrive.
+
+    Instead of having one sleeping asyncio task per flow, every delayed
+    check is kept as a small (due tick, check name, args) record in the
+    slot of the wheel it's due in, and all the checks due at once are run
+    in one batch by run_due().
+
+    The clock of the wheel is whatever the caller passes as now, wall
+    time or zeek time, in seconds. Due times are rounded up to the given
+    resolution.
+    Level 0 has one slot per tick, every other level has one slot per
+    full turn of the level below it. Checks in higher levels are moved
+    down when their slot is reached.
+
+    The wheel starts at the first now given to pop_due(), checks
+    scheduled before that are kept aside and inserted then.
+
+    At most max_pending checks are kept, new ones are dropped once the
+    wheel is full so memory stays bounded on busy links.
+    """
+
+    def __init__(
+        self,
+        resolution: float = 1,
+        wheel_sizes: Tuple[int, ...] = (64, 64, 64),
+        max_pending: int = 100000,
+    ):
+        self.resolution = resolution
+        self.wheel_sizes = wheel_sizes
+        self.max_pending = max_pending
+        # number of ticks a slot of each level spans
+        self.spans: List[int] = []
+        span = 1
+        for size in wheel_sizes:
+            self.spans.append(span)
+            span *= size
+        # checks due after the last level
+        self.total_span = span
+        self.wheels: List[List[List[Record]]] = [
+            [[] for _ in range(size)] for size in wheel_sizes
+        ]
+        # checks due after the last level, and the ones scheduled before
+        # the clock of the wheel is known
+        self.overflow: List[Record] = []
+        # checks that were already due when they were scheduled
+        self.expired: List[Record] = []
+        # the last tick we advanced to
+        self.current_tick: Optional[int] = None
+        self.checks: Dict[str, Callable] = {}
+        self.pending = Counter()
+        self.dropped = Counter()
+        self.ran = Counter()
+
+    def register(self, name: str, check: Callable[..., Any]):
+        """the check is called with the args given to schedule()"""
+        self.checks[name] = check
+
+    def to_tick(self, ts: float) -> int:
+        # round up, checks never run before they're due
+        return -int(-float(ts) // self.resolution)
+
+    def __len__(self):
+        return sum(self.pending.values())
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {
+                "pending": self.pending[name],
+                "dropped": self.dropped[name],
+                "ran": self.ran[name],
+            }
+            for name in self.checks
+        }
+
+    def schedule(self, name: str, due: float, *args) -> bool:
+        """
+        schedules the check registered with the given name to be run with
+        the given args once the clock reaches due.
+        returns False if the check was dropped because the wheel is full
+        """
+        if len(self) >= self.max_pending:
+            self.dropped[name] += 1
+            return False
+
+        record = (self.to_tick(due), name, args)
+        self.pending[name] += 1
+        if self.current_tick is None:
+            # we don't know where the wheel is yet, the due time of this
+            # check tells us nothing about the time of the next ones
+            self.overflow.append(record)
+        else:
+            self._insert(record)
+        return True
+
+    def _insert(self, record: Record):
+        due_tick = record[0]
+        if due_tick <= self.current_tick:
+            self.expired.append(record)
+            return
+
+        for level, size in enumerate(self.wheel_sizes):
+            # the span of a full turn of this level
+            turn = self.spans[level] * size
+            if due_tick // turn == self.current_tick // turn:
+                slot = (due_tick // self.spans[level]) % size
+                self.wheels[level][slot].append(record)
+                return
+
+        self.overflow.append(record)
+
+    def _cascade(self, tick: int):
+        """moves the checks of the slots reached at the given tick one
+        level down"""
+        if tick % self.total_span == 0:
+            records, self.overflow = self.overflow, []
+            for record in records:
+                self._insert(record)
+
+        for level in range(len(self.wheel_sizes) - 1, 0, -1):
+            span = self.spans[level]
+            if tick % span:
+                continue
+            slot = (tick // span) % self.wheel_sizes[level]
+            records = self.wheels[level][slot]
+            self.wheels[level][slot] = []
+            for record in records:
+                self._insert(record)
+
+    def _pop_all_records(self) -> List[Record]:
+        records = self.expired + self.overflow
+        self.expired, self.overflow = [], []
+        for wheel in self.wheels:
+            for slot, slot_records in enumerate(wheel):
+                if slot_records:
+                    records.extend(slot_records)
+                    wheel[slot] = []
+        return records
+
+    def pop_due(self, now: float) -> List[Tuple[str, tuple]]:
+        """
+        advances the clock of the wheel to now and returns the checks that
+        are due as (name, args), without running them. they're counted as
+        ran in the stats
+        """
+        now_tick = int(float(now) // self.resolution)
+        if self.current_tick is None:
+            self.current_tick = now_tick
+            records, self.overflow = self.overflow, []
+            for record in records:
+                self._insert(record)
+        if now_tick <= self.current_tick and not self.expired:
+            return []
+
+        due: List[Record] = self.expired
+        self.expired = []
+        ticks_to_advance = now_tick - self.current_tick
+        if ticks_to_advance > len(self):
+            # the clock jumped, e.g. zeek time after a gap in the traffic.
+            # cheaper to re-insert everything than to walk every tick
+            records = self._pop_all_records() + due
+            due = []
+            self.current_tick = max(now_tick, self.current_tick)
+            for record in records:
+                self._insert(record)
+            due, self.expired = self.expired, []
+        else:
+            first_slots = self.wheels[0]
+            size = self.wheel_sizes[0]
+            for tick in range(self.current_tick + 1, now_tick + 1):
+                self.current_tick = tick
+                self._cascade(tick)
+                slot = tick % size
+                if first_slots[slot]:
+                    due.extend(first_slots[slot])
+                    first_slots[slot] = []
+            # checks that were moved down to the current tick while
+            # cascading
+            due.extend(self.expired)
+            self.expired = []
+
+        for _, name, _ in due:
+            self.pending[name] -= 1
+            self.ran[name] += 1
+        return [(name, args) for _, name, args in due]
+
+    def pop_all(self) -> List[Tuple[str, tuple]]:
+        """returns all the pending checks, due or not. used before
+        stopping slips to not lose them"""
+        records = self._pop_all_records()
+        self.pending.clear()
+        self.ran.update(name for _, name, _ in records)
+        records.sort(key=lambda record: record[0])
+        return [(name, args) for _, name, args in records]
+
+    def _run(self, checks: List[Tuple[str, tuple]]) -> int:
+        for name, args in checks:
+            self.checks[name](*args)
+        return len(checks)
+
+    def run_due(self, now: float) -> int:
+        """runs the checks that are due at the given time. returns how
+        many ran"""
+        return self._run(self.pop_due(now))
+
+    def run_all(self) -> int:
+        """runs all the pending checks without waiting for them to be
+        due"""
+        return self._run(self.pop_all())
@@ -7,6 +7,16 @@
 
 import math
 import sys
+from itertools import chain
+from typing import (
+    Dict,
+    Hashable,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import numpy as np
 
 
 class Matrix(dict):
@@ -63,57 +73,167 @@ class Matrix(dict):
             sys.exit(-1)
 
 
-def maximum_likelihood_probabilities(states, order=1):
-    """Our own second order Markov Chain implementation"""
-    initial_matrix = {}
-    total_transitions = 0
-    # print 'Receiving {} states to compute the Markov Matrix of {} order'.format(amount_of_states, order)
-    # 1st order
-    if order == 1:
-        # Create matrix
-        index = 0
-        initial_vector = {}
-        amount_of_states = len(states)
-        while index < amount_of_states:
-            state1 = states[index]
-            try:
-                state2 = states[index + 1]
-            except IndexError:
-                # The last state is alone. There is no transaction, forget about it.
-                break
-            try:
-                initial_matrix[state1]
-            except KeyError:
-                # First time there is a transition FROM state1
-                initial_matrix[state1] = {}
-                initial_vector[state1] = 0
-            try:
-                value = initial_matrix[state1][state2]
-                initial_matrix[state1][state2] = value + 1
-            except KeyError:
-                # First time there is a transition FROM state 1 to state2
-                initial_matrix[state1][state2] = 1
-            initial_vector[state1] += 1
-            total_transitions += 1
-            # Move along
-            index += 1
-        # Normalize using the initial vector
-        matrix = Matrix()
-        init_vector = {}
-        for state1 in initial_matrix:
-            # Create the init vector
-            init_vector[state1] = initial_vector[state1] / float(
-                total_transitions
+class TransitionMatrix:
+    """
+    A first order markov chain stored as numpy arrays, to score many
+    sequences of states at once.
+
+    The states are encoded to the indices of the rows and columns of the
+    matrix of the probabilities of each transition. The last row and
+    column are for the states that aren't in the matrix, all their
+    transitions are impossible.
+    """
+
+    def __init__(self, states: Sequence, probs: np.ndarray):
+        """
+        :param states: the known states, in the order of the rows of
+            probs
+        :param probs: (len(states) + 1) x (len(states) + 1) matrix of
+            the probability of going from the state of each row to the
+            state of each column
+        """
+        self.states = list(states)
+        self.state_indices: Dict[Hashable, int] = {
+            state: index for index, state in enumerate(self.states)
+        }
+        self.probs = probs
+        with np.errstate(divide="ignore"):
+            self.log_probs = np.log(probs)
+        self.unknown_state = len(self.states)
+        # strings of single char states, like the behavioral letters, are
+        # encoded with a table of the index of each code point instead of
+        # a dict lookup per state
+        self.char_table: Optional[np.ndarray] = None
+        if self.states and all(
+            isinstance(state, str) and len(state) == 1 and ord(state) < 65536
+            for state in self.states
+        ):
+            codes = [ord(state) for state in self.states]
+            # the last item is for all the chars after the known ones
+            self.char_table = np.full(
+                max(codes) + 2, self.unknown_state, dtype=np.int64
             )
-            for state2 in initial_matrix[state1]:
-                value = initial_matrix[state1][state2]
-                initial_matrix[state1][state2] = value / float(
-                    initial_vector[state1]
+            self.char_table[codes] = np.arange(len(codes))
+
+    @classmethod
+    def from_matrix(cls, matrix: Matrix) -> "TransitionMatrix":
+        """converts a Matrix of {(state1, state2): probability}"""
+        states = list(dict.fromkeys(chain.from_iterable(matrix)))
+        state_indices = {state: index for index, state in enumerate(states)}
+        probs = np.zeros((len(states) + 1, len(states) + 1))
+        for (state1, state2), prob in matrix.items():
+            probs[state_indices[state1], state_indices[state2]] = prob
+        return cls(states, probs)
+
+    @classmethod
+    def from_states(
+        cls, states: Sequence
+    ) -> Tuple["TransitionMatrix", np.ndarray]:
+        """
+        Computes the maximum likelihood probabilities of the transitions
+        between the given states, like maximum_likelihood_probabilities().
+        Returns the matrix and the init vector, the fraction of the
+        transitions that start in each state
+        """
+        known_states = list(dict.fromkeys(states))
+        state_indices = {
+            state: index for index, state in enumerate(known_states)
+        }
+        encoded = np.fromiter(
+            (state_indices[state] for state in states),
+            dtype=np.int64,
+            count=len(states),
+        )
+        transitions = np.zeros((len(known_states) + 1,) * 2)
+        np.add.at(transitions, (encoded[:-1], encoded[1:]), 1)
+
+        transitions_from = transitions.sum(axis=1)
+        total_transitions = transitions_from.sum()
+        init_vector = (
+            transitions_from / total_transitions
+            if total_transitions
+            else transitions_from
+        )
+        # states without transitions from them keep all their probs at 0
+        probs = np.divide(
+            transitions,
+            transitions_from[:, np.newaxis],
+            out=np.zeros_like(transitions),
+            where=transitions_from[:, np.newaxis] > 0,
+        )
+        return cls(known_states, probs), init_vector
+
+    def to_matrix(self) -> Matrix:
+        """converts back to a Matrix with only the possible transitions"""
+        rows, columns = np.nonzero(self.probs)
+        return Matrix(
+            {
+                (self.states[row], self.states[column]): float(
+                    self.probs[row, column]
                 )
-                # Change the style of the matrix
-                matrix[(state1, state2)] = initial_matrix[state1][state2]
-        matrix.set_init_vector(init_vector)
-        # print init_vector
-        # for value in matrix:
-        #    print value, matrix[value]
+                for row, column in zip(rows, columns)
+            }
+        )
+
+    def encode(self, states: Sequence) -> np.ndarray:
+        """returns the index of each of the given states"""
+        if self.char_table is not None and isinstance(states, str):
+            codes = np.frombuffer(states.encode("utf-32-le"), dtype=np.uint32)
+            return self.char_table[np.minimum(codes, len(self.char_table) - 1)]
+        return np.fromiter(
+            (
+                self.state_indices.get(state, self.unknown_state)
+                for state in states
+            ),
+            dtype=np.int64,
+            count=len(states),
+        )
+
+    def walk_probabilities(self, sequences: Sequence[Sequence]) -> np.ndarray:
+        """
+        Returns the log probability of generating each of the given
+        sequences of states, like Matrix.walk_probability() does for one
+        of them.
+        All the transitions of all the sequences are looked up at once,
+        so it's much faster for many sequences
+        """
+        lengths = np.fromiter(
+            (len(states) for states in sequences),
+            dtype=np.int64,
+            count=len(sequences),
+        )
+        if self.char_table is not None and all(
+            isinstance(states, str) for states in sequences
+        ):
+            encoded = self.encode("".join(sequences))
+        else:
+            encoded = self.encode(list(chain.from_iterable(sequences)))
+
+        # the sequence of each state, transitions between the last state
+        # of a sequence and the first one of the next one are ignored
+        sequence_ids = np.repeat(np.arange(len(sequences)), lengths)
+        same_sequence = sequence_ids[:-1] == sequence_ids[1:]
+        log_probs = self.log_probs[
+            encoded[:-1][same_sequence], encoded[1:][same_sequence]
+        ]
+        return np.bincount(
+            sequence_ids[:-1][same_sequence],
+            weights=log_probs,
+            minlength=len(sequences),
+        )
+
+
+def maximum_likelihood_probabilities(states, order=1):
+    """Our own second order Markov Chain implementation"""
+    if order != 1:
+        raise ValueError("Only first order markov chains are supported")
+
+    transition_matrix, init_vector = TransitionMatrix.from_states(states)
+    matrix = transition_matrix.to_matrix()
+    init_vector = {
+        state: float(init_vector[index])
+        for index, state in enumerate(transition_matrix.states)
+        if init_vector[index]
+    }
+    matrix.set_init_vector(init_vector)
     return (init_vector, matrix)
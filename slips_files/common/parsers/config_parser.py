@@ -1,6 +1,7 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
 from datetime import timedelta
+import os
 import sys
 import ipaddress
 from typing import (
@@ -152,15 +153,17 @@ class ConfigParser(object):
             "parameters", "export_labeled_flows", False
         )
 
+    def compress_flows(self) -> bool:
+        return self.read_configuration("parameters", "compress_flows", False)
+
     def export_labeled_flows_to(self):
         export = self.read_configuration(
             "parameters", "export_format", "None"
         ).lower()
-        if "tsv" in export:
-            return "tsv"
-        if "json" in export:
-            return "json"
-        return False
+        for format_ in ("tsv", "json", "parquet", "arrow"):
+            if format_ in export:
+                return format_
+        return "json"
 
     def rotation(self):
         return self.read_configuration("parameters", "rotation", True)
@@ -418,6 +421,17 @@ class ConfigParser(object):
     def get_ml_mode(self):
         return self.read_configuration("flowmldetection", "mode", "test")
 
+    def rnn_rescore_after_letters(self) -> int:
+        default_value = 3
+        letters = self.read_configuration(
+            "rnn_cc_detection", "rescore_after_letters", default_value
+        )
+        try:
+            letters = int(letters)
+        except ValueError:
+            letters = default_value
+        return max(letters, 1)
+
     def RiskIQ_credentials_path(self):
         return self.read_configuration(
             "threatintelligence", "RiskIQ_credentials_path", ""
@@ -443,6 +457,13 @@ class ConfigParser(object):
         )
         return utils.sanitize(path)
 
+    def ti_snapshot_path(self) -> str:
+        """
+        the IoCs loaded from all feeds are compiled into this file and
+        shared by all processes that do TI lookups
+        """
+        return os.path.join(self.remote_ti_data_path(), "ti_snapshot.bin")
+
     def ti_files(self):
         return self.read_configuration("threatintelligence", "ti_files", False)
 
@@ -486,6 +507,42 @@ class ConfigParser(object):
             update_period = 86400  # 1 day
         return update_period
 
+    def max_concurrent_feed_downloads(self) -> int:
+        max_downloads = self.read_configuration(
+            "threatintelligence", "max_concurrent_feed_downloads", 8
+        )
+        try:
+            return int(max_downloads)
+        except ValueError:
+            return 8
+
+    def max_feed_downloads_per_host(self) -> int:
+        max_downloads = self.read_configuration(
+            "threatintelligence", "max_feed_downloads_per_host", 2
+        )
+        try:
+            return int(max_downloads)
+        except ValueError:
+            return 2
+
+    def max_concurrent_online_lookups(self) -> int:
+        max_lookups = self.read_configuration(
+            "threatintelligence", "max_concurrent_online_lookups", 16
+        )
+        try:
+            return int(max_lookups)
+        except ValueError:
+            return 16
+
+    def online_lookups_cache_ttl(self) -> int:
+        ttl = self.read_configuration(
+            "threatintelligence", "online_lookups_cache_ttl", 86400
+        )
+        try:
+            return int(ttl)
+        except ValueError:
+            return 86400
+
     def vt_api_key_file(self):
         return self.read_configuration("virustotal", "api_key_file", None)
 
@@ -560,6 +617,42 @@ class ConfigParser(object):
         client_ips: List = [self.parse_ip(ip) for ip in client_ips]
         return client_ips
 
+    def conn_flows_cache_size(self) -> int:
+        size = self.read_configuration(
+            "parameters", "conn_flows_cache_size", 100000
+        )
+        try:
+            return max(1, int(size))
+        except ValueError:
+            return 100000
+
+    def conn_flows_cache_ttl(self) -> int:
+        ttl = self.read_configuration(
+            "parameters", "conn_flows_cache_ttl", 600
+        )
+        try:
+            return int(ttl)
+        except ValueError:
+            return 600
+
+    def max_logfile_size(self) -> int:
+        """
+        returns the size in bytes after which slips.log and errors.log
+        are rotated. 0 means they're never rotated
+        """
+        size = self.read_configuration("parameters", "max_logfile_size", 0)
+        try:
+            return max(0, int(float(size) * 1024 * 1024))
+        except ValueError:
+            return 0
+
+    def logfile_backups(self) -> int:
+        backups = self.read_configuration("parameters", "logfile_backups", 3)
+        try:
+            return max(1, int(backups))
+        except ValueError:
+            return 3
+
     def keep_rotated_files_for(self) -> int:
         """returns period in seconds"""
         keep_rotated_files_for = self.read_configuration(
@@ -1,5 +1,11 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
+from typing import (
+    Any,
+    Callable,
+    Union,
+)
+
 from slips_files.common.abstracts.iobserver import IObservable
 from slips_files.core.output import Output
 
@@ -50,3 +56,52 @@ class Printer(IObservable):
                 "end": end,
             }
         )
+
+    def is_enabled(
+        self, verbose=1, debug=0, log_to_logfiles_only=False
+    ) -> bool:
+        """
+        returns True if a msg with the given levels would be printed or
+        logged by the output, using the verbose and debug levels slips was
+        started with
+        """
+        if log_to_logfiles_only or debug == 1:
+            # these are always logged to slips.log or errors.log
+            return True
+        return self.logger.enough_verbose(verbose) or self.logger.enough_debug(
+            debug
+        )
+
+    def lazy_print(
+        self,
+        text: Union[str, Callable[[], Any]],
+        *args,
+        verbose=1,
+        debug=0,
+        log_to_logfiles_only=False,
+        end="\n",
+    ):
+        """
+        Same as print(), but the text is only formatted if the given
+        verbose and debug levels are enough for it to be printed or logged.
+        Meant for hot paths where most msgs are discarded.
+        :param text: either a %-style format string that is formatted
+        using the given args, or a function that returns the text.
+        e.g. lazy_print("Prev Data: %s", prev_symbols, verbose=3)
+        or lazy_print(lambda: json.dumps(data), verbose=3)
+        """
+        if not self.is_enabled(verbose, debug, log_to_logfiles_only):
+            return
+
+        if callable(text):
+            text = text()
+        elif args:
+            text = text % args
+
+        self.print(
+            text,
+            verbose,
+            debug,
+            log_to_logfiles_only=log_to_logfiles_only,
+            end=end,
+        )
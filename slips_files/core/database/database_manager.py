@@ -1,20 +1,32 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
+import json
 import os
 from pathlib import Path
 from typing import (
     List,
     Dict,
+    Optional,
 )
 
 from modules.p2ptrust.trust.trustdb import TrustDB
+from slips_files.common.data_structures.conn_flows_cache import (
+    ConnFlowsCache,
+)
 from slips_files.common.printer import Printer
 from slips_files.common.slips_utils import utils
 from slips_files.core.database.redis_db.database import RedisDB
-from slips_files.core.database.sqlite_db.database import SQLiteDB
+from slips_files.core.database.sqlite_db.database import (
+    SQLiteDB,
+    normalize_flow,
+)
+from slips_files.core.database.sqlite_db.labeled_flows_exporter import (
+    LabeledFlowsExporter,
+)
 from slips_files.common.parsers.config_parser import ConfigParser
 from slips_files.core.structures.evidence import Evidence
 from slips_files.core.structures.alerts import Alert
+from slips_files.core.structures.tw_features import TWFeatures
 from slips_files.core.output import Output
 
 
@@ -26,6 +38,9 @@ class DBManager:
     """
 
     name = "DBManager"
+    # the hits and misses of the conn flows cache are added to the db once
+    # every this many lookups
+    conn_flows_cache_stats_interval = 100
 
     def __init__(
         self,
@@ -45,6 +60,11 @@ class DBManager:
         self.rdb = RedisDB(
             self.logger, redis_port, start_redis_server, **kwargs
         )
+        # each process has its own cache, filled from the new_flow msgs
+        # it receives
+        self.conn_flows_cache = ConnFlowsCache(
+            self.rdb.conn_flows_cache_size, self.rdb.conn_flows_cache_ttl
+        )
 
         self.trust_db = None
         if self.conf.use_local_p2p():
@@ -60,7 +80,11 @@ class DBManager:
         # the existing one
         self.sqlite = None
         if start_sqlite:
-            self.sqlite = SQLiteDB(self.logger, output_dir)
+            self.sqlite = SQLiteDB(
+                self.logger,
+                output_dir,
+                compress_flows=self.conf.compress_flows(),
+            )
 
     def init_p2ptrust_db(self) -> str:
         """returns  the path of the trustdb inside the p2ptrust_runtime_dir"""
@@ -86,9 +110,6 @@ class DBManager:
     def get_sqlite_db_path(self) -> str:
         return self.sqlite.get_db_path()
 
-    def iterate_flows(self, *args, **kwargs):
-        return self.sqlite.iterate_flows(*args, **kwargs)
-
     def get_columns(self, *args, **kwargs):
         return self.sqlite.get_columns(*args, **kwargs)
 
@@ -589,6 +610,33 @@ class DBManager:
     def get_all_blacklisted_ja3(self, *args, **kwargs):
         return self.rdb.get_all_blacklisted_ja3(*args, **kwargs)
 
+    def is_blacklisted_ja3(self, *args, **kwargs):
+        return self.rdb.is_blacklisted_ja3(*args, **kwargs)
+
+    def get_blacklisted_ip_range_info(self, *args, **kwargs):
+        return self.rdb.get_blacklisted_ip_range_info(*args, **kwargs)
+
+    def publish_ti_snapshot(self, *args, **kwargs):
+        return self.rdb.publish_ti_snapshot(*args, **kwargs)
+
+    def get_cached_online_ti_result(self, *args, **kwargs):
+        return self.rdb.get_cached_online_ti_result(*args, **kwargs)
+
+    def cache_online_ti_result(self, *args, **kwargs):
+        return self.rdb.cache_online_ti_result(*args, **kwargs)
+
+    def start_staging_iocs(self, *args, **kwargs):
+        return self.rdb.start_staging_iocs(*args, **kwargs)
+
+    def promote_staged_iocs(self, *args, **kwargs):
+        return self.rdb.promote_staged_iocs(*args, **kwargs)
+
+    def discard_staged_iocs(self, *args, **kwargs):
+        return self.rdb.discard_staged_iocs(*args, **kwargs)
+
+    def get_ioc_generation(self, *args, **kwargs):
+        return self.rdb.get_ioc_generation(*args, **kwargs)
+
     def is_blacklisted_jarm(self, *args, **kwargs):
         return self.rdb.is_blacklisted_jarm(*args, **kwargs)
 
@@ -652,6 +700,9 @@ class DBManager:
     def get_msgs_published_in_channel(self, *args, **kwargs):
         return self.rdb.get_msgs_published_in_channel(*args, **kwargs)
 
+    def has_subscribers(self, *args, **kwargs):
+        return self.rdb.has_subscribers(*args, **kwargs)
+
     def get_dhcp_flows(self, *args, **kwargs):
         return self.rdb.get_dhcp_flows(*args, **kwargs)
 
@@ -688,6 +739,22 @@ class DBManager:
     def get_all_flows(self, *args, **kwargs):
         return self.sqlite.get_all_flows(*args, **kwargs)
 
+    def get_flows_after(self, *args, **kwargs):
+        return self.sqlite.get_flows_after(*args, **kwargs)
+
+    def set_tw_features(self, features: TWFeatures):
+        return self.sqlite.set_tw_features(
+            features.profileid, features.twid, features.to_bytes()
+        )
+
+    def get_tw_features(self, profileid, twid) -> Optional[TWFeatures]:
+        features: Optional[bytes] = self.sqlite.get_tw_features(
+            profileid, twid
+        )
+        if features is None:
+            return None
+        return TWFeatures.from_bytes(profileid, twid, features)
+
     def get_all_contacted_ips_in_profileid_twid(self, *args, **kwargs):
         """
         Get all the contacted IPs in a given profile and TW
@@ -877,6 +944,9 @@ class DBManager:
     def add_timeline_line(self, *args, **kwargs):
         return self.rdb.add_timeline_line(*args, **kwargs)
 
+    def add_timeline_lines(self, *args, **kwargs):
+        return self.rdb.add_timeline_lines(*args, **kwargs)
+
     def get_timeline_last_lines(self, *args, **kwargs):
         return self.rdb.get_timeline_last_lines(*args, **kwargs)
 
@@ -946,9 +1016,46 @@ class DBManager:
     def set_flow_label(self, *args, **kwargs):
         return self.sqlite.set_flow_label(*args, **kwargs)
 
-    def get_flow(self, *args, **kwargs):
-        """returns the raw flow as read from the log file"""
-        return self.sqlite.get_flow(*args, **kwargs)
+    def cache_conn_flow(self, flow: dict, twid: str):
+        """
+        keeps the given conn flow in the conn flows cache of this process
+        :param flow: the flow as sent in the new_flow channel
+        """
+        # cached the way sqlite returns it, so get_flow() returns
+        # the same flow whether it's cached or not
+        self.conn_flows_cache.add(
+            flow.get("uid"), twid, json.dumps(normalize_flow(flow))
+        )
+
+    def get_flow(self, uid: str, twid=False) -> dict:
+        """
+        returns the raw flow as read from the log file
+        the conn flows this process received in the new_flow channel are
+        read from its conn flows cache, the rest are read from sqlite
+        """
+        flow = self.conn_flows_cache.get(uid, twid=twid)
+        if (
+            self.conn_flows_cache.lookups
+            >= self.conn_flows_cache_stats_interval
+        ):
+            self.update_conn_flows_cache_stats()
+
+        if flow:
+            return {uid: flow}
+        return self.sqlite.get_flow(uid, twid=twid)
+
+    def get_conn_flows_cache_stats(self, *args, **kwargs):
+        return self.rdb.get_conn_flows_cache_stats(*args, **kwargs)
+
+    def update_conn_flows_cache_stats(self):
+        """
+        adds the hits and misses of the conn flows cache of this process
+        that weren't added yet to the ones of all processes in the db
+        """
+        if not self.conn_flows_cache.lookups:
+            return
+        hits, misses = self.conn_flows_cache.pop_stats()
+        self.rdb.update_conn_flows_cache_stats(hits, misses)
 
     def add_flow(self, flow, profileid: str, twid: str, label="benign"):
         # stores it in the db
@@ -1003,13 +1110,13 @@ class DBManager:
     def increment_attack_counter(self, *args, **kwargs):
         return self.rdb.increment_attack_counter(*args, **kwargs)
 
-    def export_labeled_flows(self, *args, **kwargs):
+    def export_labeled_flows(self, format_: str):
         """
         exports the labeled flows and altflows stored in sqlite
-        db to json or csv based on the config file
+        db to json, tsv, parquet or arrow based on the config file
         """
-        self.sqlite.export_labeled_flows(
-            self.get_output_dir(), *args, **kwargs
+        LabeledFlowsExporter(self.sqlite, self.get_output_dir()).export(
+            format_
         )
 
     def get_commit(self, *args, **kwargs):
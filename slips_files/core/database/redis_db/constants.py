@@ -13,6 +13,21 @@ class Constants:
     IOC_JA3 = "IoC_JA3"
     IOC_JARM = "IoC_JARM"
     IOC_SSL = "IoC_SSL"
+    # incremented on every change to one of the IoC_* keys above, used to
+    # know if the shared TI snapshot is still up to date
+    IOC_GENERATIONS = "IoC_generations"
+    # {section: its generation when the shared TI snapshot was published}
+    IOC_SNAPSHOT_GENERATIONS = "IoC_snapshot_generations"
+    # prefix of the keys holding the changes made to each section of the
+    # TI snapshot after it was published, and the generation each
+    # of them is up to date with
+    IOC_OVERLAY = "IoC_overlay"
+    IOC_OVERLAY_GENERATIONS = "IoC_overlay_generations"
+    # feeds whose old entries are deleted from the IoC_* keys once the
+    # iocs staged during a feeds update are promoted
+    IOC_STAGED_FEEDS = "IoC_staged_feeds"
+    # prefix of the keys caching the results of online TI lookups
+    ONLINE_TI_CACHE = "online_TI_cache"
     LABELED_AS_MALICIOUS = "labeled_as_malicious"
     # used to cache url info by the virustotal module only
     VT_CACHED_URL_INFO = "virustotal_cached_url_info"
@@ -29,7 +44,14 @@ class Constants:
     PASSIVE_DNS = "passiveDNS"
     # called for every ip in kalipso timeline
     DNS_RESOLUTION = "DNSresolution"
+    # {domain: [IPs]}, written by older versions of slips. only read for
+    # the dbs they saved
     DOMAINS_RESOLVED = "DomainsResolved"
+    # sorted set of {ip: ts of the last time it was resolved}
+    DNS_RESOLUTION_TIMES = "dns_resolution_times"
+    # prefix of the sorted sets of {ip: ts of the last time the domain
+    # resolved to it} of each domain
+    DOMAIN_RESOLUTIONS = "domain_resolutions"
     CACHED_ASN = "cached_asn"
     PIDS = "PIDs"
     MAC = "MAC"
@@ -69,6 +91,7 @@ class Constants:
     WILL_SLIPS_HAVE_MORE_FLOWS = "will_slips_have_more_flows"
     SUBS_WHO_PROCESSED_MSG = "number_of_subscribers_who_processed_this_msg"
     FLOWS_ANALYZED_BY_ALL_MODULES_PER_MIN = "flows_analyzed_per_minute"
+    CONN_FLOWS_CACHE_STATS = "conn_flows_cache_stats"
 
 
 class Channels:
@@ -54,6 +54,7 @@ class RedisDB(IoCHandler, AlertHandler, ProfileHandler, P2PHandler):
         "ip_info_change",
         "dns_info_change",
         "tw_closed",
+        "tw_features",
         "core_messages",
         "new_blocking",
         "new_ssh",
@@ -222,6 +223,9 @@ class RedisDB(IoCHandler, AlertHandler, ProfileHandler, P2PHandler):
         cls.disabled_detections: List[str] = conf.disabled_detections()
         cls.width = conf.get_tw_width_as_float()
         cls.client_ips: List[str] = conf.client_ips()
+        cls.ti_snapshot_path: str = conf.ti_snapshot_path()
+        cls.conn_flows_cache_size: int = conf.conn_flows_cache_size()
+        cls.conn_flows_cache_ttl: int = conf.conn_flows_cache_ttl()
 
     @classmethod
     def set_slips_internal_time(cls, timestamp):
@@ -407,6 +411,10 @@ class RedisDB(IoCHandler, AlertHandler, ProfileHandler, P2PHandler):
         """returns the number of msgs published in a channel"""
         return self.r.hget(self.constants.MSGS_PUBLISHED_AT_RUNTIME, channel)
 
+    def has_subscribers(self, channel: str) -> bool:
+        """returns True if any module is subscribed to the given channel"""
+        return self.r.pubsub_numsub(channel)[0][1] > 0
+
     def subscribe(self, channel: str, ignore_subscribe_messages=True):
         """Subscribe to channel"""
         # For when a TW is modified
@@ -611,6 +619,9 @@ class RedisDB(IoCHandler, AlertHandler, ProfileHandler, P2PHandler):
     def print(self, *args, **kwargs):
         return self.printer.print(*args, **kwargs)
 
+    def lazy_print(self, *args, **kwargs):
+        return self.printer.lazy_print(*args, **kwargs)
+
     def get_ip_info(self, ip: str) -> Optional[dict]:
         """
         Return information about this IP from IPsInfo key
@@ -852,28 +863,38 @@ class RedisDB(IoCHandler, AlertHandler, ProfileHandler, P2PHandler):
             return ip_info
         return {}
 
-    def is_ip_resolved(self, ip, hrs):
+    @staticmethod
+    def get_resolution_ts(ts) -> float:
+        return float(utils.convert_ts_format(ts, "unixtimestamp"))
+
+    def is_ip_resolved(self, ip, hrs, ts) -> bool:
         """
-        checks self.constants.DNS_RESOLUTION for the ip's resolutions
+        checks if the given ip was resolved in the past x hrs
         :param hrs: float, how many hours to look back for resolutions
+        :param ts: the ts to look back from, e.g. the ts of the flow we're
+        checking
         """
-        ip_info = self.get_dns_resolution(ip)
-        if ip_info == {}:
+        last_resolution: Optional[float] = self.r.zscore(
+            self.constants.DNS_RESOLUTION_TIMES, ip
+        )
+        if last_resolution is None:
             return False
 
-        # these are the tws this ip was resolved in
-        tws_where_ip_was_resolved = ip_info["timewindows"]
-
-        # IP is resolved, was it resolved in the past x hrs?
-        tws_to_search: int = self.get_equivalent_tws(hrs)
-
-        for tw_number in range(tws_to_search):
-            if f"timewindow{tw_number}" in tws_where_ip_was_resolved:
-                return True
-        return False
+        # resolutions that came after the given ts count too
+        return last_resolution >= self.get_resolution_ts(ts) - hrs * 3600
 
     def delete_dns_resolution(self, ip):
-        self.r.hdel(self.constants.DNS_RESOLUTION, ip)
+        """
+        deletes the resolutions of the given ip, and the ip from the
+        resolutions of the domains it was resolved by
+        """
+        domains = self.get_dns_resolution(ip).get("domains", [])
+        pipe = self.r.pipeline()
+        pipe.hdel(self.constants.DNS_RESOLUTION, ip)
+        pipe.zrem(self.constants.DNS_RESOLUTION_TIMES, ip)
+        for domain in domains:
+            pipe.zrem(self._get_domain_resolutions_key(domain), ip)
+        pipe.execute()
 
     def should_store_resolution(
         self, query: str, answers: list, qtype_name: str
@@ -932,10 +953,9 @@ class RedisDB(IoCHandler, AlertHandler, ProfileHandler, P2PHandler):
         """
         if not self.should_store_resolution(query, answers, qtype_name):
             return
-        # List of IPs to associate with the given domain
-        ips_to_add = []
-        cnames = []
 
+        ips = []
+        cnames = []
         for answer in answers:
             if self.is_txt_record(answer):
                 continue
@@ -943,16 +963,35 @@ class RedisDB(IoCHandler, AlertHandler, ProfileHandler, P2PHandler):
             if self.is_cname(answer):
                 cnames.append(answer)
                 continue
+            ips.append(answer)
 
-            # get stored DNS resolution from our db
-            ip_info_from_db = self.get_dns_resolution(answer)
-            if ip_info_from_db == {}:
+        if not ips:
+            return
+
+        resolution_ts: float = self.get_resolution_ts(ts)
+        # get the stored DNS resolutions of all ips at once, the ts of
+        # the last resolution of each one, used by is_ip_resolved(), and
+        # the ts of the last time the query resolved to each one
+        domain_resolutions_key = self._get_domain_resolutions_key(query)
+        read_pipe = self.r.pipeline()
+        read_pipe.hmget(self.constants.DNS_RESOLUTION, ips)
+        for ip in ips:
+            read_pipe.zscore(self.constants.DNS_RESOLUTION_TIMES, ip)
+            read_pipe.zscore(domain_resolutions_key, ip)
+        cached_resolutions, *scores = read_pipe.execute()
+        last_resolutions = scores[::2]
+        last_domain_resolutions = dict(zip(ips, scores[1::2]))
+        domains_of_ips = {}
+        pipe = self.r.pipeline()
+        for ip, ip_info_from_db in zip(ips, cached_resolutions):
+            if not ip_info_from_db:
                 resolved_by = [srcip]
                 # list of cached domains in the db, in this case theres none
                 domains = []
                 timewindows = [twid]
             else:
                 # we have info about this domain in DNSresolution in the db
+                ip_info_from_db = json.loads(ip_info_from_db)
                 # keep track of all srcips that resolved this domain
                 resolved_by = ip_info_from_db.get("resolved-by", [])
                 if srcip not in resolved_by:
@@ -970,6 +1009,7 @@ class RedisDB(IoCHandler, AlertHandler, ProfileHandler, P2PHandler):
             # DNSresolution in the db, add it
             if query not in domains:
                 domains.append(query)
+            domains_of_ips[ip] = domains
 
             # domains should be a list, not a string!,
             # so don't use json.dumps(domains) here
@@ -980,37 +1020,73 @@ class RedisDB(IoCHandler, AlertHandler, ProfileHandler, P2PHandler):
                 "resolved-by": resolved_by,
                 "timewindows": timewindows,
             }
-            ip_info = json.dumps(ip_info)
             # we store ALL dns resolutions seen since starting slips
             # store with the IP as the key
-            self.r.hset(self.constants.DNS_RESOLUTION, answer, ip_info)
-            self.set_ip_info(answer, {"DNS_resolution": domains})
-            # these ips will be associated with the query in our db
-            if not utils.is_ignored_ip(answer):
-                ips_to_add.append(answer)
+            pipe.hset(self.constants.DNS_RESOLUTION, ip, json.dumps(ip_info))
+
+        # dns flows may come out of order, keep the latest ts
+        pipe.zadd(
+            self.constants.DNS_RESOLUTION_TIMES,
+            {
+                ip: max(resolution_ts, last_resolution or 0)
+                for ip, last_resolution in zip(ips, last_resolutions)
+            },
+        )
+        pipe.execute()
 
+        for ip, domains in domains_of_ips.items():
+            self.set_ip_info(ip, {"DNS_resolution": domains})
+
+        # these ips will be associated with the query in our db
+        ips_to_add = [ip for ip in ips if not utils.is_ignored_ip(ip)]
         # For each CNAME in the answer
         # store it in DomainsInfo in the cache db (used for kalipso)
         # and in CNAMEsInfo in the main db  (used for detecting dns
         # without resolution)
         if ips_to_add:
-            domaindata = {"IPs": ips_to_add}
-            # if an ip came in the DNS answer along with the last seen CNAME
-            try:
-                # store this CNAME in the db
-                domaindata["CNAME"] = cnames
-            except NameError:
-                # no CNAME came with this query
-                pass
+            domaindata = {"IPs": ips_to_add, "CNAME": cnames}
             self.set_info_for_domains(query, domaindata, mode="add")
-            self.set_domain_resolution(query, ips_to_add)
+            self.set_domain_resolution(
+                query,
+                ips_to_add,
+                resolution_ts,
+                last_resolutions=[
+                    last_domain_resolutions[ip] for ip in ips_to_add
+                ],
+            )
 
-    def set_domain_resolution(self, domain, ips):
+    def _get_domain_resolutions_key(self, domain: str) -> str:
+        return f"{self.constants.DOMAIN_RESOLUTIONS}:{domain}"
+
+    def set_domain_resolution(
+        self,
+        domain,
+        ips,
+        ts: float,
+        last_resolutions: Optional[List[Optional[float]]] = None,
+    ):
         """
         stores all the resolved domains with their ips in the db
-        stored as {Domain: [IP, IP, IP]} in the db
+        stored as a sorted set of {IP: ts of the last resolution} per domain
+        :param last_resolutions: the ts of the last time the domain
+        resolved to each of the given ips, read from the db if not given
         """
-        self.r.hset(self.constants.DOMAINS_RESOLVED, domain, json.dumps(ips))
+        key = self._get_domain_resolutions_key(domain)
+        if last_resolutions is None:
+            pipe = self.r.pipeline()
+            for ip in ips:
+                pipe.zscore(key, ip)
+            last_resolutions = pipe.execute()
+
+        # dns flows may come out of order, never move the ts of an ip back.
+        # ZADD GT would do this in redis, but it needs redis 6.2
+        self.r.zadd(
+            key,
+            {
+                ip: max(ts, last_resolution or 0)
+                for ip, last_resolution in zip(ips, last_resolutions)
+            },
+        )
 
     @staticmethod
     def get_redis_server_pid(redis_port):
@@ -1334,8 +1410,14 @@ class RedisDB(IoCHandler, AlertHandler, ProfileHandler, P2PHandler):
 
     def get_domain_resolution(self, domain) -> List[str]:
         """
-        Returns the IPs resolved by this domain
+        Returns all the IPs this domain ever resolved to, the most
+        recently resolved first
         """
+        if ips := self.r.zrevrange(
+            self._get_domain_resolutions_key(domain), 0, -1
+        ):
+            return ips
+        # dbs saved by older versions of slips
         ips = self.r.hget(self.constants.DOMAINS_RESOLVED, domain)
         return json.loads(ips) if ips else []
 
@@ -1421,19 +1503,18 @@ class RedisDB(IoCHandler, AlertHandler, ProfileHandler, P2PHandler):
 
         }
         """
-        if cached_asn := self.get_asn_cache(first_octet=first_octet):
+        # not read from the TI snapshot, it may not have our latest changes
+        if cached_asn := self.rcache.hget(
+            self.constants.CACHED_ASN, first_octet
+        ):
             # we already have a cached asn of a range that
             # starts with the same first octet
             cached_asn: dict = json.loads(cached_asn)
             cached_asn.update(range_info)
-            self.rcache.hset(
-                self.constants.CACHED_ASN, first_octet, json.dumps(cached_asn)
-            )
-        else:
-            # first time storing a range starting with the same first octet
-            self.rcache.hset(
-                self.constants.CACHED_ASN, first_octet, json.dumps(range_info)
-            )
+            range_info = cached_asn
+        # else, first time storing a range starting with the same first
+        # octet
+        self._write_iocs("asn_cache", {first_octet: json.dumps(range_info)})
 
     def get_asn_cache(self, first_octet=False):
         """
@@ -1441,6 +1522,8 @@ class RedisDB(IoCHandler, AlertHandler, ProfileHandler, P2PHandler):
         Returns cached asn of ip if present, or False.
         """
         if first_octet:
+            if snapshot := self._get_ti_snapshot("asn_cache"):
+                return snapshot.get("asn_cache", first_octet)
             return self.rcache.hget(self.constants.CACHED_ASN, first_octet)
 
         return self.rcache.hgetall(self.constants.CACHED_ASN)
@@ -1477,9 +1560,16 @@ class RedisDB(IoCHandler, AlertHandler, ProfileHandler, P2PHandler):
         """
         # info will be stored in OrgInfo key {'facebook_asn': ..,
         # 'twitter_domains': ...}
-        self.rcache.hset(
-            self.constants.ORG_INFO, f"{org}_{info_type}", org_info
-        )
+        self._write_iocs("orgs", {f"{org}_{info_type}": org_info})
+
+    def _get_org_info(self, org_info: str) -> Optional[str]:
+        """
+        returns the given "<org>_<info type>" from the TI snapshot if
+        it's up to date, or from the db
+        """
+        if snapshot := self._get_ti_snapshot("orgs"):
+            return snapshot.get("orgs", org_info)
+        return self.rcache.hget(self.constants.ORG_INFO, org_info)
 
     def get_org_info(self, org, info_type) -> str:
         """
@@ -1490,13 +1580,10 @@ class RedisDB(IoCHandler, AlertHandler, ProfileHandler, P2PHandler):
         returns a json serialized dict with info
         PS: All ASNs returned by this function are uppercase
         """
-        return (
-            self.rcache.hget(self.constants.ORG_INFO, f"{org}_{info_type}")
-            or "[]"
-        )
+        return self._get_org_info(f"{org}_{info_type}") or "[]"
 
     def get_org_ips(self, org):
-        org_info = self.rcache.hget(self.constants.ORG_INFO, f"{org}_IPs")
+        org_info = self._get_org_info(f"{org}_IPs")
 
         if not org_info:
             org_info = {}
@@ -1,6 +1,7 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
 import json
+import time
 from typing import (
     Dict,
     List,
@@ -10,10 +11,20 @@ from typing import (
 )
 
 from slips_files.common.data_structures.trie import Trie
+from slips_files.common.data_structures.ti_snapshot import (
+    DELETED,
+    TISnapshot,
+    TISnapshotOverlay,
+    TISnapshotWriter,
+)
 
 # for future developers, remember to invalidate_trie_cache() on every
 # change to the self.constants.IOC_DOMAINS key or slips will keep using an
 # invalid cache to lookup malicious domains
+# and remember to use _add_iocs() or _write_iocs() for every change to any
+# of the keys in _get_snapshot_sections(), or slips will keep using an
+# outdated TI snapshot and processes will keep using outdated in-memory
+# caches of the iocs
 
 
 class IoCHandler:
@@ -24,11 +35,386 @@ class IoCHandler:
     """
 
     name = "DB"
+    # path of the TI snapshot shared by all processes. set by the
+    # RedisDB using the config. None means don't use a snapshot
+    ti_snapshot_path = None
+    # how often (in seconds) to check for a newer snapshot and whether the
+    # mapped one is still up to date
+    ti_snapshot_check_interval = 1
 
     def __init__(self):
         # used for faster domain lookups
         self.trie = None
         self.is_trie_cached = False
+        # the mmapped TI snapshot published by publish_ti_snapshot()
+        self.ti_snapshot = None
+        self.ti_snapshot_last_check = float("-inf")
+        # {snapshot section: generation of its IoC key in the cache db}
+        self.ioc_generations = {}
+        # {snapshot section: its generation when the mapped snapshot was
+        # published}
+        self.snapshot_generations = {}
+        # {snapshot section: TISnapshotOverlay with the changes made to it
+        # since the snapshot was published}
+        self.snapshot_overlays = {}
+        # {snapshot section: (snapshot generation, overlay generation)} of
+        # the overlays in self.snapshot_overlays
+        self.overlay_generations = {}
+        # generation of the domains the trie was built from
+        self.trie_generation = None
+        # when true, iocs are written to the staging keys instead of the
+        # live ones. see start_staging_iocs()
+        self.is_staging_iocs = False
+
+    def _get_snapshot_sections(self) -> Dict[str, str]:
+        """
+        returns {snapshot section: the IoC key it's compiled from}
+        """
+        return {
+            "ips": self.constants.IOC_IPS,
+            "domains": self.constants.IOC_DOMAINS,
+            "ip_ranges": self.constants.IOC_IP_RANGES,
+            "asns": self.constants.IOC_ASN,
+            "ja3": self.constants.IOC_JA3,
+            "jarm": self.constants.IOC_JARM,
+            "ssl": self.constants.IOC_SSL,
+            # not iocs, but looked up by the whitelist and ip_info as
+            # often as them
+            "orgs": self.constants.ORG_INFO,
+            "asn_cache": self.constants.CACHED_ASN,
+        }
+
+    @staticmethod
+    def _get_staging_key(key: str) -> str:
+        return f"{key}_staging"
+
+    def _get_ioc_key(self, key: str) -> str:
+        """
+        returns the key new iocs should be written to, the given live
+        IoC_* key, or its staging copy if we're staging iocs
+        """
+        if self.is_staging_iocs:
+            return self._get_staging_key(key)
+        return key
+
+    def _get_overlay_key(self, section: str) -> str:
+        return f"{self.constants.IOC_OVERLAY}_{section}"
+
+    def _write_iocs(
+        self,
+        section: str,
+        iocs: Optional[Dict[str, str]] = None,
+        deleted: Optional[List[str]] = None,
+    ):
+        """
+        adds the given iocs to the live key of the given section and
+        deletes the given deleted iocs from it, in one transaction that
+        also records the changes in the overlay of the section.
+        the generation of the section is incremented, processes rebuild
+        their caches of it, and keep using the snapshot with the overlay
+        on top until a new snapshot is published.
+        """
+        key = self._get_snapshot_sections()[section]
+        overlay_key = self._get_overlay_key(section)
+        transaction = self.rcache.pipeline(transaction=True)
+        if deleted:
+            transaction.hdel(key, *deleted)
+            transaction.hset(
+                overlay_key, mapping=dict.fromkeys(deleted, DELETED)
+            )
+        if iocs:
+            transaction.hset(key, mapping=iocs)
+            transaction.hset(overlay_key, mapping=iocs)
+        transaction.hincrby(self.constants.IOC_GENERATIONS, section, 1)
+        transaction.hincrby(self.constants.IOC_OVERLAY_GENERATIONS, section, 1)
+        transaction.execute()
+
+    def _add_iocs(self, section: str, iocs: Dict[str, str]):
+        """
+        adds the given iocs to the given section, or to its staging
+        key if we're staging iocs
+        """
+        if not iocs:
+            return
+        if self.is_staging_iocs:
+            # the live keys don't change, the generation is incremented
+            # once when the staged iocs are promoted
+            key = self._get_snapshot_sections()[section]
+            self.rcache.hmset(self._get_staging_key(key), iocs)
+            return
+        self._write_iocs(section, iocs)
+
+    @staticmethod
+    def _get_feed_entries(iocs: Dict[str, str], feeds) -> List[str]:
+        """
+        returns the given iocs that were read from any of the given feeds
+        :param iocs: {ioc: its json description} as stored in an IoC key
+        """
+        entries = []
+        for ioc, description in iocs.items():
+            source = json.loads(description)["source"]
+            if any(feed in source for feed in feeds):
+                entries.append(ioc)
+        return entries
+
+    def _get_staging_keys(self) -> List[str]:
+        """
+        returns all the keys written while staging iocs
+        """
+        return [
+            self.constants.IOC_STAGED_FEEDS,
+            self._get_staging_key(self.constants.TI_FILES_INFO),
+            *[
+                self._get_staging_key(key)
+                for key in self._get_snapshot_sections().values()
+            ],
+        ]
+
+    def start_staging_iocs(self):
+        """
+        From now on, iocs and feed info added by this process are written
+        to staging keys instead of the live ones, and deleting the entries
+        of a feed only marks it as replaced. lookups keep using the old
+        iocs until promote_staged_iocs() is called.
+        """
+        # leftovers of an update that crashed before discarding them
+        self.discard_staged_iocs()
+        self.is_staging_iocs = True
+
+    def discard_staged_iocs(self):
+        """
+        Drops everything staged since start_staging_iocs(). the live iocs
+        and the info of their feeds stay as they were, so the feeds are
+        downloaded again on the next update.
+        """
+        self.rcache.delete(*self._get_staging_keys())
+        self.is_staging_iocs = False
+
+    def promote_staged_iocs(self) -> List[str]:
+        """
+        Applies all the staged iocs and the info of their feeds to the
+        live keys in one redis transaction, so lookups see either the old
+        or the new iocs, never a mix of both, and the e-tags of the
+        feeds are never newer than their iocs.
+        The generation of each modified section is incremented once, so
+        caches built from it are rebuilt once per promotion.
+        returns the modified sections
+        """
+        self.is_staging_iocs = False
+        # the live iocs are watched, if another process modifies them
+        # between reading the outdated iocs and applying the staged ones,
+        # the transaction is retried
+        modified_sections = self.rcache.transaction(
+            self._promote_staged_iocs,
+            *self._get_snapshot_sections().values(),
+            value_from_callable=True,
+        )
+        if "domains" in modified_sections:
+            self._invalidate_trie_cache()
+        return modified_sections
+
+    def _promote_staged_iocs(self, pipe) -> List[str]:
+        """
+        the body of the transaction done by promote_staged_iocs().
+        reads the staged and outdated iocs using the given pipe before
+        calling pipe.multi(), and queues the writes after it.
+        returns the modified sections
+        """
+        replaced_feeds = pipe.smembers(self.constants.IOC_STAGED_FEEDS)
+        staged_feeds_info = pipe.hgetall(
+            self._get_staging_key(self.constants.TI_FILES_INFO)
+        )
+        changes = {}
+        for section, key in self._get_snapshot_sections().items():
+            staged_iocs = pipe.hgetall(self._get_staging_key(key))
+            outdated_iocs = []
+            # same as delete_feed_entries(), only ips and domains are
+            # deleted when a feed is updated
+            if replaced_feeds and section in ("ips", "domains"):
+                outdated_iocs = self._get_feed_entries(
+                    pipe.hgetall(key), replaced_feeds
+                )
+            if staged_iocs or outdated_iocs:
+                changes[section] = (key, staged_iocs, outdated_iocs)
+
+        pipe.multi()
+        for section, (key, staged_iocs, outdated_iocs) in changes.items():
+            # the deletion comes first so that iocs that are still in the
+            # updated feeds are added back by the hset
+            if outdated_iocs:
+                pipe.hdel(key, *outdated_iocs)
+            if staged_iocs:
+                pipe.hset(key, mapping=staged_iocs)
+            # the overlay isn't incremented, too many iocs change to keep
+            # track of them. lookups go to redis until the next publish
+            pipe.hincrby(self.constants.IOC_GENERATIONS, section, 1)
+
+        if staged_feeds_info:
+            pipe.hset(self.constants.TI_FILES_INFO, mapping=staged_feeds_info)
+        pipe.delete(*self._get_staging_keys())
+        return list(changes)
+
+    def publish_ti_snapshot(self):
+        """
+        Compiles all the IoCs in the cache db into a read-only file that
+        is mmapped by every process that does TI lookups.
+        the file is replaced atomically, readers switch to it on their
+        next check.
+        """
+        if not self.ti_snapshot_path:
+            return
+
+        # the generations are watched, if anything changes while we're
+        # reading the iocs, they're read again
+        generations, sections = self.rcache.transaction(
+            self._read_ti_snapshot,
+            self.constants.IOC_GENERATIONS,
+            value_from_callable=True,
+        )
+        TISnapshotWriter().write(self.ti_snapshot_path, sections, generations)
+
+    def _read_ti_snapshot(
+        self, pipe
+    ) -> Tuple[Dict[str, int], Dict[str, Dict[str, str]]]:
+        """
+        the body of the transaction done by publish_ti_snapshot().
+        reads all the sections of the snapshot and their generations,
+        and empties their overlays, since the new snapshot has all the
+        changes in them.
+        returns the generations and the sections
+        """
+        db_generations = pipe.hgetall(self.constants.IOC_GENERATIONS)
+        generations = {}
+        sections = {}
+        for section, key in self._get_snapshot_sections().items():
+            generations[section] = int(db_generations.get(section, 0))
+            sections[section] = pipe.hgetall(key)
+
+        pipe.multi()
+        pipe.delete(*[self._get_overlay_key(section) for section in sections])
+        pipe.hset(self.constants.IOC_SNAPSHOT_GENERATIONS, mapping=generations)
+        pipe.hset(self.constants.IOC_OVERLAY_GENERATIONS, mapping=generations)
+        return generations, sections
+
+    def _read_generations(self, *overlays: str) -> List[dict]:
+        """
+        reads the generations of the IoC keys, of the published snapshot
+        and of the overlays, and the given overlays, in one transaction so
+        they're consistent with each other
+        """
+        transaction = self.rcache.pipeline(transaction=True)
+        transaction.hgetall(self.constants.IOC_GENERATIONS)
+        transaction.hgetall(self.constants.IOC_SNAPSHOT_GENERATIONS)
+        transaction.hgetall(self.constants.IOC_OVERLAY_GENERATIONS)
+        for section in overlays:
+            transaction.hgetall(self._get_overlay_key(section))
+        return transaction.execute()
+
+    def _get_usable_overlays(
+        self, snapshot_generations: dict, overlay_generations: dict
+    ) -> Dict[str, Tuple[int, int]]:
+        """
+        returns {section: (snapshot generation, overlay generation)} of
+        the sections whose overlay holds all the changes made to them
+        since the mapped snapshot was published
+        """
+        usable = {}
+        for section in self._get_snapshot_sections():
+            snapshot_generation = self.ti_snapshot.get_generation(section)
+            if snapshot_generation is None:
+                continue
+            overlay_generation = int(overlay_generations.get(section, -1))
+            if (
+                int(snapshot_generations.get(section, -1))
+                == snapshot_generation
+                and int(self.ioc_generations.get(section, 0))
+                == overlay_generation
+            ):
+                usable[section] = (snapshot_generation, overlay_generation)
+        return usable
+
+    def _refresh_ioc_generations(self):
+        """
+        re-reads the generations of the IoC keys and switches to a newer
+        snapshot if one was published. does so at most once every
+        ti_snapshot_check_interval seconds
+        """
+        now = time.monotonic()
+        if now - self.ti_snapshot_last_check < self.ti_snapshot_check_interval:
+            return
+
+        self.ti_snapshot_last_check = now
+        self.ioc_generations, snapshot_generations, overlay_generations = (
+            self._read_generations()
+        )
+        if not self.ti_snapshot_path:
+            return
+
+        if self.ti_snapshot is None:
+            self.ti_snapshot = TISnapshot(self.ti_snapshot_path)
+        self.ti_snapshot.reload_if_changed()
+        usable = self._get_usable_overlays(
+            snapshot_generations, overlay_generations
+        )
+        # only the overlays that changed since our last check are read
+        outdated = [
+            section
+            for section, generations in usable.items()
+            if self.overlay_generations.get(section) != generations
+        ]
+        if outdated:
+            (
+                self.ioc_generations,
+                snapshot_generations,
+                overlay_generations,
+                *changes,
+            ) = self._read_generations(*outdated)
+            usable = self._get_usable_overlays(
+                snapshot_generations, overlay_generations
+            )
+            for section, section_changes in zip(outdated, changes):
+                if section in usable:
+                    self.snapshot_overlays[section] = TISnapshotOverlay(
+                        self.ti_snapshot, section, section_changes
+                    )
+                    self.overlay_generations[section] = usable[section]
+
+        # drop the overlays of the sections that changed in ways they
+        # don't know about, or of an older snapshot
+        for section in list(self.overlay_generations):
+            if self.overlay_generations[section] != usable.get(section):
+                del self.overlay_generations[section]
+                del self.snapshot_overlays[section]
+
+    def get_ioc_generation(self, section: str) -> int:
+        """
+        returns the generation of the given section. it changes whenever
+        its IoC key is modified, processes use it to know when to rebuild
+        their in-memory caches of the iocs
+        """
+        self._refresh_ioc_generations()
+        return int(self.ioc_generations.get(section, 0))
+
+    def _get_ti_snapshot(
+        self, section: str
+    ) -> Optional[Union[TISnapshot, TISnapshotOverlay]]:
+        """
+        returns the mapped snapshot if its given section is up to date
+        with the cache db, the snapshot with the changes made to the
+        section since it was published on top if we have them,
+        and None if lookups should go to redis instead
+        """
+        if not self.ti_snapshot_path:
+            return None
+
+        self._refresh_ioc_generations()
+        if not self.ti_snapshot.is_loaded():
+            return None
+
+        generation = int(self.ioc_generations.get(section, 0))
+        if self.ti_snapshot.get_generation(section) == generation:
+            return self.ti_snapshot
+        return self.snapshot_overlays.get(section)
 
     def _build_trie(self):
         """Retrieve domains from Redis and construct the trie."""
@@ -73,25 +459,48 @@ class IoCHandler:
         """
         Delete all entries in
          IoC_domains and IoC_ips that contain the given feed as source
+        if we're staging iocs, the entries are deleted when the staged
+        iocs are promoted
         """
         # get the feed name from the given url
         feed_to_delete = url.split("/")[-1]
-        # get all domains that are read from TI files in our db
-        ioc_domains = self.rcache.hgetall(self.constants.IOC_DOMAINS)
-        for domain, domain_description in ioc_domains.items():
-            domain_description = json.loads(domain_description)
-            if feed_to_delete in domain_description["source"]:
-                # this entry has the given feed as source, delete it
-                self.rcache.hdel(self.constants.IOC_DOMAINS, domain)
-                self._invalidate_trie_cache()
-
-        # get all IPs that are read from TI files in our db
-        ioc_ips = self.rcache.hgetall(self.constants.IOC_IPS)
-        for ip, ip_description in ioc_ips.items():
-            ip_description = json.loads(ip_description)
-            if feed_to_delete in ip_description["source"]:
-                # this entry has the given feed as source, delete it
-                self.rcache.hdel(self.constants.IOC_IPS, ip)
+        if self.is_staging_iocs:
+            self.rcache.sadd(self.constants.IOC_STAGED_FEEDS, feed_to_delete)
+            return
+
+        if domains := self._get_feed_entries(
+            self.rcache.hgetall(self.constants.IOC_DOMAINS), [feed_to_delete]
+        ):
+            self.delete_domains_from_ioc_domains(domains)
+
+        if ips := self._get_feed_entries(
+            self.rcache.hgetall(self.constants.IOC_IPS), [feed_to_delete]
+        ):
+            self.delete_ips_from_ioc_ips(ips)
+
+    def get_cached_online_ti_result(
+        self, source: str, query: str
+    ) -> Optional[str]:
+        """
+        returns the json result of looking up the given query in the
+        given online TI source, or None if it's not cached or expired
+        """
+        return self.rcache.get(
+            f"{self.constants.ONLINE_TI_CACHE}:{source}:{query}"
+        )
+
+    def cache_online_ti_result(
+        self, source: str, query: str, result: str, ttl: int
+    ):
+        """
+        caches the json result of looking up the given query in the given
+        online TI source for ttl seconds
+        """
+        self.rcache.set(
+            f"{self.constants.ONLINE_TI_CACHE}:{source}:{query}",
+            result,
+            ex=ttl,
+        )
 
     def delete_ti_feed(self, file):
         self.rcache.hdel(self.constants.TI_FILES_INFO, file)
@@ -107,26 +516,22 @@ class IoCHandler:
         sets the 'time' of last update of the given file
         :param file: ti file
         """
-        if file_info := self.rcache.hget(self.constants.TI_FILES_INFO, file):
-            # update an existin time
-            file_info = json.loads(file_info)
-            file_info.update({"time": time})
-            self.rcache.hset(
-                self.constants.TI_FILES_INFO, file, json.dumps(file_info)
-            )
-            return
-
-        # no cached info about this file
-        self.rcache.hset(
-            self.constants.TI_FILES_INFO, file, json.dumps({"time": time})
-        )
+        file_info = self.get_ti_feed_info(file)
+        file_info.update({"time": time})
+        self.set_ti_feed_info(file, file_info)
 
     def get_ti_feed_info(self, file):
         """
         Get TI file info
         :param file: a valid filename not a feed url
         """
-        data = self.rcache.hget(self.constants.TI_FILES_INFO, file)
+        data = None
+        if self.is_staging_iocs:
+            # the info of the feeds updated by the current update
+            data = self.rcache.hget(
+                self._get_staging_key(self.constants.TI_FILES_INFO), file
+            )
+        data = data or self.rcache.hget(self.constants.TI_FILES_INFO, file)
         return json.loads(data) if data else {}
 
     def give_threat_intelligence(
@@ -165,7 +570,11 @@ class IoCHandler:
         :param data: dict containing info about TI file
         """
         data = json.dumps(data)
-        self.rcache.hset(self.constants.TI_FILES_INFO, file, data)
+        # while staging, the info is written to the live key when the
+        # iocs of the feed are promoted
+        self.rcache.hset(
+            self._get_ioc_key(self.constants.TI_FILES_INFO), file, data
+        )
 
     def store_known_fp_md5_hashes(self, fps: Dict[str, List[str]]):
         self.rcache.hmset(self.constants.KNOWN_FPS, fps)
@@ -179,13 +588,13 @@ class IoCHandler:
         """
         Delete the given IPs from IoC
         """
-        self.rcache.hdel(self.constants.IOC_IPS, *ips)
+        self._write_iocs("ips", deleted=ips)
 
     def delete_domains_from_ioc_domains(self, domains: List[str]):
         """
         Delete old domains from IoC
         """
-        self.rcache.hdel(self.constants.IOC_DOMAINS, *domains)
+        self._write_iocs("domains", deleted=domains)
         self._invalidate_trie_cache()
 
     def add_ips_to_ioc(self, ips_and_description: Dict[str, str]) -> None:
@@ -197,8 +606,7 @@ class IoCHandler:
                                                         'description':...}}
 
         """
-        if ips_and_description:
-            self.rcache.hmset(self.constants.IOC_IPS, ips_and_description)
+        self._add_iocs("ips", ips_and_description)
 
     def add_domains_to_ioc(self, domains_and_description: dict) -> None:
         """
@@ -208,10 +616,8 @@ class IoCHandler:
         {domain: json.dumps{'source':..,'tags':..,
             'threat_level':... ,'description'}}
         """
-        if domains_and_description:
-            self.rcache.hmset(
-                self.constants.IOC_DOMAINS, domains_and_description
-            )
+        self._add_iocs("domains", domains_and_description)
+        if domains_and_description and not self.is_staging_iocs:
             self._invalidate_trie_cache()
 
     def add_ip_range_to_ioc(self, malicious_ip_ranges: dict) -> None:
@@ -221,10 +627,7 @@ class IoCHandler:
         {range: json.dumps{'source':..,'tags':..,
          'threat_level':... ,'description'}}
         """
-        if malicious_ip_ranges:
-            self.rcache.hmset(
-                self.constants.IOC_IP_RANGES, malicious_ip_ranges
-            )
+        self._add_iocs("ip_ranges", malicious_ip_ranges)
 
     def add_asn_to_ioc(self, blacklisted_ASNs: dict):
         """
@@ -233,8 +636,7 @@ class IoCHandler:
         {asn: json.dumps{'source':..,'tags':..,
             'threat_level':... ,'description'}}
         """
-        if blacklisted_ASNs:
-            self.rcache.hmset(self.constants.IOC_ASN, blacklisted_ASNs)
+        self._add_iocs("asns", blacklisted_ASNs)
 
     def add_ja3_to_ioc(self, ja3: dict) -> None:
         """
@@ -243,7 +645,7 @@ class IoCHandler:
                             'threat_level':... ,'description'}}
 
         """
-        self.rcache.hmset(self.constants.IOC_JA3, ja3)
+        self._add_iocs("ja3", ja3)
 
     def add_jarm_to_ioc(self, jarm: dict) -> None:
         """
@@ -251,7 +653,7 @@ class IoCHandler:
         :param jarm:  {jarm: {'source':..,'tags':..,
                             'threat_level':... ,'description'}}
         """
-        self.rcache.hmset(self.constants.IOC_JARM, jarm)
+        self._add_iocs("jarm", jarm)
 
     def add_ssl_sha1_to_ioc(self, malicious_ssl_certs):
         """
@@ -259,17 +661,30 @@ class IoCHandler:
         :param malicious_ssl_certs:  {sha1: {'source':..,'tags':..,
                                     'threat_level':... ,'description'}}
         """
-        self.rcache.hmset(self.constants.IOC_SSL, malicious_ssl_certs)
+        self._add_iocs("ssl", malicious_ssl_certs)
 
     def is_blacklisted_asn(self, asn) -> bool:
+        if snapshot := self._get_ti_snapshot("asns"):
+            return snapshot.get("asns", str(asn))
         return self.rcache.hget(self.constants.IOC_ASN, asn)
 
     def is_blacklisted_jarm(self, jarm_hash: str):
         """
         search for the given hash in the malicious hashes stored in the db
         """
+        if snapshot := self._get_ti_snapshot("jarm"):
+            return snapshot.get("jarm", jarm_hash)
         return self.rcache.hget(self.constants.IOC_JARM, jarm_hash)
 
+    def is_blacklisted_ja3(self, ja3: str) -> Optional[str]:
+        """
+        search for the given ja3 in the malicious ja3 stored in the db
+        returns the json description of it if found
+        """
+        if snapshot := self._get_ti_snapshot("ja3"):
+            return snapshot.get("ja3", ja3)
+        return self.rcache.hget(self.constants.IOC_JA3, ja3)
+
     def is_blacklisted_ip(self, ip: str) -> Union[Dict[str, str], bool]:
         """
         Search in the dB of malicious IPs and return a
@@ -281,19 +696,28 @@ class IoCHandler:
             "tags": ["phishing honeypot"]}
 
         """
-        ip_info: str = self.rcache.hget(self.constants.IOC_IPS, ip)
+        if snapshot := self._get_ti_snapshot("ips"):
+            ip_info: str = snapshot.get("ips", ip)
+        else:
+            ip_info: str = self.rcache.hget(self.constants.IOC_IPS, ip)
         return False if ip_info is None else json.loads(ip_info)
 
     def is_blacklisted_ssl(self, sha1):
-        info = self.rcache.hmget(self.constants.IOC_SSL, sha1)[0]
+        if snapshot := self._get_ti_snapshot("ssl"):
+            info = snapshot.get("ssl", sha1)
+        else:
+            info = self.rcache.hmget(self.constants.IOC_SSL, sha1)[0]
         return False if info is None else info
 
     def _match_exact_domain(self, domain: str) -> Optional[Dict[str, str]]:
         """checks if the given domain is blacklisted.
         checks only the exact given domain, no subdomains"""
-        domain_description = self.rcache.hget(
-            self.constants.IOC_DOMAINS, domain
-        )
+        if snapshot := self._get_ti_snapshot("domains"):
+            domain_description = snapshot.get("domains", domain)
+        else:
+            domain_description = self.rcache.hget(
+                self.constants.IOC_DOMAINS, domain
+            )
         if not domain_description:
             return
         return json.loads(domain_description)
@@ -307,11 +731,21 @@ class IoCHandler:
         # the goal here is we dont retrieve that huge amount of domains
         # from the db on every domain lookup
         # so we retrieve once, put em in a trie (aka cache them in memory),
-        # keep using them from that data structure until a new domain is
-        # added to the db, when that happens we invalidate the cache,
-        # rebuild the trie, and keep using it from there.
-        if not self.is_trie_cached:
+        # keep using them from that data structure until the domains in the
+        # db change, when that happens (by this process or by another one,
+        # e.g. a promotion of updated feeds) the generation of the domains
+        # changes, we rebuild the trie, and keep using it from there.
+        # when the shared snapshot is up to date, no need for the trie,
+        # the snapshot is already sorted and shared between processes.
+        if snapshot := self._get_ti_snapshot("domains"):
+            if domain_info := snapshot.match_domain(domain):
+                return json.loads(domain_info)
+            return
+
+        generation = self.get_ioc_generation("domains")
+        if not self.is_trie_cached or self.trie_generation != generation:
             self._build_trie()
+            self.trie_generation = generation
 
         found, domain_info = self.trie.search(domain)
         if found:
@@ -336,13 +770,23 @@ class IoCHandler:
             return match, is_subdomain
         return False, False
 
-    def get_all_blacklisted_ip_ranges(self) -> dict:
+    def get_all_blacklisted_ip_ranges(self) -> List[str]:
+        """
+        Returns all the malicious ip ranges we have from different feeds,
+        without their descriptions.
+        use get_blacklisted_ip_range_info() to get the description of one
+        """
+        if snapshot := self._get_ti_snapshot("ip_ranges"):
+            return list(snapshot.keys("ip_ranges"))
+        return self.rcache.hkeys(self.constants.IOC_IP_RANGES)
+
+    def get_blacklisted_ip_range_info(self, ip_range: str) -> Optional[str]:
         """
-        Returns all the malicious ip ranges we have from different feeds
-        return format is {range: json.dumps{'source':..,'tags':..,
-                                            'threat_level':... ,'description'}}
+        returns the json description of the given malicious ip range
         """
-        return self.rcache.hgetall(self.constants.IOC_IP_RANGES)
+        if snapshot := self._get_ti_snapshot("ip_ranges"):
+            return snapshot.get("ip_ranges", ip_range)
+        return self.rcache.hget(self.constants.IOC_IP_RANGES, ip_range)
 
     def get_all_blacklisted_ips(self):
         """
@@ -8,6 +8,8 @@ import traceback
 from dataclasses import asdict
 from math import floor
 from typing import (
+    Any,
+    Dict,
     Tuple,
     Union,
     Optional,
@@ -172,7 +174,7 @@ class ProfileHandler:
         self.publish("new_http", to_send)
         self.publish("new_url", to_send)
 
-        self.print(f"Adding HTTP flow to DB: {flow}", 3, 0)
+        self.lazy_print("Adding HTTP flow to DB: %s", flow, verbose=3)
         # Check if the host domain AND the url is detected by the threat
         # intelligence.
         # not all flows have a host value so don't send empty hosts to ti
@@ -564,10 +566,12 @@ class ProfileHandler:
             if data:
                 return json.loads(data)
 
-            self.print(
-                f"There is no data for Key: {key}. Profile {profileid} TW {twid}",
-                3,
-                0,
+            self.lazy_print(
+                "There is no data for Key: %s. Profile %s TW %s",
+                key,
+                profileid,
+                twid,
+                verbose=3,
             )
             return {}
         except Exception:
@@ -818,10 +822,11 @@ class ProfileHandler:
         if label:
             self.r.zincrby(self.constants.LABELS, 1, label)
 
+        raw_flow: dict = asdict(flow)
         to_send = {
             "profileid": profileid,
             "twid": twid,
-            "flow": asdict(flow),
+            "flow": raw_flow,
             "stime": flow.starttime,
             "interpreted_state": self.get_final_state_from_flags(
                 flow.state, flow.pkts
@@ -837,6 +842,31 @@ class ProfileHandler:
             self.publish("new_flow", to_send)
         return True
 
+    def update_conn_flows_cache_stats(self, hits: int, misses: int):
+        """
+        adds the hits and misses of the conn flows cache of one process to
+        the ones of all processes in the db
+        """
+        pipe = self.r.pipeline(transaction=False)
+        pipe.hincrby(self.constants.CONN_FLOWS_CACHE_STATS, "hits", hits)
+        pipe.hincrby(self.constants.CONN_FLOWS_CACHE_STATS, "misses", misses)
+        pipe.execute()
+
+    def get_conn_flows_cache_stats(self) -> Dict[str, float]:
+        """
+        returns the hits, misses and hit rate of the conn flows cache in
+        all processes
+        """
+        stats = self.r.hgetall(self.constants.CONN_FLOWS_CACHE_STATS)
+        hits = int(stats.get("hits", 0))
+        misses = int(stats.get("misses", 0))
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
     def add_software_to_profile(self, profileid, flow):
         """
         Used to associate this profile with it's used software and version
@@ -891,7 +921,7 @@ class ProfileHandler:
         }
         to_send = json.dumps(to_send)
         self.publish("new_ssh", to_send)
-        self.print(f"Adding SSH flow to DB: {flow}", 3, 0)
+        self.lazy_print("Adding SSH flow to DB: %s", flow, verbose=3)
         self.give_threat_intelligence(
             profileid,
             twid,
@@ -917,7 +947,7 @@ class ProfileHandler:
         }
         to_send = json.dumps(to_send)
         self.publish("new_notice", to_send)
-        self.print(f"Adding notice flow to DB: {flow}", 3, 0)
+        self.lazy_print("Adding notice flow to DB: %s", flow, verbose=3)
         self.give_threat_intelligence(
             profileid,
             twid,
@@ -939,7 +969,7 @@ class ProfileHandler:
         to_send = {"profileid": profileid, "twid": twid, "flow": asdict(flow)}
         to_send = json.dumps(to_send)
         self.publish("new_ssl", to_send)
-        self.print(f"Adding SSL flow to DB: {flow}", 3, 0)
+        self.lazy_print("Adding SSL flow to DB: %s", flow, verbose=3)
         # Check if the server_name (SNI) is detected by the threat intelligence.
         # Empty field in the end, cause we have extra field for the IP.
         # If server_name is not empty, set in the IPsInfo and send to TI
@@ -1526,15 +1556,16 @@ class ProfileHandler:
         for profile_tw_to_close in profiles_tws_to_close:
             profile_tw_to_close_id = profile_tw_to_close[0]
             profile_tw_to_close_time = profile_tw_to_close[1]
-            self.print(
-                f"The profile id {profile_tw_to_close_id} has to be closed"
-                f" because it was"
-                f" last modifed on {profile_tw_to_close_time} and we are "
-                f"closing everything older than {modification_time}."
-                f" Current time {sit}. "
-                f"Difference: {modification_time - profile_tw_to_close_time}",
-                3,
-                0,
+            self.lazy_print(
+                "The profile id %s has to be closed because it was last "
+                "modifed on %s and we are closing everything older than %s."
+                " Current time %s. Difference: %s",
+                profile_tw_to_close_id,
+                profile_tw_to_close_time,
+                modification_time,
+                sit,
+                modification_time - profile_tw_to_close_time,
+                verbose=3,
             )
             self.mark_profile_tw_as_closed(profile_tw_to_close_id)
 
@@ -1644,14 +1675,18 @@ class ProfileHandler:
 
                 # Separate the symbol to add and the previous data
                 (symbol_to_add, previous_two_timestamps) = symbol
-                self.print(
-                    f"Not the first time for tuple {tupleid} as an "
-                    f"{direction} for "
-                    f"{profileid} in TW {twid}. Add the symbol: {symbol_to_add}. "
-                    f"Store previous_times: {previous_two_timestamps}. "
-                    f"Prev Data: {prev_symbols}",
-                    3,
-                    0,
+                self.lazy_print(
+                    "Not the first time for tuple %s as an %s for %s in TW "
+                    "%s. Add the symbol: %s. Store previous_times: %s. "
+                    "Prev Data: %s",
+                    tupleid,
+                    direction,
+                    profileid,
+                    twid,
+                    symbol_to_add,
+                    previous_two_timestamps,
+                    prev_symbols,
+                    verbose=3,
                 )
 
                 # Add it to form the string of letters
@@ -1662,21 +1697,24 @@ class ProfileHandler:
                 )
 
                 prev_symbols[tupleid] = (new_symbol, previous_two_timestamps)
-                self.print(
-                    f"\tLetters so far for tuple {tupleid}:" f" {new_symbol}",
-                    3,
-                    0,
+                self.lazy_print(
+                    "\tLetters so far for tuple %s: %s",
+                    tupleid,
+                    new_symbol,
+                    verbose=3,
                 )
             except (TypeError, KeyError):
                 # TODO check that this condition is triggered correctly
                 #  only for the first case and not the rest after...
                 # There was no previous data stored in the DB to append
                 # the given symbol to.
-                self.print(
-                    f"First time for tuple {tupleid} as an"
-                    f" {direction} for {profileid} in TW {twid}",
-                    3,
-                    0,
+                self.lazy_print(
+                    "First time for tuple %s as an %s for %s in TW %s",
+                    tupleid,
+                    direction,
+                    profileid,
+                    twid,
+                    verbose=3,
                 )
                 prev_symbols[tupleid] = symbol
 
@@ -1703,7 +1741,9 @@ class ProfileHandler:
 
     def add_timeline_line(self, profileid, twid, data, timestamp):
         """Add a line to the timeline of this profileid and twid"""
-        self.print(f"Adding timeline for {profileid}, {twid}: {data}", 3, 0)
+        self.lazy_print(
+            "Adding timeline for %s, %s: %s", profileid, twid, data, verbose=3
+        )
         key = str(
             profileid + self.separator + twid + self.separator + "timeline"
         )
@@ -1713,6 +1753,23 @@ class ProfileHandler:
         # Mark the tw as modified since the timeline line is new data in the TW
         self.mark_profile_tw_as_modified(profileid, twid, timestamp="")
 
+    def add_timeline_lines(self, lines: List[Tuple[str, str, dict, Any]]):
+        """
+        Adds many lines to the timelines of their profileids and twids
+        at once
+        :param lines: a list of (profileid, twid, data, timestamp)
+        """
+        modified_tws = set()
+        pipe = self.r.pipeline()
+        for profileid, twid, data, timestamp in lines:
+            key = f"{profileid}{self.separator}{twid}{self.separator}timeline"
+            pipe.zadd(key, {json.dumps(data): timestamp})
+            modified_tws.add((profileid, twid))
+        pipe.execute()
+        # Mark the tws as modified since the timeline lines are new data
+        for profileid, twid in modified_tws:
+            self.mark_profile_tw_as_modified(profileid, twid, timestamp="")
+
     def get_timeline_last_lines(
         self, profileid, twid, first_index: int
     ) -> Tuple[str, int]:
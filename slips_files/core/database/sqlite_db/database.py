@@ -1,19 +1,94 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+import fcntl
+import math
 import os.path
 import sqlite3
 import json
-import csv
 from dataclasses import asdict
 
 from slips_files.common.abstracts.isqlite import ISQLite
 from slips_files.common.printer import Printer
 from slips_files.common.slips_utils import utils
+from slips_files.core.database.sqlite_db.payload_codec import PayloadCodec
 from slips_files.core.structures.alerts import Alert
 from slips_files.core.output import Output
 
+# the version of the tables, stored as the user_version of the db.
+# 1: flows stored as json in the flow column of the flows table
+# 2: the common fields of the flows stored in their own columns
+# 3: the payload_dicts table, for compressed payloads
+SCHEMA_VERSION = 3
+# the fields of conn flows that have their own column in the flows table,
+# {field: sqlite type}, the rest of the fields are stored as json in the
+# extra column
+FLOW_COLUMNS = {
+    "starttime": "REAL",
+    "saddr": "TEXT",
+    "sport": "TEXT",
+    "daddr": "TEXT",
+    "dport": "TEXT",
+    "proto": "TEXT",
+    "state": "TEXT",
+    "dur": "REAL",
+    "sbytes": "INTEGER",
+    "dbytes": "INTEGER",
+    "spkts": "INTEGER",
+    "dpkts": "INTEGER",
+}
+# the columns to select to build the flows back with to_flow()
+FLOW_FIELDS = f"uid, {', '.join(FLOW_COLUMNS)}, extra"
+# the number of flows copied per transaction when migrating old dbs
+MIGRATION_BATCH_SIZE = 10000
+
+
+def to_column_type(value, type_: str):
+    """
+    converts the given value the way sqlite does when storing it in a
+    column of the given type. values that aren't numbers are stored as
+    they are in the numeric columns
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        value = int(value)
+    if type_ == "TEXT":
+        return value if isinstance(value, str) else str(value)
+    if isinstance(value, str) and type_ == "INTEGER":
+        try:
+            return int(value)
+        except ValueError:
+            pass
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return value
+    if not math.isfinite(number):
+        return value
+    if type_ == "REAL":
+        return number
+    if isinstance(value, int):
+        return value
+    return int(number) if number.is_integer() else number
+
+
+def normalize_flow(flow: dict) -> dict:
+    """
+    returns the given flow the way to_flow() reads it back from the
+    flows table, with the uid first, then the FLOW_COLUMNS converted to
+    the types of their columns and then the rest of the fields.
+    used for the flows read from other places than sqlite, so readers
+    get the same flow wherever it's read from
+    """
+    extra = dict(flow)
+    normalized = {"uid": extra.pop("uid", None)}
+    for column, type_ in FLOW_COLUMNS.items():
+        normalized[column] = to_column_type(extra.pop(column, None), type_)
+    normalized.update(extra)
+    return normalized
+
 
 class SQLiteDB(ISQLite):
     """
@@ -23,9 +98,13 @@ class SQLiteDB(ISQLite):
 
     name = "SQLiteDB"
 
-    def __init__(self, logger: Output, output_dir: str):
+    def __init__(
+        self, logger: Output, output_dir: str, compress_flows: bool = False
+    ):
         self.printer = Printer(logger, self.name)
         self._flows_db = os.path.join(output_dir, "flows.sqlite")
+        # encodes the json payloads of the flows and altflows
+        self.codec = PayloadCodec(self, compress_flows)
 
         db_newly_created = False
         if not os.path.exists(self._flows_db):
@@ -39,6 +118,9 @@ class SQLiteDB(ISQLite):
         if db_newly_created:
             # only init tables if the db is newly created
             self.init_tables()
+            self.set_schema_version()
+        else:
+            self.migrate()
 
     def connect(self):
         """
@@ -54,17 +136,79 @@ class SQLiteDB(ISQLite):
 
     def init_tables(self):
         """creates the tables we're gonna use"""
+        flow_columns = ", ".join(
+            f"{column} {type_}" for column, type_ in FLOW_COLUMNS.items()
+        )
         table_schema = {
-            "flows": "uid TEXT PRIMARY KEY, flow TEXT, label TEXT, profileid "
-            "TEXT, twid TEXT, aid TEXT",
+            "flows": f"uid TEXT PRIMARY KEY, {flow_columns}, extra TEXT, "
+            "label TEXT, profileid TEXT, twid TEXT, aid TEXT",
             "altflows": "uid TEXT PRIMARY KEY, flow TEXT, label TEXT, "
             "profileid TEXT, twid TEXT, flow_type TEXT",
             "alerts": "alert_id TEXT PRIMARY KEY, alert_time TEXT, ip_alerted "
             "TEXT, timewindow TEXT, tw_start TEXT, tw_end TEXT, "
             "label TEXT",
+            "tw_features": "profileid TEXT, twid TEXT, features BLOB, "
+            "PRIMARY KEY (profileid, twid)",
+            # the dictionaries of the compressed payloads of each flow type
+            "payload_dicts": "id INTEGER PRIMARY KEY, flow_type TEXT, "
+            "compressor TEXT, dict BLOB",
         }
         for table_name, schema in table_schema.items():
             self.create_table(table_name, schema)
+        # the uid is already indexed by the primary key
+        self.execute(
+            "CREATE INDEX IF NOT EXISTS flows_profileid_twid "
+            "ON flows (profileid, twid)"
+        )
+        self.execute("CREATE INDEX IF NOT EXISTS flows_daddr ON flows (daddr)")
+
+    def get_schema_version(self) -> int:
+        cursor = self.execute("PRAGMA user_version")
+        return self.fetchone(cursor)[0]
+
+    def set_schema_version(self):
+        self.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def migrate(self):
+        """
+        upgrades the tables of a db created by an older version of slips,
+        e.g. when reading the output dir of a previous run.
+        only one process migrates the db, the rest wait for it
+        """
+        with open(f"{self.lockfile_name}.migration", "w") as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            if self.get_schema_version() >= SCHEMA_VERSION:
+                return
+
+            if "flow" in self.get_columns("flows"):
+                # version 1, the flows are json in the flow column
+                self.execute("ALTER TABLE flows RENAME TO flows_v1")
+            self.init_tables()
+            # is there if a previous migration was interrupted too
+            if self.get_columns("flows_v1"):
+                self.migrate_v1_flows()
+                self.execute("DROP TABLE flows_v1")
+            self.set_schema_version()
+
+    def migrate_v1_flows(self):
+        """copies the json flows of the flows_v1 table to the columns of
+        the flows table, in batches so they're never all in memory"""
+        aid = "aid" if "aid" in self.get_columns("flows_v1") else "NULL"
+        rowid = 0
+        while rows := self.fetchall(
+            self.execute(
+                f"SELECT rowid, flow, label, profileid, twid, {aid} "
+                "FROM flows_v1 WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (rowid, MIGRATION_BATCH_SIZE),
+            )
+        ):
+            rowid = rows[-1][0]
+            self.insert_flows(
+                [
+                    (json.loads(flow), profileid, twid, label, aid)
+                    for _, flow, label, profileid, twid, aid in rows
+                ]
+            )
 
     def _init_db(self):
         """
@@ -78,205 +222,234 @@ class SQLiteDB(ISQLite):
         """
         return self._flows_db
 
+    def add_payload_dict(
+        self, flow_type: str, compressor: str, dict_data: bytes
+    ) -> int:
+        """stores a compression dictionary, returns its id"""
+        cursor = self.execute(
+            "INSERT INTO payload_dicts (flow_type, compressor, dict) "
+            "VALUES (?, ?, ?);",
+            (flow_type, compressor, dict_data),
+        )
+        return cursor.lastrowid
+
+    def get_payload_dict(self, dict_id: int) -> bytes:
+        res = self.select(
+            "payload_dicts",
+            columns="dict",
+            condition="id = ?",
+            params=(dict_id,),
+            limit=1,
+        )
+        return res[0]
+
     def get_altflow_from_uid(self, profileid, twid, uid) -> dict:
         """Given a uid, get the alternative flow associated with it"""
-        condition = f'uid = "{uid}"'
-        altflow = self.select("altflows", condition=condition)
+        altflow = self.select(
+            "altflows",
+            columns="flow",
+            condition="uid = ?",
+            params=(uid,),
+            limit=1,
+        )
         if altflow:
-            flow: str = altflow[0][1]
-            return json.loads(flow)
+            return self.codec.decode(altflow[0])
         return False
 
-    def get_all_contacted_ips_in_profileid_twid(self, profileid, twid) -> dict:
-        all_flows: dict = self.get_all_flows_in_profileid_twid(profileid, twid)
-
-        if not all_flows:
-            return {}
+    def to_flow(self, row: tuple) -> dict:
+        """
+        builds the flow back from the FLOW_FIELDS columns of one row of
+        the flows table, with the uid first, then the FLOW_COLUMNS and
+        then the fields of the extra column
+        """
+        uid, *values, extra = row
+        flow = {"uid": uid}
+        flow.update(zip(FLOW_COLUMNS, values))
+        flow.update(self.codec.decode(extra))
+        return flow
+
+    def select_flows(self, condition=None, params=()) -> Dict[str, dict]:
+        """returns {uid: flow} of the flows matching the given condition"""
+        rows = self.select(
+            "flows", columns=FLOW_FIELDS, condition=condition, params=params
+        )
+        return {row[0]: self.to_flow(row) for row in rows or ()}
 
-        contacted_ips = {}
-        for uid, flow in all_flows.items():
-            # get the daddr of this flow
-            daddr = flow["daddr"]
-            contacted_ips[daddr] = uid
-        return contacted_ips
+    def get_all_contacted_ips_in_profileid_twid(self, profileid, twid) -> dict:
+        """returns {daddr: uid of the last flow to it}"""
+        rows = self.select(
+            "flows",
+            columns="daddr, uid",
+            condition="profileid = ? AND twid = ?",
+            params=(profileid, twid),
+            order_by="rowid",
+        )
+        return dict(rows or ())
 
     def get_all_flows_in_profileid_twid(self, profileid, twid):
-        condition = f'profileid = "{profileid}" ' f'AND twid = "{twid}"'
-        all_flows: list = self.select("flows", condition=condition)
-        if not all_flows:
-            return False
-        res = {}
-        for flow in all_flows:
-            uid = flow[0]
-            flow = flow[1]
-            res[uid] = json.loads(flow)
-        return res
+        return (
+            self.select_flows(
+                condition="profileid = ? AND twid = ?",
+                params=(profileid, twid),
+            )
+            or False
+        )
 
     def get_all_flows_in_profileid(self, profileid) -> Dict[str, dict]:
         """
         Return a list of all the flows in this profileid
         [{'uid':flow},...]
         """
-        condition = f'profileid = "{profileid}"'
-        flows = self.select("flows", condition=condition)
-        all_flows: Dict[str, dict] = {}
-        if flows:
-            for flow in flows:
-                uid = flow[0]
-                flow: str = flow[1]
-                all_flows[uid] = json.loads(flow)
-
-        return all_flows
+        return self.select_flows(
+            condition="profileid = ?", params=(profileid,)
+        )
 
     def get_all_flows(self):
         """
         Returns a list with all the flows in all profileids and twids
         Each element in the list is a flow
         """
-        flows = self.select("flows")
-        flow_list = []
-        if flows:
-            for flow in flows:
-                flow_list.append(json.loads(flow[1]))
-        return flow_list
+        return list(self.select_flows().values())
+
+    def get_rows_after(
+        self, table: str, columns: List[str], rowid: int, limit: int
+    ) -> List[tuple]:
+        """
+        Returns the (rowid, *columns) of up to limit rows of the given
+        table stored after the row with the given rowid, oldest first.
+        Used to read big tables in chunks, the rowid of the last row
+        returned is the rowid to give the next call
+        """
+        cursor = self.execute(
+            f"SELECT rowid, {', '.join(columns)} FROM {table} "
+            f"WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (rowid, limit),
+        )
+        if not cursor:
+            return []
+        return self.fetchall(cursor)
+
+    def get_flows_after(
+        self, rowid: int, limit: int
+    ) -> List[Tuple[int, dict, str]]:
+        """
+        Returns up to limit (rowid, flow, label) of the flows stored after
+        the flow with the given rowid, oldest first.
+        Used to read the flows added since the last read, the rowid of the
+        last flow returned is the rowid to give the next call
+        """
+        rows = self.get_rows_after(
+            "flows", ["label", FLOW_FIELDS], rowid, limit
+        )
+        return [(row[0], self.to_flow(row[2:]), row[1]) for row in rows]
+
+    def set_tw_features(self, profileid: str, twid: str, features: bytes):
+        self.execute(
+            "INSERT OR REPLACE INTO tw_features (profileid, twid, features) "
+            "VALUES (?, ?, ?);",
+            (profileid, twid, features),
+        )
+
+    def get_tw_features(self, profileid: str, twid: str) -> Optional[bytes]:
+        """returns the serialized features of the given closed tw, None
+        if they weren't computed"""
+        res = self.select(
+            "tw_features",
+            columns="features",
+            condition="profileid = ? AND twid = ?",
+            params=(profileid, twid),
+            limit=1,
+        )
+        return res[0] if res else None
 
     def set_flow_label(self, uids: List[str], new_label: str):
         """
         sets the given new_label to each flow in the uids list
         """
-        for uid in uids:
-            # add the label to the flow (conn.log flow)
-            query = f'UPDATE flows SET label="{new_label}" WHERE uid="{uid}"'
-            self.execute(query)
-            # add the label to the altflow (dns, http, whatever it is)
-            query = (
-                f'UPDATE altflows SET label="{new_label}" WHERE uid="{uid}"'
-            )
-            self.execute(query)
-
-    def export_labeled_flows(self, output_dir, format):
-        if "tsv" in format:
-            csv_output_file = os.path.join(output_dir, "labeled_flows.tsv")
-            header: list = self.get_columns("flows")
-
-            with open(csv_output_file, "w", newline="") as tsv_file:
-                writer = csv.writer(tsv_file, delimiter="\t")
-
-                # write the header
-                writer.writerow(header)
-
-                # Fetch rows one by one and write them to the file
-                for row in self.iterate_flows():
-                    writer.writerow(row)
-
-        if "json" in format:
-            json_output_file = os.path.join(output_dir, "labeled_flows.json")
-
-            with open(json_output_file, "w", newline="") as json_file:
-                # Fetch rows one by one and write them to the file
-                for row in self.iterate_flows():
-                    json_labeled_flow = {
-                        "uid": row[0],
-                        "flow": row[1],
-                        "label": row[2],
-                        "profileid": row[3],
-                        "twid": row[4],
-                    }
-                    json.dump(json_labeled_flow, json_file)
-                    json_file.write("\n")
+        params = [(new_label, uid) for uid in uids]
+        # add the label to the flow (conn.log flow)
+        self.executemany("UPDATE flows SET label = ? WHERE uid = ?", params)
+        # add the label to the altflow (dns, http, whatever it is)
+        self.executemany("UPDATE altflows SET label = ? WHERE uid = ?", params)
 
     def get_columns(self, table) -> list:
         """returns a list with column names in the given table"""
-        self.execute(f"PRAGMA table_info({table})")
-        columns = self.fetchall()
+        cursor = self.execute(f"PRAGMA table_info({table})")
+        columns = self.fetchall(cursor) if cursor else []
         return [column[1] for column in columns]
 
-    def iterate_flows(self):
-        """returns an iterator"""
-
-        # generator function to iterate over the rows
-        def row_generator():
-            # select all flows and altflows
-            self.execute(
-                "SELECT * FROM flows UNION SELECT uid, flow, label, profileid,"
-                " twid FROM altflows"
-            )
-
-            while True:
-                row = self.fetchone()
-                if row is None:
-                    break
-                yield row
-
-        # Return the combined iterator
-        return iter(row_generator())
-
     def get_flow(self, uid: str, twid=False) -> dict:
         """
         Returns the flow with the given uid
-        the flow returned is read from conn.log
+        the flow returned is read from conn.log, as json
         """
-        condition = f'uid = "{uid}"'
+        condition = "uid = ?"
+        params = (uid,)
         if twid:
-            condition += f'AND twid = "{twid}"'
+            condition += " AND twid = ?"
+            params += (twid,)
 
-        res = self.select("flows", condition=condition)
-        res = res[0][1] if res else {}
-        return {uid: res}
+        flows = self.select_flows(condition=condition, params=params)
+        return {uid: json.dumps(flows[uid]) if uid in flows else {}}
 
-    def add_flow(self, flow, profileid: str, twid: str, label="benign"):
-        if hasattr(flow, "aid"):
-            parameters = (
-                profileid,
-                twid,
-                flow.uid,
-                json.dumps(asdict(flow)),
-                label,
-                flow.aid,
-            )
-            self.execute(
-                "INSERT OR REPLACE INTO flows (profileid, twid, uid, flow, label, aid) "
-                "VALUES (?, ?, ?, ?, ?, ?);",
-                parameters,
-            )
-        else:
-            parameters = (
-                profileid,
-                twid,
-                flow.uid,
-                json.dumps(asdict(flow)),
-                label,
-            )
+    def insert_flows(self, flows: List[Tuple[dict, str, str, str, str]]):
+        """
+        stores the given (flow, profileid, twid, label, aid) in the flows
+        table in one transaction
+        :param flows: the flows are dicts of the fields of the flow
+        dataclasses, their common fields are stored in their columns and
+        the rest in the extra column
+        """
+        rows = []
+        for flow, profileid, twid, label, aid in flows:
+            extra = dict(flow)
+            uid = extra.pop("uid")
+            values = [extra.pop(column, None) for column in FLOW_COLUMNS]
+            extra = self.codec.encode(extra, extra.get("type_") or "conn")
+            rows.append((uid, *values, extra, label, profileid, twid, aid))
+
+        placeholders = ", ".join(["?"] * (len(FLOW_COLUMNS) + 6))
+        self.executemany(
+            f"INSERT OR REPLACE INTO flows ({FLOW_FIELDS}, label, "
+            f"profileid, twid, aid) VALUES ({placeholders});",
+            rows,
+        )
 
-            self.execute(
-                "INSERT OR REPLACE INTO flows (profileid, twid, uid, flow, label) "
-                "VALUES (?, ?, ?, ?, ?);",
-                parameters,
-            )
+    def add_flow(self, flow, profileid: str, twid: str, label="benign"):
+        # aid is an attribute of conn flows, not one of their fields
+        aid = getattr(flow, "aid", None)
+        self.insert_flows([(asdict(flow), profileid, twid, label, aid)])
 
     def get_flows_count(self, profileid=None, twid=None) -> int:
         """
         returns the total number of flows
          in the db for this profileid and twid if given
         """
-        condition = ""
+        conditions = []
+        params = ()
         if profileid:
-            condition = f'profileid="{profileid}"'
-        elif twid and not profileid:
-            condition += f'twid= "{twid}"'
-        elif profileid and twid:
-            condition += f'AND twid= "{twid}"'
-
-        flows = self.get_count("flows", condition=condition)
-        # flows += self.get_count('altflows', condition=condition)
-        return flows
+            conditions.append("profileid = ?")
+            params += (profileid,)
+        if twid:
+            conditions.append("twid = ?")
+            params += (twid,)
+
+        res = self.select(
+            "flows",
+            columns="COUNT(*)",
+            condition=" AND ".join(conditions) or None,
+            params=params,
+            limit=1,
+        )
+        # altflows aren't counted
+        return res[0] if res else None
 
     def add_altflow(self, flow, profileid: str, twid: str, label="benign"):
         parameters = (
             profileid,
             twid,
             flow.uid,
-            json.dumps(asdict(flow)),
+            self.codec.encode(asdict(flow), flow.type_),
             label,
             flow.type_,
         )
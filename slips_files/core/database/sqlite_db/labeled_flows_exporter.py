@@ -0,0 +1,235 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+"""
+Exports the labeled flows and altflows of the sqlite db to files.
+The rows are read in chunks ordered by rowid and each chunk is written
+before reading the next one, so the memory used doesn't depend on the
+number of flows
+"""
+
+import csv
+import json
+import os
+import time
+from typing import (
+    Iterator,
+    List,
+    Tuple,
+)
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from slips_files.core.database.sqlite_db.database import (
+    FLOW_COLUMNS,
+    SQLiteDB,
+)
+
+# the format the flows are exported to when the configured one isn't
+# available
+DEFAULT_FORMAT = "json"
+# formats that need pyarrow
+ARROW_FORMATS = ("parquet", "arrow")
+SUPPORTED_FORMATS = ("tsv", DEFAULT_FORMAT) + ARROW_FORMATS
+# the columns of the tsv and json files, the flows are json in the flow
+# column
+LEGACY_COLUMNS = ("uid", "flow", "label", "profileid", "twid")
+ALTFLOW_COLUMNS = ("uid", "label", "profileid", "twid", "flow_type", "flow")
+FLOW_INFO_COLUMNS = ("uid", "label", "profileid", "twid", "aid")
+
+
+def get_flow_columns() -> List[str]:
+    """
+    returns the columns to select from the flows table for the arrow
+    formats. sqlite doesn't enforce the types of the columns, values
+    that aren't of the type of their column are exported as nulls
+    """
+    columns = list(FLOW_INFO_COLUMNS)
+    for column, type_ in FLOW_COLUMNS.items():
+        if type_ == "TEXT":
+            columns.append(column)
+        else:
+            columns.append(
+                f"CASE WHEN typeof({column}) IN ('integer', 'real') "
+                f"THEN CAST({column} AS {type_}) END"
+            )
+    columns.append("extra")
+    return columns
+
+
+def get_arrow_schema(columns: Tuple[str, ...]):
+    types = {"REAL": pyarrow.float64(), "INTEGER": pyarrow.int64()}
+    return pyarrow.schema(
+        [
+            (column, types.get(FLOW_COLUMNS.get(column), pyarrow.string()))
+            for column in columns
+        ]
+    )
+
+
+class LabeledFlowsExporter:
+    """
+    Exports the labeled flows to the output dir, as labeled_flows.<ext>,
+    in one of SUPPORTED_FORMATS:
+    - tsv and json: one row per flow and altflow with the flow as json.
+    the json file has one json object per line
+    - parquet and arrow (IPC file format): one column per field of the
+    conn flows. altflows have different fields per type, so they're
+    exported to labeled_altflows.<ext> with the flow as json
+    """
+
+    def __init__(self, db: SQLiteDB, output_dir: str, chunk_size=10000):
+        self.db = db
+        self.output_dir = output_dir
+        self.chunk_size = chunk_size
+
+    def get_format(self, format_: str) -> str:
+        format_ = format_.lower()
+        if format_ not in SUPPORTED_FORMATS:
+            self.db.print(
+                f"Unsupported export format: {format_}. Exporting to "
+                f"{DEFAULT_FORMAT} instead.",
+                0,
+                1,
+            )
+            return DEFAULT_FORMAT
+
+        if format_ in ARROW_FORMATS and pyarrow is None:
+            self.db.print(
+                f"pyarrow is needed for exporting to {format_} and it's not "
+                f"installed. Exporting to {DEFAULT_FORMAT} instead.",
+                0,
+                1,
+            )
+            return DEFAULT_FORMAT
+        return format_
+
+    def get_path(self, name: str, format_: str) -> str:
+        return os.path.join(self.output_dir, f"{name}.{format_}")
+
+    def iterate_chunks(self, table: str, columns) -> Iterator[List[tuple]]:
+        """yields the given columns of the rows of the given table,
+        chunk_size rows at a time"""
+        rowid = 0
+        while rows := self.db.get_rows_after(
+            table, columns, rowid, self.chunk_size
+        ):
+            rowid = rows[-1][0]
+            yield [row[1:] for row in rows]
+            if len(rows) < self.chunk_size:
+                break
+
+    def iterate_legacy_rows(self) -> Iterator[List[tuple]]:
+        """yields chunks of LEGACY_COLUMNS rows of the flows and then of
+        the altflows"""
+        flow_fields = ["uid", *FLOW_COLUMNS, "extra"]
+        for chunk in self.iterate_chunks(
+            "flows", ["label", "profileid", "twid", *flow_fields]
+        ):
+            yield [
+                (row[3], json.dumps(self.db.to_flow(row[3:]))) + row[:3]
+                for row in chunk
+            ]
+        for chunk in self.iterate_chunks("altflows", LEGACY_COLUMNS):
+            yield [
+                (uid, self.db.codec.to_json(flow), *info)
+                for uid, flow, *info in chunk
+            ]
+
+    def export_tsv(self) -> int:
+        rows_written = 0
+        with open(
+            self.get_path("labeled_flows", "tsv"), "w", newline=""
+        ) as tsv_file:
+            writer = csv.writer(tsv_file, delimiter="\t")
+            writer.writerow(LEGACY_COLUMNS)
+            for chunk in self.iterate_legacy_rows():
+                writer.writerows(chunk)
+                rows_written += len(chunk)
+        return rows_written
+
+    def export_json(self) -> int:
+        rows_written = 0
+        with open(
+            self.get_path("labeled_flows", "json"), "w", newline=""
+        ) as json_file:
+            for chunk in self.iterate_legacy_rows():
+                json_file.writelines(
+                    json.dumps(dict(zip(LEGACY_COLUMNS, row))) + "\n"
+                    for row in chunk
+                )
+                rows_written += len(chunk)
+        return rows_written
+
+    def export_table_to_arrow(
+        self,
+        table: str,
+        columns: List[str],
+        names: Tuple[str, ...],
+        format_: str,
+    ) -> int:
+        """writes each chunk of the given table as a record batch of a
+        parquet or arrow file"""
+        schema = get_arrow_schema(names)
+        path = self.get_path(f"labeled_{table}", format_)
+        if format_ == "parquet":
+            writer = pyarrow.parquet.ParquetWriter(path, schema)
+        else:
+            writer = pyarrow.ipc.new_file(path, schema)
+
+        rows_written = 0
+        with writer:
+            for chunk in self.iterate_chunks(table, columns):
+                # the json payload is the last column
+                chunk = [
+                    (*row[:-1], self.db.codec.to_json(row[-1]))
+                    for row in chunk
+                ]
+                batch = pyarrow.RecordBatch.from_arrays(
+                    [
+                        pyarrow.array(values, type=field.type)
+                        for values, field in zip(zip(*chunk), schema)
+                    ],
+                    schema=schema,
+                )
+                if format_ == "parquet":
+                    writer.write_table(pyarrow.Table.from_batches([batch]))
+                else:
+                    writer.write_batch(batch)
+                rows_written += len(chunk)
+        return rows_written
+
+    def export_arrow(self, format_: str) -> int:
+        flow_names = (*FLOW_INFO_COLUMNS, *FLOW_COLUMNS, "extra")
+        return self.export_table_to_arrow(
+            "flows", get_flow_columns(), flow_names, format_
+        ) + self.export_table_to_arrow(
+            "altflows", list(ALTFLOW_COLUMNS), ALTFLOW_COLUMNS, format_
+        )
+
+    def export(self, format_: str) -> int:
+        """
+        exports all flows and altflows in the given format
+        returns the number of rows exported
+        """
+        format_ = self.get_format(format_)
+        start_time = time.monotonic()
+        if format_ == "tsv":
+            rows = self.export_tsv()
+        elif format_ == "json":
+            rows = self.export_json()
+        else:
+            rows = self.export_arrow(format_)
+
+        duration = time.monotonic() - start_time
+        self.db.print(
+            f"Exported {rows} labeled flows to {format_} in "
+            f"{duration:.2f}s ({rows / max(duration, 1e-6):.0f} rows/s).",
+            2,
+            0,
+        )
+        return rows
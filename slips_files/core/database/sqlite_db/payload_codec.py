@@ -0,0 +1,259 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+"""
+Encodes the fields of the flows that are stored in the sqlite db as one
+payload, the extra column of the flows table and the flow column of the
+altflows table.
+
+Payloads stored as text are plain json, that's how they're stored when
+compression is disabled and how older versions of slips stored them.
+Compressed payloads are stored as blobs that start with a header with
+the codec used and the id of the compression dictionary, so dbs with
+both kinds of payloads are readable.
+"""
+
+import json
+import struct
+import zlib
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# codec id, dictionary id. the dictionary id is 0 for payloads compressed
+# without a dictionary
+HEADER = struct.Struct(">BH")
+# {codec id: (serializer, compressor)}
+CODECS = {
+    1: ("json", "zlib"),
+    2: ("json", "zstd"),
+    3: ("msgpack", "zlib"),
+    4: ("msgpack", "zstd"),
+}
+# the number of payloads of each flow type used to build its dictionary
+DICT_SAMPLES = 256
+# the max size of the dictionaries. zlib hashes the whole dict for each
+# payload, bigger dicts make the payloads a bit smaller but their
+# compression much slower
+DICT_SIZE = {"zlib": 8 * 1024, "zstd": 16 * 1024}
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def get_best_codec() -> int:
+    """returns the id of the best codec with the libs installed"""
+    serializer = "msgpack" if msgpack else "json"
+    compressor = "zstd" if zstandard else "zlib"
+    return next(
+        codec
+        for codec, names in CODECS.items()
+        if names == (serializer, compressor)
+    )
+
+
+def get_missing_libs(codec: int) -> List[str]:
+    """returns the pip packages needed for the given codec that
+    aren't installed"""
+    libs = {"msgpack": ("msgpack", msgpack), "zstd": ("zstandard", zstandard)}
+    return [
+        libs[name][0]
+        for name in CODECS[codec]
+        if name in libs and libs[name][1] is None
+    ]
+
+
+def serialize(serializer: str, payload: dict) -> bytes:
+    if serializer == "msgpack":
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+def deserialize(serializer: str, data: bytes) -> dict:
+    if serializer == "msgpack":
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+def build_dict(compressor: str, samples: List[bytes]) -> bytes:
+    """
+    builds the compression dictionary of a flow type from some of its
+    serialized payloads.
+    zstd dictionaries are trained with the samples. zlib dictionaries
+    are the samples themselves, zlib finds the repeated strings of each
+    payload in them
+    """
+    size = DICT_SIZE[compressor]
+    if compressor == "zstd":
+        try:
+            return zstandard.train_dictionary(size, samples).as_bytes()
+        except zstandard.ZstdError:
+            # too few or too similar samples to train a dictionary,
+            # use them as a raw content dictionary instead
+            pass
+    # zlib prefers the strings at the end of the dictionary
+    return b"".join(samples)[-size:]
+
+
+class PayloadCodec:
+    """
+    Encodes and decodes the payloads of the flows.
+
+    When compression is enabled, the first DICT_SAMPLES payloads of each
+    flow type are compressed without a dictionary and used to build one
+    for the flow type, which is stored in the db and used for the rest
+    of its payloads. Flows of the same type have mostly the same field
+    names and many common values, so small payloads compress much
+    better with a dictionary
+    """
+
+    def __init__(self, db, compress: bool):
+        """
+        :param db: the SQLiteDB that stores the dictionaries, with
+        add_payload_dict() and get_payload_dict()
+        :param compress: encode the payloads as compressed blobs instead
+        of json
+        """
+        self.db = db
+        self.compress = compress
+        self.codec = get_best_codec()
+        # {flow_type: [serialized payloads]} used to build the dicts
+        self.samples: Dict[str, List[bytes]] = {}
+        # {flow_type: id of the dict used for encoding its payloads}
+        self.dict_ids: Dict[str, int] = {}
+        # {(compressor, dict_id): compressor or decompressor}, zlib ones
+        # are the dict itself, zlib objects can't be reused for many
+        # payloads. payloads without a dict have the same dict id with
+        # any compressor
+        self.compressors: Dict[Tuple[str, int], object] = {}
+        self.decompressors: Dict[Tuple[str, int], object] = {}
+        # the codecs of the payloads decoded so far, with their libs
+        # installed
+        self.readable_codecs: Set[int] = set()
+
+    def get_dict_id(self, flow_type: str, sample: bytes) -> int:
+        """
+        returns the id of the dict to encode the payloads of the given
+        flow type with, 0 if there's none yet.
+        until there is one, keeps the given serialized payload as one of
+        the samples to build it with
+        """
+        if flow_type in self.dict_ids:
+            return self.dict_ids[flow_type]
+
+        samples = self.samples.setdefault(flow_type, [])
+        samples.append(sample)
+        if len(samples) < DICT_SAMPLES:
+            return 0
+
+        compressor = CODECS[self.codec][1]
+        dict_data = build_dict(compressor, samples)
+        dict_id = self.db.add_payload_dict(flow_type, compressor, dict_data)
+        self.dict_ids[flow_type] = dict_id
+        del self.samples[flow_type]
+        return dict_id
+
+    def get_dict(self, compressor: str, dict_id: int):
+        """returns the dict with the given id the way the given
+        compressor uses it"""
+        if not dict_id:
+            return None if compressor == "zstd" else b""
+        dict_data: bytes = self.db.get_payload_dict(dict_id)
+        if compressor == "zstd":
+            return zstandard.ZstdCompressionDict(dict_data)
+        return dict_data
+
+    def get_compressor(self, compressor: str, dict_id: int):
+        key = (compressor, dict_id)
+        if key not in self.compressors:
+            dict_data = self.get_dict(compressor, dict_id)
+            if compressor == "zstd":
+                # the dict id is in the header already
+                dict_data = zstandard.ZstdCompressor(
+                    level=ZSTD_LEVEL, dict_data=dict_data, write_dict_id=False
+                )
+            self.compressors[key] = dict_data
+        return self.compressors[key]
+
+    def get_decompressor(self, compressor: str, dict_id: int):
+        key = (compressor, dict_id)
+        if key not in self.decompressors:
+            dict_data = self.get_dict(compressor, dict_id)
+            if compressor == "zstd":
+                dict_data = zstandard.ZstdDecompressor(dict_data=dict_data)
+            self.decompressors[key] = dict_data
+        return self.decompressors[key]
+
+    def encode(self, payload: dict, flow_type: str) -> Union[str, bytes]:
+        if not self.compress:
+            return json.dumps(payload)
+
+        serializer, compressor = CODECS[self.codec]
+        data = serialize(serializer, payload)
+        dict_id = self.get_dict_id(flow_type, data)
+        compressor_obj = self.get_compressor(compressor, dict_id)
+        if compressor == "zstd":
+            data = compressor_obj.compress(data)
+        else:
+            # raw deflate, without the zlib header and checksum
+            zlib_compressor = zlib.compressobj(
+                ZLIB_LEVEL, zlib.DEFLATED, -15, zdict=compressor_obj
+            )
+            data = zlib_compressor.compress(data) + zlib_compressor.flush()
+        return HEADER.pack(self.codec, dict_id) + data
+
+    def check_libs(self, codec: int):
+        """
+        raises ImportError if the libs needed for decoding the payloads
+        of the given codec aren't installed. the db may have been written
+        by slips running with other libs installed
+        """
+        if missing := get_missing_libs(codec):
+            raise ImportError(
+                f"{' and '.join(missing)} is needed for reading the "
+                f"{'/'.join(CODECS[codec])} flows of the sqlite db and "
+                f"it's not installed. Install it with: pip install "
+                f"{' '.join(missing)}"
+            )
+        self.readable_codecs.add(codec)
+
+    def decode(self, value: Optional[Union[str, bytes]]) -> dict:
+        """decodes a payload stored by any version of slips"""
+        if not value:
+            return {}
+        if isinstance(value, str):
+            return json.loads(value)
+
+        codec, dict_id = HEADER.unpack_from(value)
+        if codec not in self.readable_codecs:
+            self.check_libs(codec)
+        serializer, compressor = CODECS[codec]
+        data = memoryview(value)[HEADER.size :]
+        decompressor = self.get_decompressor(compressor, dict_id)
+        if compressor == "zstd":
+            data = decompressor.decompress(data)
+        else:
+            zlib_decompressor = zlib.decompressobj(-15, zdict=decompressor)
+            data = zlib_decompressor.decompress(data)
+            data += zlib_decompressor.flush()
+        return deserialize(serializer, data)
+
+    def to_json(self, value: Optional[Union[str, bytes]]) -> Optional[str]:
+        """returns the given payload as json without decoding the ones
+        that already are"""
+        if value is None or isinstance(value, str):
+            return value
+        return json.dumps(self.decode(value))
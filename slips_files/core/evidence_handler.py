@@ -20,11 +20,19 @@
 # Contact: eldraco@gmail.com, sebastian.garcia@agents.fel.cvut.cz,
 # stratosphere@aic.fel.cvut.cz
 
+import copy
 import json
+from dataclasses import (
+    dataclass,
+    field,
+)
 from typing import (
+    Iterable,
     List,
     Dict,
     Optional,
+    Set,
+    Tuple,
 )
 from datetime import datetime
 from os import path
@@ -57,6 +65,26 @@ from slips_files.core.text_formatters.evidence import EvidenceFormatter
 IS_IN_A_DOCKER_CONTAINER = os.environ.get("IS_IN_A_DOCKER_CONTAINER", False)
 
 
+@dataclass
+class TWEvidence:
+    """
+    the evidence of a profile in a timewindow, kept in memory so we don't
+    re-read and re-parse all of them from the db every time the threshold
+    is crossed
+    """
+
+    # evidence that can be a part of the next alert of this profile and tw.
+    # {evidence_id: Evidence}
+    evidence: Dict[str, Evidence] = field(default_factory=dict)
+    # ids of the evidence that were part of a past alert in this tw
+    past_alert_ids: Set[str] = field(default_factory=set)
+
+    def mark_as_alerted(self, evidence_ids: Iterable[str]):
+        for evidence_id in evidence_ids:
+            self.evidence.pop(evidence_id, None)
+            self.past_alert_ids.add(evidence_id)
+
+
 # Evidence Process
 class EvidenceHandler(ICore):
     name = "EvidenceHandler"
@@ -82,10 +110,15 @@ class EvidenceHandler(ICore):
 
         self.c1 = self.db.subscribe("evidence_added")
         self.c2 = self.db.subscribe("new_blame")
+        self.c3 = self.db.subscribe("tw_closed")
         self.channels = {
             "evidence_added": self.c1,
             "new_blame": self.c2,
+            "tw_closed": self.c3,
         }
+        # the evidence of each profile and tw, updated with every new
+        # evidence and deleted when the tw is closed
+        self.tw_evidence: Dict[Tuple[str, str], TWEvidence] = {}
 
         # clear output/alerts.log
         self.logfile = self.clean_file(self.output_dir, "alerts.log")
@@ -266,20 +299,50 @@ class EvidenceHandler(ICore):
         self, profileid: str, twid: str
     ) -> Optional[Dict[str, Evidence]]:
         """
-        filters and returns all the evidence for this profile in this TW
+        returns the evidence of this profile in this TW that weren't part
+        of a past alert
         returns the dict with filtered evidence
         """
-        tw_evidence: Dict[str, dict] = self.db.get_twid_evidence(
-            profileid, twid
-        )
-        if not tw_evidence:
+        tw_evidence: TWEvidence = self.get_tw_evidence(profileid, twid)
+        if not tw_evidence.evidence:
             return
+        return dict(tw_evidence.evidence)
+
+    def get_tw_evidence(self, profileid: str, twid: str) -> TWEvidence:
+        """
+        returns the evidence we have in memory for the given profile and
+        tw. they're loaded from the db only the first time we see this
+        profile and tw, or if an evidence arrives after the tw was closed
+        """
+        key = (profileid, twid)
+        if key not in self.tw_evidence:
+            self.tw_evidence[key] = self.load_tw_evidence(profileid, twid)
+        return self.tw_evidence[key]
 
-        past_evidence_ids: List[str] = (
+    def load_tw_evidence(self, profileid: str, twid: str) -> TWEvidence:
+        """
+        reads the past alerts and the filtered evidence of this profile in
+        this tw from the db
+        """
+        past_evidence_ids: Set[str] = set(
             self.get_evidence_that_were_part_of_a_past_alert(profileid, twid)
         )
+        return TWEvidence(
+            evidence=self.get_filtered_evidence_from_db(
+                profileid, twid, past_evidence_ids
+            ),
+            past_alert_ids=past_evidence_ids,
+        )
 
+    def get_filtered_evidence_from_db(
+        self, profileid: str, twid: str, past_evidence_ids: Set[str]
+    ) -> Dict[str, Evidence]:
+        tw_evidence: Dict[str, dict] = self.db.get_twid_evidence(
+            profileid, twid
+        )
         filtered_evidence = {}
+        if not tw_evidence:
+            return filtered_evidence
 
         for id, evidence in tw_evidence.items():
             id: str
@@ -307,7 +370,7 @@ class EvidenceHandler(ICore):
         return filtered_evidence
 
     def is_filtered_evidence(
-        self, evidence: Evidence, past_evidence_ids: List[str]
+        self, evidence: Evidence, past_evidence_ids: Iterable[str]
     ):
         """
         filters the following
@@ -503,6 +566,16 @@ class EvidenceHandler(ICore):
         # 1 min passed since the last evidence with no new msgs. stop.
         return True
 
+    def handle_tw_closed(self, msg: dict):
+        """
+        forgets the evidence of the closed tw. if more evidence arrive
+        for it later, they're read from the db again
+        """
+        profileid_tw = msg["data"].split("_")
+        profileid = f"{profileid_tw[0]}_{profileid_tw[1]}"
+        twid = profileid_tw[-1]
+        self.tw_evidence.pop((profileid, twid), None)
+
     def pre_main(self):
         self.print(f"Using threshold: {green(self.detection_threshold)}")
 
@@ -531,6 +604,16 @@ class EvidenceHandler(ICore):
                     self.db.delete_evidence(profileid, twid, evidence.id)
                     continue
 
+                tw_evidence: TWEvidence = self.get_tw_evidence(profileid, twid)
+                past_evidence_ids: Set[str] = tw_evidence.past_alert_ids
+                is_filtered: bool = self.is_filtered_evidence(
+                    evidence, past_evidence_ids
+                )
+                if not is_filtered:
+                    # a copy bc the description of the evidence is
+                    # changed below for logging
+                    tw_evidence.evidence[evidence.id] = copy.copy(evidence)
+
                 # convert time to local timezone
                 if self.is_running_non_stop:
                     timestamp: datetime = utils.convert_to_local_timezone(
@@ -555,13 +638,8 @@ class EvidenceHandler(ICore):
                     evidence.profile.ip, evidence.victim, evidence_type
                 )
 
-                past_evidence_ids: List[str] = (
-                    self.get_evidence_that_were_part_of_a_past_alert(
-                        profileid, twid
-                    )
-                )
                 # filtered evidence dont add to the acc threat level
-                if not self.is_filtered_evidence(evidence, past_evidence_ids):
+                if not is_filtered:
                     accumulated_threat_level: float = (
                         self.update_accumulated_threat_level(evidence)
                     )
@@ -590,9 +668,11 @@ class EvidenceHandler(ICore):
                     accumulated_threat_level
                     >= self.detection_threshold_in_this_width
                 ):
-                    tw_evidence: Dict[str, Evidence]
-                    tw_evidence = self.get_evidence_for_tw(profileid, twid)
-                    if tw_evidence:
+                    evidence_to_alert: Optional[Dict[str, Evidence]]
+                    evidence_to_alert = self.get_evidence_for_tw(
+                        profileid, twid
+                    )
+                    if evidence_to_alert:
                         tw_start, tw_end = self.db.get_tw_limits(
                             profileid, twid
                         )
@@ -604,9 +684,13 @@ class EvidenceHandler(ICore):
                             timewindow=evidence.timewindow,
                             last_evidence=evidence,
                             accumulated_threat_level=accumulated_threat_level,
-                            correl_id=list(tw_evidence.keys()),
+                            correl_id=list(evidence_to_alert.keys()),
                         )
-                        self.handle_new_alert(alert, tw_evidence)
+                        tw_evidence.mark_as_alerted(alert.correl_id)
+                        self.handle_new_alert(alert, evidence_to_alert)
+
+            if msg := self.get_msg("tw_closed"):
+                self.handle_tw_closed(msg)
 
             if msg := self.get_msg("new_blame"):
                 data = msg["data"]
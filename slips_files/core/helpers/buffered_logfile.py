@@ -0,0 +1,206 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import fcntl
+import os
+import threading
+import time
+from multiprocessing import util
+from typing import (
+    List,
+    Optional,
+)
+
+
+class BufferedLogFile:
+    """
+    Keeps a logfile open and writes lines to it in batches instead of
+    opening and closing it for every line.
+
+    The buffered lines are written to disk when they reach
+    max_buffer_size bytes, every flush_interval seconds, and when the
+    process exits.
+
+    Every slips process has its own buffer and its own O_APPEND fd, a
+    forked process starts with an empty buffer instead of the one of its
+    parent. Each flush is one write of whole lines to the end of the
+    file, so the lines of different processes are never mixed, they're
+    in the order their batches were flushed.
+
+    If max_size is set, the file is rotated once it reaches max_size bytes,
+    keeping the given number of backups (slips.log.1, slips.log.2, ...)
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = 1,
+        max_buffer_size: int = 64 * 1024,
+        max_size: int = 0,
+        backups: int = 3,
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_buffer_size = max_buffer_size
+        self.max_size = max_size
+        self.backups = max(1, backups)
+        self.lines_written = 0
+        self.fd: Optional[int] = None
+        self._init_process_state()
+
+    def _init_process_state(self):
+        """
+        initializes everything that can't be shared with the parent
+        process
+        """
+        # the fd of the parent, when we're in a forked child
+        if self.fd is not None:
+            os.close(self.fd)
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.buffer: List[str] = []
+        self.buffered_bytes = 0
+        self.last_flush_time = time.monotonic()
+        self.fd = None
+        self.flusher: Optional[threading.Thread] = None
+        self.stop_flusher = threading.Event()
+        # flush whatever is left when this process exits
+        util.Finalize(self, self.close, exitpriority=10)
+
+    def _check_process(self):
+        if self.pid != os.getpid():
+            # we're in a forked child, the buffer and the fd are the
+            # parent's
+            self._init_process_state()
+
+    def write(self, line: str):
+        self._check_process()
+        with self.lock:
+            self.buffer.append(line)
+            self.buffered_bytes += len(line)
+            if (
+                self.buffered_bytes >= self.max_buffer_size
+                or time.monotonic() - self.last_flush_time
+                >= self.flush_interval
+            ):
+                self._flush()
+
+            if self.flusher is None:
+                self._start_flusher()
+
+    def _start_flusher(self):
+        """
+        starts a thread that flushes the buffer every flush_interval
+        seconds, so lines don't stay in the buffer when nothing else is
+        written
+        """
+        self.flusher = threading.Thread(
+            target=self._flush_periodically,
+            args=(self.stop_flusher,),
+            daemon=True,
+            name=f"flush_{os.path.basename(self.path)}",
+        )
+        self.flusher.start()
+
+    def _flush_periodically(self, stop: threading.Event):
+        while not stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        self._check_process()
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        """writes the buffered lines. the caller must hold the lock"""
+        self.last_flush_time = time.monotonic()
+        if not self.buffer:
+            return
+
+        if self.fd is None:
+            self._open()
+
+        data = "".join(self.buffer).encode()
+        if self.max_size:
+            self._write_and_rotate(data)
+        else:
+            self._write(data)
+        self.lines_written += len(self.buffer)
+        self.buffer.clear()
+        self.buffered_bytes = 0
+
+    def _open(self):
+        self.fd = os.open(
+            self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+        )
+
+    def _write(self, data: bytes):
+        while data:
+            data = data[os.write(self.fd, data) :]
+
+    def _write_and_rotate(self, data: bytes):
+        """
+        the processes writing to the file take a lock on it before
+        writing, so only one of them rotates it and the others write to
+        the new file instead of the rotated one
+        """
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            # another process may have rotated it while we were waiting
+            while self._was_rotated():
+                self._reopen()
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+            self._write(data)
+            if self._rotate():
+                self._reopen()
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _was_rotated(self) -> bool:
+        """returns True if the path isn't the file we're writing to
+        anymore"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            # deleted by someone else
+            return True
+        # another process rotated it, we're writing to a backup
+        return stat.st_ino != os.fstat(self.fd).st_ino
+
+    def _rotate(self) -> bool:
+        """
+        rotates the file if it reached max_size. the caller must hold the
+        lock of the file.
+        returns True if it was rotated
+        """
+        if os.fstat(self.fd).st_size < self.max_size:
+            return False
+
+        for backup in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{backup}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{backup + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        return True
+
+    def _reopen(self):
+        """closes the fd, releasing its lock, and opens the file at the
+        path"""
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self._open()
+
+    def close(self):
+        """
+        flushes the buffered lines and closes the file. writing to it
+        after closing it opens it again
+        """
+        if self.pid != os.getpid():
+            return
+        self.stop_flusher.set()
+        with self.lock:
+            self._flush()
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+        self.flusher = None
+        self.stop_flusher = threading.Event()
@@ -20,11 +20,13 @@ import sys
 from pathlib import Path
 from datetime import datetime
 import os
+from typing import Dict
 
 from slips_files.common.abstracts.iobserver import IObserver
 from slips_files.common.parsers.config_parser import ConfigParser
 from slips_files.common.slips_utils import utils
 from slips_files.common.style import red, yellow
+from slips_files.core.helpers.buffered_logfile import BufferedLogFile
 
 
 class Output(IObserver):
@@ -35,9 +37,10 @@ class Output(IObserver):
     """
 
     name = "Output"
-    slips_logfile_lock = Lock()
-    errors_logfile_lock = Lock()
     cli_lock = Lock()
+    # rotate the logfiles once they reach this size in bytes. 0 means never
+    max_logfile_size = 0
+    logfile_backups = 3
 
     def __init__(
         self,
@@ -58,6 +61,9 @@ class Output(IObserver):
         self.input_type = input_type
         self.errors_logfile = stderr
         self.slips_logfile = slips_logfile
+        # {path: BufferedLogFile}. the logfiles are kept open instead of
+        # being opened for every line
+        self.logfiles: Dict[str, BufferedLogFile] = {}
 
         if self.verbose > 2:
             print(f"Verbosity: {self.verbose}. Debugging: {self.debug}")
@@ -84,6 +90,26 @@ class Output(IObserver):
         self.printable_twid_width = conf.get_tw_width()
         self.GID = conf.get_GID()
         self.UID = conf.get_UID()
+        self.max_logfile_size = conf.max_logfile_size()
+        self.logfile_backups = conf.logfile_backups()
+
+    def get_logfile(self, path: str) -> BufferedLogFile:
+        if path not in self.logfiles:
+            self.logfiles[path] = BufferedLogFile(
+                path,
+                max_size=self.max_logfile_size,
+                backups=self.logfile_backups,
+            )
+        return self.logfiles[path]
+
+    def flush(self):
+        """writes all the buffered lines to the logfiles"""
+        for logfile in self.logfiles.values():
+            logfile.flush()
+
+    def close(self):
+        for logfile in self.logfiles.values():
+            logfile.close()
 
     def log_branch_info(self, logfile: str):
         """
@@ -129,11 +155,9 @@ class Output(IObserver):
         sender, msg = msg["from"], msg["txt"]
 
         date_time = utils.get_human_readable_datetime()
-
-        self.slips_logfile_lock.acquire()
-        with open(self.slips_logfile, "a") as slips_logfile:
-            slips_logfile.write(f"{date_time} [{sender}] {msg}\n")
-        self.slips_logfile_lock.release()
+        self.get_logfile(self.slips_logfile).write(
+            f"{date_time} [{sender}] {msg}\n"
+        )
 
     def print(self, sender: str, txt: str, end="\n"):
         """
@@ -158,11 +182,9 @@ class Output(IObserver):
         Log error line to errors.log
         """
         date_time = utils.get_human_readable_datetime()
-
-        self.errors_logfile_lock.acquire()
-        with open(self.errors_logfile, "a") as errors_logfile:
-            errors_logfile.write(f'{date_time} [{msg["from"]}] {msg["txt"]}\n')
-        self.errors_logfile_lock.release()
+        self.get_logfile(self.errors_logfile).write(
+            f'{date_time} [{msg["from"]}] {msg["txt"]}\n'
+        )
 
     def enough_verbose(self, verbose: int):
         """
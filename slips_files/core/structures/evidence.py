@@ -108,6 +108,8 @@ class EvidenceType(Enum):
     THREAT_INTELLIGENCE_BLACKLISTED_DOMAIN = auto()
     MALICIOUS_DOWNLOADED_FILE = auto()
     THREAT_INTELLIGENCE_MALICIOUS_URL = auto()
+    SLOW_PORT_SCAN = auto()
+    BEACONING = auto()
 
     def __str__(self):
         return self.name
@@ -0,0 +1,200 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+"""
+Contains the features of a closed timewindow of a profile, computed once
+when the tw is closed so modules don't have to read its flows again
+"""
+
+import io
+import ipaddress
+from dataclasses import dataclass
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+)
+
+import numpy as np
+
+from slips_files.common.slips_utils import utils
+
+# the features of each outtuple of the tw, one array per feature
+TUPLE_FEATURES = (
+    # daddr-dport-proto, the same tupleid of the OutTuples in redis
+    "tupleid",
+    "daddr",
+    "dport",
+    "proto",
+    "flows",
+    "sbytes",
+    "dbytes",
+    "pkts",
+    "established",
+    "first_ts",
+    "last_ts",
+    # the strato letters of the tuple, "" if there are none
+    "letters",
+)
+# the features of the whole tw, one number per feature
+TW_FEATURES = (
+    "flows",
+    "sbytes",
+    "dbytes",
+    "pkts",
+    "established",
+    "established_ratio",
+    "distinct_dstips",
+    "distinct_dports",
+    "tuples",
+)
+
+
+@dataclass
+class TWFeatures:
+    profileid: str
+    twid: str
+    # {feature: value}, the features in TW_FEATURES
+    tw: Dict[str, float]
+    # {feature: array with one item per tuple}, the features in
+    # TUPLE_FEATURES
+    tuples: Dict[str, np.ndarray]
+
+    def __len__(self) -> int:
+        """returns the number of tuples"""
+        return len(self.tuples["tupleid"])
+
+    def get_letters(self) -> Dict[str, str]:
+        """returns {tupleid: letters} of the tuples that have letters"""
+        return {
+            tupleid: letters
+            for tupleid, letters in zip(
+                self.tuples["tupleid"], self.tuples["letters"]
+            )
+            if letters
+        }
+
+    def to_bytes(self) -> bytes:
+        """serializes the features as an npz, without pickling anything"""
+        arrays = {f"tw.{name}": np.asarray(self.tw[name]) for name in self.tw}
+        arrays.update(
+            {f"tuples.{name}": column for name, column in self.tuples.items()}
+        )
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(
+        cls, profileid: str, twid: str, data: bytes
+    ) -> "TWFeatures":
+        tw = {}
+        tuples = {}
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            for key in arrays.files:
+                kind, name = key.split(".", 1)
+                if kind == "tw":
+                    tw[name] = arrays[key].item()
+                else:
+                    tuples[name] = arrays[key]
+        return cls(profileid=profileid, twid=twid, tw=tw, tuples=tuples)
+
+
+def get_daddr(daddr: str) -> str:
+    """returns the daddr the way it's written in the tupleids"""
+    try:
+        return str(ipaddress.ip_address(daddr))
+    except ValueError:
+        return daddr
+
+
+def get_ts(starttime) -> float:
+    try:
+        return float(starttime)
+    except (TypeError, ValueError):
+        return float(utils.convert_ts_format(starttime, "unixtimestamp"))
+
+
+def compute_tw_features(
+    profileid: str,
+    twid: str,
+    flows: Iterable[dict],
+    letters: Dict[str, str],
+    get_final_state_from_flags: Callable[[str, int], str],
+) -> TWFeatures:
+    """
+    computes the features of the given tw and of each of its outtuples
+    in one pass over its flows
+    :param flows: the conn flows of the tw, as stored in the sqlite db
+    :param letters: {tupleid: strato letters} of the outtuples of the tw
+    :param get_final_state_from_flags: the function that interprets the
+    state of the flows, DBManager.get_final_state_from_flags()
+    """
+    tupleids, daddrs, dports, protos = [], [], [], []
+    sbytes, dbytes, pkts, established, ts = [], [], [], [], []
+    for flow in flows:
+        flow_pkts = int(flow.get("spkts") or 0) + int(flow.get("dpkts") or 0)
+        daddr = get_daddr(flow["daddr"])
+        tupleids.append(f"{daddr}-{flow['dport']}-{flow['proto']}")
+        daddrs.append(daddr)
+        dports.append(str(flow["dport"]))
+        protos.append(flow["proto"])
+        sbytes.append(int(flow.get("sbytes") or 0))
+        dbytes.append(int(flow.get("dbytes") or 0))
+        pkts.append(flow_pkts)
+        established.append(
+            get_final_state_from_flags(flow["state"], flow_pkts)
+            == "Established"
+        )
+        ts.append(get_ts(flow["starttime"]))
+
+    unique_tupleids, first_index, inverse = np.unique(
+        np.asarray(tupleids, dtype=str), return_index=True, return_inverse=True
+    )
+    tuples_count = len(unique_tupleids)
+    ts = np.asarray(ts, dtype=np.float64)
+    first_ts = np.full(tuples_count, np.inf)
+    np.minimum.at(first_ts, inverse, ts)
+    last_ts = np.full(tuples_count, -np.inf)
+    np.maximum.at(last_ts, inverse, ts)
+
+    def sum_per_tuple(column: list) -> np.ndarray:
+        return np.bincount(
+            inverse,
+            weights=np.asarray(column, dtype=np.float64),
+            minlength=tuples_count,
+        ).astype(np.int64)
+
+    tuples = {
+        "tupleid": unique_tupleids,
+        "daddr": np.asarray(daddrs, dtype=str)[first_index],
+        "dport": np.asarray(dports, dtype=str)[first_index],
+        "proto": np.asarray(protos, dtype=str)[first_index],
+        "flows": np.bincount(inverse, minlength=tuples_count),
+        "sbytes": sum_per_tuple(sbytes),
+        "dbytes": sum_per_tuple(dbytes),
+        "pkts": sum_per_tuple(pkts),
+        "established": sum_per_tuple(established),
+        "first_ts": first_ts,
+        "last_ts": last_ts,
+        "letters": np.asarray(
+            [letters.get(tupleid, "") for tupleid in unique_tupleids],
+            dtype=str,
+        ),
+    }
+
+    flows_count = len(tupleids)
+    established_count = int(tuples["established"].sum())
+    tw = {
+        "flows": flows_count,
+        "sbytes": int(tuples["sbytes"].sum()),
+        "dbytes": int(tuples["dbytes"].sum()),
+        "pkts": int(tuples["pkts"].sum()),
+        "established": established_count,
+        "established_ratio": (
+            established_count / flows_count if flows_count else 0.0
+        ),
+        "distinct_dstips": len(set(daddrs)),
+        "distinct_dports": len(set(zip(dports, protos))),
+        "tuples": tuples_count,
+    }
+    return TWFeatures(profileid=profileid, twid=twid, tw=tw, tuples=tuples)
@@ -16,6 +16,7 @@ from managers.profilers_manager import ProfilersManager
 from modules.arp.filter import ARPEvidenceFilter
 from modules.arp_poisoner.arp_poisoner import ARPPoisoner
 from modules.blocking.unblocker import Unblocker
+from modules.flowalerts.beaconing import Beaconing
 from modules.flowalerts.conn import Conn
 from modules.threat_intelligence.circl_lu import Circllu
 from modules.threat_intelligence.spamhaus import Spamhaus
@@ -61,6 +62,8 @@ from modules.ip_info.asn_info import ASN
 from slips_files.core.helpers.flow_handler import FlowHandler
 from modules.network_discovery.horizontal_portscan import HorizontalPortscan
 from modules.network_discovery.network_discovery import NetworkDiscovery
+from modules.flowmldetection.flowmldetection import FlowMLDetection
+from modules.network_discovery.slow_portscan import SlowPortscan
 from modules.network_discovery.vertical_portscan import VerticalPortscan
 from modules.p2ptrust.trust.base_model import BaseModel
 from slips_files.core.database.redis_db.alert_handler import AlertHandler
@@ -69,6 +72,7 @@ from slips.daemon import Daemon
 from slips_files.core.database.redis_db.ioc_handler import IoCHandler
 from slips_files.core.helpers.checker import Checker
 from modules.timeline.timeline import Timeline
+from modules.tw_features.tw_features import TimewindowFeatures
 from modules.cesnet.cesnet import CESNET
 from modules.riskiq.riskiq import RiskIQ
 from slips_files.common.markov_chains import Matrix
@@ -306,6 +310,11 @@ class ModuleFactory:
         flowalerts = self.create_flowalerts_obj()
         return Conn(flowalerts.db, flowalerts=flowalerts)
 
+    @patch(DB_MANAGER, name="mock_db")
+    def create_beaconing_analyzer_obj(self, mock_db):
+        flowalerts = self.create_flowalerts_obj()
+        return Beaconing(flowalerts.db, flowalerts=flowalerts)
+
     @patch(DB_MANAGER, name="mock_db")
     def create_software_analyzer_obj(self, mock_db):
         flowalerts = self.create_flowalerts_obj()
@@ -486,6 +495,12 @@ class ModuleFactory:
         vertical_ps = VerticalPortscan(mock_db)
         return vertical_ps
 
+    @patch(DB_MANAGER, name="mock_db")
+    def create_slow_portscan_obj(self, mock_db):
+        slow_ps = SlowPortscan(mock_db)
+        slow_ps.db.get_dns_resolution.return_value = {}
+        return slow_ps
+
     @patch(MODULE_DB_MANAGER, name="mock_db")
     def create_urlhaus_obj(self, mock_db):
         """Create an instance of URLhaus."""
@@ -495,7 +510,7 @@ class ModuleFactory:
     @patch(MODULE_DB_MANAGER, name="mock_db")
     def create_circllu_obj(self, mock_db):
         """Create an instance of Circllu."""
-        return Circllu(mock_db, Queue())
+        return Circllu(mock_db)
 
     @patch(MODULE_DB_MANAGER, name="mock_db")
     def create_set_evidence_helper(self, mock_db):
@@ -563,6 +578,18 @@ class ModuleFactory:
             confidence=confidence,
         )
 
+    @patch(MODULE_DB_MANAGER, name="mock_db")
+    def create_flowmldetection_obj(self, mock_db):
+        flowmldetection = FlowMLDetection(
+            self.logger,
+            "dummy_output_dir",
+            6379,
+            Mock(),  # termination event
+            Mock(),  # args
+            Mock(),  # conf
+        )
+        return flowmldetection
+
     @patch(MODULE_DB_MANAGER, name="mock_db")
     def create_network_discovery_obj(self, mock_db):
         network_discovery = NetworkDiscovery(
@@ -741,6 +768,19 @@ class ModuleFactory:
         tl.db = mock_db
         return tl
 
+    @patch(MODULE_DB_MANAGER, name="mock_db")
+    def create_tw_features_object(self, mock_db):
+        tw_features = TimewindowFeatures(
+            self.logger,
+            "dummy_output_dir",
+            6379,
+            Mock(),  # termination event
+            Mock(),  # args
+            Mock(),  # conf
+        )
+        tw_features.db = mock_db
+        return tw_features
+
     def create_alert_handler_obj(self):
         alert_handler = AlertHandler()
         alert_handler.constants = Constants()
@@ -754,6 +794,7 @@ class ModuleFactory:
         handler.separator = "_"
         handler.width = 3600
         handler.print = Mock()
+        handler.lazy_print = Mock()
         return handler
 
     def create_process_manager_obj(self):
@@ -816,5 +857,6 @@ class ModuleFactory:
                 Mock(),  # args
             )
             cc_detection.db = mock_db
+            cc_detection.init()
             cc_detection.exporter = Mock()
             return cc_detection
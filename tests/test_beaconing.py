@@ -0,0 +1,231 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import time
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from modules.flowalerts.beaconing import get_periodicity_scores
+from tests.module_factory import ModuleFactory
+
+PROFILEID = "profile_192.168.1.1"
+PERIOD = 60
+
+
+def get_flow(ts: float, daddr="1.2.3.4", dport="443", proto="tcp", uid=""):
+    return Mock(
+        starttime=str(ts),
+        saddr="192.168.1.1",
+        daddr=daddr,
+        dport=dport,
+        proto=proto,
+        uid=uid or f"uid{ts}",
+    )
+
+
+def get_scheduled_ts(amount: int, jitter: float, missed: float, seed=0):
+    """ts of a beacon scheduled every PERIOD seconds, jittered and with
+    some of the beacons missed"""
+    rng = np.random.default_rng(seed)
+    ts = np.arange(amount) * PERIOD + rng.normal(0, jitter * PERIOD, amount)
+    return np.sort(ts[rng.random(amount) >= missed]) + 1700000000
+
+
+def get_sleeping_ts(amount: int, jitter: float, seed=0):
+    """ts of a beacon that sleeps a jittered PERIOD between conns"""
+    rng = np.random.default_rng(seed)
+    intervals = PERIOD * (1 + rng.uniform(-jitter, jitter, amount))
+    return np.cumsum(intervals) + 1700000000
+
+
+def get_random_ts(amount: int, seed=0):
+    """ts of flows that arrive at random, on average every PERIOD
+    seconds"""
+    rng = np.random.default_rng(seed)
+    return np.cumsum(rng.exponential(PERIOD, amount)) + 1700000000
+
+
+def create_beaconing():
+    beaconing = ModuleFactory().create_beaconing_analyzer_obj()
+    beaconing.set_evidence = Mock()
+    return beaconing
+
+
+def add_flows(beaconing, ts, twid="timewindow1", **flow_fields):
+    for flow_ts in ts:
+        beaconing.add_flow(PROFILEID, twid, get_flow(flow_ts, **flow_fields))
+
+
+@pytest.mark.parametrize(
+    "ts, expected_detected",
+    [
+        # Testcase 1: scheduled beacon
+        (get_scheduled_ts(40, jitter=0.01, missed=0), True),
+        # Testcase 2: jittered scheduled beacon
+        (get_scheduled_ts(40, jitter=0.05, missed=0), True),
+        # Testcase 3: scheduled beacon that missed a third of the beacons
+        (get_scheduled_ts(60, jitter=0.03, missed=0.3, seed=1), True),
+        # Testcase 4: beacon sleeping between conns
+        (get_sleeping_ts(40, jitter=0.2), True),
+        # Testcase 5: random flows
+        (get_random_ts(40), False),
+        (get_random_ts(200, seed=1), False),
+        # Testcase 6: periodic, but not enough flows
+        (get_scheduled_ts(10, jitter=0.01, missed=0), False),
+        # Testcase 7: too fast to be a beacon
+        (np.arange(50) * 0.1 + 1700000000, False),
+    ],
+)
+def test_check_beaconing(ts, expected_detected):
+    beaconing = create_beaconing()
+    add_flows(beaconing, ts)
+    beaconing.check_beaconing(PROFILEID, "timewindow1")
+    assert beaconing.set_evidence.beaconing.called == expected_detected
+
+
+def test_check_beaconing_sets_evidence_once_per_tuple():
+    beaconing = create_beaconing()
+    ts = get_scheduled_ts(80, jitter=0.01, missed=0)
+    add_flows(beaconing, ts[:40], twid="timewindow1")
+    add_flows(beaconing, get_random_ts(20), twid="timewindow1", dport="80")
+    beaconing.check_beaconing(PROFILEID, "timewindow1")
+    add_flows(beaconing, ts[40:], twid="timewindow2")
+    beaconing.check_beaconing(PROFILEID, "timewindow2")
+
+    beaconing.set_evidence.beaconing.assert_called_once()
+    call = beaconing.set_evidence.beaconing.call_args
+    twid, flow = call[0]
+    assert twid == "timewindow1"
+    assert flow.starttime == str(ts[39])
+    assert call[1]["period"] == pytest.approx(PERIOD, rel=0.01)
+    assert call[1]["flows"] == 40
+
+
+def test_beacon_spread_over_tws():
+    beaconing = create_beaconing()
+    ts = get_scheduled_ts(18, jitter=0.01, missed=0)
+    for tw, tw_ts in enumerate(np.array_split(ts, 3), start=1):
+        add_flows(beaconing, tw_ts, twid=f"timewindow{tw}")
+        beaconing.check_beaconing(PROFILEID, f"timewindow{tw}")
+        # not enough flows in the first tws
+        assert beaconing.set_evidence.beaconing.called == (tw == 3)
+
+
+@pytest.mark.parametrize(
+    "flow_fields",
+    [
+        # Testcase 1: the profile is the server
+        {"daddr": "192.168.1.1"},
+        # Testcase 2: icmp
+        {"proto": "icmp"},
+        # Testcase 3: dns
+        {"dport": "53", "proto": "udp"},
+        # Testcase 4: multicast
+        {"daddr": "224.0.0.251", "dport": "5353", "proto": "udp"},
+    ],
+)
+def test_add_flow_ignored_flows(flow_fields):
+    beaconing = create_beaconing()
+    flow = get_flow(1700000000)
+    for field, value in flow_fields.items():
+        setattr(flow, field, value)
+    if flow.daddr == "192.168.1.1":
+        flow.saddr = "8.8.8.8"
+    beaconing.add_flow(PROFILEID, "timewindow1", flow)
+    assert not beaconing.tuples
+
+
+def test_ring_buffer_keeps_the_last_intervals():
+    beaconing = create_beaconing()
+    # intervals 1, 2, 3... seconds
+    ts = 1700000000 + np.cumsum(np.arange(200))
+    add_flows(beaconing, ts)
+    tuple_intervals = beaconing.tuples[PROFILEID][("1.2.3.4", "443", "TCP")]
+
+    assert len(tuple_intervals.intervals) == beaconing.max_intervals
+    assert tuple_intervals.count == 199
+    assert list(tuple_intervals.get_intervals()) == list(
+        range(200 - beaconing.max_intervals, 200)
+    )
+
+
+def test_add_flow_ignores_older_flows():
+    beaconing = create_beaconing()
+    add_flows(beaconing, [100, 160, 130, 220])
+    tuple_intervals = beaconing.tuples[PROFILEID][("1.2.3.4", "443", "TCP")]
+    assert list(tuple_intervals.get_intervals()) == [60, 60]
+
+
+def test_forget_idle_tuples():
+    beaconing = create_beaconing()
+    add_flows(beaconing, [100, 160], twid="timewindow1", dport="80")
+    add_flows(beaconing, [200, 260], twid="timewindow3", dport="443")
+    # a flow that arrived after its tw was closed
+    add_flows(beaconing, [300], twid="timewindow2", dport="22")
+    beaconing.check_beaconing(PROFILEID, "timewindow3")
+    assert set(beaconing.tuples[PROFILEID]) == {
+        ("1.2.3.4", "80", "TCP"),
+        ("1.2.3.4", "443", "TCP"),
+        ("1.2.3.4", "22", "TCP"),
+    }
+
+    beaconing.check_beaconing(PROFILEID, "timewindow4")
+    assert set(beaconing.tuples[PROFILEID]) == {
+        ("1.2.3.4", "443", "TCP"),
+        ("1.2.3.4", "22", "TCP"),
+    }
+    assert list(beaconing.tuples_in_tw[PROFILEID]) == ["timewindow2"]
+
+    beaconing.check_beaconing(PROFILEID, "timewindow6")
+    assert PROFILEID not in beaconing.tuples
+    assert PROFILEID not in beaconing.tuples_in_tw
+
+
+def test_analyze_tw_closed():
+    beaconing = create_beaconing()
+    beaconing.check_beaconing = Mock()
+    beaconing.analyze(
+        {
+            "channel": "tw_closed",
+            "data": f"{PROFILEID}_timewindow3",
+        }
+    )
+    beaconing.check_beaconing.assert_called_once_with(PROFILEID, "timewindow3")
+
+
+def pad(intervals: np.ndarray, size=64) -> np.ndarray:
+    padded = np.full(size, np.nan)
+    padded[: len(intervals)] = intervals[-size:]
+    return padded
+
+
+def test_get_periodicity_scores_of_many_tuples():
+    tuples = [
+        np.diff(get_scheduled_ts(30 + i, jitter=0.02, missed=0.2, seed=i))
+        for i in range(50)
+    ] + [np.diff(get_random_ts(15 + i, seed=i)) for i in range(50)]
+    intervals = np.stack([pad(tuple_intervals) for tuple_intervals in tuples])
+
+    scores = get_periodicity_scores(intervals)
+
+    # the scores of a tuple don't depend on the other tuples
+    for row in (0, 49, 50, 99):
+        single = get_periodicity_scores(intervals[row : row + 1])
+        assert scores.cv[row] == pytest.approx(single.cv[0])
+        assert scores.coherence[row] == pytest.approx(single.coherence[0])
+    assert (scores.coherence[:50] > 0.85).all()
+    assert scores.period[:50] == pytest.approx(PERIOD, rel=0.01)
+    assert (scores.coherence[50:] < 0.85).all()
+    assert (scores.cv[50:] > 0.15).all()
+
+
+@pytest.mark.benchmark
+def test_get_periodicity_scores_throughput():
+    intervals = np.stack(
+        [pad(np.diff(get_random_ts(65, seed=i))) for i in range(5000)]
+    )
+    start = time.monotonic()
+    get_periodicity_scores(intervals)
+    rate = len(intervals) / (time.monotonic() - start)
+    print(f"beaconing tuples scored/sec: {rate:.0f}")
@@ -0,0 +1,124 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+"""Unit test for slips_files/core/helpers/buffered_logfile.py"""
+
+import multiprocessing
+import os
+import re
+import time
+
+from slips_files.core.helpers.buffered_logfile import BufferedLogFile
+
+
+def test_lines_are_buffered_until_the_buffer_is_full(tmp_path):
+    path = tmp_path / "slips.log"
+    logfile = BufferedLogFile(str(path), flush_interval=60, max_buffer_size=20)
+    logfile.write("line 1\n")
+    logfile.write("line 2\n")
+    assert not path.exists()
+
+    logfile.write("line 3\n")
+    assert path.read_text() == "line 1\nline 2\nline 3\n"
+    logfile.close()
+
+
+def test_lines_are_flushed_periodically(tmp_path):
+    path = tmp_path / "slips.log"
+    logfile = BufferedLogFile(str(path), flush_interval=0.1)
+    logfile.write("line 1\n")
+    logfile.write("line 2\n")
+    assert not path.exists()
+
+    # even if nothing else is written
+    time.sleep(0.5)
+    assert path.read_text() == "line 1\nline 2\n"
+    logfile.close()
+
+
+def test_close_flushes_and_reopens(tmp_path):
+    path = tmp_path / "slips.log"
+    logfile = BufferedLogFile(str(path), flush_interval=60)
+    logfile.write("line 1\n")
+    logfile.close()
+    assert path.read_text() == "line 1\n"
+
+    logfile.write("line 2\n")
+    logfile.close()
+    assert path.read_text() == "line 1\nline 2\n"
+    assert logfile.lines_written == 2
+
+
+def test_rotation(tmp_path):
+    path = tmp_path / "slips.log"
+    logfile = BufferedLogFile(
+        str(path), max_buffer_size=0, max_size=10, backups=2
+    )
+    for i in range(4):
+        logfile.write(f"line {i} is long\n")
+    logfile.close()
+
+    assert path.read_text() == ""
+    assert (tmp_path / "slips.log.1").read_text() == "line 3 is long\n"
+    assert (tmp_path / "slips.log.2").read_text() == "line 2 is long\n"
+    # only 2 backups are kept
+    assert not (tmp_path / "slips.log.3").exists()
+
+
+def write_in_child(logfile: BufferedLogFile, conn):
+    logfile.write("child 1\n")
+    logfile.write("child 2\n")
+    conn.send(os.path.exists(logfile.path))
+    # the lines are written when the child exits
+
+
+def test_lines_are_buffered_in_forked_children(tmp_path):
+    path = tmp_path / "slips.log"
+    logfile = BufferedLogFile(str(path), flush_interval=60)
+    logfile.write("parent 1\n")
+
+    ctx = multiprocessing.get_context("fork")
+    parent_conn, child_conn = ctx.Pipe()
+    child = ctx.Process(target=write_in_child, args=(logfile, child_conn))
+    child.start()
+    # the child buffered its lines too
+    assert parent_conn.recv() is False
+    child.join()
+    # without the buffered line of the parent
+    assert path.read_text() == "child 1\nchild 2\n"
+
+    logfile.write("parent 2\n")
+    assert path.read_text() == "child 1\nchild 2\n"
+    logfile.close()
+    assert path.read_text() == "child 1\nchild 2\nparent 1\nparent 2\n"
+
+
+def write_many_in_child(logfile: BufferedLogFile, lines: int):
+    for i in range(lines):
+        logfile.write(f"line {i:04}\n")
+
+
+def test_concurrent_rotation(tmp_path):
+    path = tmp_path / "slips.log"
+    lines = 500
+    logfile = BufferedLogFile(
+        str(path), max_buffer_size=0, max_size=100, backups=1000
+    )
+    ctx = multiprocessing.get_context("fork")
+    children = [
+        ctx.Process(target=write_many_in_child, args=(logfile, lines))
+        for _ in range(4)
+    ]
+    for child in children:
+        child.start()
+    for child in children:
+        child.join()
+
+    written = [
+        line
+        for logfile_path in tmp_path.iterdir()
+        for line in logfile_path.read_text().splitlines()
+    ]
+    # no backup was overwritten by two processes rotating at once
+    assert len(written) == 4 * lines
+    # and the lines of different processes weren't mixed
+    assert all(re.fullmatch(r"line \d{4}", line) for line in written)
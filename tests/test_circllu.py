@@ -6,6 +6,9 @@ from unittest.mock import (
     Mock,
 )
 import pytest
+import requests
+
+from modules.threat_intelligence.online_lookups import OnlineLookupError
 from tests.module_factory import ModuleFactory
 
 
@@ -75,13 +78,28 @@ def test_lookup(mocker, status_code, response_text, expected_result):
     """
     circllu = ModuleFactory().create_circllu_obj()
     circllu.circl_session = Mock()
-    flow_info = {"flow": {"md5": "1234567890abcdef1234567890abcdef"}}
+    md5 = "1234567890abcdef1234567890abcdef"
     mock_response = MagicMock()
     mock_response.status_code = status_code
     mock_response.text = response_text
     circllu.circl_session.get.return_value = mock_response
-    result = circllu.lookup(flow_info)
+    result = circllu.lookup(md5)
     assert result == expected_result
+    circllu.circl_session.get.assert_called_once_with(
+        f"{circllu.base_url}/md5/{md5}",
+        headers=circllu.circl_session.headers,
+    )
+
+
+def test_lookup_connection_error():
+    """
+    the lookup should be retried later by the online lookups worker
+    """
+    circllu = ModuleFactory().create_circllu_obj()
+    circllu.circl_session = Mock()
+    circllu.circl_session.get.side_effect = requests.exceptions.ConnectionError
+    with pytest.raises(OnlineLookupError):
+        circllu.lookup("1234567890abcdef1234567890abcdef")
 
 
 @pytest.mark.parametrize(
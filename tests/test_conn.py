@@ -6,6 +6,7 @@ from slips_files.common.slips_utils import utils
 from slips_files.core.flows.zeek import Conn
 from tests.module_factory import ModuleFactory
 import json
+import time
 from unittest.mock import (
     Mock,
 )
@@ -349,44 +350,85 @@ def test_is_ignored_ip_data_upload(ip_address, expected_result):
     assert conn.is_ignored_ip_data_upload(ip_address) is expected_result
 
 
-@pytest.mark.parametrize(
-    "all_flows, expected_bytes_sent",
-    [
-        (  # Testcase 1: Normal flows with data
-            {
-                "uid1": {
-                    "daddr": "8.8.8.8",
-                    "sbytes": 1024,
-                    "starttime": "2023-11-01 12:00:00",
-                },
-                "uid2": {
-                    "daddr": "8.8.8.8",
-                    "sbytes": 2048,
-                    "starttime": "2023-11-01 12:02:00",
-                },
-            },
-            {"8.8.8.8": (3072, ["uid1", "uid2"], "2023-11-01 12:02:00")},
-        ),
-        (  # Testcase 2: Flows with no 'sbytes'
-            {
-                "uid1": {
-                    "daddr": "8.8.8.8",
-                    "starttime": "2023-11-01 12:00:00",
-                },
-                "uid2": {
-                    "daddr": "8.8.4.4",
-                    "sbytes": 2048,
-                    "starttime": "2023-11-01 12:02:00",
-                },
-            },
-            {"8.8.4.4": (2048, ["uid2"], "2023-11-01 12:02:00")},
-        ),
-    ],
-)
-def test_get_sent_bytes(all_flows, expected_bytes_sent):
+def get_conn_flow(uid, daddr, sbytes=0, dport="80", state="SF"):
+    flow = Conn(
+        starttime="1726249372.312124",
+        uid=uid,
+        saddr="192.168.1.1",
+        daddr=daddr,
+        dur=1,
+        proto="tcp",
+        appproto="",
+        sport="5555",
+        dport=dport,
+        spkts=1,
+        dpkts=1,
+        sbytes=sbytes,
+        dbytes=0,
+        smac="",
+        dmac="",
+        state=state,
+        history="",
+    )
+    flow.interpreted_state = (
+        "Established" if state == "SF" else "Not Established"
+    )
+    return flow
+
+
+def test_update_tw_conns():
     conn = ModuleFactory().create_conn_analyzer_obj()
-    bytes_sent = conn.get_sent_bytes(all_flows)
-    assert bytes_sent == expected_bytes_sent
+    conn.gateway = "192.168.1.254"
+    flows = [
+        get_conn_flow("uid1", "8.8.8.8", sbytes=1024, dport="80"),
+        get_conn_flow("uid2", "8.8.8.8", sbytes=2048, dport="8080"),
+        get_conn_flow("uid3", "8.8.4.4", dport="80", state="S0"),
+        get_conn_flow("uid4", "8.8.8.8", dport="80"),
+    ]
+    for flow in flows:
+        conn.update_tw_conns(profileid, twid, flow)
+
+    ips = conn.tw_conns[profileid][twid]
+    assert ips["8.8.8.8"].bytes_sent == 3072
+    assert ips["8.8.8.8"].upload_uids == ["uid1", "uid2"]
+    assert list(ips["8.8.8.8"].estab_tcp_ports) == ["80", "8080"]
+    assert ips["8.8.8.8"].estab_tcp_uids == ["uid1", "uid2", "uid4"]
+    # no bytes sent and not established
+    assert "8.8.4.4" not in ips
+
+
+def test_detect_data_upload_in_twid():
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    conn.gateway = "192.168.1.254"
+    conn.data_exfiltration_threshold = 1
+    conn.set_evidence = Mock()
+    big_upload = 1000 * 1000
+    conn.update_tw_conns(
+        profileid, twid, get_conn_flow("uid1", "8.8.8.8", sbytes=big_upload)
+    )
+    conn.update_tw_conns(
+        profileid, twid, get_conn_flow("uid2", "8.8.4.4", sbytes=1)
+    )
+    conn.update_tw_conns(
+        profileid,
+        "timewindow2",
+        get_conn_flow("uid3", "8.8.8.8", sbytes=big_upload),
+    )
+
+    conn.detect_data_upload_in_twid(profileid, twid)
+    conn.set_evidence.data_exfiltration.assert_called_once_with(
+        "8.8.8.8",
+        1.0,
+        profileid,
+        twid,
+        ["uid1"],
+        "1726249372.312124",
+    )
+    # the closed tw is evicted, the open one is not
+    assert list(conn.tw_conns[profileid]) == ["timewindow2"]
+
+    conn.detect_data_upload_in_twid(profileid, "timewindow2")
+    assert conn.tw_conns == {}
 
 
 @pytest.mark.parametrize(
@@ -540,6 +582,42 @@ def test_should_ignore_conn_without_dns(
     assert conn.should_ignore_conn_without_dns(flow) is expected_result
 
 
+@pytest.mark.parametrize(
+    "resolved_after_waiting, expected_evidence",
+    [
+        # Testcase 1: the dns resolution arrived while waiting
+        (True, False),
+        # Testcase 2: no dns resolution
+        (False, True),
+    ],
+)
+def test_check_connection_without_dns_resolution(
+    resolved_after_waiting, expected_evidence
+):
+    conn = ModuleFactory().create_conn_analyzer_obj()
+    conn.should_ignore_conn_without_dns = Mock(return_value=False)
+    conn.is_interface_timeout_reached = Mock(return_value=True)
+    conn.check_if_resolution_was_made_by_different_version = Mock(
+        return_value=False
+    )
+    conn.is_well_known_org = Mock(return_value=False)
+    conn.set_evidence = Mock()
+    conn.db.is_ip_resolved.return_value = False
+    flow = Mock(daddr="8.8.8.8")
+
+    # the conn is checked again 15s later without sleeping
+    assert not conn.check_connection_without_dns_resolution(
+        profileid, twid, flow
+    )
+    assert len(conn.flowalerts.delayed_checks) == 1
+    conn.set_evidence.conn_without_dns.assert_not_called()
+
+    conn.db.is_ip_resolved.return_value = resolved_after_waiting
+    conn.flowalerts.delayed_checks.run_due(time.time() + 16)
+    assert len(conn.flowalerts.delayed_checks) == 0
+    assert conn.set_evidence.conn_without_dns.called == expected_evidence
+
+
 @pytest.mark.parametrize(
     "profileid, daddr, mock_get_the_other_ip_version_return_value, "
     "mock_get_dns_resolution_return_value, expected_result",
@@ -0,0 +1,57 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+from unittest.mock import patch
+
+import pytest
+
+from slips_files.common.data_structures.conn_flows_cache import (
+    ConnFlowsCache,
+)
+
+
+@pytest.mark.parametrize(
+    "twid, expected_flow, expected_stats",
+    [
+        # Testcase 1: any tw
+        (False, "flow1", (1, 0)),
+        # Testcase 2: the tw of the flow
+        ("timewindow1", "flow1", (1, 0)),
+        # Testcase 3: another tw
+        ("timewindow2", None, (0, 1)),
+    ],
+)
+def test_get(twid, expected_flow, expected_stats):
+    cache = ConnFlowsCache(size=10, ttl=600)
+    cache.add("uid1", "timewindow1", "flow1")
+
+    assert cache.get("uid1", twid=twid) == expected_flow
+    assert cache.pop_stats() == expected_stats
+    assert cache.lookups == 0
+    assert cache.get("uid2") is None
+    assert cache.pop_stats() == (0, 1)
+
+
+def test_oldest_flows_are_dropped():
+    cache = ConnFlowsCache(size=2, ttl=600)
+    cache.add("uid1", "timewindow1", "flow1")
+    cache.add("uid2", "timewindow1", "flow2")
+    # re-adding a flow makes it the most recent one
+    cache.add("uid1", "timewindow1", "flow1")
+    cache.add("uid3", "timewindow1", "flow3")
+
+    assert len(cache) == 2
+    assert cache.get("uid2") is None
+    assert cache.get("uid1") == "flow1"
+    assert cache.get("uid3") == "flow3"
+
+
+def test_expired_flows_are_dropped():
+    cache = ConnFlowsCache(size=10, ttl=600)
+    with patch("time.monotonic", return_value=1000):
+        cache.add("uid1", "timewindow1", "flow1")
+        assert cache.get("uid1") == "flow1"
+
+    with patch("time.monotonic", return_value=1600):
+        assert cache.get("uid1") is None
+    assert len(cache) == 0
+    assert cache.pop_stats() == (1, 1)
@@ -1,5 +1,6 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
+from dataclasses import asdict
 from unittest.mock import (
     Mock,
     call,
@@ -283,3 +284,90 @@ def test_update_max_threat_level(
     assert (
         db.update_max_threat_level(profileid, cur_threat_level) == expected_max
     )
+
+
+def test_get_flow_from_conn_flows_cache():
+    db = ModuleFactory().create_db_manager_obj(6394, flush_db=True)
+    db.sqlite = Mock()
+    db.sqlite.get_flow.return_value = {"unknown_uid": {}}
+    # the flow as received in the new_flow channel
+    db.cache_conn_flow(asdict(flow), twid)
+
+    cached_flow = utils.get_original_conn_flow(flow, db)
+    assert cached_flow["uid"] == flow.uid
+    assert cached_flow["daddr"] == flow.daddr
+    # the cache is used for lookups in a given tw too
+    assert db.get_flow(flow.uid, twid=twid) == {
+        flow.uid: json.dumps(cached_flow)
+    }
+    db.sqlite.get_flow.assert_not_called()
+
+    # flows that aren't cached are read from sqlite
+    assert db.get_flow("unknown_uid") == {"unknown_uid": {}}
+    db.sqlite.get_flow.assert_called_once_with("unknown_uid", twid=False)
+
+    db.update_conn_flows_cache_stats()
+    stats = db.get_conn_flows_cache_stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+
+
+@pytest.mark.parametrize(
+    "hrs, ts, expected_result",
+    [
+        # Testcase 1: resolved 2 hrs before the given ts
+        (24, 1700007200, True),
+        # Testcase 2: resolved more than 24 hrs before the given ts
+        (24, 1700000000 + 25 * 3600, False),
+        # Testcase 3: resolved after the given ts
+        (1, 1699990000, True),
+    ],
+)
+def test_is_ip_resolved(hrs, ts, expected_result):
+    db = ModuleFactory().create_db_manager_obj(6395, flush_db=True)
+    db.set_dns_resolution(
+        "example.com", ["8.8.8.8"], 1700000000, "uid", "A", "1.1.1.1", twid
+    )
+    assert db.is_ip_resolved("8.8.8.8", hrs, ts) is expected_result
+    assert db.is_ip_resolved("9.9.9.9", hrs, ts) is False
+
+
+def test_dns_resolutions_are_consistent():
+    db = ModuleFactory().create_db_manager_obj(6396, flush_db=True)
+    db.set_dns_resolution(
+        "example.com", ["8.8.8.8"], 1700000000, "uid1", "A", "1.1.1.1", twid
+    )
+    db.set_dns_resolution(
+        "example.com",
+        ["8.8.4.4", "example.net"],
+        1700000100,
+        "uid2",
+        "A",
+        "1.1.1.1",
+        twid,
+    )
+    db.set_dns_resolution(
+        "example.org", ["8.8.8.8"], 1700000200, "uid3", "A", "1.1.1.1", twid
+    )
+    # an older dns flow that arrived late
+    db.set_dns_resolution(
+        "example.com", ["8.8.4.4"], 1699999999, "uid4", "A", "1.1.1.1", twid
+    )
+
+    assert db.get_domain_resolution("example.com") == ["8.8.4.4", "8.8.8.8"]
+    assert db.get_dns_resolution("8.8.8.8")["domains"] == [
+        "example.com",
+        "example.org",
+    ]
+
+    db.delete_dns_resolution("8.8.8.8")
+    assert db.get_domain_resolution("example.com") == ["8.8.4.4"]
+    assert db.get_domain_resolution("example.org") == []
+    assert db.get_dns_resolution("8.8.8.8") == {}
+    assert not db.is_ip_resolved("8.8.8.8", 24, 1700000200)
+
+
+def test_get_domain_resolution_from_dbs_saved_by_older_versions():
+    db = ModuleFactory().create_db_manager_obj(6397, flush_db=True)
+    db.r.hset("DomainsResolved", "example.com", json.dumps(["8.8.8.8"]))
+    assert db.get_domain_resolution("example.com") == ["8.8.8.8"]
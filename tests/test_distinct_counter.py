@@ -0,0 +1,114 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import time
+
+import pytest
+
+from slips_files.common.data_structures.distinct_counter import (
+    DistinctCounter,
+    SlidingDistinctCounter,
+    count_union,
+)
+
+
+def test_exact_count():
+    counter = DistinctCounter(exact_limit=10)
+    assert counter.add("1.1.1.1")
+    assert not counter.add("1.1.1.1")
+    assert counter.add("2.2.2.2")
+    assert len(counter) == 2
+    assert counter.is_exact
+
+
+def test_switch_to_sketch():
+    counter = DistinctCounter(exact_limit=10)
+    for i in range(11):
+        counter.add(str(i))
+    assert not counter.is_exact
+    assert counter.items is None
+    assert len(counter) == 11
+    # already counted items don't change the registers
+    assert not counter.add("0")
+
+
+@pytest.mark.parametrize(
+    "items",
+    [
+        # Testcase 1: right after switching to the sketch
+        300,
+        # Testcase 2: in the small range correction
+        5000,
+        # Testcase 3: in the normal range
+        100000,
+    ],
+)
+def test_sketch_error(items):
+    counter = DistinctCounter(exact_limit=256, precision=12)
+    for i in range(items):
+        counter.add(f"10.{i // 65536}.{i // 256 % 256}.{i % 256}")
+    # ~4 times the standard error of the default precision
+    assert abs(len(counter) - items) / items < 0.07
+
+
+def test_memory_is_bounded():
+    counter = DistinctCounter(exact_limit=256, precision=10)
+    for i in range(10000):
+        counter.add(str(i))
+    assert len(counter.registers) == 1024
+
+
+@pytest.mark.benchmark
+def test_add_throughput():
+    counter = DistinctCounter()
+    items = [str(i) for i in range(200000)]
+    start = time.monotonic()
+    for item in items:
+        counter.add(item)
+        len(counter)
+    elapsed = time.monotonic() - start
+    assert len(counter) > 0
+    print(f"distinct counter adds/sec: {len(items) / elapsed:.0f}")
+
+
+@pytest.mark.parametrize(
+    "exact_limits, expected_union",
+    [
+        # Testcase 1: all exact
+        ((1000, 1000), 1500),
+        # Testcase 2: one exact and one sketch
+        ((1000, 10), 1500),
+        # Testcase 3: all sketches
+        ((10, 10), 1500),
+    ],
+)
+def test_count_union(exact_limits, expected_union):
+    first = DistinctCounter(exact_limit=exact_limits[0])
+    second = DistinctCounter(exact_limit=exact_limits[1])
+    for i in range(1000):
+        first.add(str(i))
+        second.add(str(i + 500))
+    union = count_union([first, second])
+    assert abs(union - expected_union) / expected_union < 0.07
+
+
+def test_sliding_counter_drops_old_windows():
+    counter = SlidingDistinctCounter(windows=3)
+    for window in range(5):
+        counter.add(window, f"port{window}")
+    assert sorted(counter.counters) == [2, 3, 4]
+    assert len(counter) == 3
+    # too old to be kept
+    assert not counter.add(1, "port1")
+    assert len(counter) == 3
+
+
+def test_sliding_counter_memory_is_bounded():
+    counter = SlidingDistinctCounter(windows=4, exact_limit=64, precision=10)
+    for window in range(100):
+        for port in range(1000):
+            counter.add(window, str(port))
+    assert len(counter.counters) == 4
+    assert all(
+        len(window.registers) == 1024 for window in counter.counters.values()
+    )
+    assert abs(len(counter) - 1000) / 1000 < 0.15
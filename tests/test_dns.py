@@ -4,9 +4,7 @@
 
 from dataclasses import asdict
 
-from slips_files.common.slips_utils import utils
 from slips_files.core.flows.zeek import DNS
-from tests.common_test_utils import get_mock_coro
 from tests.module_factory import ModuleFactory
 from numpy import arange
 from unittest.mock import (
@@ -493,7 +491,7 @@ def test_check_high_entropy_dns_answers_no_call(
 async def test_analyze_new_flow_msg(test_case, expected_calls):
     dns = ModuleFactory().create_dns_analyzer_obj()
     dns.connections_checked_in_dns_conn_timer_thread = []
-    dns.check_dns_without_connection = get_mock_coro(True)
+    dns.check_dns_without_connection = Mock(return_value=True)
     dns.check_high_entropy_dns_answers = Mock()
     dns.check_invalid_dns_answers = Mock()
     dns.detect_dga = Mock()
@@ -742,204 +740,125 @@ def get_dns_obj():
     dns.should_detect_dns_without_conn = Mock()
     dns.is_interface_timeout_reached = Mock()
     dns.is_any_flow_answer_contacted = Mock()
-    dns.pending_dns_without_conn = Mock()
     dns.set_evidence = Mock()
-    dns.check_pending_flows_timeout = Mock()
-    dns.flowalerts.should_stop = Mock(side_effect=[False, True])  # to loop
-    # once
     return dns
 
 
-async def test_check_dns_without_connection_shouldnt_detect():
+def get_dns_flow(starttime="1726568479.5997488"):
+    return DNS(
+        starttime=starttime,
+        uid="1234",
+        saddr="",
+        daddr="",
+        query="",
+        qclass_name="",
+        qtype_name="",
+        dport="",
+        sport="",
+        proto="",
+        rcode_name="",
+        answers="",
+        TTLs="",
+    )
+
+
+def test_check_dns_without_connection_shouldnt_detect():
     dns = get_dns_obj()
     # Test when should_detect_dns_without_conn returns False
     dns.should_detect_dns_without_conn.return_value = False
-    result = await dns.check_dns_without_connection(
-        "profileid", "twid", "flow"
-    )
+    result = dns.check_dns_without_connection("profileid", "twid", "flow")
     assert result is False
 
 
-async def test_check_dns_without_connection_interface_timeout_not_reached():
+def test_check_dns_without_connection_interface_timeout_not_reached():
     dns = get_dns_obj()
     # Test when is_interface_timeout_reached returns False
     dns.should_detect_dns_without_conn.return_value = True
     dns.is_interface_timeout_reached.return_value = False
-    result = await dns.check_dns_without_connection(
-        "profileid", "twid", "flow"
-    )
+    result = dns.check_dns_without_connection("profileid", "twid", "flow")
     assert result is False
 
 
-async def test_check_dns_without_connection_flow_answer_contacted_true():
+def test_check_dns_without_connection_flow_answer_contacted_true():
     dns = get_dns_obj()
     # Test when is_any_flow_answer_contacted returns True
     dns.should_detect_dns_without_conn.return_value = True
     dns.is_interface_timeout_reached.return_value = True
     dns.is_any_flow_answer_contacted.return_value = True
-    result = await dns.check_dns_without_connection(
-        "profileid", "twid", "flow"
-    )
+    result = dns.check_dns_without_connection("profileid", "twid", "flow")
     assert result is False
 
 
-async def test_check_dns_without_connection_waited_for_the_conn_false():
+def test_check_dns_without_connection_waited_for_the_conn_false():
     dns = get_dns_obj()
     # Test when waited_for_the_conn is False
     dns.should_detect_dns_without_conn.return_value = True
     dns.is_interface_timeout_reached.return_value = True
     dns.is_any_flow_answer_contacted.return_value = False
-    result = await dns.check_dns_without_connection(
-        "profileid", "twid", "flow", waited_for_the_conn=False
+    flow = get_dns_flow()
+    result = dns.check_dns_without_connection(
+        "profileid", "twid", flow, waited_for_the_conn=False
     )
     assert result is False
-    dns.pending_dns_without_conn.put.assert_called_once_with(
-        ("profileid", "twid", "flow")
-    )
+    assert len(dns.pending_dns_without_conn) == 1
+    dns.set_evidence.dns_without_conn.assert_not_called()
 
 
-async def test_check_dns_without_connection_waited_for_the_conn_true():
+def test_check_dns_without_connection_waited_for_the_conn_true():
     dns = get_dns_obj()
     # Test when waited_for_the_conn is True
     dns.should_detect_dns_without_conn.return_value = True
     dns.is_interface_timeout_reached.return_value = True
     dns.is_any_flow_answer_contacted.return_value = False
-    result = await dns.check_dns_without_connection(
+    result = dns.check_dns_without_connection(
         "profileid", "twid", "flow", waited_for_the_conn=True
     )
     assert result is True
     dns.set_evidence.dns_without_conn.assert_called_once_with("twid", "flow")
 
 
-def test_check_dns_without_connection_timeout_empty_queue():
-    """Test that the method does nothing when the queue is empty."""
-    dns = ModuleFactory().create_dns_analyzer_obj()
-    # to loop once only
-    dns.flowalerts.should_stop = Mock(side_effect=[False, True])
-    dns.stop_event.is_set = Mock(side_effect=[False, True])
-
-    dns.pending_dns_without_conn.empty = Mock(return_value=True)
-    dns.check_pending_flows_timeout = Mock()
-    dns.check_dns_without_connection_timeout()
-    dns.check_pending_flows_timeout.assert_not_called()
-
-
-def test_check_dns_without_connection_timeout_flow_processing():
-    """Test that the method processes flows correctly."""
-    dns = ModuleFactory().create_dns_analyzer_obj()
-    dns.flowalerts.should_stop = Mock(side_effect=[False, True])  # to loop
-    # once
-    mock_flow = DNS(
-        starttime="1726568479.5997488",
-        uid="1234",
-        saddr="",
-        daddr="",
-        query="",
-        qclass_name="",
-        qtype_name="",
-        dport="",
-        sport="",
-        proto="",
-        rcode_name="",
-        answers="",
-        TTLs="",
-    )
-    dns_flow_to_check = DNS(
-        starttime="1726570879.5997488",
-        uid="1234",
-        saddr="",
-        daddr="",
-        query="",
-        qclass_name="",
-        dport="",
-        sport="",
-        proto="",
-        qtype_name="",
-        rcode_name="",
-        answers="",
-        TTLs="",
-    )
-    flow_info_to_check = ("profileid", "twid", dns_flow_to_check)
-
-    dns.pending_dns_without_conn.put(flow_info_to_check)
-    dns.get_dns_flow_from_queue = Mock(return_value=mock_flow)
-
-    dns.check_dns_without_connection_timeout()
-    # since it didnt pass, the flow should be put back to queue
-    assert dns.pending_dns_without_conn.qsize() == 1
-    assert dns.pending_dns_without_conn.get() == flow_info_to_check
-
-
-def test_check_dns_without_connection_timeout_keyboard_interrupt():
-    """Test that the method handles KeyboardInterrupt gracefully."""
-    dns = ModuleFactory().create_dns_analyzer_obj()
-    # Simulate a KeyboardInterrupt
-    dns.get_dns_flow_from_queue = Mock(side_effect=KeyboardInterrupt)
-    dns.check_dns_without_connection_timeout()
-    # just checking that it doesnt raise an exception
-    assert True
-
-
-def test_check_dns_without_connection_timeout_should_stop():
-    """Test that the method exits when should_stop returns True."""
-    dns = ModuleFactory().create_dns_analyzer_obj()
-    dns.flowalerts.should_stop = Mock(return_value=True)
-    dns.get_dns_flow_from_queue = Mock()
-    dns.check_dns_without_connection_timeout()
-
-    # Assert that the method exits without processing any flows
-    dns.get_dns_flow_from_queue.assert_not_called()
-
-
-def test_check_pending_flows_timeout():
-    reference_flow = DNS(
-        starttime="1726568479.5997488",
-        uid="1234",
-        saddr="",
-        daddr="",
-        query="",
-        qclass_name="",
-        dport="",
-        sport="",
-        proto="",
-        qtype_name="",
-        rcode_name="",
-        answers="",
-        TTLs="",
-    )
-
-    # This will be 10 mins after the reference_flow
-    dns_flow_to_check = DNS(
-        starttime="1726570879.5997488",
-        uid="5678",
-        saddr="",
-        daddr="",
-        query="",
-        qclass_name="",
-        dport="",
-        sport="",
-        proto="",
-        qtype_name="",
-        rcode_name="",
-        answers="",
-        TTLs="",
-    )
-    # Simulate 10 minutes difference
-    utils.get_time_diff = Mock(return_value=10)
+@pytest.mark.parametrize(
+    "mins_passed, contacted, expected_pending, expected_evidence",
+    [
+        # Testcase 1: 10 mins passed, conn didnt arrive, keep waiting
+        (10, False, 1, False),
+        # Testcase 2: 10 mins passed, conn arrived, stop waiting
+        (10, True, 0, False),
+        # Testcase 3: 30 mins passed, conn never arrived
+        (30, False, 0, True),
+        # Testcase 4: 5 mins passed, nothing is checked yet
+        (5, True, 1, False),
+    ],
+)
+def test_pending_dns_without_conn(
+    mins_passed, contacted, expected_pending, expected_evidence
+):
+    dns = get_dns_obj()
+    dns.should_detect_dns_without_conn.return_value = True
+    dns.is_interface_timeout_reached.return_value = True
+    dns.is_any_flow_answer_contacted.return_value = False
+    flow = get_dns_flow()
+    dns.check_dns_without_connection("profileid", "twid", flow)
+
+    dns.is_any_flow_answer_contacted.return_value = contacted
+    # zeek time is driven by the dns flows slips reads
+    for minute in range(1, mins_passed + 1):
+        dns.pending_dns_without_conn.run_due(
+            float(flow.starttime) + minute * 60 + 1
+        )
 
-    dns = ModuleFactory().create_dns_analyzer_obj()
-    dns.check_dns_without_connection = Mock()
-    dns.pending_dns_without_conn.put(
-        ("profile5678", "twid_123", dns_flow_to_check)
-    )
+    assert len(dns.pending_dns_without_conn) == expected_pending
+    assert dns.set_evidence.dns_without_conn.called == expected_evidence
 
-    back_to_queue = dns.check_pending_flows_timeout(reference_flow)
 
-    utils.get_time_diff.assert_called_once_with(
-        dns_flow_to_check.starttime, reference_flow.starttime, "minutes"
-    )
+def test_check_dns_without_connection_of_all_pending_flows():
+    dns = get_dns_obj()
+    dns.should_detect_dns_without_conn.return_value = True
+    dns.is_interface_timeout_reached.return_value = True
+    dns.is_any_flow_answer_contacted.return_value = False
+    flow = get_dns_flow()
+    dns.check_dns_without_connection("profileid", "twid", flow)
 
-    dns.check_dns_without_connection.assert_called_once_with(
-        "profile5678", "twid_123", dns_flow_to_check, waited_for_the_conn=False
-    )
-    assert back_to_queue == []
+    dns.check_dns_without_connection_of_all_pending_flows()
+    assert len(dns.pending_dns_without_conn) == 0
+    dns.set_evidence.dns_without_conn.assert_called_once_with("twid", flow)
@@ -0,0 +1,237 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+"""Unit test for modules/update_manager/download_scheduler.py
+runs against a local HTTP server that acts like a TI feed server"""
+
+import threading
+import time
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+
+import pytest
+
+from modules.update_manager.download_scheduler import (
+    Download,
+    DownloadScheduler,
+    DownloadStatus,
+)
+
+FEED_CONTENT = b"1.1.1.1,malicious\n" * 10000
+ETAG = '"v1"'
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+class FeedServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FeedHandler)
+        self.lock = threading.Lock()
+        self.active_requests = 0
+        self.max_active_requests = 0
+        self.requests = 0
+        # seconds every request takes, to test concurrency limits
+        self.delay = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """
+    /feed.csv supports e-tags and last-modified
+    /no_validators.csv has neither
+    /missing.csv returns 404
+    /unavailable.csv returns 503
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server: FeedServer = self.server
+        with server.lock:
+            server.requests += 1
+            server.active_requests += 1
+            server.max_active_requests = max(
+                server.max_active_requests, server.active_requests
+            )
+        try:
+            time.sleep(server.delay)
+            self.handle_feed()
+        finally:
+            with server.lock:
+                server.active_requests -= 1
+
+    def handle_feed(self):
+        if self.path.startswith("/missing"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        if self.path.startswith("/unavailable"):
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        validators = {}
+        if not self.path.startswith("/no_validators"):
+            validators = {"ETag": ETAG, "Last-Modified": LAST_MODIFIED}
+
+        if validators and (
+            self.headers.get("If-None-Match") == ETAG
+            or self.headers.get("If-Modified-Since") == LAST_MODIFIED
+        ):
+            self.send_response(304)
+            for header, value in validators.items():
+                self.send_header(header, value)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        for header, value in validators.items():
+            self.send_header(header, value)
+        self.send_header("Content-Length", str(len(FEED_CONTENT)))
+        self.end_headers()
+        self.wfile.write(FEED_CONTENT)
+
+
+@pytest.fixture
+def feed_server():
+    server = FeedServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+async def test_download_new_feed(feed_server, tmp_path):
+    path = str(tmp_path / "feed.csv")
+    scheduler = DownloadScheduler()
+    [result] = await scheduler.download_all(
+        [Download(f"{feed_server.url}/feed.csv", path)]
+    )
+    assert result.status == DownloadStatus.UPDATED
+    assert result.etag == ETAG
+    assert result.last_modified == LAST_MODIFIED
+    with open(path, "rb") as f:
+        assert f.read() == FEED_CONTENT
+    # no partial file is left behind
+    assert [p.name for p in tmp_path.iterdir()] == ["feed.csv"]
+
+
+@pytest.mark.parametrize(
+    "etag, last_modified",
+    [
+        # Testcase 1: using the e-tag
+        (ETAG, None),
+        # Testcase 2: using the last-modified
+        (None, LAST_MODIFIED),
+    ],
+)
+async def test_conditional_download(
+    feed_server, tmp_path, etag, last_modified
+):
+    path = tmp_path / "feed.csv"
+    scheduler = DownloadScheduler()
+    [result] = await scheduler.download_all(
+        [
+            Download(
+                f"{feed_server.url}/feed.csv",
+                str(path),
+                etag=etag,
+                last_modified=last_modified,
+            )
+        ]
+    )
+    assert result.status == DownloadStatus.NOT_MODIFIED
+    # nothing was written to disk
+    assert not path.exists()
+
+
+@pytest.mark.parametrize(
+    "path, status_code, expected_requests",
+    [
+        # Testcase 1: client errors aren't retried
+        ("missing.csv", 404, 1),
+        # Testcase 2: server errors are
+        ("unavailable.csv", 503, 2),
+    ],
+)
+async def test_failed_download(
+    feed_server, tmp_path, path, status_code, expected_requests
+):
+    scheduler = DownloadScheduler(retries=2)
+    [result] = await scheduler.download_all(
+        [Download(f"{feed_server.url}/{path}", str(tmp_path / "x"))]
+    )
+    assert result.status == DownloadStatus.FAILED
+    assert str(status_code) in result.error
+    assert feed_server.requests == expected_requests
+
+
+@pytest.mark.parametrize(
+    "status_code, expected_result",
+    [(404, False), (403, False), (429, True), (500, True), (503, True)],
+)
+def test_should_retry(status_code, expected_result):
+    assert DownloadScheduler.should_retry(status_code) == expected_result
+
+
+async def test_connection_error(tmp_path):
+    scheduler = DownloadScheduler(retries=1, timeout=1)
+    # nothing is listening on port 9 of localhost
+    [result] = await scheduler.download_all(
+        [Download("http://127.0.0.1:9/feed.csv", str(tmp_path / "x"))]
+    )
+    assert result.status == DownloadStatus.FAILED
+    assert "Connection error" in result.error
+
+
+@pytest.mark.parametrize(
+    "max_concurrent_downloads, max_downloads_per_host, expected_max_active",
+    [
+        # Testcase 1: limited by the per host limit
+        (8, 2, 2),
+        # Testcase 2: limited by the global limit
+        (3, 5, 3),
+    ],
+)
+async def test_concurrency_limits(
+    feed_server,
+    tmp_path,
+    max_concurrent_downloads,
+    max_downloads_per_host,
+    expected_max_active,
+):
+    feed_server.delay = 0.2
+    scheduler = DownloadScheduler(
+        max_concurrent_downloads=max_concurrent_downloads,
+        max_downloads_per_host=max_downloads_per_host,
+    )
+    downloads = [
+        Download(
+            f"{feed_server.url}/no_validators_{i}.csv",
+            str(tmp_path / f"feed_{i}.csv"),
+        )
+        for i in range(8)
+    ]
+    start = time.time()
+    results = await scheduler.download_all(downloads)
+
+    assert all(r.status == DownloadStatus.UPDATED for r in results)
+    # results are returned in the same order of the downloads
+    assert [r.url for r in results] == [d.url for d in downloads]
+    assert feed_server.max_active_requests == expected_max_active
+    # the whole refresh cycle takes seconds, not minutes
+    assert time.time() - start < 5
+
+
+def test_get_host():
+    assert (
+        DownloadScheduler.get_host("https://example.com/a/b.csv")
+        == "example.com"
+    )
@@ -1,5 +1,6 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
+import json
 import pytest
 import os
 from unittest.mock import Mock, MagicMock, patch, call
@@ -16,6 +17,8 @@ from slips_files.core.structures.evidence import (
     Direction,
     ThreatLevel,
 )
+from slips_files.common.slips_utils import utils
+from slips_files.core.evidence_handler import TWEvidence
 from tests.module_factory import ModuleFactory
 from datetime import datetime
 
@@ -517,3 +520,87 @@ def test_log_alert(
     evidence_handler.add_alert_to_json_log_file.assert_called_once()
     assert flow_datetime in evidence_handler.add_to_log_file.call_args[0][0]
     assert str(twid) in evidence_handler.add_to_log_file.call_args[0][0]
+
+
+def create_evidence(evidence_id: str, direction="SRC") -> Evidence:
+    return Evidence(
+        evidence_type=EvidenceType.ARP_SCAN,
+        description="",
+        attacker=Attacker(
+            direction=direction,
+            ioc_type=IoCType.IP,
+            value="192.168.1.1",
+        ),
+        threat_level=ThreatLevel.INFO,
+        profile=ProfileID("192.168.1.1"),
+        timewindow=TimeWindow(1),
+        uid=[],
+        timestamp=datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f%z"),
+        id=evidence_id,
+    )
+
+
+def test_get_tw_evidence_is_loaded_from_the_db_once():
+    evidence_handler = ModuleFactory().create_evidence_handler_obj()
+    evidence_handler.tw_evidence = {}
+    db = evidence_handler.db
+    db.get_profileid_twid_alerts.return_value = {"alert1": '["1"]'}
+    db.get_twid_evidence.return_value = {
+        evidence_id: json.dumps(utils.to_dict(create_evidence(evidence_id)))
+        for evidence_id in ("1", "2")
+    }
+    db.is_whitelisted_evidence.return_value = False
+    db.is_evidence_processed.return_value = True
+
+    for _ in range(3):
+        tw_evidence = evidence_handler.get_tw_evidence(
+            "profile_192.168.1.1", "timewindow1"
+        )
+    assert list(tw_evidence.evidence) == ["2"]
+    assert tw_evidence.past_alert_ids == {"1"}
+    db.get_twid_evidence.assert_called_once()
+    db.get_profileid_twid_alerts.assert_called_once()
+
+
+def test_alerted_evidence_are_not_alerted_again():
+    evidence_handler = ModuleFactory().create_evidence_handler_obj()
+    evidence_handler.tw_evidence = {
+        ("profile_192.168.1.1", "timewindow1"): TWEvidence()
+    }
+    tw_evidence = evidence_handler.get_tw_evidence(
+        "profile_192.168.1.1", "timewindow1"
+    )
+    for evidence_id in ("1", "2"):
+        tw_evidence.evidence[evidence_id] = create_evidence(evidence_id)
+
+    evidence_to_alert = evidence_handler.get_evidence_for_tw(
+        "profile_192.168.1.1", "timewindow1"
+    )
+    assert list(evidence_to_alert) == ["1", "2"]
+    tw_evidence.mark_as_alerted(evidence_to_alert)
+
+    assert tw_evidence.past_alert_ids == {"1", "2"}
+    assert evidence_handler.is_filtered_evidence(
+        create_evidence("1"), tw_evidence.past_alert_ids
+    )
+    assert (
+        evidence_handler.get_evidence_for_tw(
+            "profile_192.168.1.1", "timewindow1"
+        )
+        is None
+    )
+    evidence_handler.db.get_twid_evidence.assert_not_called()
+
+
+def test_handle_tw_closed():
+    evidence_handler = ModuleFactory().create_evidence_handler_obj()
+    evidence_handler.tw_evidence = {
+        ("profile_192.168.1.1", "timewindow1"): TWEvidence(),
+        ("profile_192.168.1.1", "timewindow2"): TWEvidence(),
+    }
+    evidence_handler.handle_tw_closed(
+        {"data": "profile_192.168.1.1_timewindow1"}
+    )
+    assert list(evidence_handler.tw_evidence) == [
+        ("profile_192.168.1.1", "timewindow2")
+    ]
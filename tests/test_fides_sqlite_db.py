@@ -15,10 +15,11 @@ from modules.fidesModule.model.service_history import ServiceHistoryRecord
 
 
 @pytest.fixture
-def db():
-    # Create an in-memory SQLite database for testing
+def db(tmp_path):
+    # SQLiteDB creates the file at the given path, so a ":memory:" path
+    # would leave a file named ":memory:" in the cwd
     logger = MagicMock()  # Mock the logger for testing purposes
-    db_instance = SQLiteDB(logger, ":memory:")  # Using in-memory DB
+    db_instance = SQLiteDB(logger, str(tmp_path / "fides.sqlite"))
     return db_instance
 
 
@@ -0,0 +1,116 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import asyncio
+import json
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from modules.flowalerts.flowalerts import ChannelStats
+from tests.module_factory import ModuleFactory
+
+
+class AsyncAnalyzer:
+    def __init__(self):
+        self.msgs = []
+
+    async def analyze(self, msg):
+        self.msgs.append(msg)
+
+
+def create_flowalerts(channels_msgs: dict):
+    """
+    :param channels_msgs: {channel: [msgs waiting in it]}
+    """
+    flowalerts = ModuleFactory().create_flowalerts_obj()
+    flowalerts.analyzers_map = {channel: [] for channel in channels_msgs}
+    flowalerts.db.get_msgs_published_in_channel.return_value = 0
+    flowalerts.init_channel_stats()
+    flowalerts.get_msg = Mock(
+        side_effect=lambda channel: (
+            channels_msgs[channel].pop(0) if channels_msgs[channel] else None
+        )
+    )
+    return flowalerts
+
+
+@pytest.mark.parametrize(
+    "quota, msgs, expected_msgs",
+    [
+        # Testcase 1: less msgs than the quota
+        (10, 3, 3),
+        # Testcase 2: more msgs than the quota
+        (10, 25, 10),
+        # Testcase 3: no msgs
+        (10, 0, 0),
+    ],
+)
+def test_get_msgs(quota, msgs, expected_msgs):
+    flowalerts = create_flowalerts({"new_flow": [{"data": ""}] * msgs})
+    flowalerts.channel_stats["new_flow"].quota = quota
+
+    assert len(flowalerts.get_msgs("new_flow")) == expected_msgs
+    stats = flowalerts.channel_stats["new_flow"]
+    assert stats.received == expected_msgs
+    assert stats.batches == (1 if expected_msgs else 0)
+
+
+def test_update_channel_quotas():
+    flowalerts = create_flowalerts({"new_flow": [], "new_software": []})
+    flowalerts.channel_stats["new_flow"] = ChannelStats(
+        received=1000, published_before_start=100
+    )
+    published = {"new_flow": 10100, "new_software": 5}
+    flowalerts.db.get_msgs_published_in_channel.side_effect = (
+        lambda channel: str(published[channel])
+    )
+
+    flowalerts.update_channel_quotas()
+
+    new_flow = flowalerts.channel_stats["new_flow"]
+    new_software = flowalerts.channel_stats["new_software"]
+    assert new_flow.backlog == 9000
+    assert new_software.backlog == 5
+    assert new_flow.quota > new_software.quota
+    assert new_software.quota == flowalerts.min_msgs_per_channel
+    assert new_flow.quota <= flowalerts.msgs_per_iteration
+
+
+def test_channel_quotas_arent_updated_too_often():
+    flowalerts = create_flowalerts({"new_flow": []})
+    flowalerts.db.get_msgs_published_in_channel.reset_mock()
+    flowalerts.ts_of_last_quota_update = time.time()
+    flowalerts.update_channel_quotas()
+    flowalerts.db.get_msgs_published_in_channel.assert_not_called()
+
+
+def test_main_runs_analyzers_in_batches():
+    msgs = [
+        {
+            "channel": "new_flow",
+            "data": json.dumps(
+                {"twid": "timewindow1", "flow": {"uid": f"uid{i}"}}
+            ),
+        }
+        for i in range(25)
+    ]
+    flowalerts = create_flowalerts({"new_flow": list(msgs)})
+    flowalerts.update_channel_quotas = Mock()
+    sync_analyzer = Mock()
+    async_analyzer = AsyncAnalyzer()
+    flowalerts.analyzers_map["new_flow"] = [sync_analyzer, async_analyzer]
+
+    async def run_main_once():
+        await flowalerts.main()
+        await asyncio.gather(*flowalerts.tasks)
+
+    asyncio.run(run_main_once())
+    quota = flowalerts.min_msgs_per_channel
+    assert sync_analyzer.analyze.call_count == quota
+    assert async_analyzer.msgs == msgs[:quota]
+    # the conn flows are cached before the analyzers look them up
+    assert flowalerts.db.cache_conn_flow.call_count == quota
+    flowalerts.db.cache_conn_flow.assert_any_call(
+        {"uid": "uid0"}, "timewindow1"
+    )
@@ -0,0 +1,396 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import random
+import time
+from unittest.mock import Mock
+
+import numpy
+import pandas as pd
+import pytest
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import StandardScaler
+
+from slips_files.core.database.sqlite_db.database import SQLiteDB
+from tests.module_factory import ModuleFactory
+
+# the fields detect() used to drop before scaling a flow
+FIELDS_TO_DROP = [
+    "label",
+    "module_labels",
+    "dpkts",
+    "ground_truth_label",
+    "detailed_ground_truth_label",
+]
+
+
+def process_features(dataset: pd.DataFrame) -> pd.DataFrame:
+    """
+    converts the flows to features with pandas, the way FlowMLDetection
+    did before get_features(). the features of get_features() are
+    checked against these
+    """
+    # Discard some type of flows that dont have ports
+    for proto in ["arp", "ARP", "icmp", "igmp", "ipv6-icmp", ""]:
+        dataset = dataset[dataset.proto != proto]
+
+    # For now, discard the ports
+    to_drop = [
+        "appproto",
+        "daddr",
+        "saddr",
+        "starttime",
+        "type_",
+        "smac",
+        "dmac",
+        "history",
+        "uid",
+        "dir_",
+        "dbytes",
+        "endtime",
+        "bytes",
+        "flow_source",
+    ]
+    dataset = dataset.drop(to_drop, axis=1, errors="ignore")
+
+    # Convert state to categorical
+    dataset.state = dataset.state.str.replace(
+        r"(^.*NotEstablished.*$)", "0", regex=True
+    )
+    dataset.state = dataset.state.str.replace(
+        r"(^.*Established.*$)", "1", regex=True
+    )
+    # Convert proto to categorical
+    dataset.proto = dataset.proto.str.lower()
+    for regex, code in (
+        (r"(^.*tcp.*$)", "0"),
+        (r"(^.*udp.*$)", "1"),
+        (r"(^.*icmp.*$)", "2"),
+        (r"(^.*icmp-ipv6.*$)", "3"),
+        (r"(^.*arp.*$)", "4"),
+    ):
+        dataset.proto = dataset.proto.str.replace(regex, code, regex=True)
+    return dataset
+
+
+def get_flow(
+    i: int, proto="tcp", state="Established", label="", rand=random
+) -> dict:
+    """returns a flow like the ones FlowMLDetection.main() gets"""
+    spkts = rand.randint(1, 100)
+    dpkts = rand.randint(0, 100)
+    sbytes = spkts * rand.randint(40, 1500)
+    dbytes = dpkts * rand.randint(40, 1500)
+    return {
+        "starttime": "1726249372.312124",
+        "uid": f"uid{i}",
+        "saddr": "192.168.1.1",
+        "daddr": f"8.8.{i // 256 % 256}.{i % 256}",
+        "dur": str(rand.uniform(0, 100)),
+        "proto": proto,
+        "appproto": "",
+        "sport": str(rand.randint(1024, 65535)),
+        "dport": str(rand.choice([22, 53, 80, 443, 8080])),
+        "spkts": spkts,
+        "dpkts": dpkts,
+        "sbytes": sbytes,
+        "dbytes": dbytes,
+        "state": state,
+        "history": "S",
+        "smac": "",
+        "dmac": "",
+        "ground_truth_label": "",
+        "detailed_ground_truth_label": "",
+        "type_": "conn",
+        "dir_": "->",
+        "allbytes": sbytes + dbytes,
+        "pkts": spkts + dpkts,
+        "label": label,
+        "module_labels": {},
+    }
+
+
+def get_flows(amount: int, seed=0) -> list:
+    rand = random.Random(seed)
+    protos = ["tcp", "udp", "TCP", "icmp", "arp"]
+    states = ["Established", "Not Established", "NotEstablished"]
+    return [
+        get_flow(
+            i,
+            proto=rand.choice(protos),
+            state=rand.choice(states),
+            rand=rand,
+        )
+        for i in range(amount)
+    ]
+
+
+def create_trained_flowmldetection():
+    """
+    returns a FlowMLDetection obj with a model and a scaler trained with
+    the features of process_features(), like the ones stored on disk
+    """
+    flowmldetection = ModuleFactory().create_flowmldetection_obj()
+    flowmldetection.print = Mock()
+    flowmldetection.db.set_evidence = Mock()
+    flows = get_flows(500, seed=1)
+    for flow in flows:
+        flow["label"] = "Malware" if flow["spkts"] > 50 else "Normal"
+    dataset = process_features(pd.DataFrame(flows))
+    labels = dataset["label"]
+    dataset = dataset.drop(FIELDS_TO_DROP, axis=1)
+
+    flowmldetection.scaler = StandardScaler()
+    x_flows = flowmldetection.scaler.fit_transform(dataset)
+    flowmldetection.clf = SGDClassifier(
+        warm_start=True, loss="hinge", penalty="l1", random_state=0
+    )
+    flowmldetection.clf.partial_fit(
+        x_flows, labels, classes=["Malware", "Normal"]
+    )
+    return flowmldetection
+
+
+def detect_one_by_one(flowmldetection, flows: list) -> list:
+    """detects the flows one per DataFrame, the way it was done before
+    batching them"""
+    predictions = []
+    for flow in flows:
+        dflow = process_features(pd.DataFrame(flow, index=[0]))
+        if dflow.empty:
+            predictions.append(None)
+            continue
+        dflow = dflow.drop(FIELDS_TO_DROP, axis=1)
+        x_flow = flowmldetection.scaler.transform(dflow)
+        predictions.append(flowmldetection.clf.predict(x_flow)[0])
+    return predictions
+
+
+def test_get_features_match_process_features():
+    flowmldetection = create_trained_flowmldetection()
+    flows = get_flows(200)
+    expected = process_features(pd.DataFrame(flows))
+    expected = expected.drop(FIELDS_TO_DROP, axis=1)
+
+    x_flows, indices = flowmldetection.get_features(flows)
+
+    assert list(indices) == list(expected.index)
+    assert numpy.allclose(x_flows, expected.astype("float64").to_numpy())
+
+
+@pytest.mark.parametrize(
+    "flow_fields, expected_detected",
+    [
+        # Testcase 1: flow without ports
+        ({"proto": "icmp"}, False),
+        # Testcase 2: unknown non numeric proto
+        ({"proto": "sctp"}, False),
+        # Testcase 3: non numeric port
+        ({"sport": "abc"}, False),
+        # Testcase 4: ipv6 tcp flow
+        ({"proto": "tcp6"}, True),
+    ],
+)
+def test_get_features_skips_invalid_flows(flow_fields, expected_detected):
+    flowmldetection = create_trained_flowmldetection()
+    flow = get_flow(0)
+    flow.update(flow_fields)
+    _, indices = flowmldetection.get_features([get_flow(1), flow])
+    assert (1 in indices) == expected_detected
+
+
+def test_batch_predictions_match_one_by_one():
+    flowmldetection = create_trained_flowmldetection()
+    flows = get_flows(300)
+    expected = detect_one_by_one(flowmldetection, flows)
+
+    x_flows, indices = flowmldetection.get_features(flows)
+    predictions = [None] * len(flows)
+    for i, prediction in zip(indices, flowmldetection.detect(x_flows)):
+        predictions[i] = prediction
+
+    assert predictions == expected
+    assert "Malware" in predictions
+
+
+def test_detect_pending_flows_sets_evidence_per_flow():
+    flowmldetection = create_trained_flowmldetection()
+    flows = get_flows(100)
+    expected = detect_one_by_one(flowmldetection, flows)
+    for flow in flows:
+        flowmldetection.add_pending_flow(flow, "timewindow1")
+
+    flowmldetection.detect_pending_flows()
+
+    assert not flowmldetection.pending_flows
+    evidence_uids = [
+        call[0][0].uid[0]
+        for call in flowmldetection.db.set_evidence.call_args_list
+    ]
+    assert evidence_uids == [
+        flow["uid"]
+        for flow, prediction in zip(flows, expected)
+        if prediction == "Malware"
+    ]
+
+
+@pytest.mark.parametrize(
+    "pending_flows, waited, expected",
+    [
+        # Testcase 1: no flows
+        (0, 10, False),
+        # Testcase 2: not enough flows, not waited enough
+        (5, 0, False),
+        # Testcase 3: not enough flows, waited enough
+        (5, 2, True),
+        # Testcase 4: a full batch
+        (256, 0, True),
+    ],
+)
+def test_should_detect_pending_flows(pending_flows, waited, expected):
+    flowmldetection = ModuleFactory().create_flowmldetection_obj()
+    for i in range(pending_flows):
+        flowmldetection.add_pending_flow(get_flow(i), "timewindow1")
+    if flowmldetection.oldest_pending_flow_time is not None:
+        flowmldetection.oldest_pending_flow_time -= waited
+    assert flowmldetection.should_detect_pending_flows() == expected
+
+
+@pytest.mark.benchmark
+def test_batch_detection_throughput():
+    """compares the flows/sec detected one per DataFrame, like before
+    the micro-batches, and in batches"""
+    flowmldetection = create_trained_flowmldetection()
+    flows = get_flows(2000)
+
+    start = time.monotonic()
+    detect_one_by_one(flowmldetection, flows[:200])
+    one_by_one_rate = 200 / (time.monotonic() - start)
+
+    start = time.monotonic()
+    for batch_start in range(0, len(flows), flowmldetection.batch_size):
+        batch = flows[batch_start : batch_start + flowmldetection.batch_size]
+        x_flows, _ = flowmldetection.get_features(batch)
+        flowmldetection.detect(x_flows)
+    batch_rate = len(flows) / (time.monotonic() - start)
+
+    print(
+        f"ml detection flows/sec: one by one {one_by_one_rate:.0f}, "
+        f"in batches {batch_rate:.0f}"
+    )
+
+
+def store_flows(sqlite: SQLiteDB, flows: list, labels: list):
+    """stores the given flows in the flows table, the way the profiler
+    does"""
+    stored_flows = []
+    for flow, label in zip(flows, labels):
+        stored_flow = {
+            field: value
+            for field, value in flow.items()
+            if field not in ("allbytes", "pkts", "label", "module_labels")
+        }
+        # the db has the origstate, not the interpreted one
+        stored_flow["state"] = "SF" if flow["state"] == "Established" else "S0"
+        stored_flows.append(
+            (stored_flow, f"profile_{flow['saddr']}", "timewindow1", label, "")
+        )
+    sqlite.insert_flows(stored_flows)
+
+
+def create_training_flowmldetection(tmp_path):
+    flowmldetection = ModuleFactory().create_flowmldetection_obj()
+    flowmldetection.print = Mock()
+    flowmldetection.store_model = Mock()
+    flowmldetection.clf = SGDClassifier(
+        warm_start=True, loss="hinge", penalty="l1", random_state=0
+    )
+    sqlite = SQLiteDB(Mock(), str(tmp_path))
+    flowmldetection.db.get_flows_after = sqlite.get_flows_after
+    flowmldetection.db.get_final_state_from_flags = lambda state, pkts: (
+        "Established" if state == "SF" else "Not Established"
+    )
+    return flowmldetection, sqlite
+
+
+def get_labeled_flows(amount: int, seed=0):
+    flows = [
+        get_flow(i, state=state)
+        for i, state in zip(
+            range(amount), ["Established", "Not Established"] * amount
+        )
+    ]
+    random.Random(seed).shuffle(flows)
+    labels = [
+        "Malicious-C&C" if flow["spkts"] > 50 else "normal" for flow in flows
+    ]
+    return flows, labels
+
+
+def test_get_training_flows(tmp_path):
+    flowmldetection, sqlite = create_training_flowmldetection(tmp_path)
+    flows, labels = get_labeled_flows(20)
+    labels[0] = "benign"
+    store_flows(sqlite, flows, labels)
+    rows = sqlite.get_flows_after(0, 100)
+
+    training_flows, classes = flowmldetection.get_training_flows(rows)
+
+    # flows that aren't normal or malware aren't used for training
+    assert len(training_flows) == 19
+    assert classes == [
+        "Malware" if label.startswith("Malicious") else "Normal"
+        for label in labels[1:]
+    ]
+    x_flows, _ = flowmldetection.get_features(training_flows)
+    expected, _ = flowmldetection.get_features(flows[1:])
+    assert numpy.allclose(x_flows, expected)
+
+
+def test_train_with_new_flows_reads_each_flow_once(tmp_path):
+    flowmldetection, sqlite = create_training_flowmldetection(tmp_path)
+    flowmldetection.training_batch_size = 30
+    flows, labels = get_labeled_flows(150)
+    train = Mock(wraps=flowmldetection.train)
+    flowmldetection.train = train
+
+    store_flows(sqlite, flows[:100], labels[:100])
+    flowmldetection.train_with_new_flows()
+    assert flowmldetection.last_trained_rowid == 100
+    assert [len(call[0][0]) for call in train.call_args_list] == [
+        30,
+        30,
+        30,
+        10,
+    ]
+
+    train.reset_mock()
+    store_flows(sqlite, flows[100:], labels[100:])
+    flowmldetection.train_with_new_flows()
+    assert flowmldetection.last_trained_rowid == 150
+    assert [len(call[0][0]) for call in train.call_args_list] == [30, 20]
+    # the scaler was fitted once with every flow
+    assert flowmldetection.scaler.n_samples_seen_ == 150
+    flowmldetection.store_model.assert_called()
+
+    train.reset_mock()
+    flowmldetection.train_with_new_flows()
+    train.assert_not_called()
+
+
+def test_train_with_new_flows_learns(tmp_path):
+    flowmldetection, sqlite = create_training_flowmldetection(tmp_path)
+    flowmldetection.training_batch_size = 100
+    flows, labels = get_labeled_flows(1000)
+    store_flows(sqlite, flows, labels)
+
+    flowmldetection.train_with_new_flows()
+
+    test_flows, test_labels = get_labeled_flows(300, seed=1)
+    x_flows, indices = flowmldetection.get_features(test_flows)
+    predictions = flowmldetection.detect(x_flows)
+    expected = [
+        "Malware" if test_labels[i].startswith("Malicious") else "Normal"
+        for i in indices
+    ]
+    accuracy = numpy.mean(predictions == numpy.asarray(expected))
+    assert accuracy > 0.8
@@ -2,7 +2,7 @@
 # SPDX-License-Identifier: GPL-2.0-only
 import pytest
 import random
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, Mock, patch
 from modules.network_discovery.horizontal_portscan import HorizontalPortscan
 from tests.module_factory import ModuleFactory
 from slips_files.core.structures.evidence import (
@@ -22,6 +22,18 @@ def generate_random_ip():
     return ".".join(str(random.randint(0, 255)) for _ in range(4))
 
 
+def get_conn_flow(daddr, dport="5555", saddr="1.1.1.1", proto="tcp"):
+    return Mock(
+        starttime="1726249372.312124",
+        uid=f"uid_{daddr}",
+        saddr=saddr,
+        daddr=daddr,
+        proto=proto,
+        dport=dport,
+        state_hist="S",
+    )
+
+
 def enough_dstips_to_reach_the_threshold():
     """
     returns conns to dport that are not enough
@@ -347,10 +359,12 @@ def test_check_broadcast_or_multicast_address(
     mock_get_not_estab_dst_ports,
 ):
     horizontal_ps = ModuleFactory().create_horizontal_portscan_obj()
-    horizontal_ps.db.get_field_separator.return_value = "_"
+    horizontal_ps.db.get_dns_resolution.return_value = {}
     profileid = "profile_255.255.255.255"
     twid = "timewindow0"
-    horizontal_ps.check(profileid, twid)
+    for i in range(horizontal_ps.minimum_dstips_to_set_evidence):
+        flow = get_conn_flow(f"8.8.8.{i}", saddr="255.255.255.255")
+        horizontal_ps.check(profileid, twid, flow, "Not Established")
     mock_get_not_estab_dst_ports.assert_not_called()
 
 
@@ -482,21 +496,105 @@ def test_is_valid_saddr(ip, expected_val):
 
 def test_check_valid_ip():
     horizontal_ps = ModuleFactory().create_horizontal_portscan_obj()
-    horizontal_ps.db.get_field_separator.return_value = "_"
+    horizontal_ps.db.get_dns_resolution.return_value = {}
 
     profileid = "profile_10.0.0.1"
     twid = "timewindow0"
+    flow = get_conn_flow("8.8.8.8", saddr="10.0.0.1")
 
     with patch.object(horizontal_ps, "get_not_estab_dst_ports"):
-        horizontal_ps.check(profileid, twid)
+        horizontal_ps.check(profileid, twid, flow, "Not Established")
 
 
 def test_check_invalid_profileid():
     horizontal_ps = ModuleFactory().create_horizontal_portscan_obj()
     profileid = None
     twid = "timewindow0"
+    flow = get_conn_flow("8.8.8.8")
     with pytest.raises(Exception):
-        horizontal_ps.check(profileid, twid)
+        horizontal_ps.check(profileid, twid, flow, "Not Established")
+
+
+def test_check_sets_evidence_when_threshold_is_reached():
+    horizontal_ps = ModuleFactory().create_horizontal_portscan_obj()
+    horizontal_ps.db.get_dns_resolution.return_value = {}
+    horizontal_ps.db.get_port_info.return_value = ""
+    profileid = "profile_1.1.1.1"
+    twid = "timewindow0"
+    minimum = horizontal_ps.minimum_dstips_to_set_evidence
+    dstips = [f"8.8.8.{i}" for i in range(minimum)]
+    horizontal_ps.db.get_data_from_profile_tw.return_value = {
+        "5555": {
+            "dstips": {
+                ip: {"spkts": 1, "stime": "1726249372.312124", "uid": [ip]}
+                for ip in dstips
+            }
+        }
+    }
+
+    results = [
+        horizontal_ps.check(
+            profileid, twid, get_conn_flow(ip), "Not Established"
+        )
+        for ip in dstips
+    ]
+    # the same dstip again doesn't change the count
+    results.append(
+        horizontal_ps.check(
+            profileid, twid, get_conn_flow(dstips[0]), "Not Established"
+        )
+    )
+
+    assert results == [False] * (minimum - 1) + [True, False]
+    # the db is only read to get the details of the evidence
+    horizontal_ps.db.get_data_from_profile_tw.assert_called_once()
+    evidence = horizontal_ps.db.set_evidence.call_args[0][0]
+    assert set(evidence.uid) == set(dstips)
+    assert str(minimum) in evidence.description
+
+
+@pytest.mark.parametrize(
+    "flow, state",
+    [
+        # Testcase 1: established flow
+        (get_conn_flow("8.8.8.8"), "Established"),
+        # Testcase 2: the profile is the server of the flow
+        (get_conn_flow("1.1.1.1", saddr="8.8.8.8"), "Not Established"),
+        # Testcase 3: icmp
+        (get_conn_flow("8.8.8.8", proto="icmp"), "Not Established"),
+        # Testcase 4: multicast dst
+        (get_conn_flow("224.0.0.1"), "Not Established"),
+    ],
+)
+def test_check_ignored_flows(flow, state):
+    horizontal_ps = ModuleFactory().create_horizontal_portscan_obj()
+    horizontal_ps.db.get_dns_resolution.return_value = {}
+    assert not horizontal_ps.check(
+        "profile_1.1.1.1", "timewindow0", flow, state
+    )
+    assert not horizontal_ps.dstips_per_dport
+
+
+def test_check_ignores_resolved_dstips():
+    horizontal_ps = ModuleFactory().create_horizontal_portscan_obj()
+    horizontal_ps.db.get_dns_resolution.return_value = {"domains": ["a.com"]}
+    flow = get_conn_flow("8.8.8.8")
+    horizontal_ps.check(
+        "profile_1.1.1.1", "timewindow0", flow, "Not Established"
+    )
+    assert not horizontal_ps.dstips_per_dport
+
+
+def test_evict():
+    horizontal_ps = ModuleFactory().create_horizontal_portscan_obj()
+    profileid = "profile_1.1.1.1"
+    for twid in ("timewindow1", "timewindow2", "timewindow3"):
+        horizontal_ps.get_dstips_counter(profileid, twid, "TCP", "80")
+
+    horizontal_ps.evict(profileid, "timewindow2")
+    assert list(horizontal_ps.dstips_per_dport[profileid]) == ["timewindow3"]
+    horizontal_ps.evict(profileid, "timewindow3")
+    assert profileid not in horizontal_ps.dstips_per_dport
 
 
 def test_is_valid_twid():
@@ -3,6 +3,7 @@
 """Unit test for modules/http_analyzer/http_analyzer.py"""
 
 import json
+import time
 from dataclasses import asdict
 import pytest
 from unittest.mock import (
@@ -17,7 +18,6 @@ from slips_files.core.flows.zeek import (
     Weird,
     Conn,
 )
-from tests.common_test_utils import get_mock_coro
 from tests.module_factory import ModuleFactory
 from modules.http_analyzer.http_analyzer import utils
 
@@ -574,18 +574,18 @@ def test_get_ua_info_online_error_cases(mock_response):
 
 
 # tests for check_non_http_port_80_conns
-async def test_check_non_http_port_80_conns_not_interested():
+def test_check_non_http_port_80_conns_not_interested():
     # mock a flow that we're not interested in (e.g. not an established tcp
     # connection on port 80 with non-zero bytes)
     analyzer = ModuleFactory().create_http_analyzer_obj()
     analyzer.is_tcp_established_port_80_non_empty_flow = Mock(
         return_value=False
     )
-    result = await analyzer.check_non_http_port_80_conns(None, None)
+    result = analyzer.check_non_http_port_80_conns(None, None)
     assert result is False
 
 
-async def test_check_non_http_port_80_conns_is_http():
+def test_check_non_http_port_80_conns_is_http():
     # when the flow is a recognized http flow, we keep track of it
     # and return false
     analyzer = ModuleFactory().create_http_analyzer_obj()
@@ -595,14 +595,14 @@ async def test_check_non_http_port_80_conns_is_http():
     analyzer.is_http_proto_recognized_by_zeek = Mock(return_value=True)
     analyzer.keep_track_of_http_flow = Mock()
     flow = MagicMock(starttime=100, saddr="192.168.1.1", daddr="1.1.1.1")
-    result = await analyzer.check_non_http_port_80_conns(None, flow)
+    result = analyzer.check_non_http_port_80_conns(None, flow)
     assert result is False
     analyzer.keep_track_of_http_flow.assert_called_once_with(
         flow, (flow.saddr, flow.daddr)
     )
 
 
-async def test_check_non_http_port_80_conns_matching_http_past():
+def test_check_non_http_port_80_conns_matching_http_past():
     # simulate a matching http flow in the past (within 5 minutes before the
     # flow's starttime)
     analyzer = ModuleFactory().create_http_analyzer_obj()
@@ -614,11 +614,11 @@ async def test_check_non_http_port_80_conns_matching_http_past():
         return_value=[1.0]
     )
     flow = MagicMock(starttime=100, saddr="192.168.1.1", daddr="1.1.1.1")
-    result = await analyzer.check_non_http_port_80_conns(None, flow)
+    result = analyzer.check_non_http_port_80_conns(None, flow)
     assert result is False
 
 
-async def test_check_non_http_port_80_conns_matching_http_future():
+def test_check_non_http_port_80_conns_matching_http_future():
     # simulate a matching http flow in the future (within 5 minutes after the
     # flow's starttime)
     analyzer = ModuleFactory().create_http_analyzer_obj()
@@ -630,13 +630,13 @@ async def test_check_non_http_port_80_conns_matching_http_future():
         return_value=[1.0]
     )
     flow = MagicMock(starttime=100, saddr="192.168.1.1", daddr="1.1.1.1")
-    result = await analyzer.check_non_http_port_80_conns(
+    result = analyzer.check_non_http_port_80_conns(
         None, flow, timeout_reached=True
     )
     assert result is False
 
 
-async def test_check_non_http_port_80_conns_no_matching_http_timeout():
+def test_check_non_http_port_80_conns_no_matching_http_timeout():
     # simulate no matching http flows when timeout has been reached
     analyzer = ModuleFactory().create_http_analyzer_obj()
     analyzer.is_tcp_established_port_80_non_empty_flow = Mock(
@@ -646,7 +646,7 @@ async def test_check_non_http_port_80_conns_no_matching_http_timeout():
     analyzer.search_http_recognized_flows_for_ts_range = Mock(return_value=[])
     analyzer.set_evidence.non_http_port_80_conn = MagicMock()
     flow = MagicMock(starttime=100, saddr="192.168.1.1", daddr="1.1.1.1")
-    result = await analyzer.check_non_http_port_80_conns(
+    result = analyzer.check_non_http_port_80_conns(
         None, flow, timeout_reached=True
     )
     assert result is True
@@ -655,11 +655,10 @@ async def test_check_non_http_port_80_conns_no_matching_http_timeout():
     )
 
 
-async def test_check_non_http_port_80_conns_no_matching_http_no_timeout():
+def test_check_non_http_port_80_conns_no_matching_http_no_timeout():
     # simulate no matching http flows when timeout has not been reached yet.
-    # the function should sleep for 5 mins (patched to return immediately),
-    # then recursively call itself with timeout_reached true
-    # (which sets evidence)
+    # the flow should be checked again 5 mins later with timeout_reached
+    # true (which sets evidence)
     analyzer = ModuleFactory().create_http_analyzer_obj()
     analyzer.is_tcp_established_port_80_non_empty_flow = Mock(
         return_value=True
@@ -667,20 +666,45 @@ async def test_check_non_http_port_80_conns_no_matching_http_no_timeout():
     analyzer.is_http_proto_recognized_by_zeek = Mock(return_value=False)
     analyzer.search_http_recognized_flows_for_ts_range = Mock(return_value=[])
     analyzer.set_evidence.non_http_port_80_conn = MagicMock()
-    # patch asyncio.sleep so that we do not really wait
-    analyzer.wait_for_new_flows_or_timeout = get_mock_coro(True)
 
     flow = MagicMock(starttime=100, saddr="192.168.1.1", daddr="1.1.1.1")
-    result = await analyzer.check_non_http_port_80_conns(None, flow)
-    # even though the recursive call returns true (after setting evidence),
-    # the original call always returns false
+    result = analyzer.check_non_http_port_80_conns(None, flow)
     assert result is False
-    analyzer.wait_for_new_flows_or_timeout.assert_called_once()
+    assert len(analyzer.delayed_checks) == 1
+    analyzer.set_evidence.non_http_port_80_conn.assert_not_called()
+
+    analyzer.delayed_checks.run_due(time.time() + 5 * 60 + 1)
+    assert len(analyzer.delayed_checks) == 0
     analyzer.set_evidence.non_http_port_80_conn.assert_called_once_with(
         None, flow
     )
 
 
+@pytest.mark.parametrize(
+    "incoming_flows, expected_pending",
+    [
+        # Testcase 1: the profiler is still sending flows, keep waiting
+        (True, 1),
+        # Testcase 2: no more flows are coming, dont wait
+        (False, 0),
+    ],
+)
+def test_run_delayed_checks(incoming_flows, expected_pending):
+    analyzer = ModuleFactory().create_http_analyzer_obj()
+    analyzer.db.will_slips_have_new_incoming_flows.return_value = (
+        incoming_flows
+    )
+    analyzer.check_pending_non_http_port_80_conn = Mock()
+    analyzer.delayed_checks.register(
+        "non_http_port_80_conn", analyzer.check_pending_non_http_port_80_conn
+    )
+    analyzer.delayed_checks.schedule(
+        "non_http_port_80_conn", time.time() + 5 * 60, None, "flow"
+    )
+    analyzer.run_delayed_checks()
+    assert len(analyzer.delayed_checks) == expected_pending
+
+
 # parameterized tests for helper functions
 
 
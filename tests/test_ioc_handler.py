@@ -261,3 +261,125 @@ def test_set_feed_last_update_time(mocker, file, time, expected_data):
     ioc_handler.rcache.hset.assert_called_with(
         "TI_files_info", file, expected_data_json
     )
+
+
+def test_add_iocs_while_staging():
+    ioc_handler = ModuleFactory().create_ioc_handler_obj()
+    ioc_handler.start_staging_iocs()
+    ioc_handler.add_ips_to_ioc({"1.1.1.1": json.dumps({"source": "feed"})})
+    ioc_handler.delete_feed_entries("https://example.com/feed.csv")
+
+    ioc_handler.rcache.hmset.assert_called_once_with(
+        "IoC_ips_staging", {"1.1.1.1": json.dumps({"source": "feed"})}
+    )
+    ioc_handler.rcache.sadd.assert_called_once_with(
+        "IoC_staged_feeds", "feed.csv"
+    )
+    # the live keys weren't touched
+    ioc_handler.rcache.hdel.assert_not_called()
+    ioc_handler.rcache.hincrby.assert_not_called()
+
+
+def test_set_ti_feed_info_while_staging():
+    ioc_handler = ModuleFactory().create_ioc_handler_obj()
+    ioc_handler.start_staging_iocs()
+    staged_info = {"TI_files_info_staging": json.dumps({"e-tag": "new"})}
+    ioc_handler.rcache.hget.side_effect = lambda key, file: staged_info.get(
+        key
+    )
+
+    ioc_handler.set_ti_feed_info("feed.csv", {"e-tag": "new"})
+
+    ioc_handler.rcache.hset.assert_called_once_with(
+        "TI_files_info_staging", "feed.csv", json.dumps({"e-tag": "new"})
+    )
+    # the staged info is used by the rest of the update
+    assert ioc_handler.get_ti_feed_info("feed.csv") == {"e-tag": "new"}
+
+
+def test_discard_staged_iocs():
+    ioc_handler = ModuleFactory().create_ioc_handler_obj()
+    ioc_handler.start_staging_iocs()
+    ioc_handler.rcache.delete.reset_mock()
+
+    ioc_handler.discard_staged_iocs()
+
+    assert not ioc_handler.is_staging_iocs
+    deleted_keys = ioc_handler.rcache.delete.call_args.args
+    assert "TI_files_info_staging" in deleted_keys
+    assert "IoC_ips_staging" in deleted_keys
+    assert "TI_files_info" not in deleted_keys
+    assert "IoC_ips" not in deleted_keys
+
+
+def test_promote_staged_iocs(mocker):
+    ioc_handler = ModuleFactory().create_ioc_handler_obj()
+    ioc_handler.start_staging_iocs()
+    new_ioc = json.dumps({"source": "feed.csv"})
+    new_info = json.dumps({"e-tag": "new"})
+    iocs = {
+        "IoC_ips": {
+            "1.1.1.1": json.dumps({"source": "feed.csv"}),
+            "2.2.2.2": json.dumps({"source": "other.csv"}),
+        },
+        "IoC_ips_staging": {"3.3.3.3": new_ioc},
+        "TI_files_info_staging": {"feed.csv": new_info},
+    }
+    pipe = mocker.Mock()
+    pipe.hgetall.side_effect = lambda key: iocs.get(key, {})
+    pipe.smembers.return_value = {"feed.csv"}
+    ioc_handler.rcache.transaction.side_effect = (
+        lambda func, *watches, **kwargs: func(pipe)
+    )
+
+    assert ioc_handler.promote_staged_iocs() == ["ips"]
+    assert not ioc_handler.is_staging_iocs
+    # the live iocs are watched while the outdated ones are read
+    watched_keys = ioc_handler.rcache.transaction.call_args.args[1:]
+    assert "IoC_ips" in watched_keys
+    pipe.hdel.assert_called_once_with("IoC_ips", "1.1.1.1")
+    pipe.hset.assert_has_calls(
+        [
+            mocker.call("IoC_ips", mapping={"3.3.3.3": new_ioc}),
+            # the e-tags are promoted with the iocs of their feeds
+            mocker.call("TI_files_info", mapping={"feed.csv": new_info}),
+        ]
+    )
+    # the generation is incremented once per promotion
+    pipe.hincrby.assert_called_once_with("IoC_generations", "ips", 1)
+    # all the writes are queued after multi()
+    assert pipe.method_calls.index(mocker.call.multi()) < (
+        pipe.method_calls.index(mocker.call.hdel("IoC_ips", "1.1.1.1"))
+    )
+    # nothing was written outside of the transaction
+    ioc_handler.rcache.hset.assert_not_called()
+    ioc_handler.rcache.hdel.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "generations, expected_builds",
+    [
+        # Testcase 1: the domains didn't change
+        ([b"1", b"1", b"1"], 1),
+        # Testcase 2: the domains were promoted once
+        ([b"1", b"2", b"2"], 2),
+    ],
+)
+def test_trie_is_rebuilt_once_per_generation(
+    mocker, generations, expected_builds
+):
+    ioc_handler = ModuleFactory().create_ioc_handler_obj()
+    ioc_handler.ti_snapshot_check_interval = 0
+    build_trie = mocker.patch.object(ioc_handler, "_build_trie")
+    ioc_handler.trie = mocker.Mock()
+    ioc_handler.trie.search.return_value = (False, None)
+    for generation in generations:
+        ioc_handler.rcache.pipeline.return_value.execute.return_value = [
+            {"domains": generation},
+            {},
+            {},
+        ]
+        ioc_handler.is_trie_cached = True
+        ioc_handler._match_subdomain("example.com")
+
+    assert build_trie.call_count == expected_builds
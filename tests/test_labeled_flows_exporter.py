@@ -0,0 +1,195 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import csv
+import json
+import os
+import time
+from typing import Tuple
+from unittest.mock import Mock
+
+import pytest
+
+from slips_files.core.database.sqlite_db import labeled_flows_exporter
+from slips_files.core.database.sqlite_db.database import SQLiteDB
+from slips_files.core.database.sqlite_db.labeled_flows_exporter import (
+    LabeledFlowsExporter,
+)
+from tests.test_sqlite_db import PROFILEID, get_flow
+
+ALTFLOW = {"uid": "uid1", "query": "example.com", "type_": "dns"}
+
+
+def create_exporter(tmp_path, flows: int, chunk_size=2):
+    sqlite = SQLiteDB(Mock(), str(tmp_path))
+    sqlite.print = Mock()
+    sqlite.insert_flows(
+        [
+            (
+                get_flow(i),
+                PROFILEID,
+                "timewindow1",
+                "malicious" if i % 2 else "benign",
+                f"aid{i}",
+            )
+            for i in range(flows)
+        ]
+    )
+    sqlite.execute(
+        "INSERT INTO altflows (uid, flow, label, profileid, twid, "
+        "flow_type) VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            "uid1",
+            json.dumps(ALTFLOW),
+            "benign",
+            PROFILEID,
+            "timewindow1",
+            "dns",
+        ),
+    )
+    return LabeledFlowsExporter(sqlite, str(tmp_path), chunk_size=chunk_size)
+
+
+def test_iterate_chunks(tmp_path):
+    exporter = create_exporter(tmp_path, 5)
+    chunks = list(exporter.iterate_chunks("flows", ["uid", "label"]))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert chunks[0] == [("uid0", "benign"), ("uid1", "malicious")]
+
+
+def test_export_tsv(tmp_path):
+    exporter = create_exporter(tmp_path, 5)
+
+    assert exporter.export("tsv") == 6
+
+    with open(tmp_path / "labeled_flows.tsv") as tsv_file:
+        rows = list(csv.reader(tsv_file, delimiter="\t"))
+    assert rows[0] == ["uid", "flow", "label", "profileid", "twid"]
+    assert len(rows) == 7
+    uid, flow, label, profileid, twid = rows[2]
+    assert (uid, label, profileid, twid) == (
+        "uid1",
+        "malicious",
+        PROFILEID,
+        "timewindow1",
+    )
+    assert json.loads(flow) == get_flow(1)
+    assert json.loads(rows[-1][1]) == ALTFLOW
+
+
+def test_export_json(tmp_path):
+    exporter = create_exporter(tmp_path, 3)
+
+    assert exporter.export("json") == 4
+
+    with open(tmp_path / "labeled_flows.json") as json_file:
+        rows = [json.loads(line) for line in json_file]
+    assert len(rows) == 4
+    assert json.loads(rows[0].pop("flow")) == get_flow(0)
+    assert rows[0] == {
+        "uid": "uid0",
+        "label": "benign",
+        "profileid": PROFILEID,
+        "twid": "timewindow1",
+    }
+    assert json.loads(rows[-1]["flow"]) == ALTFLOW
+
+
+@pytest.mark.parametrize(
+    "format_, pyarrow_installed, expected_format",
+    [
+        # Testcase 1: supported format
+        ("TSV", False, "tsv"),
+        # Testcase 2: unsupported format
+        ("xml", True, "json"),
+        # Testcase 3: pyarrow is needed
+        ("parquet", False, "json"),
+        ("arrow", False, "json"),
+        ("parquet", True, "parquet"),
+    ],
+)
+def test_get_format(
+    tmp_path, monkeypatch, format_, pyarrow_installed, expected_format
+):
+    exporter = create_exporter(tmp_path, 0)
+    monkeypatch.setattr(
+        labeled_flows_exporter,
+        "pyarrow",
+        Mock() if pyarrow_installed else None,
+    )
+    assert exporter.get_format(format_) == expected_format
+    assert exporter.db.print.called == (format_.lower() != expected_format)
+
+
+@pytest.mark.parametrize("format_", ["parquet", "arrow"])
+def test_export_arrow(tmp_path, format_):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    ipc = pytest.importorskip("pyarrow.ipc")
+
+    exporter = create_exporter(tmp_path, 5)
+    # values that aren't of the type of their column
+    exporter.db.execute(
+        "UPDATE flows SET dur = 'unknown', sbytes = 1.0 WHERE uid = 'uid0'"
+    )
+
+    assert exporter.export(format_) == 6
+
+    def read(name: str):
+        path = str(tmp_path / f"{name}.{format_}")
+        if format_ == "parquet":
+            return parquet.read_table(path)
+        return ipc.open_file(path).read_all()
+
+    flows = read("labeled_flows").to_pylist()
+    assert len(flows) == 5
+    assert flows[0]["dur"] is None
+    assert flows[0]["sbytes"] == 1
+    assert flows[1]["label"] == "malicious"
+    assert flows[1]["aid"] == "aid1"
+    assert flows[1]["starttime"] == get_flow(1)["starttime"]
+    assert flows[1]["dport"] == "443"
+    assert json.loads(flows[1]["extra"]) == {
+        "history": "ShADadFf",
+        "type_": "conn",
+    }
+    altflows = read("labeled_altflows").to_pylist()
+    assert altflows[0]["flow_type"] == "dns"
+    assert json.loads(altflows[0]["flow"]) == ALTFLOW
+
+
+def run_in_child(func) -> Tuple[float, int]:
+    """
+    runs the given function in a forked child, so its peak RSS isn't
+    the one of previous tests.
+    returns the seconds it took and the peak RSS of the child in bytes
+    """
+    start = time.monotonic()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            func()
+        finally:
+            os._exit(0)
+    _, status, rusage = os.wait4(pid, 0)
+    assert status == 0
+    # ru_maxrss is in KBs
+    return time.monotonic() - start, rusage.ru_maxrss * 1024
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("format_", ["tsv", "json", "parquet", "arrow"])
+def test_export_throughput(tmp_path, format_):
+    """measures the rows/sec and the peak RSS of exporting a big flows
+    db"""
+    if format_ in labeled_flows_exporter.ARROW_FORMATS:
+        pytest.importorskip("pyarrow")
+    flows = 200000
+    exporter = create_exporter(tmp_path, flows, chunk_size=10000)
+
+    _, idle_rss = run_in_child(lambda: None)
+    elapsed, peak_rss = run_in_child(lambda: exporter.export(format_))
+
+    print(
+        f"labeled flows exported to {format_}: "
+        f"{(flows + 1) / elapsed:.0f} rows/sec, "
+        f"peak RSS +{(peak_rss - idle_rss) / 2**20:.0f} MB"
+    )
@@ -1,10 +1,15 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
+import random
+import time
+
+import numpy
 import pytest
 from tests.module_factory import ModuleFactory
 from slips_files.common.markov_chains import (
     maximum_likelihood_probabilities,
     Matrix,
+    TransitionMatrix,
 )
 import math
 
@@ -125,3 +130,97 @@ def test_maximum_likelihood_probabilities(
     for key, value in expected_init_vector.items():
         assert key in matrix_init_vector
         assert math.isclose(matrix_init_vector[key], value, rel_tol=1e-9)
+
+
+LETTERS = "abcdefghiABCDEFGHIrstuvwxyzRSTUVWXYZ1234567890,.+*"
+
+
+def get_sequences(amount: int, seed=0, letters=LETTERS) -> list:
+    rng = random.Random(seed)
+    return [
+        "".join(rng.choices(letters, k=rng.randint(0, 100)))
+        for _ in range(amount)
+    ]
+
+
+def get_training_states() -> str:
+    rng = random.Random(1)
+    return "".join(rng.choices(LETTERS[:30], k=2000))
+
+
+def create_letters_matrix() -> Matrix:
+    # a model with some of the transitions missing
+    _, matrix = maximum_likelihood_probabilities(get_training_states())
+    return matrix
+
+
+def test_walk_probabilities_match_walk_probability():
+    matrix = create_letters_matrix()
+    sequences = get_sequences(300, letters=LETTERS[:30] + "#")
+    # sequences that only use known transitions
+    sequences += [
+        "".join(states) for states in list(matrix)[:10] + [("a",), ()]
+    ]
+
+    log_probs = TransitionMatrix.from_matrix(matrix).walk_probabilities(
+        sequences
+    )
+
+    assert numpy.isfinite(log_probs).any()
+    for states, log_prob in zip(sequences, log_probs):
+        assert math.isclose(
+            log_prob, matrix.walk_probability(states), rel_tol=1e-9
+        )
+
+
+def test_walk_probabilities_of_non_char_states():
+    matrix = ModuleFactory().create_markov_chain_obj()
+    matrix.update({("ab", "cd"): 0.5, ("cd", "ab"): 0.25})
+    transition_matrix = TransitionMatrix.from_matrix(matrix)
+
+    log_probs = transition_matrix.walk_probabilities(
+        [["ab", "cd", "ab"], ["cd", "xy"], ["ab"]]
+    )
+
+    assert list(log_probs) == [math.log(0.5) + math.log(0.25), -math.inf, 0]
+
+
+def test_transition_matrix_from_matrix():
+    matrix = create_letters_matrix()
+    assert TransitionMatrix.from_matrix(matrix).to_matrix() == matrix
+
+
+@pytest.mark.benchmark
+def test_walk_probabilities_throughput():
+    """compares the sequences/sec scored one by one by
+    Matrix.walk_probability() and all at once by walk_probabilities()"""
+    matrix = create_letters_matrix()
+    transition_matrix = TransitionMatrix.from_matrix(matrix)
+    # parts of the training states, so the walks don't stop at the
+    # first missing transition
+    states = get_training_states()
+    rng = random.Random(2)
+    sequences = []
+    for _ in range(5000):
+        start = rng.randint(0, len(states) - 100)
+        sequences.append(states[start : start + rng.randint(0, 100)])
+
+    start = time.monotonic()
+    for states in sequences:
+        matrix.walk_probability(states)
+    one_by_one_rate = len(sequences) / (time.monotonic() - start)
+
+    start = time.monotonic()
+    transition_matrix.walk_probabilities(sequences)
+    vectorized_rate = len(sequences) / (time.monotonic() - start)
+
+    letters = "".join(rng.choices(LETTERS, k=200000))
+    start = time.monotonic()
+    maximum_likelihood_probabilities(letters)
+    build_rate = len(letters) / (time.monotonic() - start)
+
+    print(
+        f"markov chain sequences/sec: one by one {one_by_one_rate:.0f}, "
+        f"vectorized {vectorized_rate:.0f}. "
+        f"states/sec when building a matrix: {build_rate:.0f}"
+    )
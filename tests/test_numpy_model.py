@@ -0,0 +1,147 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import glob
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from modules.rnn_cc_detection.numpy_model import load_model
+
+MODELS_DIR = "modules/rnn_cc_detection"
+
+
+def get_letters(amount: int, three_dimensional=True, seed=0) -> np.ndarray:
+    """
+    returns letters converted to ints and padded like
+    convert_input_for_module() does, with sequences of different lengths
+    """
+    rng = np.random.default_rng(seed)
+    sequences = []
+    for i in range(amount):
+        length = [1, 5, 30, 100, 499, 500][i % 6]
+        sequence = rng.integers(0, 50, length)
+        # "0" is the padding
+        sequence = np.concatenate([sequence, np.full(500 - length, 45)])
+        sequences.append(sequence)
+    letters = np.array(sequences, dtype=np.float32)
+    if three_dimensional:
+        return letters[:, :, None]
+    return letters
+
+
+@pytest.mark.parametrize(
+    "model_file",
+    ["rnn_model.h5", "rnn_model_v1.5_2024_07_13.h5"],
+)
+def test_predictions_match_keras(model_file):
+    keras = pytest.importorskip("keras")
+    path = f"{MODELS_DIR}/{model_file}"
+    keras_model = keras.models.load_model(path, compile=False)
+    letters = get_letters(12)
+
+    expected = keras_model.predict(letters, verbose=0)
+    predictions = load_model(path).predict(letters)
+
+    assert predictions.shape == expected.shape
+    assert np.allclose(predictions, expected, atol=1e-5)
+
+
+def build_keras_model(keras, recurrent_layers):
+    from keras import layers
+
+    model = keras.Sequential(
+        [
+            keras.Input((None,)),
+            layers.Embedding(50, 8, mask_zero=True),
+            *recurrent_layers,
+            layers.Dense(7, activation="relu"),
+            layers.Dropout(0.3),
+            layers.Dense(1, activation="sigmoid"),
+        ]
+    )
+    # the initial weights are too small to notice most mistakes
+    rng = np.random.default_rng(0)
+    model.set_weights(
+        [
+            weights + rng.normal(0, 0.5, weights.shape).astype("float32")
+            for weights in model.get_weights()
+        ]
+    )
+    return model
+
+
+@pytest.mark.parametrize(
+    "recurrent_layers",
+    [
+        # Testcase 1: GRU without reset_after
+        [("Bidirectional", ("GRU", {"units": 6, "reset_after": False}))],
+        # Testcase 2: stacked LSTMs
+        [
+            (
+                "Bidirectional",
+                ("LSTM", {"units": 6, "return_sequences": True}),
+                "sum",
+            ),
+            ("LSTM", {"units": 5}),
+        ],
+        # Testcase 3: backwards GRU returning sequences
+        [
+            (
+                "GRU",
+                {"units": 6, "return_sequences": True, "go_backwards": True},
+            ),
+            ("Bidirectional", ("GRU", {"units": 4}), "ave"),
+        ],
+    ],
+)
+def test_masked_recurrent_layers_match_keras(recurrent_layers, tmp_path):
+    keras = pytest.importorskip("keras")
+    from keras import layers
+
+    def build_layer(class_name, config, merge_mode="concat"):
+        if class_name == "Bidirectional":
+            return layers.Bidirectional(
+                build_layer(*config), merge_mode=merge_mode
+            )
+        return getattr(layers, class_name)(**config)
+
+    keras_model = build_keras_model(
+        keras, [build_layer(*layer) for layer in recurrent_layers]
+    )
+    path = str(tmp_path / "model.h5")
+    keras_model.save(path)
+    letters = np.random.default_rng(1).integers(0, 50, (6, 40))
+    # masked letters at the end, the start and the middle
+    letters[0, 20:] = 0
+    letters[1, :5] = 0
+    letters[2, 10:15] = 0
+
+    expected = keras_model.predict(letters, verbose=0)
+    predictions = load_model(path).predict(letters)
+
+    assert np.allclose(predictions, expected, atol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "path", sorted(glob.glob(f"{MODELS_DIR}/rnn_model*.h5"))
+)
+def test_load_shipped_models(path):
+    model = load_model(path)
+    three_dimensional = type(model.layers[1]).__name__ == "Reshape"
+    predictions = model.predict(get_letters(6, three_dimensional))
+    assert predictions.shape == (6, 1)
+    assert ((predictions >= 0) & (predictions <= 1)).all()
+
+
+def test_module_runs_without_tensorflow():
+    # None in sys.modules makes any import of tensorflow fail
+    code = (
+        "import sys\n"
+        "sys.modules['tensorflow'] = None\n"
+        "from modules.rnn_cc_detection.rnn_cc_detection import CCDetection\n"
+        "from modules.rnn_cc_detection.numpy_model import load_model\n"
+        f"load_model('{MODELS_DIR}/rnn_model.h5')\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,394 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+"""Unit test for modules/threat_intelligence/online_lookups.py
+the sources are tested against a local HTTP server that acts like
+circl.lu and a local DNS server that acts like spamhaus"""
+
+import asyncio
+import json
+import socket
+import threading
+import time
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+from unittest.mock import AsyncMock
+
+import dns.asyncresolver
+import dns.message
+import dns.rcode
+import dns.rrset
+import pytest
+
+from modules.threat_intelligence.circl_lu import Circllu
+from modules.threat_intelligence.online_lookups import (
+    OnlineLookupError,
+    OnlineLookups,
+    RateLimiter,
+)
+from modules.threat_intelligence.spamhaus import Spamhaus
+
+MALICIOUS_MD5 = "a" * 32
+
+
+class CacheDB:
+    """acts like the cache db used by the online lookups"""
+
+    def __init__(self):
+        self.cache = {}
+
+    def get_cached_online_ti_result(self, source, query):
+        return self.cache.get((source, query))
+
+    def cache_online_ti_result(self, source, query, result, ttl):
+        self.cache[(source, query)] = result
+
+
+class FakeSource:
+    name = "fake"
+    max_concurrent_queries = 100
+    queries_per_second = 0
+
+    def __init__(self, delay=0, result=None, fail=False):
+        self.delay = delay
+        self.result = result
+        self.fail = fail
+        self.queries = 0
+
+    async def async_lookup(self, ioc):
+        self.queries += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise OnlineLookupError("unreachable")
+        return self.result
+
+
+def create_online_lookups(source, **kwargs) -> OnlineLookups:
+    online_lookups = OnlineLookups(CacheDB(), **kwargs)
+    online_lookups.register(source)
+    return online_lookups
+
+
+@pytest.fixture
+def running_lookups():
+    """starts the lookups thread of the created objs, and stops it after
+    the test"""
+    started = []
+
+    def start(online_lookups: OnlineLookups) -> OnlineLookups:
+        online_lookups.thread.start()
+        started.append(online_lookups)
+        return online_lookups
+
+    yield start
+    for online_lookups in started:
+        online_lookups.stop()
+
+
+def test_lookup_is_cached():
+    source = FakeSource(result={"source": "fake"})
+    online_lookups = create_online_lookups(source)
+    for _ in range(3):
+        result = online_lookups.loop.run_until_complete(
+            online_lookups.lookup("fake", "1.1.1.1")
+        )
+        assert result == {"source": "fake"}
+    assert source.queries == 1
+    assert online_lookups.get_stats()["fake"]["cache_hits"] == 2
+
+
+def test_negative_result_is_cached():
+    source = FakeSource(result=None)
+    online_lookups = create_online_lookups(source)
+    for _ in range(2):
+        online_lookups.loop.run_until_complete(
+            online_lookups.lookup("fake", "1.1.1.1")
+        )
+    assert source.queries == 1
+
+
+def test_concurrent_lookups_of_the_same_ioc():
+    source = FakeSource(delay=0.1, result={"source": "fake"})
+    online_lookups = create_online_lookups(source)
+
+    async def lookup_twice():
+        return await asyncio.gather(
+            online_lookups.lookup("fake", "1.1.1.1"),
+            online_lookups.lookup("fake", "1.1.1.1"),
+        )
+
+    results = online_lookups.loop.run_until_complete(lookup_twice())
+    assert results == [{"source": "fake"}] * 2
+    assert source.queries == 1
+
+
+def test_failed_lookup_is_retried_and_not_cached():
+    source = FakeSource(fail=True)
+    online_lookups = create_online_lookups(source, retries=2, retry_delay=0)
+    result = online_lookups.loop.run_until_complete(
+        online_lookups.lookup("fake", "1.1.1.1")
+    )
+    assert result is None
+    assert source.queries == 3
+    assert online_lookups.get_stats()["fake"]["errors"] == 3
+    assert not online_lookups.db.cache
+
+
+def test_rate_limiter(monkeypatch):
+    limiter = RateLimiter(20)
+    sleep = AsyncMock()
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+
+    async def wait_10_times():
+        for _ in range(10):
+            await limiter.wait()
+
+    start = time.monotonic()
+    asyncio.run(wait_10_times())
+    # the first call doesn't wait, the rest wait for their own slot
+    assert sleep.await_count == 9
+    assert limiter.next_slot >= start + 10 / 20
+
+
+def test_global_concurrency_limit():
+    source = FakeSource(delay=0.1)
+    online_lookups = create_online_lookups(source, max_concurrent_lookups=2)
+    active = 0
+    max_active = 0
+
+    async def lookup(ioc):
+        nonlocal active, max_active
+        active += 1
+        max_active = max(max_active, active)
+        await asyncio.sleep(0.05)
+        active -= 1
+
+    source.async_lookup = lookup
+    online_lookups.register(source)
+
+    async def lookup_all():
+        await asyncio.gather(
+            *(online_lookups.lookup("fake", str(ip)) for ip in range(6))
+        )
+
+    online_lookups.loop.run_until_complete(lookup_all())
+    assert max_active == 2
+
+
+def test_submit_doesnt_block(running_lookups):
+    source = FakeSource(result={"source": "fake"})
+    online_lookups = running_lookups(create_online_lookups(source))
+    found = threading.Event()
+    answered = threading.Event()
+    lookup = source.async_lookup
+
+    async def wait_for_the_answer(ioc):
+        while not answered.is_set():
+            await asyncio.sleep(0.01)
+        return await lookup(ioc)
+
+    source.async_lookup = wait_for_the_answer
+    online_lookups.register(source)
+
+    future = online_lookups.submit(
+        online_lookups.lookup("fake", "1.1.1.1"),
+        callback=lambda result: found.set(),
+    )
+    # submit() returned while the lookup is still waiting for the answer
+    assert not future.done()
+    answered.set()
+    assert future.result(timeout=5) == {"source": "fake"}
+    assert found.wait(timeout=5)
+    assert online_lookups.get_stats()["total"]["pending"] == 0
+
+
+def test_pending_lookups_are_bounded(running_lookups):
+    source = FakeSource(delay=0.3)
+    online_lookups = running_lookups(
+        create_online_lookups(source, max_pending_lookups=2)
+    )
+    futures = [
+        online_lookups.submit(online_lookups.lookup("fake", str(ip)))
+        for ip in range(3)
+    ]
+    assert futures[2] is None
+    assert online_lookups.get_stats()["total"]["dropped"] == 1
+    for future in futures[:2]:
+        future.result(timeout=5)
+
+
+class CirclHandler(BaseHTTPRequestHandler):
+    """acts like the circl.lu hashlookup API"""
+
+    def log_message(self, *args):
+        pass
+
+    lock = threading.Lock()
+    active_requests = 0
+    max_active_requests = 0
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.active_requests += 1
+            cls.max_active_requests = max(
+                cls.max_active_requests, cls.active_requests
+            )
+        try:
+            # simulate the latency of the real API
+            time.sleep(0.05)
+            self.reply()
+        finally:
+            with cls.lock:
+                cls.active_requests -= 1
+
+    def reply(self):
+        md5 = self.path.split("/")[-1]
+        if md5 != MALICIOUS_MD5:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = json.dumps(
+            {"KnownMalicious": "blacklist1", "hashlookup:trust": "10"}
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def circl_server():
+    CirclHandler.max_active_requests = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CirclHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def create_circllu(circl_server: str) -> Circllu:
+    circllu = Circllu(CacheDB())
+    circllu.base_url = circl_server
+    circllu.queries_per_second = 0
+    return circllu
+
+
+def test_circllu_against_local_server(circl_server, running_lookups):
+    online_lookups = running_lookups(
+        create_online_lookups(
+            create_circllu(circl_server), max_concurrent_lookups=16
+        )
+    )
+    hashes = [MALICIOUS_MD5] + [f"{i:032x}" for i in range(39)]
+
+    futures = [
+        online_lookups.submit(online_lookups.lookup("Circl.lu", md5))
+        for md5 in hashes
+    ]
+    results = [future.result(timeout=10) for future in futures]
+
+    assert results[0]["blacklist"] == "blacklist1, circl.lu"
+    assert not any(results[1:])
+    # the lookups were sent concurrently, not one by one
+    assert CirclHandler.max_active_requests > 1
+
+
+class DNSServer:
+    """acts like the spamhaus DNSBL. 1.2.3.4 is listed"""
+
+    listed = "4.3.2.1.zen.spamhaus.org."
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.1)
+        self.port = self.sock.getsockname()[1]
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(512)
+            except socket.timeout:
+                continue
+            query = dns.message.from_wire(data)
+            response = dns.message.make_response(query)
+            name = query.question[0].name.to_text()
+            if name == self.listed:
+                response.answer.append(
+                    dns.rrset.from_text(name, 60, "IN", "A", "127.0.0.2")
+                )
+            else:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+            self.sock.sendto(response.to_wire(), addr)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+
+@pytest.fixture
+def dns_server():
+    server = DNSServer()
+    yield server
+    server.stop()
+
+
+def create_spamhaus(dns_server: DNSServer) -> Spamhaus:
+    spamhaus = Spamhaus(CacheDB())
+    spamhaus._resolver = dns.asyncresolver.Resolver(configure=False)
+    spamhaus._resolver.nameservers = ["127.0.0.1"]
+    spamhaus._resolver.port = dns_server.port
+    spamhaus.queries_per_second = 0
+    return spamhaus
+
+
+def test_spamhaus_against_local_server(dns_server, running_lookups):
+    online_lookups = running_lookups(
+        create_online_lookups(create_spamhaus(dns_server))
+    )
+    ips = ["1.2.3.4"] + [f"5.6.7.{i}" for i in range(50)]
+
+    futures = [
+        online_lookups.submit(online_lookups.lookup("Spamhaus", ip))
+        for ip in ips
+    ]
+    results = [future.result(timeout=10) for future in futures]
+
+    assert results[0]["source"] == "SBL Data,  spamhaus"
+    assert not any(results[1:])
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("source", ["Circl.lu", "Spamhaus"])
+def test_lookups_throughput(circl_server, dns_server, running_lookups, source):
+    """measures the lookups/sec of each online source against its local
+    stand-in, without rate limits"""
+    if source == "Circl.lu":
+        # the stand-in answers after 50ms, circl.lu is queried 4 at a time
+        source_obj = create_circllu(circl_server)
+        iocs = [f"{i:032x}" for i in range(200)]
+    else:
+        source_obj = create_spamhaus(dns_server)
+        iocs = [f"5.6.{i // 250}.{i % 250}" for i in range(1000)]
+    online_lookups = running_lookups(
+        create_online_lookups(source_obj, max_concurrent_lookups=16)
+    )
+
+    start = time.monotonic()
+    futures = [
+        online_lookups.submit(online_lookups.lookup(source, ioc))
+        for ioc in iocs
+    ]
+    for future in futures:
+        future.result(timeout=60)
+    elapsed = time.monotonic() - start
+
+    print(f"{source} lookups/sec: {len(iocs) / elapsed:.0f}")
@@ -1,6 +1,9 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
 from unittest.mock import MagicMock, mock_open, patch, call as mockedcall
+import multiprocessing
+import time
+
 import pytest
 from tests.module_factory import ModuleFactory
 from pathlib import Path
@@ -27,20 +30,66 @@ from pathlib import Path
     ],
 )
 @patch("slips_files.common.slips_utils.Utils.convert_ts_format")
-def test_log_line(mock_convert_ts_format, msg, expected_log_content):
+def test_log_line(mock_convert_ts_format, msg, expected_log_content, tmp_path):
     """Test that the log_line method logs the correct message
     to the slips.log file."""
     mock_convert_ts_format.return_value = "formatted_datetime"
 
     output = ModuleFactory().create_output_obj()
-    output.slips_logfile = "path/to/slips.log"
+    output.slips_logfile = str(tmp_path / "slips.log")
+
+    output.log_line(msg)
+    output.flush()
+
+    assert (tmp_path / "slips.log").read_text() == expected_log_content
+
+
+@patch("slips_files.common.slips_utils.Utils.convert_ts_format")
+def test_log_error(mock_convert_ts_format, tmp_path):
+    mock_convert_ts_format.return_value = "formatted_datetime"
+    output = ModuleFactory().create_output_obj()
+    output.errors_logfile = str(tmp_path / "errors.log")
+
+    output.log_error({"from": "sender", "txt": "error"})
+    output.close()
+
+    assert (
+        tmp_path / "errors.log"
+    ).read_text() == "formatted_datetime [sender] error\n"
+
 
-    with patch("builtins.open", mock_open()) as mock_file:
-        output.log_line(msg)
+def log_lines(output, lines: int):
+    for i in range(lines):
+        output.log_line({"from": "benchmark", "txt": f"line {i}"})
 
-        mock_file.assert_called_once_with("path/to/slips.log", "a")
-        handle = mock_file()
-        handle.write.assert_called_once_with(expected_log_content)
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("processes", [1, 4])
+def test_log_line_throughput(tmp_path, processes):
+    """measures how many lines per second can be logged to slips.log by
+    the given number of forked processes at once"""
+    output = ModuleFactory().create_output_obj()
+    output.slips_logfile = str(tmp_path / "slips.log")
+    lines = 50000
+    ctx = multiprocessing.get_context("fork")
+    children = [
+        ctx.Process(target=log_lines, args=(output, lines // processes))
+        for _ in range(processes)
+    ]
+
+    start = time.perf_counter()
+    for child in children:
+        child.start()
+    for child in children:
+        child.join()
+    elapsed = time.perf_counter() - start
+
+    with open(output.slips_logfile) as f:
+        assert sum(1 for _ in f) == lines
+    print(
+        f"slips.log lines/sec with {processes} processes: "
+        f"{lines / elapsed:.0f}"
+    )
 
 
 def test_print():
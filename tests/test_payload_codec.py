@@ -0,0 +1,201 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import json
+from dataclasses import dataclass
+from typing import List
+from unittest.mock import Mock
+
+import pytest
+
+from slips_files.core.database.sqlite_db import payload_codec
+from slips_files.core.database.sqlite_db.database import SQLiteDB
+from slips_files.core.database.sqlite_db.payload_codec import (
+    CODECS,
+    DICT_SAMPLES,
+    HEADER,
+    PayloadCodec,
+)
+from tests.test_sqlite_db import PROFILEID, get_flow
+
+
+@dataclass
+class DNS:
+    starttime: str
+    uid: str
+    saddr: str
+    daddr: str
+    query: str
+    answers: List[str]
+    type_: str = "dns"
+
+
+def get_dns(i: int) -> DNS:
+    return DNS(
+        starttime=str(1700000000 + i),
+        uid=f"dns{i}",
+        saddr="192.168.1.1",
+        daddr="8.8.8.8",
+        query=f"host{i}.example.com",
+        answers=[f"1.2.3.{i % 250}"],
+    )
+
+
+def create_sqlite(tmp_path, compress_flows=True) -> SQLiteDB:
+    return SQLiteDB(Mock(), str(tmp_path), compress_flows=compress_flows)
+
+
+def test_encode_without_compression():
+    codec = PayloadCodec(Mock(), compress=False)
+    payload = {"query": "example.com", "answers": ["1.2.3.4"]}
+    assert codec.encode(payload, "dns") == json.dumps(payload)
+    assert codec.decode(json.dumps(payload)) == payload
+    assert codec.decode(None) == {}
+
+
+@pytest.mark.parametrize("codec_id", CODECS)
+def test_encode_decode(tmp_path, codec_id):
+    serializer, compressor = CODECS[codec_id]
+    if serializer == "msgpack":
+        pytest.importorskip("msgpack")
+    if compressor == "zstd":
+        pytest.importorskip("zstandard")
+    sqlite = create_sqlite(tmp_path)
+    sqlite.codec.codec = codec_id
+    payloads = [
+        {"query": f"host{i}.example.com", "answers": [f"1.2.3.{i}"]}
+        for i in range(DICT_SAMPLES + 10)
+    ]
+
+    encoded = [sqlite.codec.encode(payload, "dns") for payload in payloads]
+
+    assert HEADER.unpack_from(encoded[0]) == (codec_id, 0)
+    # the dict is built with the first DICT_SAMPLES payloads
+    assert HEADER.unpack_from(encoded[-1]) == (codec_id, 1)
+    assert sqlite.get_payload_dict(1)
+    # a reader without the dicts of the writer cached
+    reader = PayloadCodec(sqlite, compress=False)
+    assert [reader.decode(value) for value in encoded] == payloads
+    assert reader.to_json(encoded[-1]) == json.dumps(payloads[-1])
+
+
+def test_dictionaries_are_per_flow_type(tmp_path):
+    sqlite = create_sqlite(tmp_path)
+    for i in range(DICT_SAMPLES):
+        sqlite.codec.encode({"query": f"host{i}"}, "dns")
+    assert sqlite.codec.dict_ids == {"dns": 1}
+    assert "http" not in sqlite.codec.samples
+
+    for i in range(DICT_SAMPLES):
+        sqlite.codec.encode({"uri": f"/{i}"}, "http")
+    assert sqlite.codec.dict_ids == {"dns": 1, "http": 2}
+    assert not sqlite.codec.samples
+
+
+def test_the_dictionary_makes_payloads_smaller(tmp_path):
+    sqlite = create_sqlite(tmp_path)
+    encoded = [
+        sqlite.codec.encode(get_flow(i), "conn")
+        for i in range(DICT_SAMPLES + 100)
+    ]
+    without_dict = sum(map(len, encoded[DICT_SAMPLES - 100 : DICT_SAMPLES]))
+    with_dict = sum(map(len, encoded[-100:]))
+    assert with_dict < without_dict / 2
+
+
+def test_get_best_codec(monkeypatch):
+    monkeypatch.setattr(payload_codec, "msgpack", None)
+    monkeypatch.setattr(payload_codec, "zstandard", None)
+    assert CODECS[payload_codec.get_best_codec()] == ("json", "zlib")
+    monkeypatch.setattr(payload_codec, "msgpack", Mock())
+    monkeypatch.setattr(payload_codec, "zstandard", Mock())
+    assert CODECS[payload_codec.get_best_codec()] == ("msgpack", "zstd")
+
+
+def test_compressed_flows_and_altflows(tmp_path):
+    sqlite = create_sqlite(tmp_path)
+    flows = [
+        (get_flow(i), PROFILEID, "timewindow1", "benign", None)
+        for i in range(DICT_SAMPLES + 1)
+    ]
+    sqlite.insert_flows(flows)
+    for i in range(DICT_SAMPLES + 1):
+        sqlite.add_altflow(get_dns(i), PROFILEID, "timewindow1")
+
+    stored = sqlite.select("flows", columns="extra", limit=1)[0]
+    assert isinstance(stored, bytes)
+    assert sqlite.get_all_flows() == [flow for flow, *_ in flows]
+    assert sqlite.get_altflow_from_uid(
+        PROFILEID, "timewindow1", f"dns{DICT_SAMPLES}"
+    ) == json.loads(json.dumps(get_dns(DICT_SAMPLES).__dict__))
+
+
+def test_old_payloads_are_readable(tmp_path):
+    """dbs with payloads stored before compression was enabled"""
+    create_sqlite(tmp_path, compress_flows=False).insert_flows(
+        [(get_flow(0), PROFILEID, "timewindow1", "benign", None)]
+    )
+    sqlite = create_sqlite(tmp_path)
+    sqlite.insert_flows(
+        [(get_flow(1), PROFILEID, "timewindow1", "benign", None)]
+    )
+
+    stored = sqlite.select("flows", columns="extra")
+    assert [type(extra) for extra, in stored] == [str, bytes]
+    assert sqlite.get_all_flows() == [get_flow(0), get_flow(1)]
+
+
+class FakeZstd:
+    """stores the payloads as they are, for testing without zstandard"""
+
+    def __init__(self, **kwargs):
+        pass
+
+    def compress(self, data) -> bytes:
+        return bytes(data)
+
+    decompress = compress
+
+
+def test_payloads_without_dict_of_different_compressors(tmp_path, monkeypatch):
+    """zlib and zstd payloads compressed without a dict have the same
+    dict id"""
+    if payload_codec.zstandard is None:
+        monkeypatch.setattr(
+            payload_codec,
+            "zstandard",
+            Mock(ZstdCompressor=FakeZstd, ZstdDecompressor=FakeZstd),
+        )
+    writer = create_sqlite(tmp_path)
+    payload = {"query": "example.com"}
+    encoded = []
+    for codec_id in (1, 2):
+        writer.codec.codec = codec_id
+        encoded.append(writer.codec.encode(payload, "dns"))
+    assert [HEADER.unpack_from(value) for value in encoded] == [
+        (1, 0),
+        (2, 0),
+    ]
+
+    reader = PayloadCodec(writer, compress=False)
+    assert [reader.decode(value) for value in encoded] == [payload, payload]
+    assert set(reader.decompressors) == {("zlib", 0), ("zstd", 0)}
+
+
+@pytest.mark.parametrize(
+    "codec_id, missing_lib",
+    [
+        # Testcase 1: msgpack payload
+        (3, "msgpack"),
+        # Testcase 2: zstd payload
+        (2, "zstandard"),
+    ],
+)
+def test_decode_without_the_libs_of_the_codec(
+    monkeypatch, codec_id, missing_lib
+):
+    monkeypatch.setattr(payload_codec, missing_lib, None)
+    codec = PayloadCodec(Mock(), compress=False)
+
+    with pytest.raises(ImportError, match=f"pip install {missing_lib}"):
+        codec.decode(HEADER.pack(codec_id, 0) + b"payload")
+    assert not codec.readable_codecs
@@ -0,0 +1,110 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+"""Unit test for slips_files/common/printer.py"""
+
+import json
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from slips_files.common.printer import Printer
+from slips_files.core.output import Output
+
+
+def create_printer(verbose=1, debug=0) -> Printer:
+    output = Output(verbose=verbose, debug=debug, create_logfiles=False)
+    output.update = Mock()
+    return Printer(output, "test")
+
+
+@pytest.mark.parametrize(
+    "verbose, debug, msg_verbose, msg_debug, "
+    "log_to_logfiles_only, expected",
+    [
+        # Testcase 1: verbose level is enough
+        (3, 0, 3, 0, False, True),
+        # Testcase 2: verbose level is not enough
+        (1, 0, 3, 0, False, False),
+        # Testcase 3: debug level is enough
+        (0, 2, 0, 2, False, True),
+        # Testcase 4: errors are always logged to errors.log
+        (0, 0, 0, 1, False, True),
+        # Testcase 5: always logged to slips.log
+        (0, 0, 3, 0, True, True),
+    ],
+)
+def test_is_enabled(
+    verbose, debug, msg_verbose, msg_debug, log_to_logfiles_only, expected
+):
+    printer = create_printer(verbose, debug)
+    assert (
+        printer.is_enabled(msg_verbose, msg_debug, log_to_logfiles_only)
+        == expected
+    )
+
+
+@pytest.mark.parametrize(
+    "text, args, expected_txt",
+    [
+        # Testcase 1: %-style formatting
+        (
+            "tuple %s: %s",
+            ("1.1.1.1-80-tcp", "abc"),
+            "tuple 1.1.1.1-80-tcp: abc",
+        ),
+        # Testcase 2: a function returning the text
+        (lambda: "from a function", (), "from a function"),
+        # Testcase 3: a text that doesn't need formatting
+        ("100% done", (), "100% done"),
+    ],
+)
+def test_lazy_print(text, args, expected_txt):
+    printer = create_printer(verbose=3)
+    printer.lazy_print(text, *args, verbose=3)
+    msg = printer.logger.update.call_args[0][0]
+    assert msg["txt"] == expected_txt
+    assert msg["verbose"] == 3
+
+
+def test_lazy_print_doesnt_format_discarded_msgs():
+    printer = create_printer(verbose=1)
+    text = Mock()
+    printer.lazy_print(text, verbose=3)
+    text.assert_not_called()
+    printer.logger.update.assert_not_called()
+
+
+@pytest.mark.benchmark
+def test_lazy_print_benchmark():
+    """
+    compares the time spent on verbose=3 msgs that are discarded because
+    slips is running with the default verbose level of 1
+    """
+    printer = create_printer(verbose=1)
+    prev_symbols = {
+        f"1.1.1.{i}-80-tcp": ["abc" * 10, [1726655400.0, 1726655401.0]]
+        for i in range(50)
+    }
+    iterations = 5000
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        printer.print(f"Prev Data: {prev_symbols}", 3, 0)
+    eager = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        printer.lazy_print("Prev Data: %s", prev_symbols, verbose=3)
+    lazy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        printer.lazy_print(lambda: json.dumps(prev_symbols), verbose=3)
+    lazy_callable = time.perf_counter() - start
+
+    print(
+        f"discarded msgs/sec. print(): {iterations / eager:.0f}, "
+        f"lazy_print(): {iterations / lazy:.0f}, "
+        f"lazy_print(callable): {iterations / lazy_callable:.0f}"
+    )
@@ -2537,3 +2537,49 @@ def test_get_ipv6_from_profile(hmget_return_value, expected_ipv6):
 
     handler.r.hmget.assert_called_once_with(profileid, "IPv6")
     assert ipv6 == expected_ipv6
+
+
+def test_add_timeline_lines():
+    handler = ModuleFactory().create_profile_handler_obj()
+    handler.mark_profile_tw_as_modified = Mock()
+    pipe = handler.r.pipeline.return_value
+    lines = [
+        ("profile_1", "timewindow1", {"info": "a"}, 1.0),
+        ("profile_1", "timewindow1", {"info": "b"}, 2.0),
+        ("profile_2", "timewindow1", {"info": "c"}, 3.0),
+    ]
+
+    handler.add_timeline_lines(lines)
+
+    assert pipe.zadd.call_count == 3
+    pipe.zadd.assert_any_call(
+        "profile_1_timewindow1_timeline", {json.dumps({"info": "b"}): 2.0}
+    )
+    pipe.execute.assert_called_once()
+    # once per tw, not once per line
+    assert handler.mark_profile_tw_as_modified.call_count == 2
+
+
+def test_update_conn_flows_cache_stats():
+    handler = ModuleFactory().create_profile_handler_obj()
+    pipe = handler.r.pipeline.return_value
+
+    handler.update_conn_flows_cache_stats(10, 2)
+
+    pipe.hincrby.assert_any_call(
+        handler.constants.CONN_FLOWS_CACHE_STATS, "hits", 10
+    )
+    pipe.hincrby.assert_any_call(
+        handler.constants.CONN_FLOWS_CACHE_STATS, "misses", 2
+    )
+    pipe.execute.assert_called_once()
+
+
+def test_get_conn_flows_cache_stats():
+    handler = ModuleFactory().create_profile_handler_obj()
+    handler.r.hgetall.return_value = {"hits": "3", "misses": "1"}
+    assert handler.get_conn_flows_cache_stats() == {
+        "hits": 3,
+        "misses": 1,
+        "hit_rate": 0.75,
+    }
@@ -4,6 +4,10 @@ import pytest
 from unittest.mock import Mock, patch
 import numpy as np
 import json
+from modules.rnn_cc_detection.numpy_model import load_model
+from modules.rnn_cc_detection.strato_letters_exporter import (
+    StratoLettersExporter,
+)
 from tests.module_factory import ModuleFactory
 
 
@@ -38,14 +42,16 @@ def test_get_confidence(pre_behavioral_model, expected_confidence):
         ("profile_fe80::1_timewindow999", "profile_fe80::1", "timewindow999"),
     ],
 )
-def test_handle_tw_closed(msg_data, expected_profileid, expected_twid):
+def test_export_letters_of_closed_tw(
+    msg_data, expected_profileid, expected_twid
+):
     cc_detection = ModuleFactory().create_rnn_detection_object()
-    msg = {"data": msg_data}
 
-    with patch.object(cc_detection.exporter, "export") as mock_export:
-        cc_detection.handle_tw_closed(msg)
+    cc_detection.handle_tw_closed({"data": msg_data})
 
-        mock_export.assert_called_once_with(expected_profileid, expected_twid)
+    cc_detection.exporter.export_outtuples.assert_called_once_with(
+        expected_profileid, expected_twid
+    )
 
 
 @pytest.mark.parametrize(
@@ -189,16 +195,17 @@ def test_handle_new_letters_valid_tcp_high_score():
 
     with patch.object(
         cc_detection,
-        "convert_input_for_module",
+        "convert_inputs_for_module",
         return_value=np.array([[[0]]]),
     ):
         # to exceed the 0.99 threshold in the function
         cc_detection.tcpmodel.predict.return_value = np.array([[0.995]])
 
         cc_detection.handle_new_letters({"data": json.dumps(msg_data)})
+        cc_detection.score_pending_tuples()
 
-        cc_detection.convert_input_for_module.assert_called_once_with(
-            msg_data["new_symbol"]
+        cc_detection.convert_inputs_for_module.assert_called_once_with(
+            [msg_data["new_symbol"]]
         )
         cc_detection.tcpmodel.predict.assert_called_once()
         cc_detection.print.assert_called()
@@ -238,16 +245,17 @@ def test_handle_new_letters_valid_tcp_low_score():
 
     with patch.object(
         cc_detection,
-        "convert_input_for_module",
+        "convert_inputs_for_module",
         return_value=np.array([[[0]]]),
     ):
         # less than the 0.99 threshold in the function
         cc_detection.tcpmodel.predict.return_value = np.array([[0.5]])
 
         cc_detection.handle_new_letters({"data": json.dumps(msg_data)})
+        cc_detection.score_pending_tuples()
 
-        cc_detection.convert_input_for_module.assert_called_once_with(
-            msg_data["new_symbol"]
+        cc_detection.convert_inputs_for_module.assert_called_once_with(
+            [msg_data["new_symbol"]]
         )
         cc_detection.tcpmodel.predict.assert_called_once()
         cc_detection.print.assert_called()
@@ -315,3 +323,259 @@ def test_handle_new_letters_tcp_not_established():
         cc_detection.tcpmodel.predict.assert_not_called()
         cc_detection.set_evidence_cc_channel.assert_not_called()
         cc_detection.db.publish.assert_not_called()
+
+
+def get_letters_msg(letters: str, tupleid="10.0.0.1-80-TCP") -> dict:
+    msg_data = {
+        "new_symbol": letters,
+        "profileid": "profile_192.168.1.1",
+        "twid": "timewindow1",
+        "tupleid": tupleid,
+        "flow": {
+            "state": "Established",
+            "starttime": "2023-01-01 12:00:00",
+            "daddr": tupleid.split("-")[0],
+        },
+        "uid": f"uid{len(letters)}",
+    }
+    return {"data": json.dumps(msg_data)}
+
+
+def convert_letters_one_by_one(letters: str) -> np.ndarray:
+    """the conversion convert_input_for_module() used to do with a dict"""
+    vocabulary = "abcdefghiABCDEFGHIrstuvwxyzRSTUVWXYZ1234567890,.+*"
+    int_of_letters = {letter: float(i) for i, letter in enumerate(vocabulary)}
+    letters = letters[:500]
+    letters += "0" * (500 - len(letters))
+    return np.array([[int_of_letters[letter]] for letter in letters])
+
+
+def test_convert_inputs_for_module_matches_one_by_one():
+    cc_detection = ModuleFactory().create_rnn_detection_object()
+    sequences = [
+        "88*y*y*h*h*h*h*h*h*h*y*y*h*h*h*y*y*",
+        "",
+        "aA1,.+*" * 100,
+        "abcdefghiABCDEFGHIrstuvwxyzRSTUVWXYZ1234567890,.+*",
+    ]
+
+    result = cc_detection.convert_inputs_for_module(sequences)
+
+    assert result.shape == (4, 500, 1)
+    for i, sequence in enumerate(sequences):
+        np.testing.assert_array_equal(
+            result[i], convert_letters_one_by_one(sequence)
+        )
+
+
+def test_convert_inputs_for_module_unknown_chars():
+    cc_detection = ModuleFactory().create_rnn_detection_object()
+    result = cc_detection.convert_inputs_for_module(["a-é"])
+    # unknown chars are padding
+    assert list(result[0, :4, 0]) == [0, 45, 45, 45]
+
+
+@pytest.mark.parametrize(
+    "scored, letters, expected",
+    [
+        # Testcase 1: never scored
+        (None, 1, True),
+        # Testcase 2: not enough new letters
+        (5, 7, False),
+        # Testcase 3: enough new letters
+        (5, 8, True),
+        # Testcase 4: the letters the model sees are complete
+        (498, 500, True),
+        # Testcase 5: the model doesn't see the new letters
+        (500, 520, False),
+    ],
+)
+def test_should_score(scored, letters, expected):
+    cc_detection = ModuleFactory().create_rnn_detection_object()
+    cc_detection.rescore_after_letters = 3
+    if scored is not None:
+        cc_detection.scored_letters[("profile_1", "timewindow1")] = {
+            "tuple": scored
+        }
+    assert (
+        cc_detection.should_score(
+            "profile_1", "timewindow1", "tuple", "a" * letters
+        )
+        == expected
+    )
+
+
+def test_handle_new_letters_keeps_newest_letters_of_each_tuple():
+    cc_detection = ModuleFactory().create_rnn_detection_object()
+    for letters in ("a", "ab", "abc"):
+        cc_detection.handle_new_letters(get_letters_msg(letters))
+    cc_detection.handle_new_letters(
+        get_letters_msg("z", tupleid="10.0.0.2-443-TCP")
+    )
+
+    assert [
+        json_msg["new_symbol"]
+        for json_msg in cc_detection.pending_tuples.values()
+    ] == ["abc", "z"]
+
+
+def test_score_pending_tuples_in_one_batch():
+    cc_detection = ModuleFactory().create_rnn_detection_object()
+    cc_detection.print = Mock()
+    cc_detection.set_evidence_cc_channel = Mock()
+    cc_detection.tcpmodel = Mock()
+    cc_detection.tcpmodel.predict.return_value = np.array([[0.995], [0.5]])
+    cc_detection.handle_new_letters(get_letters_msg("abcd"))
+    cc_detection.handle_new_letters(
+        get_letters_msg("z", tupleid="10.0.0.2-443-TCP")
+    )
+
+    cc_detection.score_pending_tuples()
+
+    cc_detection.tcpmodel.predict.assert_called_once()
+    assert cc_detection.tcpmodel.predict.call_args[0][0].shape == (2, 500, 1)
+    assert not cc_detection.pending_tuples
+    assert cc_detection.scored_letters[
+        ("profile_192.168.1.1", "timewindow1")
+    ] == {"10.0.0.1-80-TCP": 4, "10.0.0.2-443-TCP": 1}
+    cc_detection.set_evidence_cc_channel.assert_called_once()
+    assert cc_detection.set_evidence_cc_channel.call_args[0][4] == (
+        "10.0.0.1-80-TCP"
+    )
+
+
+@pytest.mark.parametrize(
+    "pending_tuples, waited, expected",
+    [
+        # Testcase 1: no tuples
+        (0, 10, False),
+        # Testcase 2: not enough tuples, not waited enough
+        (5, 0, False),
+        # Testcase 3: not enough tuples, waited enough
+        (5, 2, True),
+        # Testcase 4: a full batch
+        (64, 0, True),
+    ],
+)
+def test_should_score_pending_tuples(pending_tuples, waited, expected):
+    cc_detection = ModuleFactory().create_rnn_detection_object()
+    for i in range(pending_tuples):
+        cc_detection.handle_new_letters(
+            get_letters_msg("a", tupleid=f"10.0.0.{i}-80-TCP")
+        )
+    if cc_detection.oldest_pending_tuple_time is not None:
+        cc_detection.oldest_pending_tuple_time -= waited
+    assert cc_detection.should_score_pending_tuples() == expected
+
+
+def test_handle_tw_closed_forgets_scored_tuples():
+    cc_detection = ModuleFactory().create_rnn_detection_object()
+    cc_detection.print = Mock()
+    cc_detection.tcpmodel = Mock()
+    cc_detection.tcpmodel.predict.return_value = np.array([[0.5]])
+    cc_detection.handle_new_letters(get_letters_msg("abcd"))
+
+    cc_detection.handle_tw_closed({"data": "profile_192.168.1.1_timewindow1"})
+
+    cc_detection.tcpmodel.predict.assert_called_once()
+    assert not cc_detection.pending_tuples
+    assert not cc_detection.scored_letters
+
+
+def score_letters(cc_detection, *letters: str):
+    """handles and scores the given letters of the same tuple"""
+    for letters_ in letters:
+        cc_detection.handle_new_letters(get_letters_msg(letters_))
+        if cc_detection.pending_tuples:
+            cc_detection.score_pending_tuples()
+
+
+def test_unscored_letters_are_scored_when_the_tw_is_closed():
+    cc_detection = ModuleFactory().create_rnn_detection_object()
+    cc_detection.print = Mock()
+    cc_detection.tcpmodel = Mock()
+    cc_detection.tcpmodel.predict.return_value = np.array([[0.5]])
+    cc_detection.rescore_after_letters = 3
+    score_letters(cc_detection, "a", "ab", "abc")
+    assert cc_detection.tcpmodel.predict.call_count == 1
+
+    cc_detection.handle_tw_closed({"data": "profile_192.168.1.1_timewindow1"})
+
+    assert cc_detection.tcpmodel.predict.call_count == 2
+    scored_letters = cc_detection.convert_inputs_for_module(["abc"])
+    np.testing.assert_array_equal(
+        cc_detection.tcpmodel.predict.call_args[0][0], scored_letters
+    )
+    assert not cc_detection.unscored_tuples
+
+
+def test_unscored_letters_are_scored_on_shutdown():
+    cc_detection = ModuleFactory().create_rnn_detection_object()
+    cc_detection.print = Mock()
+    cc_detection.tcpmodel = Mock()
+    cc_detection.tcpmodel.predict.return_value = np.array([[0.5]])
+    cc_detection.rescore_after_letters = 3
+    score_letters(cc_detection, "a", "ab")
+
+    cc_detection.shutdown_gracefully()
+
+    assert cc_detection.tcpmodel.predict.call_count == 2
+    assert cc_detection.scored_letters[
+        ("profile_192.168.1.1", "timewindow1")
+    ] == {"10.0.0.1-80-TCP": 2}
+
+
+def test_scored_letters_are_not_scored_again():
+    cc_detection = ModuleFactory().create_rnn_detection_object()
+    cc_detection.print = Mock()
+    cc_detection.tcpmodel = Mock()
+    cc_detection.tcpmodel.predict.return_value = np.array([[0.5]])
+    cc_detection.rescore_after_letters = 3
+    score_letters(cc_detection, "a", "ab", "abcd")
+
+    cc_detection.shutdown_gracefully()
+
+    assert cc_detection.tcpmodel.predict.call_count == 2
+    assert not cc_detection.unscored_tuples
+
+
+def test_batch_scores_match_one_by_one():
+    cc_detection = ModuleFactory().create_rnn_detection_object()
+    cc_detection.tcpmodel = load_model("modules/rnn_cc_detection/rnn_model.h5")
+    rng = np.random.default_rng(0)
+    vocabulary = "abcdefghiABCDEFGHIrstuvwxyzRSTUVWXYZ1234567890,.+*"
+    sequences = [
+        "".join(rng.choice(list(vocabulary), length))
+        for length in (1, 10, 50, 200, 600)
+    ]
+
+    batch_scores = cc_detection.tcpmodel.predict(
+        cc_detection.convert_inputs_for_module(sequences)
+    )
+
+    for sequence, batch_score in zip(sequences, batch_scores):
+        score = cc_detection.tcpmodel.predict(
+            convert_letters_one_by_one(sequence)[np.newaxis]
+        )
+        assert np.allclose(batch_score, score[0], atol=1e-6)
+
+
+def test_export_strato_letters(tmp_path):
+    exporter = StratoLettersExporter(Mock())
+    exporter.should_export = True
+    exporter.db.get_output_dir.return_value = str(tmp_path)
+    exporter.db.get_outtuples_from_profile_tw.return_value = json.dumps(
+        {
+            "1.1.1.1-443-tcp": ["88*e", [1.0, 2.0]],
+            "8.8.8.8-53-udp": ["", []],
+        }
+    )
+    exporter.init()
+
+    exporter.export_outtuples("profile_192.168.1.1", "timewindow2")
+
+    with open(tmp_path / "strato_letters.tsv") as letters_file:
+        assert letters_file.read().splitlines() == [
+            "Outtuple\tLetters",
+            "192.168.1.1-1.1.1.1-443-tcp-timewindow2\t88*e",
+        ]
@@ -0,0 +1,104 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+from unittest.mock import Mock
+
+import pytest
+
+from slips_files.core.structures.evidence import EvidenceType
+from tests.module_factory import ModuleFactory
+
+PROFILEID = "profile_1.1.1.1"
+
+
+def get_conn_flow(daddr, dport, saddr="1.1.1.1", history="S"):
+    return Mock(
+        starttime="1726249372.312124",
+        uid=f"uid_{daddr}_{dport}",
+        saddr=saddr,
+        daddr=daddr,
+        proto="tcp",
+        dport=dport,
+        state_hist=history,
+    )
+
+
+def scan(slow_ps, tws: int, dports_per_tw: int, daddr="8.8.8.8"):
+    """scans dports_per_tw new ports of daddr in each tw, closing every
+    tw after it"""
+    port = 0
+    for tw in range(tws):
+        twid = f"timewindow{tw}"
+        for _ in range(dports_per_tw):
+            flow = get_conn_flow(daddr, str(port))
+            slow_ps.add_flow(PROFILEID, twid, flow, "Not Established")
+            port += 1
+        slow_ps.check(PROFILEID, twid)
+
+
+def test_slow_vertical_scan():
+    slow_ps = ModuleFactory().create_slow_portscan_obj()
+    # 3 ports per tw never reach the vertical portscan threshold
+    scan(slow_ps, tws=20, dports_per_tw=3)
+
+    slow_ps.db.set_evidence.assert_called_once()
+    evidence = slow_ps.db.set_evidence.call_args[0][0]
+    assert evidence.evidence_type == EvidenceType.SLOW_PORT_SCAN
+    assert evidence.attacker.value == "1.1.1.1"
+    assert "to 51 different destination ports" in evidence.description
+
+
+def test_scan_in_one_tw_isnt_slow():
+    slow_ps = ModuleFactory().create_slow_portscan_obj()
+    scan(slow_ps, tws=1, dports_per_tw=100)
+    slow_ps.db.set_evidence.assert_not_called()
+
+
+def test_slow_scan_is_reported_again_when_it_grows():
+    slow_ps = ModuleFactory().create_slow_portscan_obj()
+    scan(slow_ps, tws=24, dports_per_tw=5)
+    # reported at 50 and 100 ports
+    assert slow_ps.db.set_evidence.call_count == 2
+
+
+def test_old_tws_slide_out():
+    slow_ps = ModuleFactory().create_slow_portscan_obj()
+    slow_ps.windows = 4
+    scan(slow_ps, tws=30, dports_per_tw=5)
+    slow_ps.db.set_evidence.assert_not_called()
+    assert len(slow_ps.counters[PROFILEID]["dports"].counters) == 4
+
+
+@pytest.mark.parametrize(
+    "flow, state",
+    [
+        # Testcase 1: established flow
+        (get_conn_flow("8.8.8.8", "80"), "Established"),
+        # Testcase 2: the profile is the server of the flow
+        (get_conn_flow("1.1.1.1", "80", saddr="8.8.8.8"), "Not Established"),
+        # Testcase 3: flipped flow
+        (get_conn_flow("8.8.8.8", "80", history="^S"), "Not Established"),
+    ],
+)
+def test_ignored_flows(flow, state):
+    slow_ps = ModuleFactory().create_slow_portscan_obj()
+    slow_ps.add_flow(PROFILEID, "timewindow0", flow, state)
+    assert PROFILEID not in slow_ps.counters
+
+
+def test_resolved_dstips_arent_counted():
+    slow_ps = ModuleFactory().create_slow_portscan_obj()
+    slow_ps.db.get_dns_resolution.return_value = {"domains": ["a.com"]}
+    flow = get_conn_flow("8.8.8.8", "80")
+    slow_ps.add_flow(PROFILEID, "timewindow0", flow, "Not Established")
+    counters = slow_ps.counters[PROFILEID]
+    assert len(counters["dports"]) == 1
+    assert len(counters["dstips"]) == 0
+
+
+def test_inactive_profile_is_removed():
+    slow_ps = ModuleFactory().create_slow_portscan_obj()
+    slow_ps.windows = 2
+    flow = get_conn_flow("8.8.8.8", "80")
+    slow_ps.add_flow(PROFILEID, "timewindow0", flow, "Not Established")
+    slow_ps.check(PROFILEID, "timewindow5")
+    assert PROFILEID not in slow_ps.counters
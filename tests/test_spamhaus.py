@@ -3,9 +3,14 @@
 """Unit test for modules/threat_intelligence/spamhaus.py"""
 
 from tests.module_factory import ModuleFactory
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import dns.exception
+import dns.resolver
 import pytest
 
+from modules.threat_intelligence.online_lookups import OnlineLookupError
+
 
 @pytest.mark.parametrize(
     "ip, dns_query_result, expected",
@@ -23,11 +28,14 @@ import pytest
         ),
     ],
 )
-@patch("modules.threat_intelligence.spamhaus.Spamhaus._perform_dns_query")
+@patch(
+    "modules.threat_intelligence.spamhaus.Spamhaus._perform_dns_query",
+    new_callable=AsyncMock,
+)
 @patch("modules.threat_intelligence.spamhaus.Spamhaus._get_list_names")
 @patch("modules.threat_intelligence.spamhaus.Spamhaus._get_list_descriptions")
 @patch("modules.threat_intelligence.spamhaus.Spamhaus._get_dataset_info")
-def test_query(
+async def test_async_lookup(
     mock_get_dataset_info,
     mock_get_list_descriptions,
     mock_get_list_names,
@@ -47,16 +55,27 @@ def test_query(
     mock_get_dataset_info.return_value = ("some_list", "This is a spam list")
 
     spamhaus = ModuleFactory().create_spamhaus_obj()
-    result = spamhaus.query(ip)
+    result = await spamhaus.async_lookup(ip)
     assert result == expected
 
 
-def test_spamhaus_dns_error(mocker):
+async def test_spamhaus_not_listed():
+    """
+    an NXDOMAIN means the ip isn't listed
+    """
+    spamhaus = ModuleFactory().create_spamhaus_obj()
+    spamhaus._resolver = MagicMock()
+    spamhaus._resolver.resolve = AsyncMock(side_effect=dns.resolver.NXDOMAIN)
+    assert await spamhaus.async_lookup("13.14.15.16") is False
+
+
+async def test_spamhaus_dns_error():
     """
     Test the `spamhaus` method's handling of DNS resolution errors.
+    the lookup should be retried, so it's not treated as not listed
     """
     spamhaus = ModuleFactory().create_spamhaus_obj()
-    mock_resolver = mocker.patch("dns.resolver.resolve")
-    mock_resolver.side_effect = Exception("DNS resolution error")
-    result = spamhaus.query("13.14.15.16")
-    assert result is False
+    spamhaus._resolver = MagicMock()
+    spamhaus._resolver.resolve = AsyncMock(side_effect=dns.exception.Timeout)
+    with pytest.raises(OnlineLookupError):
+        await spamhaus.async_lookup("13.14.15.16")
@@ -0,0 +1,236 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import json
+import sqlite3
+from dataclasses import dataclass
+from unittest.mock import Mock
+
+import pytest
+
+from slips_files.core.database.sqlite_db.database import (
+    MIGRATION_BATCH_SIZE,
+    SCHEMA_VERSION,
+    SQLiteDB,
+    normalize_flow,
+)
+
+PROFILEID = "profile_192.168.1.1"
+
+
+@dataclass
+class Flow:
+    starttime: float
+    uid: str
+    saddr: str
+    daddr: str
+    dur: float
+    proto: str
+    sport: str
+    dport: str
+    spkts: int
+    dpkts: int
+    sbytes: int
+    dbytes: int
+    state: str
+    history: str = "ShADadFf"
+    type_: str = "conn"
+
+
+def get_flow(i: int, daddr="1.1.1.1") -> dict:
+    return {
+        "starttime": 1700000000.0 + i,
+        "uid": f"uid{i}",
+        "saddr": "192.168.1.1",
+        "daddr": daddr,
+        "dur": 1.5,
+        "proto": "tcp",
+        "sport": "12345",
+        "dport": "443",
+        "spkts": 2,
+        "dpkts": 3,
+        "sbytes": 100,
+        "dbytes": 200,
+        "state": "SF",
+        "history": "ShADadFf",
+        "type_": "conn",
+    }
+
+
+def create_sqlite(tmp_path) -> SQLiteDB:
+    return SQLiteDB(Mock(), str(tmp_path))
+
+
+def test_add_flow(tmp_path):
+    sqlite = create_sqlite(tmp_path)
+    flow = Flow(**get_flow(1))
+    flow.aid = "aid1"
+
+    sqlite.add_flow(flow, PROFILEID, "timewindow1")
+
+    assert sqlite.get_all_flows_in_profileid_twid(
+        PROFILEID, "timewindow1"
+    ) == {"uid1": get_flow(1)}
+    assert json.loads(sqlite.get_flow("uid1")["uid1"]) == get_flow(1)
+    assert sqlite.get_flow("uid1", twid="timewindow2") == {"uid1": {}}
+    row = sqlite.select(
+        "flows",
+        columns="daddr, sbytes, label, aid",
+        condition="uid = ?",
+        params=("uid1",),
+        limit=1,
+    )
+    assert row == ("1.1.1.1", 100, "benign", "aid1")
+
+
+def test_filters_are_done_by_sqlite(tmp_path):
+    sqlite = create_sqlite(tmp_path)
+    sqlite.insert_flows(
+        [
+            (get_flow(1), PROFILEID, "timewindow1", "benign", None),
+            (get_flow(2, "8.8.8.8"), PROFILEID, "timewindow1", "benign", None),
+            (get_flow(3), PROFILEID, "timewindow1", "benign", None),
+            (get_flow(4), PROFILEID, "timewindow2", "benign", None),
+            (get_flow(5), "profile_10.0.0.1", "timewindow1", "benign", None),
+        ]
+    )
+
+    assert sqlite.get_all_contacted_ips_in_profileid_twid(
+        PROFILEID, "timewindow1"
+    ) == {"1.1.1.1": "uid3", "8.8.8.8": "uid2"}
+    assert (
+        sqlite.get_all_contacted_ips_in_profileid_twid(
+            PROFILEID, "timewindow3"
+        )
+        == {}
+    )
+    assert not sqlite.get_all_flows_in_profileid_twid(PROFILEID, "timewindow3")
+    assert set(sqlite.get_all_flows_in_profileid(PROFILEID)) == {
+        "uid1",
+        "uid2",
+        "uid3",
+        "uid4",
+    }
+    assert len(sqlite.get_all_flows()) == 5
+    assert sqlite.get_flows_count() == 5
+    assert sqlite.get_flows_count(profileid=PROFILEID) == 4
+    assert sqlite.get_flows_count(twid="timewindow1") == 4
+    assert sqlite.get_flows_count(PROFILEID, "timewindow2") == 1
+
+
+def test_indexes(tmp_path):
+    sqlite = create_sqlite(tmp_path)
+    plan = sqlite.fetchall(
+        sqlite.execute(
+            "EXPLAIN QUERY PLAN SELECT uid FROM flows "
+            "WHERE profileid = ? AND twid = ?",
+            (PROFILEID, "timewindow1"),
+        )
+    )
+    assert "flows_profileid_twid" in str(plan)
+    plan = sqlite.fetchall(
+        sqlite.execute(
+            "EXPLAIN QUERY PLAN SELECT uid FROM flows WHERE daddr = ?",
+            ("1.1.1.1",),
+        )
+    )
+    assert "flows_daddr" in str(plan)
+
+
+def test_set_flow_label(tmp_path):
+    sqlite = create_sqlite(tmp_path)
+    sqlite.insert_flows(
+        [
+            (get_flow(i), PROFILEID, "timewindow1", "benign", None)
+            for i in range(3)
+        ]
+    )
+    sqlite.set_flow_label(["uid0", "uid2"], "malicious")
+
+    rows = sqlite.get_flows_after(0, 10)
+    assert [label for _, _, label in rows] == [
+        "malicious",
+        "benign",
+        "malicious",
+    ]
+    assert [flow for _, flow, _ in rows] == [get_flow(i) for i in range(3)]
+
+
+def create_v1_db(tmp_path, flows: int):
+    """creates a flows.sqlite like the ones of older slips versions,
+    with the flows stored as json"""
+    conn = sqlite3.connect(tmp_path / "flows.sqlite")
+    conn.execute(
+        "CREATE TABLE flows (uid TEXT PRIMARY KEY, flow TEXT, label TEXT, "
+        "profileid TEXT, twid TEXT, aid TEXT)"
+    )
+    conn.execute(
+        "CREATE TABLE altflows (uid TEXT PRIMARY KEY, flow TEXT, label "
+        "TEXT, profileid TEXT, twid TEXT, flow_type TEXT)"
+    )
+    conn.executemany(
+        "INSERT INTO flows VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (
+                f"uid{i}",
+                json.dumps(get_flow(i)),
+                "malicious" if i % 2 else "benign",
+                PROFILEID,
+                "timewindow1",
+                f"aid{i}",
+            )
+            for i in range(flows)
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+
+@pytest.mark.parametrize("flows", [0, 3, MIGRATION_BATCH_SIZE + 1])
+def test_migrate_v1_db(tmp_path, flows):
+    create_v1_db(tmp_path, flows)
+
+    sqlite = create_sqlite(tmp_path)
+
+    assert sqlite.get_schema_version() == SCHEMA_VERSION
+    assert "flows_v1" not in str(
+        sqlite.select("sqlite_master", columns="name")
+    )
+    assert "extra" in sqlite.get_columns("flows")
+    assert sqlite.get_flows_count() == flows
+    rows = sqlite.get_flows_after(0, 3)
+    assert [flow for _, flow, _ in rows] == [
+        get_flow(i) for i in range(min(flows, 3))
+    ]
+    assert [label for _, _, label in rows] == [
+        "benign",
+        "malicious",
+        "benign",
+    ][:flows]
+    # already migrated dbs are left as they are
+    sqlite.insert_flows([(get_flow(-1), PROFILEID, "timewindow2", "", None)])
+    assert create_sqlite(tmp_path).get_flows_count() == flows + 1
+
+
+@pytest.mark.parametrize(
+    "values, missing",
+    [
+        # Testcase 1: values of the type of their columns
+        ({}, []),
+        # Testcase 2: numbers as strings and strings as numbers
+        ({"dur": "2", "sbytes": "100", "dbytes": "1.0", "sport": 1}, []),
+        # Testcase 3: values that aren't numbers in numeric columns
+        ({"dur": "", "spkts": "unknown", "dpkts": 1.5}, []),
+        # Testcase 4: bools and missing columns
+        ({"state": True, "spkts": False}, ["dport", "starttime"]),
+    ],
+)
+def test_normalize_flow(tmp_path, values, missing):
+    sqlite = create_sqlite(tmp_path)
+    flow = {**get_flow(1), **values}
+    for field in missing:
+        del flow[field]
+
+    sqlite.insert_flows([(flow, PROFILEID, "timewindow1", "benign", None)])
+
+    # same fields, types and order as the flows read from sqlite
+    assert json.dumps(normalize_flow(flow)) == sqlite.get_flow("uid1")["uid1"]
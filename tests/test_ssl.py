@@ -105,10 +105,10 @@ def test_detect_malicious_ja3(
         "modules.flowalerts.set_evidence.SetEvidenceHelper.malicious_ja3s"
     )
 
-    ssl.db.get_all_blacklisted_ja3.return_value = {
+    ssl.db.is_blacklisted_ja3.side_effect = {
         "malicious_ja3": "Malicious JA3",
         "malicious_ja3s": "Malicious JA3S",
-    }
+    }.get
     flow = SSL(
         starttime="1726593782.8840969",
         uid="123",
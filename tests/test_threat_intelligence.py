@@ -3,10 +3,12 @@
 """Unit test for modules/threat_intelligence/threat_intelligence.py"""
 
 from tests.module_factory import ModuleFactory
+import asyncio
 import os
 import pytest
 import json
 from unittest.mock import (
+    AsyncMock,
     patch,
     Mock,
 )
@@ -14,6 +16,21 @@ import ipaddress
 from slips_files.core.structures.evidence import ThreatLevel
 
 
+def run_online_lookups_inline(threatintel):
+    """
+    makes the lookups submitted to the online lookups worker run in the
+    calling thread, so tests don't have to wait for the worker
+    """
+
+    def submit(coroutine, callback=None):
+        if (result := asyncio.run(coroutine)) and callback:
+            callback(result)
+        return Mock()
+
+    threatintel.online_lookups.submit = submit
+    threatintel.db.get_cached_online_ti_result.return_value = None
+
+
 def test_parse_local_ti_file():
     """
     Test parsing of a local threat intelligence file.
@@ -164,7 +181,9 @@ def test_get_malicious_ip_ranges(
     This test covers both IPv4 and IPv6 range scenarios.
     """
     threatintel = ModuleFactory().create_threatintel_obj()
-    threatintel.db.get_all_blacklisted_ip_ranges.return_value = mock_ip_ranges
+    threatintel.db.get_all_blacklisted_ip_ranges.return_value = list(
+        mock_ip_ranges
+    )
     threatintel.get_all_blacklisted_ip_ranges()
 
     assert threatintel.cached_ipv4_ranges == expected_ipv4_ranges
@@ -732,6 +751,7 @@ def test_search_online_for_hash(
     online threat intelligence sources.
     """
     threatintel = ModuleFactory().create_threatintel_obj()
+    threatintel.db.get_cached_online_ti_result.return_value = None
     threatintel.urlhaus.lookup = Mock(return_value=urlhaus_lookup_return)
     threatintel.circllu.lookup = Mock(return_value=circl_lu_return)
     flow_info = {
@@ -740,7 +760,7 @@ def test_search_online_for_hash(
         "profileid": "profile_10.0.0.1",
         "twid": "timewindow1",
     }
-    result = threatintel.search_online_for_hash(flow_info)
+    result = asyncio.run(threatintel.search_online_for_hash(flow_info))
     assert result == expected_result
 
 
@@ -804,12 +824,11 @@ def test_ip_belongs_to_blacklisted_range(
     threatintel.cached_ipv6_ranges = (
         {first_octet: [range_value]} if ip_type == "ipv6" else {}
     )
-    threatintel.db.get_all_blacklisted_ip_ranges.return_value = (
-        {
-            range_value: '{"description": "Bad range", "source": "Example Source", "threat_level": "high"}'
-        }
+    threatintel.db.get_blacklisted_ip_range_info.return_value = (
+        '{"description": "Bad range", "source": "Example Source", '
+        '"threat_level": "high"}'
         if in_blacklist
-        else {}
+        else None
     )
 
     result = threatintel.ip_belongs_to_blacklisted_range(
@@ -841,9 +860,10 @@ def test_search_online_for_url(
     """Test `search_online_for_url` for
     querying online threat intelligence sources."""
     threatintel = ModuleFactory().create_threatintel_obj()
+    threatintel.db.get_cached_online_ti_result.return_value = None
     mock_urlhaus_lookup = mocker.patch.object(threatintel.urlhaus, "lookup")
     mock_urlhaus_lookup.return_value = mock_return_value
-    result = threatintel.search_online_for_url(url)
+    result = asyncio.run(threatintel.search_online_for_url(url))
     assert result == expected_result
 
 
@@ -1039,32 +1059,41 @@ def test_is_malicious_cname_ignored_cname(mocker, cname):
 
 
 @pytest.mark.parametrize(
-    "offline_result, online_result, expected_result",
+    "offline_result, online_result, expected_result, expected_evidence",
     [  # testcase1: Offline hit
         (
             {"description": "Malicious IP", "source": "test_source"},
             None,
             True,
+            True,
         ),
-        # testcase2: Online hit
+        # testcase2: Online hit, the evidence is set in the background
         (
             None,
             {"description": "Malicious IP", "source": "test_source"},
+            False,
             True,
         ),
         # testcase3: No hit
-        (None, None, False),
+        (None, None, False, False),
     ],
 )
-def test_is_malicious_ip(offline_result, online_result, expected_result):
+def test_is_malicious_ip(
+    offline_result, online_result, expected_result, expected_evidence
+):
     """Test `is_malicious_ip` for checking IP blacklisting."""
     threatintel = ModuleFactory().create_threatintel_obj()
+    threatintel.set_evidence_malicious_ip = Mock()
+
+    def search_online_for_ip(ip, ip_state, callback):
+        if online_result:
+            callback(online_result)
+
     with patch(
         "modules.threat_intelligence.threat_intelligence.ThreatIntel.search_offline_for_ip",
         return_value=offline_result,
-    ), patch(
-        "modules.threat_intelligence.threat_intelligence.ThreatIntel.search_online_for_ip",
-        return_value=online_result,
+    ), patch.object(
+        threatintel, "search_online_for_ip", side_effect=search_online_for_ip
     ):
         result = threatintel.is_malicious_ip(
             "192.168.1.1",
@@ -1076,26 +1105,40 @@ def test_is_malicious_ip(offline_result, online_result, expected_result):
             "srcip",
         )
         assert result == expected_result
+    assert threatintel.set_evidence_malicious_ip.called == expected_evidence
 
 
 @pytest.mark.parametrize(
-    "ip_address, mock_return_value, expected_result",
+    "ip_address, mock_return_value, is_inbound_traffic",
     [
-        ("1.2.3.4", {"description": "Spam IP"}, {"description": "Spam IP"}),
-        ("10.0.0.1", None, None),
+        ("1.2.3.4", {"description": "Spam IP"}, True),
+        ("10.0.0.1", None, True),
+        # outbound traffic isn't looked up
+        ("1.2.3.4", {"description": "Spam IP"}, False),
     ],
 )
-@patch("modules.threat_intelligence.spamhaus.Spamhaus.query")
+@patch(
+    "modules.threat_intelligence.spamhaus.Spamhaus.async_lookup",
+    new_callable=AsyncMock,
+)
 def test_search_online_for_ip(
-    mock_spamhaus, ip_address, mock_return_value, expected_result
+    mock_spamhaus, ip_address, mock_return_value, is_inbound_traffic
 ):
     """Test `search_online_for_ip` for querying online threat intelligence sources."""
     mock_spamhaus.return_value = mock_return_value
     threatintel = ModuleFactory().create_threatintel_obj()
+    run_online_lookups_inline(threatintel)
     threatintel.is_inbound_traffic = Mock()
-    threatintel.is_inbound_traffic.return_value = True
-    result = threatintel.search_online_for_ip(ip_address, "dstip")
-    assert result == expected_result
+    threatintel.is_inbound_traffic.return_value = is_inbound_traffic
+    callback = Mock()
+    submitted = threatintel.search_online_for_ip(ip_address, "dstip", callback)
+    assert submitted == is_inbound_traffic
+    if is_inbound_traffic and mock_return_value:
+        callback.assert_called_once_with(mock_return_value)
+        # the result is cached
+        threatintel.db.cache_online_ti_result.assert_called_once()
+    else:
+        callback.assert_not_called()
 
 
 # External function to mock `is_global` behavior with an IP parameter
@@ -1190,9 +1233,10 @@ def test_is_malicious_hash(
     recording evidence of malicious file hashes.
     """
     threatintel = ModuleFactory().create_threatintel_obj()
+    run_online_lookups_inline(threatintel)
     threatintel.db.is_known_fp_md5_hash.return_value = False
     mock_search_online_for_hash = mocker.patch.object(
-        threatintel, "search_online_for_hash"
+        threatintel, "search_online_for_hash", new_callable=AsyncMock
     )
 
     flow_info = {
@@ -1235,8 +1279,9 @@ def test_is_malicious_url(url, result, is_malicious, mocker):
     both malicious and non-malicious URLs.
     """
     threatintel = ModuleFactory().create_threatintel_obj()
+    run_online_lookups_inline(threatintel)
     mock_search_online_for_url = mocker.patch.object(
-        threatintel, "search_online_for_url"
+        threatintel, "search_online_for_url", new_callable=AsyncMock
     )
     mock_urlhaus_set_evidence = mocker.patch.object(
         threatintel.urlhaus, "set_evidence_malicious_url"
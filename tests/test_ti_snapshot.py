@@ -0,0 +1,266 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import json
+import os
+
+import pytest
+
+from slips_files.common.data_structures.ti_snapshot import (
+    DELETED,
+    HEADER,
+    SECTION,
+    TISnapshot,
+    TISnapshotOverlay,
+    TISnapshotWriter,
+)
+from slips_files.common.data_structures.trie import Trie
+from tests.module_factory import ModuleFactory
+
+
+def write_snapshot(path, sections, generations=None):
+    TISnapshotWriter().write(str(path), sections, generations or {})
+    snapshot = TISnapshot(str(path))
+    snapshot.reload_if_changed()
+    return snapshot
+
+
+@pytest.mark.parametrize(
+    "key, expected_result",
+    [
+        # Testcase 1: first key
+        ("1.1.1.1", '{"source": "a"}'),
+        # Testcase 2: last key
+        ("9.9.9.9", '{"source": "c"}'),
+        # Testcase 3: key in the middle
+        ("5.5.5.5", '{"source": "b"}'),
+        # Testcase 4: not found
+        ("4.4.4.4", None),
+    ],
+)
+def test_get(tmp_path, key, expected_result):
+    snapshot = write_snapshot(
+        tmp_path / "snapshot",
+        {
+            "ips": {
+                "9.9.9.9": '{"source": "c"}',
+                "1.1.1.1": '{"source": "a"}',
+                "5.5.5.5": '{"source": "b"}',
+            }
+        },
+    )
+    assert snapshot.get("ips", key) == expected_result
+
+
+def test_get_unknown_section(tmp_path):
+    snapshot = write_snapshot(tmp_path / "snapshot", {"ips": {}})
+    assert snapshot.get("domains", "google.com") is None
+    assert snapshot.get_generation("domains") is None
+
+
+@pytest.mark.parametrize(
+    "domain",
+    ["evil.com", "sub.evil.com", "a.b.evil.com", "notevil.com", "com"],
+)
+def test_match_domain_matches_the_trie(tmp_path, domain):
+    domains = {
+        "evil.com": json.dumps({"source": "feed1"}),
+        "bad.org": json.dumps({"source": "feed2"}),
+    }
+    snapshot = write_snapshot(tmp_path / "snapshot", {"domains": domains})
+    trie = Trie()
+    for d, info in domains.items():
+        trie.insert(d, info)
+
+    found, info = trie.search(domain)
+    assert snapshot.match_domain(domain) == (info if found else None)
+
+
+def test_reload_if_changed(tmp_path):
+    path = tmp_path / "snapshot"
+    snapshot = write_snapshot(path, {"ips": {"1.1.1.1": "old"}}, {"ips": 1})
+    # nothing changed
+    assert not snapshot.reload_if_changed()
+
+    TISnapshotWriter().write(
+        str(path), {"ips": {"1.1.1.1": "new"}}, {"ips": 2}
+    )
+    assert snapshot.reload_if_changed()
+    assert snapshot.get("ips", "1.1.1.1") == "new"
+    assert snapshot.get_generation("ips") == 2
+    # the temp file used for the atomic swap is gone
+    assert os.listdir(tmp_path) == ["snapshot"]
+
+
+@pytest.mark.parametrize(
+    "size",
+    [
+        # Testcase 1: truncated header
+        4,
+        # Testcase 2: truncated section table
+        HEADER.size + 4,
+        # Testcase 3: truncated index
+        HEADER.size + SECTION.size + 4,
+    ],
+)
+def test_reload_truncated_file(tmp_path, size):
+    path = tmp_path / "snapshot"
+    snapshot = write_snapshot(path, {"ips": {"1.1.1.1": "old"}})
+    TISnapshotWriter().write(str(path), {"ips": {"1.1.1.1": "new"}}, {})
+    with open(path, "r+b") as snapshot_file:
+        snapshot_file.truncate(size)
+
+    assert not snapshot.reload_if_changed()
+    assert snapshot.get("ips", "1.1.1.1") == "old"
+
+
+def test_reload_missing_file(tmp_path):
+    snapshot = TISnapshot(str(tmp_path / "doesnt_exist"))
+    assert not snapshot.reload_if_changed()
+    assert not snapshot.is_loaded()
+
+
+def test_items(tmp_path):
+    ranges = {"1.0.0.0/8": "a", "2.0.0.0/8": "b"}
+    snapshot = write_snapshot(tmp_path / "snapshot", {"ip_ranges": ranges})
+    assert dict(snapshot.items("ip_ranges")) == ranges
+
+
+def test_keys(tmp_path):
+    ranges = {"1.0.0.0/8": "a", "2.0.0.0/8": "b"}
+    snapshot = write_snapshot(tmp_path / "snapshot", {"ip_ranges": ranges})
+    assert list(snapshot.keys("ip_ranges")) == list(ranges)
+
+
+def test_overlay(tmp_path):
+    snapshot = write_snapshot(
+        tmp_path / "snapshot",
+        {
+            "domains": {"evil.com": "old", "bad.org": "bad"},
+            "ips": {"1.1.1.1": "ip"},
+        },
+    )
+    overlay = TISnapshotOverlay(
+        snapshot,
+        "domains",
+        {"evil.com": DELETED, "sub.bad.org": "sub", "new.com": "new"},
+    )
+
+    assert overlay.get("domains", "evil.com") is None
+    assert overlay.get("domains", "new.com") == "new"
+    assert overlay.get("domains", "bad.org") == "bad"
+    # other sections are looked up in the snapshot only
+    assert overlay.get("ips", "1.1.1.1") == "ip"
+    assert overlay.match_domain("a.evil.com") is None
+    # the shortest blacklisted domain is matched, same as the snapshot
+    assert overlay.match_domain("x.sub.bad.org") == "bad"
+    assert sorted(overlay.keys("domains")) == [
+        "bad.org",
+        "new.com",
+        "sub.bad.org",
+    ]
+    assert dict(overlay.items("domains"))["new.com"] == "new"
+
+
+@pytest.mark.parametrize(
+    "generations, overlay, expected_lookups_in_redis, expected_result",
+    [
+        # Testcase 1: snapshot is up to date
+        ([{"ips": b"3"}, {"ips": b"3"}, {"ips": b"3"}], {}, 0, "feed"),
+        # Testcase 2: the db was modified by writes that are all in the
+        # overlay
+        (
+            [{"ips": b"4"}, {"ips": b"3"}, {"ips": b"4"}],
+            {"1.1.1.1": json.dumps({"source": "p2p"})},
+            0,
+            "p2p",
+        ),
+        # Testcase 3: the db was modified by a promotion, which isn't in
+        # the overlay
+        ([{"ips": b"5"}, {"ips": b"3"}, {"ips": b"4"}], {}, 1, "redis"),
+        # Testcase 4: the overlay is of a newer snapshot than the mapped one
+        ([{"ips": b"6"}, {"ips": b"5"}, {"ips": b"6"}], {}, 1, "redis"),
+    ],
+)
+def test_ioc_handler_uses_snapshot(
+    tmp_path, generations, overlay, expected_lookups_in_redis, expected_result
+):
+    ioc_handler = ModuleFactory().create_ioc_handler_obj()
+    ioc_handler.ti_snapshot_path = str(tmp_path / "snapshot")
+    TISnapshotWriter().write(
+        ioc_handler.ti_snapshot_path,
+        {"ips": {"1.1.1.1": json.dumps({"source": "feed"})}},
+        {"ips": 3},
+    )
+    # the first read gets the generations, the second one the overlays
+    # that changed since the last check
+    ioc_handler.rcache.pipeline.return_value.execute.side_effect = [
+        generations,
+        generations + [overlay],
+    ]
+    ioc_handler.rcache.hget.return_value = json.dumps({"source": "redis"})
+
+    assert ioc_handler.is_blacklisted_ip("1.1.1.1") == {
+        "source": expected_result
+    }
+    assert ioc_handler.rcache.hget.call_count == expected_lookups_in_redis
+
+
+@pytest.mark.parametrize(
+    "write, expected_overlay",
+    [
+        # Testcase 1: added iocs
+        (
+            lambda ioc_handler: ioc_handler.add_ips_to_ioc({"1.1.1.1": "new"}),
+            {"1.1.1.1": "new"},
+        ),
+        # Testcase 2: deleted iocs
+        (
+            lambda ioc_handler: ioc_handler.delete_ips_from_ioc_ips(
+                ["1.1.1.1"]
+            ),
+            {"1.1.1.1": DELETED},
+        ),
+    ],
+)
+def test_writes_are_recorded_in_the_overlay(write, expected_overlay):
+    ioc_handler = ModuleFactory().create_ioc_handler_obj()
+    write(ioc_handler)
+
+    transaction = ioc_handler.rcache.pipeline.return_value
+    ioc_handler.rcache.pipeline.assert_called_once_with(transaction=True)
+    transaction.hset.assert_any_call(
+        "IoC_overlay_ips", mapping=expected_overlay
+    )
+    # both generations are incremented, so readers know the overlay has
+    # all the changes
+    transaction.hincrby.assert_any_call("IoC_generations", "ips", 1)
+    transaction.hincrby.assert_any_call("IoC_overlay_generations", "ips", 1)
+    transaction.execute.assert_called_once()
+
+
+def test_publish_ti_snapshot(mocker, tmp_path):
+    ioc_handler = ModuleFactory().create_ioc_handler_obj()
+    ioc_handler.ti_snapshot_path = str(tmp_path / "snapshot")
+    iocs = {
+        ioc_handler.constants.IOC_GENERATIONS: {"domains": "2"},
+        ioc_handler.constants.IOC_DOMAINS: {"evil.com": "info"},
+    }
+    pipe = mocker.Mock()
+    pipe.hgetall.side_effect = lambda key: iocs.get(key, {})
+    ioc_handler.rcache.transaction.side_effect = (
+        lambda func, *watches, **kwargs: func(pipe)
+    )
+    ioc_handler.publish_ti_snapshot()
+
+    snapshot = TISnapshot(ioc_handler.ti_snapshot_path)
+    snapshot.reload_if_changed()
+    assert snapshot.get("domains", "evil.com") == "info"
+    assert snapshot.get_generation("domains") == 2
+    assert snapshot.get_generation("ips") == 0
+    # the overlays are emptied in the same transaction
+    assert "IoC_overlay_domains" in pipe.delete.call_args.args
+    pipe.hset.assert_any_call(
+        "IoC_snapshot_generations",
+        mapping=mocker.ANY,
+    )
+    pipe.hset.assert_any_call("IoC_overlay_generations", mapping=mocker.ANY)
@@ -1,11 +1,16 @@
 # SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
 # SPDX-License-Identifier: GPL-2.0-only
+import json
+import time
+
 import pytest
 from unittest.mock import Mock, patch
 
+from modules.timeline.timeline import Timeline
 from slips_files.core.flows.suricata import (
     SuricataFlow,
 )
+from slips_files.core.flows.zeek import Conn
 from tests.module_factory import ModuleFactory
 
 
@@ -726,3 +731,124 @@ def test_process_ssl_altflow(alt_flow, expected):
     timeline = ModuleFactory().create_timeline_object()
     result = timeline.process_ssl_altflow(alt_flow)
     assert result == expected
+
+
+def create_conn_flow(uid: str, proto="tcp") -> Conn:
+    return Conn(
+        starttime="1726655400.0",
+        uid=uid,
+        saddr="192.168.1.1",
+        daddr="1.1.1.1",
+        dur=1,
+        proto=proto,
+        appproto="",
+        sport=5555,
+        dport=53,
+        spkts=1,
+        dpkts=1,
+        sbytes=10,
+        dbytes=10,
+        state="SF",
+        history="",
+    )
+
+
+def create_dns_msg(uid: str) -> dict:
+    alt_flow = {
+        "type_": "dns",
+        "uid": uid,
+        "query": "example.com",
+        "answers": ["1.1.1.1"],
+        "rcode_name": "NOERROR",
+    }
+    return {"data": json.dumps({"flow": alt_flow})}
+
+
+def create_timeline_with_batches(max_batch_size=500) -> Timeline:
+    timeline = ModuleFactory().create_timeline_object()
+    timeline.db.get_port_info.return_value = "dns"
+    timeline.db.get_dns_resolution.return_value = {}
+    timeline.db.get_altflow_from_uid.return_value = False
+    timeline.max_batch_size = max_batch_size
+    return timeline
+
+
+@pytest.mark.parametrize(
+    "altflow_first",
+    [
+        # Testcase 1: the conn flow waits for the altflow
+        False,
+        # Testcase 2: the altflow waits for the conn flow
+        True,
+    ],
+)
+def test_flow_is_joined_with_its_altflow(altflow_first):
+    timeline = create_timeline_with_batches()
+    if altflow_first:
+        timeline.process_altflow_msg(create_dns_msg("uid1"))
+    timeline.process_flow("profile_1", "timewindow1", create_conn_flow("uid1"))
+    if not altflow_first:
+        assert "uid1" in timeline.pending_flows
+        timeline.process_altflow_msg(create_dns_msg("uid1"))
+
+    assert not timeline.pending_flows
+    assert not timeline.altflows
+    [(profileid, twid, activity, _)] = timeline.timeline_lines
+    assert activity["info"] == {
+        "query": "example.com",
+        "answers": ["1.1.1.1"],
+    }
+    timeline.db.get_altflow_from_uid.assert_not_called()
+
+
+def test_pending_flow_is_written_after_the_deadline():
+    timeline = create_timeline_with_batches()
+    timeline.process_flow("profile_1", "timewindow1", create_conn_flow("uid1"))
+    deadline = timeline.pending_flows["uid1"].deadline
+
+    timeline.write_expired_pending_flows(deadline - 0.1)
+    assert not timeline.timeline_lines
+
+    timeline.write_expired_pending_flows(deadline)
+    assert not timeline.pending_flows
+    assert timeline.timeline_lines[0][2]["info"] == ""
+    # the altflow may have arrived long ago, so the db is checked
+    timeline.db.get_altflow_from_uid.assert_called_once()
+
+
+def test_pending_flows_are_bounded():
+    timeline = create_timeline_with_batches()
+    timeline.max_pending_flows = 2
+    for uid in ("uid1", "uid2", "uid3"):
+        timeline.process_flow(
+            "profile_1", "timewindow1", create_conn_flow(uid)
+        )
+    assert list(timeline.pending_flows) == ["uid2", "uid3"]
+    assert len(timeline.timeline_lines) == 1
+
+
+def test_timeline_lines_are_written_in_batches():
+    timeline = create_timeline_with_batches(max_batch_size=10)
+    start = time.time()
+    for i in range(25):
+        timeline.process_altflow_msg(create_dns_msg(f"uid{i}"))
+        timeline.process_flow(
+            "profile_1", "timewindow1", create_conn_flow(f"uid{i}")
+        )
+    # no more waiting 50ms for every flow
+    assert time.time() - start < 1
+    assert timeline.db.add_timeline_lines.call_count == 2
+    timeline.db.add_timeline_line.assert_not_called()
+
+    timeline.shutdown_gracefully()
+    assert timeline.db.add_timeline_lines.call_count == 3
+    assert not timeline.timeline_lines
+
+
+def test_icmp_flows_dont_wait_for_altflows():
+    timeline = create_timeline_with_batches()
+    timeline.process_flow(
+        "profile_1", "timewindow1", create_conn_flow("uid1", proto="icmp")
+    )
+    assert not timeline.pending_flows
+    assert len(timeline.timeline_lines) == 1
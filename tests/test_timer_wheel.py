@@ -0,0 +1,141 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import random
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from slips_files.common.data_structures.timer_wheel import TimerWheel
+
+
+def create_wheel(**kwargs) -> TimerWheel:
+    wheel = TimerWheel(**kwargs)
+    wheel.register("check", Mock())
+    return wheel
+
+
+@pytest.mark.parametrize(
+    "delay",
+    [
+        # Testcase 1: due in the first level
+        5,
+        # Testcase 2: due in the second level
+        100,
+        # Testcase 3: due in the third level
+        10000,
+        # Testcase 4: due after the last level
+        300000,
+    ],
+)
+def test_check_runs_when_due(delay):
+    wheel = create_wheel(wheel_sizes=(8, 8, 8))
+    now = 1000
+    wheel.pop_due(now)
+    wheel.schedule("check", now + delay, "arg")
+
+    for ts in range(now + 1, now + delay):
+        assert wheel.pop_due(ts) == []
+    assert wheel.pop_due(now + delay) == [("check", ("arg",))]
+    assert len(wheel) == 0
+
+
+def test_clock_jump():
+    wheel = create_wheel()
+    wheel.pop_due(0)
+    wheel.schedule("check", 10, 1)
+    wheel.schedule("check", 10**6, 2)
+    assert wheel.pop_due(10**5) == [("check", (1,))]
+    assert wheel.pop_due(10**6) == [("check", (2,))]
+
+
+def test_already_due_check():
+    wheel = create_wheel()
+    wheel.pop_due(100)
+    wheel.schedule("check", 50, "late")
+    assert wheel.pop_due(100) == [("check", ("late",))]
+
+
+def test_checks_scheduled_before_the_first_pop_due():
+    """the wheel starts at the clock, not at the due time of the first
+    check"""
+    wheel = create_wheel(wheel_sizes=(4, 4, 4))
+    wheel.schedule("check", 971, "late")
+    wheel.schedule("check", 868, "early")
+
+    assert wheel.pop_due(865) == []
+    assert wheel.pop_due(868) == [("check", ("early",))]
+    assert wheel.pop_due(970) == []
+    assert wheel.pop_due(971) == [("check", ("late",))]
+
+
+def test_random_schedule():
+    """every check runs once, at the first tick after it's due"""
+    wheel = create_wheel(wheel_sizes=(4, 4, 4))
+    wheel.pop_due(0)
+    dues = [random.uniform(1, 500) for _ in range(1000)]
+    for due in dues:
+        wheel.schedule("check", due, due)
+
+    ran = []
+    for now in range(1, 502):
+        for _, (due,) in wheel.pop_due(now):
+            assert now - 1 < due <= now
+            ran.append(due)
+    assert sorted(ran) == sorted(dues)
+
+
+def test_max_pending():
+    wheel = create_wheel(max_pending=2)
+    wheel.pop_due(0)
+    assert wheel.schedule("check", 10)
+    assert wheel.schedule("check", 10)
+    assert not wheel.schedule("check", 10)
+    assert wheel.get_stats()["check"] == {
+        "pending": 2,
+        "dropped": 1,
+        "ran": 0,
+    }
+
+
+def test_run_due_and_run_all():
+    wheel = create_wheel()
+    wheel.pop_due(0)
+    wheel.schedule("check", 5, "a")
+    wheel.schedule("check", 50, "b")
+
+    assert wheel.run_due(10) == 1
+    wheel.checks["check"].assert_called_once_with("a")
+    assert wheel.run_all() == 1
+    wheel.checks["check"].assert_called_with("b")
+    assert wheel.get_stats()["check"]["ran"] == 2
+    assert len(wheel) == 0
+
+
+def test_pop_all_stats():
+    wheel = create_wheel()
+    wheel.schedule("check", 5, "a")
+    wheel.schedule("check", 50, "b")
+
+    assert wheel.pop_all() == [("check", ("a",)), ("check", ("b",))]
+    assert wheel.get_stats()["check"] == {
+        "pending": 0,
+        "dropped": 0,
+        "ran": 2,
+    }
+
+
+@pytest.mark.benchmark
+def test_schedule_throughput():
+    wheel = create_wheel()
+    wheel.pop_due(0)
+    checks = 100000
+    start = time.monotonic()
+    for i in range(checks):
+        wheel.schedule("check", 15 + i / 1000)
+    ran = 0
+    for now in range(1, 120):
+        ran += len(wheel.pop_due(now))
+    elapsed = time.monotonic() - start
+    assert ran == checks
+    print(f"delayed checks/sec: {checks / elapsed:.0f}")
@@ -0,0 +1,209 @@
+# SPDX-FileCopyrightText: 2021 Sebastian Garcia <sebastian.garcia@agents.fel.cvut.cz>
+# SPDX-License-Identifier: GPL-2.0-only
+import json
+import pytest
+from unittest.mock import Mock
+
+import numpy as np
+
+from slips_files.core.database.sqlite_db.database import SQLiteDB
+from slips_files.core.structures.tw_features import (
+    TUPLE_FEATURES,
+    TW_FEATURES,
+    TWFeatures,
+    compute_tw_features,
+)
+from tests.module_factory import ModuleFactory
+
+PROFILEID = "profile_192.168.1.1"
+TWID = "timewindow1"
+
+
+def get_flow(
+    starttime, daddr, dport, proto="tcp", state="SF", sbytes=100, dbytes=200
+) -> dict:
+    """returns a flow the way it's stored in the sqlite db"""
+    return {
+        "starttime": str(starttime),
+        "uid": f"uid{starttime}",
+        "saddr": "192.168.1.1",
+        "daddr": daddr,
+        "dur": "1",
+        "proto": proto,
+        "sport": "12345",
+        "dport": dport,
+        "spkts": 2,
+        "dpkts": 3,
+        "sbytes": sbytes,
+        "dbytes": dbytes,
+        "state": state,
+        "type_": "conn",
+    }
+
+
+def get_final_state_from_flags(state, pkts):
+    return "Established" if state == "SF" else "Not Established"
+
+
+def get_flows() -> list:
+    return [
+        get_flow(1700000010, "8.8.8.8", "53", proto="udp"),
+        get_flow(1700000000, "1.1.1.1", "443", state="S0", sbytes=60),
+        get_flow(1700000030, "1.1.1.1", "443"),
+        get_flow(1700000020, "1.1.1.1", "80", dbytes=0),
+        # not compressed ipv6 addresses are compressed in the tupleids
+        get_flow(1700000040, "2001:db8:0:0:0:0:0:1", "443"),
+    ]
+
+
+def compute_features(flows=None, letters=None) -> TWFeatures:
+    return compute_tw_features(
+        PROFILEID,
+        TWID,
+        get_flows() if flows is None else flows,
+        letters or {},
+        get_final_state_from_flags,
+    )
+
+
+def test_compute_tw_features_per_tuple():
+    features = compute_features(
+        letters={"1.1.1.1-443-tcp": "88*e", "8.8.8.8-53-udp": "1"}
+    )
+
+    assert set(features.tuples) == set(TUPLE_FEATURES)
+    assert len(features) == 4
+    rows = {
+        tupleid: row for row, tupleid in enumerate(features.tuples["tupleid"])
+    }
+    https = rows["1.1.1.1-443-tcp"]
+    assert features.tuples["daddr"][https] == "1.1.1.1"
+    assert features.tuples["dport"][https] == "443"
+    assert features.tuples["proto"][https] == "tcp"
+    assert features.tuples["flows"][https] == 2
+    assert features.tuples["sbytes"][https] == 160
+    assert features.tuples["dbytes"][https] == 400
+    assert features.tuples["pkts"][https] == 10
+    assert features.tuples["established"][https] == 1
+    assert features.tuples["first_ts"][https] == 1700000000
+    assert features.tuples["last_ts"][https] == 1700000030
+    assert features.tuples["letters"][https] == "88*e"
+    assert "2001:db8::1-443-tcp" in rows
+    assert features.get_letters() == {
+        "1.1.1.1-443-tcp": "88*e",
+        "8.8.8.8-53-udp": "1",
+    }
+
+
+def test_compute_tw_features_per_tw():
+    features = compute_features()
+
+    assert set(features.tw) == set(TW_FEATURES)
+    assert features.tw == {
+        "flows": 5,
+        "sbytes": 460,
+        "dbytes": 800,
+        "pkts": 25,
+        "established": 4,
+        "established_ratio": 0.8,
+        "distinct_dstips": 3,
+        "distinct_dports": 3,
+        "tuples": 4,
+    }
+
+
+def test_compute_tw_features_without_flows():
+    features = compute_features(flows=[])
+    assert len(features) == 0
+    assert features.tw["flows"] == 0
+    assert features.tw["established_ratio"] == 0
+
+
+def test_tw_features_serialization():
+    features = compute_features(letters={"1.1.1.1-80-tcp": "a" * 1000})
+
+    loaded = TWFeatures.from_bytes(PROFILEID, TWID, features.to_bytes())
+
+    assert loaded.profileid == PROFILEID
+    assert loaded.twid == TWID
+    assert loaded.tw == features.tw
+    assert set(loaded.tuples) == set(features.tuples)
+    for name, column in features.tuples.items():
+        assert np.array_equal(loaded.tuples[name], column)
+
+
+def test_sqlite_tw_features(tmp_path):
+    sqlite = SQLiteDB(Mock(), str(tmp_path))
+    features = compute_features()
+    assert sqlite.get_tw_features(PROFILEID, TWID) is None
+
+    sqlite.set_tw_features(PROFILEID, TWID, features.to_bytes())
+
+    loaded = TWFeatures.from_bytes(
+        PROFILEID, TWID, sqlite.get_tw_features(PROFILEID, TWID)
+    )
+    assert loaded.tw == features.tw
+    assert sqlite.get_tw_features(PROFILEID, "timewindow2") is None
+
+
+def test_materialize():
+    tw_features = ModuleFactory().create_tw_features_object()
+    flows = get_flows()
+    tw_features.db.get_all_flows_in_profileid_twid.return_value = {
+        flow["uid"]: flow for flow in flows
+    }
+    tw_features.db.get_outtuples_from_profile_tw.return_value = json.dumps(
+        {"1.1.1.1-443-tcp": ["88*e", [1700000000, 1700000030]]}
+    )
+    tw_features.db.get_final_state_from_flags = get_final_state_from_flags
+
+    features = tw_features.materialize(PROFILEID, TWID)
+
+    tw_features.db.get_all_flows_in_profileid_twid.assert_called_once_with(
+        PROFILEID, TWID
+    )
+    tw_features.db.set_tw_features.assert_called_once_with(features)
+    tw_features.db.publish.assert_called_once_with(
+        "tw_features", f"{PROFILEID}_{TWID}"
+    )
+    assert features.tw["flows"] == len(flows)
+    assert features.get_letters() == {"1.1.1.1-443-tcp": "88*e"}
+
+
+def test_materialize_tw_without_flows():
+    tw_features = ModuleFactory().create_tw_features_object()
+    tw_features.db.get_all_flows_in_profileid_twid.return_value = False
+    tw_features.db.get_outtuples_from_profile_tw.return_value = None
+
+    features = tw_features.materialize(PROFILEID, TWID)
+
+    assert len(features) == 0
+    tw_features.db.publish.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "has_subscribers, expected_calls",
+    [
+        # Testcase 1: a module reads the features
+        (True, 1),
+        # Testcase 2: no module reads the features, the flows of the tw
+        # aren't read
+        (False, 0),
+    ],
+)
+def test_main_handles_tw_closed(has_subscribers, expected_calls):
+    tw_features = ModuleFactory().create_tw_features_object()
+    tw_features.get_msg = Mock(
+        return_value={"data": "profile_fe80::1_timewindow10"}
+    )
+    tw_features.db.has_subscribers.return_value = has_subscribers
+    tw_features.materialize = Mock()
+
+    tw_features.main()
+
+    tw_features.db.has_subscribers.assert_called_once_with("tw_features")
+    assert tw_features.materialize.call_count == expected_calls
+    if expected_calls:
+        tw_features.materialize.assert_called_with(
+            "profile_fe80::1", "timewindow10"
+        )
@@ -2,7 +2,13 @@
 # SPDX-License-Identifier: GPL-2.0-only
 """Unit test for modules/update_manager/update_manager.py"""
 
+from modules.update_manager.download_scheduler import (
+    Download,
+    DownloadResult,
+    DownloadStatus,
+)
 from tests.module_factory import ModuleFactory
+import asyncio
 import json
 import requests
 import pytest
@@ -18,57 +24,66 @@ def test_check_if_update_based_on_update_period():
     assert update_manager.should_update(url, float("inf")) is False
 
 
-def test_check_if_update_based_on_e_tag(mocker):
-    update_manager = ModuleFactory().create_update_manager_obj()
-
-    # period passed, etag same
-    etag = "1234"
-    url = "google.com/images"
-    update_manager.db.get_ti_feed_info.return_value = {"e-tag": etag}
-
-    mock_requests = mocker.patch("requests.get")
-    mock_requests.return_value.status_code = 200
-    mock_requests.return_value.headers = {"ETag": "1234"}
-    mock_requests.return_value.text = ""
-    assert update_manager.should_update(url, float("-inf")) is False
-
-    # period passed, etag different
-    etag = "1111"
-    url = "google.com/images"
-    update_manager.db.get_ti_feed_info.return_value = {"e-tag": etag}
-    mock_requests = mocker.patch("requests.get")
-    mock_requests.return_value.status_code = 200
-    mock_requests.return_value.headers = {"ETag": "2222"}
-    mock_requests.return_value.text = ""
-    assert update_manager.should_update(url, float("-inf")) is True
-
-
-def test_check_if_update_based_on_last_modified(
-    mocker,
+@pytest.mark.parametrize(
+    "status, etag, last_modified, cached_info, expected_result",
+    [
+        # Testcase 1: etag same
+        (DownloadStatus.UPDATED, "1234", None, {"e-tag": "1234"}, False),
+        # Testcase 2: etag different
+        (DownloadStatus.UPDATED, "2222", None, {"e-tag": "1111"}, True),
+        # Testcase 3: no etag, last modified the same
+        (
+            DownloadStatus.UPDATED,
+            None,
+            "10",
+            {"Last-Modified": "10"},
+            False,
+        ),
+        # Testcase 4: no etag, last modified changed
+        (
+            DownloadStatus.UPDATED,
+            None,
+            "11",
+            {"Last-Modified": "10"},
+            True,
+        ),
+        # Testcase 5: no etag and no last modified
+        (DownloadStatus.UPDATED, None, None, {}, False),
+        # Testcase 6: the server replied with 304
+        (DownloadStatus.NOT_MODIFIED, "1234", None, {"e-tag": "1234"}, False),
+        # Testcase 7: download failed
+        (DownloadStatus.FAILED, None, None, {}, False),
+    ],
+)
+def test_is_feed_modified(
+    status, etag, last_modified, cached_info, expected_result
 ):
     update_manager = ModuleFactory().create_update_manager_obj()
+    update_manager.db.get_ti_feed_info.return_value = cached_info
+    result = DownloadResult(
+        "google.com/images",
+        "path",
+        status,
+        etag=etag,
+        last_modified=last_modified,
+    )
+    assert update_manager.is_feed_modified(result) is expected_result
 
-    # period passed, no etag, last modified the same
-    url = "google.com/photos"
-
-    update_manager.db.get_ti_feed_info.return_value = {"Last-Modified": 10.0}
-    mock_requests = mocker.patch("requests.get")
-    mock_requests.return_value.status_code = 200
-    mock_requests.return_value.headers = {"Last-Modified": 10.0}
-    mock_requests.return_value.text = ""
-
-    assert update_manager.should_update(url, float("-inf")) is False
-
-    # period passed, no etag, last modified changed
-    url = "google.com/photos"
-
-    update_manager.db.get_ti_feed_info.return_value = {"Last-Modified": 10}
-    mock_requests = mocker.patch("requests.get")
-    mock_requests.return_value.status_code = 200
-    mock_requests.return_value.headers = {"Last-Modified": 11}
-    mock_requests.return_value.text = ""
 
-    assert update_manager.should_update(url, float("-inf")) is True
+def test_get_download():
+    update_manager = ModuleFactory().create_update_manager_obj()
+    update_manager.path_to_remote_ti_files = "remote_data_files/"
+    update_manager.db.get_ti_feed_info.return_value = {
+        "e-tag": "1234",
+        "Last-Modified": False,
+    }
+    download = update_manager.get_download("https://example.com/feed.csv")
+    assert download == Download(
+        "https://example.com/feed.csv",
+        "remote_data_files/feed.csv",
+        etag="1234",
+        last_modified=None,
+    )
 
 
 @pytest.mark.parametrize(
@@ -335,21 +350,6 @@ def test_get_e_tag(mocker, headers, expected_etag):
     assert update_manager.get_e_tag(mock_response) == expected_etag
 
 
-def test_write_file_to_disk(mocker, tmp_path):
-    """
-    Test write_file_to_disk() by writing content to a temporary file.
-    """
-    update_manager = ModuleFactory().create_update_manager_obj()
-    mock_response = mocker.Mock()
-    mock_response.text = "test content"
-    file_path = tmp_path / "test_file.txt"
-
-    update_manager.write_file_to_disk(mock_response, file_path)
-
-    with open(file_path, "r") as f:
-        assert f.read() == "test content"
-
-
 def test_update_riskiq_feed(
     mocker,
 ):
@@ -823,3 +823,50 @@ def test_parse_ssl_feed_no_valid_fingerprints(mocker, tmp_path):
 
     update_manager.db.add_ssl_sha1_to_ioc.assert_not_called()
     assert result is False
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        # Testcase 1: a feed failed to load
+        ValueError("invalid feed"),
+        # Testcase 2: slips was stopped during the update
+        KeyboardInterrupt(),
+    ],
+)
+def test_update_discards_staged_iocs_on_failure(mocker, error):
+    update_manager = ModuleFactory().create_update_manager_obj()
+    update_manager.update_period = 3600
+    mocker.patch.object(
+        update_manager, "should_update_mac_db", return_value=False
+    )
+    mocker.patch.object(
+        update_manager, "should_update_online_whitelist", return_value=False
+    )
+    mocker.patch.object(update_manager, "delete_unused_cached_remote_feeds")
+    mocker.patch.object(
+        update_manager, "update_remote_feeds", side_effect=error
+    )
+
+    if isinstance(error, KeyboardInterrupt):
+        assert asyncio.run(update_manager.update()) is False
+    else:
+        with pytest.raises(ValueError):
+            asyncio.run(update_manager.update())
+
+    update_manager.db.start_staging_iocs.assert_called_once()
+    update_manager.db.discard_staged_iocs.assert_called_once()
+    update_manager.db.promote_staged_iocs.assert_not_called()
+    # the next update can run
+    assert not update_manager.update_lock.locked()
+
+
+def test_update_is_skipped_while_another_is_running(mocker):
+    update_manager = ModuleFactory().create_update_manager_obj()
+    update_manager.update_period = 3600
+    _update = mocker.patch.object(update_manager, "_update")
+    update_manager.update_lock.acquire()
+
+    assert asyncio.run(update_manager.update()) is False
+
+    _update.assert_not_called()
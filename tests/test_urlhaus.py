@@ -10,6 +10,7 @@ from modules.threat_intelligence.urlhaus import (
     EvidenceType,
     Direction,
 )
+from modules.threat_intelligence.online_lookups import OnlineLookupError
 from tests.module_factory import ModuleFactory
 
 
@@ -69,8 +70,10 @@ def test_make_urlhaus_request_connection_error(mock_response, to_lookup):
     urlhaus = ModuleFactory().create_urlhaus_obj()
     urlhaus.urlhaus_session = mock_response_instance
 
-    response = urlhaus.make_urlhaus_request(to_lookup)
-    assert response is None
+    with pytest.raises(OnlineLookupError):
+        urlhaus.make_urlhaus_request(to_lookup)
+    # the session is recreated
+    assert mock_response.call_count == 2
 
 
 @patch("modules.threat_intelligence.urlhaus.requests.session")
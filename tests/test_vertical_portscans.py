@@ -5,6 +5,8 @@ import random
 import binascii
 import base64
 import os
+from unittest.mock import Mock
+
 from tests.module_factory import ModuleFactory
 
 
@@ -12,6 +14,18 @@ def get_random_uid():
     return base64.b64encode(binascii.b2a_hex(os.urandom(9))).decode("utf-8")
 
 
+def get_conn_flow(dport, daddr="8.8.8.8", saddr="1.1.1.1"):
+    return Mock(
+        starttime="1700828217.314165",
+        uid=get_random_uid(),
+        saddr=saddr,
+        daddr=daddr,
+        proto="tcp",
+        dport=dport,
+        state_hist="S",
+    )
+
+
 def not_enough_dports_to_reach_the_threshold():
     """
     returns a dict with conns to dport that are not enough
@@ -154,3 +168,67 @@ def test_check_if_enough_dports_to_trigger_an_evidence(
         key, cur_amount_of_dports
     )
     assert enough == expected_return_val
+
+
+def test_check_sets_evidence_when_threshold_is_reached():
+    vertical_ps = ModuleFactory().create_vertical_portscan_obj()
+    profileid = "profile_1.1.1.1"
+    twid = "timewindow0"
+    minimum = vertical_ps.minimum_dports_to_set_evidence
+    dports = [str(port) for port in range(minimum)]
+    vertical_ps.db.get_data_from_profile_tw.return_value = {
+        "8.8.8.8": {
+            "stime": "1700828217.314165",
+            "uid": ["uid1"],
+            "dstports": {port: 2 for port in dports},
+        }
+    }
+
+    results = [
+        vertical_ps.check(
+            profileid, twid, get_conn_flow(port), "Not Established"
+        )
+        for port in dports
+    ]
+    # the same port again doesn't change the count
+    results.append(
+        vertical_ps.check(
+            profileid, twid, get_conn_flow(dports[0]), "Not Established"
+        )
+    )
+
+    assert results == [False] * (minimum - 1) + [True, False]
+    # the db is only read to get the details of the evidence
+    vertical_ps.db.get_data_from_profile_tw.assert_called_once()
+    evidence = vertical_ps.db.set_evidence.call_args[0][0]
+    assert evidence.victim.value == "8.8.8.8"
+    assert f"Total packets sent to all ports: {2 * minimum}" in (
+        evidence.description
+    )
+
+
+@pytest.mark.parametrize(
+    "flow, state",
+    [
+        # Testcase 1: established flow
+        (get_conn_flow("80"), "Established"),
+        # Testcase 2: the profile is the server of the flow
+        (
+            get_conn_flow("80", saddr="8.8.8.8", daddr="1.1.1.1"),
+            "Not Established",
+        ),
+    ],
+)
+def test_check_ignored_flows(flow, state):
+    vertical_ps = ModuleFactory().create_vertical_portscan_obj()
+    assert not vertical_ps.check("profile_1.1.1.1", "timewindow0", flow, state)
+    assert not vertical_ps.dports_per_dstip
+
+
+def test_evict():
+    vertical_ps = ModuleFactory().create_vertical_portscan_obj()
+    profileid = "profile_1.1.1.1"
+    for twid in ("timewindow1", "timewindow2"):
+        vertical_ps.get_dports_counter(profileid, twid, "TCP", "8.8.8.8")
+    vertical_ps.evict(profileid, "timewindow1")
+    assert list(vertical_ps.dports_per_dstip[profileid]) == ["timewindow2"]